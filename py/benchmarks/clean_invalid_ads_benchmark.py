@@ -0,0 +1,139 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the validation of training ads in Copycat._clean_invalid_ads.
+
+Compares the row-wise validation (two GoogleAd objects per row inside
+DataFrame.apply) with the vectorized AdCopyEvaluator.check_validity_batch, on
+synthetic responsive search ads where some of the ads are invalid and some use
+special variables, and checks that both give the same invalid ads.
+
+Usage:
+  python -m benchmarks.clean_invalid_ads_benchmark --n_ads=10000,100000
+"""
+
+from collections.abc import Sequence
+import time
+
+from absl import app
+from absl import flags
+import numpy as np
+import pandas as pd
+
+from copycat import ad_copy_evaluator
+from copycat import google_ads
+
+_N_ADS = flags.DEFINE_list(
+    "n_ads", ["1000", "10000", "100000"], "The numbers of ads to benchmark."
+)
+_SEED = flags.DEFINE_integer("seed", 0, "The random seed.")
+
+
+def make_ads(n_ads: int, seed: int) -> pd.DataFrame:
+  """Returns synthetic ads, many of which are invalid for different reasons."""
+  rng = np.random.default_rng(seed)
+  words = np.array(
+      ["shoes", "running", "cheap", "buy", "new", "sale", "best", "online"]
+  )
+
+  def make_text(max_length: int) -> str:
+    text = " ".join(rng.choice(words, size=rng.integers(1, 4)))
+    text += f" {rng.integers(100_000)}"
+    roll = rng.random()
+    if roll < 0.02:
+      text += " {KeyWord:running shoes}"
+    elif roll < 0.03:
+      text += " {CUSTOMIZER.price}"
+    elif roll < 0.04:
+      text = text + " " + "x" * max_length
+    return text
+
+  return pd.DataFrame({
+      "headlines": [
+          [make_text(30) for _ in range(rng.integers(2, 16))]
+          for _ in range(n_ads)
+      ],
+      "descriptions": [
+          [make_text(90) for _ in range(rng.integers(1, 5))]
+          for _ in range(n_ads)
+      ],
+  })
+
+
+def row_wise_is_invalid(
+    evaluator: ad_copy_evaluator.AdCopyEvaluator, data: pd.DataFrame
+) -> pd.Series:
+  """The row-wise validation, as previously used by _clean_invalid_ads."""
+  return data.apply(
+      lambda row: not evaluator.is_valid(
+          google_ads.GoogleAd(
+              headlines=row["headlines"], descriptions=row["descriptions"]
+          )
+      )
+      or evaluator.has_unfillable_google_ads_special_variables(
+          google_ads.GoogleAd(
+              headlines=row["headlines"], descriptions=row["descriptions"]
+          )
+      ),
+      axis=1,
+  )
+
+
+def vectorized_is_invalid(
+    evaluator: ad_copy_evaluator.AdCopyEvaluator, data: pd.DataFrame
+) -> pd.Series:
+  """The vectorized validation, as now used by _clean_invalid_ads."""
+  return evaluator.check_validity_batch(
+      data["headlines"].tolist(),
+      data["descriptions"].tolist(),
+      check_unfillable_special_variables=True,
+  ).any(axis=1)
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError("Too many command-line arguments.")
+
+  evaluator = ad_copy_evaluator.AdCopyEvaluator(
+      google_ads.RESPONSIVE_SEARCH_AD_FORMAT
+  )
+
+  results = []
+  for n_ads in map(int, _N_ADS.value):
+    data = make_ads(n_ads, _SEED.value)
+
+    start_time = time.perf_counter()
+    expected_is_invalid = row_wise_is_invalid(evaluator, data)
+    row_wise_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    is_invalid = vectorized_is_invalid(evaluator, data)
+    vectorized_seconds = time.perf_counter() - start_time
+
+    if not np.array_equal(is_invalid.values, expected_is_invalid.values):
+      raise RuntimeError(f"The invalid ads do not match for {n_ads} ads.")
+
+    results.append({
+        "n_ads": n_ads,
+        "n_invalid_ads": int(is_invalid.sum()),
+        "row_wise_seconds": row_wise_seconds,
+        "vectorized_seconds": vectorized_seconds,
+        "speedup": row_wise_seconds / vectorized_seconds,
+    })
+
+  print(pd.DataFrame(results).to_string(index=False, float_format="%.3f"))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,247 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the rule based evaluation of generated ads.
+
+Compares the previous AdCopyEvaluator.evaluate_batch, which ran the per-ad
+checks and created a validated EvaluationResults for each ad, with the
+columnar AdCopyEvaluator.evaluate_batch. Both only count exactly memorised
+headlines and descriptions, which is the default. The columnar evaluation is
+then timed again also finding near duplicates of the training data. The
+similarity metrics are not calculated, they are benchmarked in
+similarity_metrics_benchmark.
+
+Usage:
+  python -m benchmarks.evaluation_benchmark --n_ads=1000,10000 --n_repeats=3
+"""
+
+from collections.abc import Callable, Sequence
+import dataclasses
+import string
+import time
+from typing import Any
+
+from absl import app
+from absl import flags
+import numpy as np
+import pandas as pd
+
+from copycat import ad_copy_evaluator
+from copycat import ad_copy_generator
+from copycat import google_ads
+from copycat import memorisation
+
+_N_ADS = flags.DEFINE_list(
+    "n_ads", ["1000", "10000"], "The numbers of ads to benchmark."
+)
+_N_EXEMPLARS = flags.DEFINE_integer(
+    "n_exemplars", 1000, "The number of training exemplars."
+)
+_N_REPEATS = flags.DEFINE_integer(
+    "n_repeats", 3, "The number of times each evaluation is timed."
+)
+
+_VOCABULARY_SIZE = 500
+
+
+def make_words(rng: np.random.Generator) -> list[str]:
+  """Returns a vocabulary of random lowercase words."""
+  letters = np.array(list(string.ascii_lowercase))
+  return [
+      "".join(rng.choice(letters, n_letters))
+      for n_letters in rng.integers(3, 10, _VOCABULARY_SIZE)
+  ]
+
+
+_WORDS = make_words(np.random.default_rng(2))
+
+
+def random_text(rng: np.random.Generator, n_words: int) -> str:
+  return " ".join(rng.choice(_WORDS, n_words)).capitalize()
+
+
+def make_evaluator(n_exemplars: int) -> ad_copy_evaluator.AdCopyEvaluator:
+  """Returns an evaluator with a vectorstore of random exemplars."""
+  rng = np.random.default_rng(0)
+  ad_exemplars = pd.DataFrame({
+      "headlines": [
+          [random_text(rng, 3) for _ in range(15)] for _ in range(n_exemplars)
+      ],
+      "descriptions": [
+          [random_text(rng, 10) for _ in range(4)] for _ in range(n_exemplars)
+      ],
+      "keywords": [f"keyword {i}" for i in range(n_exemplars)],
+      "embeddings": list(rng.normal(size=(n_exemplars, 8))),
+  })
+  vectorstore = ad_copy_generator.AdCopyVectorstore(
+      ad_exemplars=ad_exemplars,
+      embedding_model_name="text-embedding-004",
+      dimensionality=8,
+      embeddings_batch_size=100,
+  )
+  return ad_copy_evaluator.AdCopyEvaluator(
+      google_ads.RESPONSIVE_SEARCH_AD_FORMAT, ad_copy_vectorstore=vectorstore
+  )
+
+
+def make_ad_copies(
+    n_ads: int, vectorstore: ad_copy_generator.AdCopyVectorstore
+) -> list[google_ads.GoogleAd]:
+  """Returns generated ads, some of which copy the training ads."""
+  rng = np.random.default_rng(1)
+  training_headlines = sorted(vectorstore.unique_headlines)
+  ad_copies = []
+  for _ in range(n_ads):
+    headlines = [random_text(rng, 3) for _ in range(14)]
+    headlines.append(
+        str(rng.choice(training_headlines)) + " {KeyWord:now}"
+    )
+    ad_copies.append(
+        google_ads.GoogleAd(
+            headlines=headlines,
+            descriptions=[random_text(rng, 10) for _ in range(4)],
+        )
+    )
+  return ad_copies
+
+
+def previous_evaluate_batch(
+    evaluator: ad_copy_evaluator.AdCopyEvaluator,
+    ad_copies: list[google_ads.GoogleAd],
+) -> list[ad_copy_evaluator.EvaluationResults]:
+  """Evaluates the ads like evaluate_batch did before it was columnar.
+
+  The memorisation is checked for the whole batch, but the other checks and
+  the warnings and errors are computed one ad at a time.
+  """
+  memorisation_results = evaluator.check_memorisation_batch(
+      [ad_copy.headlines for ad_copy in ad_copies],
+      [ad_copy.descriptions for ad_copy in ad_copies],
+  )
+  results = []
+  for ad_copy, memorisation_results_i in zip(
+      ad_copies, memorisation_results.to_dict("records")
+  ):
+    errors = []
+    warnings = []
+    if not evaluator.has_valid_number_of_headlines(ad_copy):
+      errors.append("Invalid number of headlines for the ad format.")
+    if not evaluator.has_valid_number_of_descriptions(ad_copy):
+      errors.append("Invalid number of descriptions for the ad format.")
+    if not evaluator.has_valid_headline_lengths(ad_copy):
+      errors.append("At least one headline too long for the ad format.")
+    if not evaluator.has_valid_description_lengths(ad_copy):
+      errors.append("At least one description too long for the ad format.")
+    if not evaluator.has_unique_headlines(ad_copy):
+      errors.append("Duplicate headlines found.")
+    if not evaluator.has_unique_descriptions(ad_copy):
+      errors.append("Duplicate descriptions found.")
+
+    headlines_are_memorised = bool(
+        memorisation_results_i["headlines_are_memorised"]
+    )
+    descriptions_are_memorised = bool(
+        memorisation_results_i["descriptions_are_memorised"]
+    )
+    n_memorised_headlines = int(memorisation_results_i["n_memorised_headlines"])
+    n_memorised_descriptions = int(
+        memorisation_results_i["n_memorised_descriptions"]
+    )
+    if headlines_are_memorised:
+      errors.append("All headlines are memorised from the training data.")
+    if descriptions_are_memorised:
+      errors.append("All descriptions are memorised from the training data.")
+    if n_memorised_headlines and not headlines_are_memorised:
+      warnings.append(
+          f"{n_memorised_headlines} of {ad_copy.headline_count} headlines are"
+          " copied from or near duplicates of the training data."
+      )
+    if n_memorised_descriptions and not descriptions_are_memorised:
+      warnings.append(
+          f"{n_memorised_descriptions} of {ad_copy.description_count}"
+          " descriptions are copied from or near duplicates of the training"
+          " data."
+      )
+
+    results.append(
+        ad_copy_evaluator.EvaluationResults(
+            errors=errors,
+            warnings=warnings,
+            headlines_are_memorised=headlines_are_memorised,
+            descriptions_are_memorised=descriptions_are_memorised,
+            style_similarity=None,
+            keyword_similarity=None,
+            n_memorised_headlines=n_memorised_headlines,
+            n_memorised_descriptions=n_memorised_descriptions,
+        )
+    )
+  return results
+
+
+def time_best_of(function: Callable[[], Any]) -> tuple[Any, float]:
+  """Returns the result and the fastest time in seconds of the repeats."""
+  best_seconds = float("inf")
+  for _ in range(_N_REPEATS.value):
+    start_time = time.perf_counter()
+    result = function()
+    best_seconds = min(best_seconds, time.perf_counter() - start_time)
+  return result, best_seconds
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError("Too many command-line arguments.")
+
+  evaluator = make_evaluator(_N_EXEMPLARS.value)
+  # Build the memorisation indexes before timing, they are built once per
+  # vectorstore.
+  evaluator.check_memorisation_batch([[]], [[]])
+  near_duplicates_evaluator = dataclasses.replace(
+      evaluator,
+      near_duplicate_threshold=memorisation.DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+  )
+
+  results = []
+  for n_ads in map(int, _N_ADS.value):
+    ad_copies = make_ad_copies(n_ads, evaluator.ad_copy_vectorstore)
+
+    previous_results, previous_seconds = time_best_of(
+        lambda: previous_evaluate_batch(evaluator, ad_copies)
+    )
+    batch_results, batch_seconds = time_best_of(
+        lambda: evaluator.evaluate_batch(ad_copies)
+    )
+    if batch_results != previous_results:
+      raise ValueError("The batch and previous results are different.")
+    near_duplicates_results, near_duplicates_seconds = time_best_of(
+        lambda: near_duplicates_evaluator.evaluate_batch(ad_copies)
+    )
+
+    results.append({
+        "n_ads": n_ads,
+        "previous_ms": previous_seconds * 1e3,
+        "batch_ms": batch_seconds * 1e3,
+        "speedup": previous_seconds / batch_seconds,
+        "near_duplicates_ms": near_duplicates_seconds * 1e3,
+        "partially_memorised_ads": sum(
+            bool(result.n_memorised_headlines)
+            for result in near_duplicates_results
+        ),
+    })
+
+  print(pd.DataFrame(results).to_string(index=False, float_format="%.1f"))
+
+
+if __name__ == "__main__":
+  app.run(main)
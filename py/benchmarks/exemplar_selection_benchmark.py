@@ -0,0 +1,150 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the exemplar selection methods on synthetic ad embeddings.
+
+Compares the run time and coverage of Affinity Propagation (followed by random
+sampling to the target number of exemplars, as in AdCopyVectorstore) with the
+scalable k-means medoids and farthest point methods.
+
+The embeddings are drawn from a mixture of Gaussians on the unit sphere, to
+mimic groups of similar ads. Coverage is measured as:
+  - mean_distance / max_distance: The mean and max cosine distance from each ad
+    to its closest exemplar. Lower is better.
+  - topic_coverage: The fraction of the mixture components (topics) that have
+    at least one exemplar. Higher is better.
+
+Usage:
+  python -m benchmarks.exemplar_selection_benchmark \
+    --n_ads=1000,5000,20000,50000 --n_exemplars=200
+"""
+
+from collections.abc import Sequence
+import time
+
+from absl import app
+from absl import flags
+import numpy as np
+import pandas as pd
+from sklearn import cluster
+
+from copycat import exemplar_selection
+from copycat import nearest_neighbors
+
+_N_ADS = flags.DEFINE_list(
+    "n_ads", ["1000", "5000", "20000"], "The numbers of ads to benchmark."
+)
+_N_EXEMPLARS = flags.DEFINE_integer(
+    "n_exemplars", 200, "The target number of exemplars."
+)
+_N_TOPICS = flags.DEFINE_integer(
+    "n_topics", 500, "The number of topics (mixture components) in the ads."
+)
+_DIMENSIONALITY = flags.DEFINE_integer(
+    "dimensionality", 256, "The dimensionality of the embeddings."
+)
+_MAX_ADS_FOR_AFFINITY_PROPAGATION = flags.DEFINE_integer(
+    "max_ads_for_affinity_propagation",
+    5000,
+    "Affinity Propagation is skipped above this number of ads, because it is"
+    " quadratic in time and memory.",
+)
+_SEED = flags.DEFINE_integer("seed", 0, "The random seed.")
+
+
+def make_embeddings(
+    n_ads: int, n_topics: int, dimensionality: int, seed: int
+) -> tuple[np.ndarray, np.ndarray]:
+  """Returns unit length embeddings and the topic of each embedding."""
+  rng = np.random.default_rng(seed)
+  centers = rng.normal(size=(n_topics, dimensionality))
+  topic_sizes = rng.zipf(1.5, size=n_topics).astype(float)
+  topics = rng.choice(n_topics, size=n_ads, p=topic_sizes / topic_sizes.sum())
+  embeddings = centers[topics] + 0.5 * rng.normal(size=(n_ads, dimensionality))
+  embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+  return embeddings.astype(np.float32), topics
+
+
+def select_with_affinity_propagation(
+    embeddings: np.ndarray, n_exemplars: int, *, random_state: int
+) -> np.ndarray:
+  """Selects exemplars the same way as AdCopyVectorstore._get_exemplars."""
+  clusterer = cluster.AffinityPropagation(random_state=random_state)
+  clusterer.fit(embeddings)
+  exemplar_indices = np.asarray(clusterer.cluster_centers_indices_)
+  if len(exemplar_indices) > n_exemplars:
+    exemplar_indices = np.random.default_rng(random_state).choice(
+        exemplar_indices, n_exemplars, replace=False
+    )
+  return exemplar_indices
+
+
+def coverage_metrics(
+    embeddings: np.ndarray, topics: np.ndarray, exemplar_indices: np.ndarray
+) -> dict[str, float]:
+  """Returns how well the exemplars cover the embeddings."""
+  index = nearest_neighbors.CosineIndex().fit(embeddings[exemplar_indices])
+  distances, _ = index.query(embeddings, k=1)
+  return {
+      "mean_distance": float(distances.mean()),
+      "max_distance": float(distances.max()),
+      "topic_coverage": (
+          len(np.unique(topics[exemplar_indices])) / len(np.unique(topics))
+      ),
+  }
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError("Too many command-line arguments.")
+
+  methods = {
+      "affinity_propagation": select_with_affinity_propagation,
+      "kmeans_medoids": exemplar_selection.select_kmeans_medoids,
+      "farthest_point": exemplar_selection.select_farthest_points,
+  }
+
+  results = []
+  for n_ads in map(int, _N_ADS.value):
+    embeddings, topics = make_embeddings(
+        n_ads, _N_TOPICS.value, _DIMENSIONALITY.value, _SEED.value
+    )
+    for method_name, select in methods.items():
+      if (
+          method_name == "affinity_propagation"
+          and n_ads > _MAX_ADS_FOR_AFFINITY_PROPAGATION.value
+      ):
+        continue
+
+      start_time = time.perf_counter()
+      exemplar_indices = select(
+          embeddings, _N_EXEMPLARS.value, random_state=_SEED.value
+      )
+      seconds = time.perf_counter() - start_time
+
+      results.append({
+          "n_ads": n_ads,
+          "method": method_name,
+          "seconds": seconds,
+          "n_exemplars": len(exemplar_indices),
+          **coverage_metrics(embeddings, topics, exemplar_indices),
+      })
+      print(pd.DataFrame([results[-1]]).to_string(index=False, header=False))
+
+  print()
+  print(pd.DataFrame(results).to_string(index=False, float_format="%.4f"))
+
+
+if __name__ == "__main__":
+  app.run(main)
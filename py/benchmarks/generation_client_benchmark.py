@@ -0,0 +1,119 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the per-request overhead of creating the chat models.
+
+Compares constructing a new GenerativeModel (and GenerationConfig) for every
+request with reusing the cached model from get_generative_model. The call to
+Gemini itself is mocked out, so this only measures the client side overhead,
+and not the connection setup of the new clients, which comes on top of it.
+
+Usage:
+  python -m benchmarks.generation_client_benchmark --n_requests=100,1000
+"""
+
+import asyncio
+from collections.abc import Sequence
+import time
+import warnings
+
+from absl import app
+from absl import flags
+import mock
+import pandas as pd
+import vertexai
+from vertexai import generative_models
+
+from copycat import ad_copy_generator
+from copycat import google_ads
+
+_N_REQUESTS = flags.DEFINE_list(
+    "n_requests", ["100", "1000"], "The numbers of requests to benchmark."
+)
+_SYSTEM_INSTRUCTION_LENGTH = flags.DEFINE_integer(
+    "system_instruction_length",
+    5000,
+    "The number of characters in the system instruction.",
+)
+
+
+def make_requests(
+    n_requests: int, system_instruction_length: int
+) -> list[ad_copy_generator.TextGenerationRequest]:
+  """Returns requests that share the same model parameters."""
+  return [
+      ad_copy_generator.TextGenerationRequest(
+          keywords=f"keyword {i}",
+          prompt=[
+              generative_models.Content(
+                  role="user",
+                  parts=[generative_models.Part.from_text(f"Prompt {i}")],
+              )
+          ],
+          system_instruction="x" * system_instruction_length,
+          chat_model_name=ad_copy_generator.ModelName.GEMINI_2_5_FLASH,
+          temperature=0.95,
+          top_k=20,
+          top_p=0.95,
+          safety_settings=None,
+          existing_ad_copy=google_ads.GoogleAd(),
+      )
+      for i in range(n_requests)
+  ]
+
+
+async def generate_all(
+    requests: list[ad_copy_generator.TextGenerationRequest],
+    reuse_models: bool,
+) -> None:
+  """Sends all the requests, optionally clearing the model cache each time."""
+  for request in requests:
+    if not reuse_models:
+      ad_copy_generator.clear_generative_model_cache()
+    await ad_copy_generator.async_generate_google_ad_json(request)
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError("Too many command-line arguments.")
+
+  warnings.filterwarnings("ignore", category=UserWarning)
+  vertexai.init(project="benchmark-project", location="us-central1")
+
+  results = []
+  with mock.patch.object(
+      generative_models.GenerativeModel,
+      "generate_content_async",
+      new=mock.AsyncMock(),
+  ):
+    for n_requests in map(int, _N_REQUESTS.value):
+      requests = make_requests(n_requests, _SYSTEM_INSTRUCTION_LENGTH.value)
+      seconds = {}
+      for reuse_models in [False, True]:
+        start_time = time.perf_counter()
+        asyncio.run(generate_all(requests, reuse_models))
+        seconds[reuse_models] = time.perf_counter() - start_time
+
+      results.append({
+          "n_requests": n_requests,
+          "new_model_us_per_request": seconds[False] / n_requests * 1e6,
+          "reused_model_us_per_request": seconds[True] / n_requests * 1e6,
+          "speedup": seconds[False] / seconds[True],
+      })
+
+  print(pd.DataFrame(results).to_string(index=False, float_format="%.1f"))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,111 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the time taken to construct the new ad copy prompts.
+
+Each prompt uses num_in_context_examples exemplars drawn from a pool of
+n_exemplars, so the same exemplars recur across many prompts, as they do when
+generating ad copy for many ad groups of the same advertiser. Compares building
+every example message from scratch with reusing the memoized messages.
+
+Usage:
+  python -m benchmarks.prompt_construction_benchmark --n_prompts=1000
+"""
+
+from collections.abc import Sequence
+import time
+
+from absl import app
+from absl import flags
+import numpy as np
+import pandas as pd
+
+from copycat import ad_copy_generator
+from copycat import google_ads
+
+_N_PROMPTS = flags.DEFINE_list(
+    "n_prompts", ["100", "1000"], "The numbers of prompts to benchmark."
+)
+_N_EXEMPLARS = flags.DEFINE_integer(
+    "n_exemplars", 200, "The number of exemplars to draw the examples from."
+)
+_NUM_IN_CONTEXT_EXAMPLES = flags.DEFINE_integer(
+    "num_in_context_examples", 10, "The number of examples in each prompt."
+)
+
+
+def make_example_ads(
+    n_prompts: int, n_exemplars: int, num_in_context_examples: int
+) -> list[list[ad_copy_generator.ExampleAd]]:
+  """Returns the example ads for each prompt, drawn from the exemplars."""
+  rng = np.random.default_rng(0)
+  exemplar_records = [
+      {
+          "keywords": f"keyword {i}a, keyword {i}b",
+          "headlines": [f"Headline {i} {j}" for j in range(15)],
+          "descriptions": [f"Description {i} {j}" for j in range(4)],
+      }
+      for i in range(n_exemplars)
+  ]
+  return [
+      [
+          ad_copy_generator.ExampleAd.from_flat_values(**exemplar_records[i])
+          for i in rng.choice(n_exemplars, num_in_context_examples, False)
+      ]
+      for _ in range(n_prompts)
+  ]
+
+
+def construct_all(
+    example_ads: list[list[ad_copy_generator.ExampleAd]], memoize: bool
+) -> None:
+  """Constructs all the prompts, optionally clearing the memoized messages."""
+  ad_copy_generator.clear_example_ad_messages_cache()
+  for i, example_ads_i in enumerate(example_ads):
+    if not memoize:
+      ad_copy_generator.clear_example_ad_messages_cache()
+    ad_copy_generator.construct_new_ad_copy_prompt(
+        example_ads=example_ads_i,
+        keywords=f"new keyword {i}",
+        ad_format=google_ads.RESPONSIVE_SEARCH_AD_FORMAT,
+    )
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError("Too many command-line arguments.")
+
+  results = []
+  for n_prompts in map(int, _N_PROMPTS.value):
+    example_ads = make_example_ads(
+        n_prompts, _N_EXEMPLARS.value, _NUM_IN_CONTEXT_EXAMPLES.value
+    )
+    seconds = {}
+    for memoize in [False, True]:
+      start_time = time.perf_counter()
+      construct_all(example_ads, memoize)
+      seconds[memoize] = time.perf_counter() - start_time
+
+    results.append({
+        "n_prompts": n_prompts,
+        "rebuilt_us_per_prompt": seconds[False] / n_prompts * 1e6,
+        "memoized_us_per_prompt": seconds[True] / n_prompts * 1e6,
+        "speedup": seconds[False] / seconds[True],
+    })
+
+  print(pd.DataFrame(results).to_string(index=False, float_format="%.1f"))
+
+
+if __name__ == "__main__":
+  app.run(main)
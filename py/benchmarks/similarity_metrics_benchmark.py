@@ -0,0 +1,153 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the style and keyword similarity metrics of the evaluator.
+
+Compares the per-ad loop, which calculates each cosine similarity separately
+and retrieves the most similar training ad as an ExampleAd, with the vectorized
+AdCopyEvaluator.calculate_similarity_metrics_batch. The embeddings are random
+float32 arrays, precomputed so only the CPU time of the metrics is measured.
+
+Usage:
+  python -m benchmarks.similarity_metrics_benchmark --n_ads=1000,10000
+"""
+
+from collections.abc import Sequence
+import time
+
+from absl import app
+from absl import flags
+import numpy as np
+import pandas as pd
+from sklearn.metrics import pairwise
+
+from copycat import ad_copy_evaluator
+from copycat import ad_copy_generator
+from copycat import google_ads
+
+_N_ADS = flags.DEFINE_list(
+    "n_ads", ["1000", "10000"], "The numbers of ads to benchmark."
+)
+_N_EXEMPLARS = flags.DEFINE_integer(
+    "n_exemplars", 1000, "The number of training exemplars."
+)
+_DIMENSIONALITY = flags.DEFINE_integer(
+    "dimensionality", 256, "The dimensionality of the embeddings."
+)
+
+
+def make_evaluator(
+    n_exemplars: int, dimensionality: int
+) -> ad_copy_evaluator.AdCopyEvaluator:
+  """Returns an evaluator with a vectorstore of random exemplars."""
+  rng = np.random.default_rng(0)
+  ad_exemplars = pd.DataFrame({
+      "headlines": [[f"headline {i}"] for i in range(n_exemplars)],
+      "descriptions": [[f"description {i}"] for i in range(n_exemplars)],
+      "keywords": [f"keyword {i}" for i in range(n_exemplars)],
+      "embeddings": list(rng.normal(size=(n_exemplars, dimensionality))),
+  })
+  vectorstore = ad_copy_generator.AdCopyVectorstore(
+      ad_exemplars=ad_exemplars,
+      embedding_model_name="text-embedding-004",
+      dimensionality=dimensionality,
+      embeddings_batch_size=100,
+  )
+  return ad_copy_evaluator.AdCopyEvaluator(
+      google_ads.TEXT_AD_FORMAT, ad_copy_vectorstore=vectorstore
+  )
+
+
+def calculate_similarity_metrics_loop(
+    vectorstore: ad_copy_generator.AdCopyVectorstore,
+    keywords_embeddings: np.ndarray,
+    ad_embeddings: np.ndarray,
+) -> list[dict[str, float]]:
+  """Calculates the similarity metrics one ad at a time."""
+  _, similar_training_ads_embeddings = (
+      vectorstore.get_relevant_ads_and_embeddings_from_embeddings(
+          ad_embeddings, k=1
+      )
+  )
+  similarity_metrics = []
+  for keywords_embedding, ad_embedding, training_ad_embeddings in zip(
+      keywords_embeddings, ad_embeddings, similar_training_ads_embeddings
+  ):
+    similarity_metrics.append({
+        "style_similarity": (
+            1.0
+            + pairwise.cosine_similarity(
+                [training_ad_embeddings[0]], [ad_embedding]
+            )[0][0]
+        )
+        / 2.0,
+        "keyword_similarity": (
+            1.0
+            + pairwise.cosine_similarity([keywords_embedding], [ad_embedding])[
+                0
+            ][0]
+        )
+        / 2.0,
+    })
+  return similarity_metrics
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError("Too many command-line arguments.")
+
+  evaluator = make_evaluator(_N_EXEMPLARS.value, _DIMENSIONALITY.value)
+  vectorstore = evaluator.ad_copy_vectorstore
+  rng = np.random.default_rng(1)
+
+  results = []
+  for n_ads in map(int, _N_ADS.value):
+    keywords_embeddings = rng.normal(
+        size=(n_ads, _DIMENSIONALITY.value)
+    ).astype(np.float32)
+    ad_embeddings = rng.normal(size=(n_ads, _DIMENSIONALITY.value)).astype(
+        np.float32
+    )
+    ad_copies = [
+        google_ads.GoogleAd(headlines=[f"headline {i}"], descriptions=[])
+        for i in range(n_ads)
+    ]
+    # Skip the embedding model, so only the metrics are timed.
+    vectorstore.embed_queries = lambda texts: keywords_embeddings
+    vectorstore.embed_documents = lambda texts: ad_embeddings
+
+    start_time = time.perf_counter()
+    calculate_similarity_metrics_loop(
+        vectorstore, keywords_embeddings, ad_embeddings
+    )
+    loop_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    evaluator.calculate_similarity_metrics_batch(
+        ad_copies=ad_copies, keywords=[""] * n_ads
+    )
+    vectorized_seconds = time.perf_counter() - start_time
+
+    results.append({
+        "n_ads": n_ads,
+        "loop_ms": loop_seconds * 1e3,
+        "vectorized_ms": vectorized_seconds * 1e3,
+        "speedup": loop_seconds / vectorized_seconds,
+    })
+
+  print(pd.DataFrame(results).to_string(index=False, float_format="%.1f"))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -27,8 +27,17 @@ ModelName = copycat.ModelName
 EmbeddingModelName = copycat.EmbeddingModelName
 TextGenerationRequest = copycat.TextGenerationRequest
 ExemplarSelectionMethod = copycat.ExemplarSelectionMethod
+NearestNeighborsIndexType = copycat.NearestNeighborsIndexType
 EvaluationResults = copycat.EvaluationResults
 BirchAgglomerativeKeywordClusterer = copycat.BirchAgglomerativeKeywordClusterer
+InMemoryEmbeddingCache = copycat.InMemoryEmbeddingCache
+SqliteEmbeddingCache = copycat.SqliteEmbeddingCache
+RateLimiter = copycat.RateLimiter
+GenerationScheduler = copycat.GenerationScheduler
+InMemoryResponseCache = copycat.InMemoryResponseCache
+SqliteResponseCache = copycat.SqliteResponseCache
+LandingPageFetcher = copycat.LandingPageFetcher
+LandingPageCache = copycat.LandingPageCache
 
 HarmCategory = copycat.generative_models.HarmCategory
 HarmBlockThreshold = copycat.generative_models.HarmBlockThreshold
@@ -12,20 +12,42 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections.abc import Sequence
 import dataclasses
+import itertools
 import re
 
+import numpy as np
+import pandas as pd
 import pydantic
-from sklearn.metrics import pairwise
 
 from copycat import ad_copy_generator
 from copycat import google_ads
+from copycat import memorisation
 
 
 GoogleAd = google_ads.GoogleAd
 GoogleAdFormat = google_ads.GoogleAdFormat
 
 
+# The error for each reason an ad can be invalid, from check_validity_batch, in
+# the order they are reported.
+_VALIDITY_ERROR_MESSAGES = {
+    "invalid_number_of_headlines": (
+        "Invalid number of headlines for the ad format."
+    ),
+    "invalid_number_of_descriptions": (
+        "Invalid number of descriptions for the ad format."
+    ),
+    "headline_too_long": "At least one headline too long for the ad format.",
+    "description_too_long": (
+        "At least one description too long for the ad format."
+    ),
+    "duplicate_headlines": "Duplicate headlines found.",
+    "duplicate_descriptions": "Duplicate descriptions found.",
+}
+
+
 class EvaluationResults(pydantic.BaseModel):
   """The metrics used to evaluate the generated ad."""
 
@@ -35,16 +57,148 @@ class EvaluationResults(pydantic.BaseModel):
   warnings: list[str]
   style_similarity: float | None
   keyword_similarity: float | None
+  n_memorised_headlines: int | None = None
+  n_memorised_descriptions: int | None = None
+
+
+def _normalize_rows(embeddings: Sequence[Sequence[float]]) -> np.ndarray:
+  """Returns the embeddings as float32 rows scaled to unit length."""
+  embeddings = np.asarray(embeddings, dtype=np.float32)
+  norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))[:, None]
+  return embeddings / np.where(norms == 0.0, 1.0, norms)
 
 
-def _normalized_cosine_similarity(
-    embedding_1: list[float], embedding_2: list[float]
-) -> float:
-  """Calculate the cosine similarity normalized to a value between 0 and 1."""
-  similarity = float(
-      pairwise.cosine_similarity([embedding_1], [embedding_2])[0][0]
+def _normalized_cosine_similarity_rows(
+    unit_embeddings_1: np.ndarray, unit_embeddings_2: np.ndarray
+) -> np.ndarray:
+  """Calculates the cosine similarity of each pair of rows, between 0 and 1.
+
+  Args:
+    unit_embeddings_1: The first embeddings, scaled to unit length, with shape
+      (n, dimensionality).
+    unit_embeddings_2: The second embeddings, scaled to unit length, with the
+      same shape.
+
+  Returns:
+    The normalized cosine similarity between each row of unit_embeddings_1 and
+    the same row of unit_embeddings_2, with shape (n,).
+  """
+  similarity = np.einsum("ij,ij->i", unit_embeddings_1, unit_embeddings_2)
+  return np.clip((1.0 + similarity) / 2.0, 0.0, 1.0)
+
+
+_UNFILLED_SPECIAL_VARIABLE_PATTERN = re.compile(r"{.*?}")
+
+
+def _check_texts_batch(
+    texts_per_ad: Sequence[Sequence[str]], max_length: int
+) -> dict[str, np.ndarray]:
+  """Checks the headlines or descriptions of many ads at once.
+
+  All the texts are flattened into a single array, so the checks are vectorized
+  over all the ads. Only the texts containing a "{" can contain special
+  variables, so only these are parsed.
+
+  Args:
+    texts_per_ad: The headlines or descriptions of each ad.
+    max_length: The maximum length of each text, after the special variables
+      are replaced with their defaults.
+
+  Returns:
+    A dict with the number of texts in each ad ("count"), and boolean arrays
+    for whether each ad has a text that is too long ("too_long"), duplicate
+    texts ("has_duplicates"), or a special variable that cannot be filled
+    ("has_unfillable_special_variables").
+  """
+  n_ads = len(texts_per_ad)
+  counts = np.fromiter(map(len, texts_per_ad), dtype=np.int64, count=n_ads)
+  ad_ids = np.repeat(np.arange(n_ads), counts)
+  texts = list(itertools.chain.from_iterable(texts_per_ad))
+  n_texts = len(texts)
+
+  # The string checks use the builtin str methods, which are faster than the
+  # pandas string accessor for short texts like headlines.
+  lengths = np.fromiter(map(len, texts), dtype=np.int64, count=n_texts)
+  has_unfillable_special_variables = np.zeros(n_texts, dtype=bool)
+  brace_ids = google_ads.find_texts_with_special_variables(texts)
+  if len(brace_ids):
+    parsed_texts = [
+        google_ads.parse_google_ads_special_variables(texts[i])
+        for i in brace_ids
+    ]
+    lengths[brace_ids] = list(map(len, parsed_texts))
+    has_unfillable_special_variables[brace_ids] = [
+        _UNFILLED_SPECIAL_VARIABLE_PATTERN.search(text) is not None
+        for text in parsed_texts
+    ]
+
+  # An ad has duplicate texts if it has fewer unique texts than texts.
+  n_unique_texts = np.fromiter(
+      map(len, map(set, texts_per_ad)), dtype=np.int64, count=n_ads
   )
-  return min(max((1.0 + similarity) / 2.0, 0.0), 1.0)
+
+  def any_per_ad(mask: np.ndarray) -> np.ndarray:
+    return np.bincount(ad_ids[mask], minlength=n_ads) > 0
+
+  return {
+      "count": counts,
+      "too_long": any_per_ad(lengths > max_length),
+      "has_duplicates": n_unique_texts < counts,
+      "has_unfillable_special_variables": any_per_ad(
+          has_unfillable_special_variables
+      ),
+  }
+
+
+def _check_memorised_texts_batch(
+    texts_per_ad: Sequence[Sequence[str]],
+    index: memorisation.MemorisationIndex | None,
+    near_duplicate_threshold: float | None,
+) -> dict[str, np.ndarray]:
+  """Checks which headlines or descriptions of many ads are memorised.
+
+  Args:
+    texts_per_ad: The headlines or descriptions of each ad.
+    index: The index of the training headlines or descriptions, or None if
+      there is no training data.
+    near_duplicate_threshold: The similarity above which a text is a near
+      duplicate of a training text, or None to only find exact copies.
+
+  Returns:
+    A dict with a boolean array for whether all the texts of each ad are copied
+    from the training data ("all_copied"), and the number of texts in each ad
+    that are copies or near duplicates of the training data ("n_memorised").
+  """
+  n_ads = len(texts_per_ad)
+  counts = np.fromiter(
+      (len(texts) for texts in texts_per_ad), dtype=np.int64, count=n_ads
+  )
+  if index is None or not len(index):
+    return {
+        "all_copied": np.zeros(n_ads, dtype=bool),
+        "n_memorised": np.zeros(n_ads, dtype=np.int64),
+    }
+
+  ad_ids = np.repeat(np.arange(n_ads), counts)
+  texts = list(itertools.chain.from_iterable(texts_per_ad))
+  if near_duplicate_threshold is None:
+    is_copied = index.contains_batch(texts)
+    is_memorised = is_copied
+  else:
+    # Generated ads often share headlines, so each unique text is compared with
+    # the training texts once.
+    text_codes, unique_texts = pd.factorize(np.asarray(texts, dtype=object))
+    # A similarity estimate of 1.0 does not mean the texts are equal, e.g. if
+    # they have the same n-grams, so copies are always found by exact lookup.
+    is_copied = index.contains_batch(unique_texts)[text_codes]
+    similarities = index.max_similarity_batch(unique_texts)[text_codes]
+    is_memorised = is_copied | (similarities >= near_duplicate_threshold)
+
+  n_copied = np.bincount(ad_ids[is_copied], minlength=n_ads)
+  return {
+      "all_copied": (counts > 0) & (n_copied == counts),
+      "n_memorised": np.bincount(ad_ids[is_memorised], minlength=n_ads),
+  }
 
 
 @dataclasses.dataclass
@@ -57,10 +211,16 @@ class AdCopyEvaluator:
       provided. Defaults to None.
     training_headlines: The headlines in the training data.
     training_descriptions: The descriptions in the training data.
+    near_duplicate_threshold: The estimated similarity of the character n-grams
+      above which a headline or description is counted as a near duplicate of
+      the training data, e.g. memorisation.DEFAULT_NEAR_DUPLICATE_THRESHOLD.
+      If None (the default), only exact copies are counted, which is much
+      faster.
   """
 
   ad_format: GoogleAdFormat
   ad_copy_vectorstore: ad_copy_generator.AdCopyVectorstore | None = None
+  near_duplicate_threshold: float | None = None
 
   @property
   def training_headlines(self) -> set[str]:
@@ -74,6 +234,20 @@ class AdCopyEvaluator:
       return set()
     return self.ad_copy_vectorstore.unique_descriptions
 
+  @property
+  def _training_headlines_index(self) -> memorisation.MemorisationIndex | None:
+    if self.ad_copy_vectorstore is None:
+      return None
+    return self.ad_copy_vectorstore.headlines_memorisation_index
+
+  @property
+  def _training_descriptions_index(
+      self,
+  ) -> memorisation.MemorisationIndex | None:
+    if self.ad_copy_vectorstore is None:
+      return None
+    return self.ad_copy_vectorstore.descriptions_memorisation_index
+
   def has_valid_number_of_headlines(self, ad_copy: GoogleAd) -> bool:
     """Returns true if the number of headlines is valid.
 
@@ -201,6 +375,61 @@ class AdCopyEvaluator:
 
     return False
 
+  def check_validity_batch(
+      self,
+      headlines: Sequence[Sequence[str]],
+      descriptions: Sequence[Sequence[str]],
+      *,
+      check_unfillable_special_variables: bool = False,
+  ) -> pd.DataFrame:
+    """Checks whether many ads are valid at once, and why they are invalid.
+
+    This applies the same checks as is_valid (and optionally
+    has_unfillable_google_ads_special_variables) to every ad, but vectorized
+    over all the ads, which is much faster for large numbers of ads.
+
+    Args:
+      headlines: The headlines of each ad.
+      descriptions: The descriptions of each ad.
+      check_unfillable_special_variables: Whether to also flag ads that contain
+        special variables that cannot be filled with a default.
+
+    Returns:
+      A dataframe with one row per ad and a boolean column for each reason the
+      ad can be invalid: "invalid_number_of_headlines",
+      "invalid_number_of_descriptions", "headline_too_long",
+      "description_too_long", "duplicate_headlines", "duplicate_descriptions"
+      and, if checked, "unfillable_special_variables". An ad is valid if all of
+      its values are False.
+    """
+    headline_checks = _check_texts_batch(
+        headlines, self.ad_format.max_headline_length
+    )
+    description_checks = _check_texts_batch(
+        descriptions, self.ad_format.max_description_length
+    )
+
+    invalid_reasons = pd.DataFrame({
+        "invalid_number_of_headlines": (
+            (headline_checks["count"] > self.ad_format.max_headlines)
+            | (headline_checks["count"] < self.ad_format.min_headlines)
+        ),
+        "invalid_number_of_descriptions": (
+            (description_checks["count"] > self.ad_format.max_descriptions)
+            | (description_checks["count"] < self.ad_format.min_descriptions)
+        ),
+        "headline_too_long": headline_checks["too_long"],
+        "description_too_long": description_checks["too_long"],
+        "duplicate_headlines": headline_checks["has_duplicates"],
+        "duplicate_descriptions": description_checks["has_duplicates"],
+    })
+    if check_unfillable_special_variables:
+      invalid_reasons["unfillable_special_variables"] = (
+          headline_checks["has_unfillable_special_variables"]
+          | description_checks["has_unfillable_special_variables"]
+      )
+    return invalid_reasons
+
   def is_complete(self, ad_copy: GoogleAd) -> bool:
     """Returns true if the ad copy is complete.
 
@@ -234,26 +463,89 @@ class AdCopyEvaluator:
     )
 
   def headlines_are_memorised(self, ad_copy: GoogleAd) -> bool:
-    """Returns true if all the headlines exist in the training data."""
-    if not ad_copy.headlines:
+    """Returns true if all the headlines exist in the training data.
+
+    The headlines are compared after normalising the case, whitespace and
+    special variables.
+
+    Args:
+      ad_copy: The ad copy to evaluate.
+    """
+    if not ad_copy.headlines or self._training_headlines_index is None:
       # There are no headlines, so they cannot be memorised.
       return False
 
-    return not (set(ad_copy.headlines) - self.training_headlines)
+    return bool(
+        self._training_headlines_index.contains_batch(ad_copy.headlines).all()
+    )
 
   def descriptions_are_memorised(self, ad_copy: GoogleAd) -> bool:
-    """Returns true if all the descriptions exist in the training data."""
-    if not ad_copy.descriptions:
+    """Returns true if all the descriptions exist in the training data.
+
+    The descriptions are compared after normalising the case, whitespace and
+    special variables.
+
+    Args:
+      ad_copy: The ad copy to evaluate.
+    """
+    if not ad_copy.descriptions or self._training_descriptions_index is None:
       # There are no descriptions, so they cannot be memorised.
       return False
 
-    return not (set(ad_copy.descriptions) - self.training_descriptions)
+    return bool(
+        self._training_descriptions_index.contains_batch(
+            ad_copy.descriptions
+        ).all()
+    )
+
+  def check_memorisation_batch(
+      self,
+      headlines: Sequence[Sequence[str]],
+      descriptions: Sequence[Sequence[str]],
+  ) -> pd.DataFrame:
+    """Checks which headlines and descriptions of many ads are memorised.
+
+    Each headline and description is looked up in the normalised index of the
+    training data, and if near_duplicate_threshold is set, compared with the
+    similar training texts found with locality sensitive hashing. This finds
+    ads which copy only some of their headlines or descriptions, without
+    comparing every pair of texts.
+
+    Args:
+      headlines: The headlines of each ad.
+      descriptions: The descriptions of each ad.
+
+    Returns:
+      A dataframe with one row per ad, with the columns
+      "headlines_are_memorised" and "descriptions_are_memorised", which are
+      True if all the headlines or descriptions are copied from the training
+      data, and "n_memorised_headlines" and "n_memorised_descriptions", the
+      number of headlines or descriptions which are copies or near duplicates
+      of the training data.
+    """
+    headline_checks = _check_memorised_texts_batch(
+        headlines,
+        self._training_headlines_index,
+        self.near_duplicate_threshold,
+    )
+    description_checks = _check_memorised_texts_batch(
+        descriptions,
+        self._training_descriptions_index,
+        self.near_duplicate_threshold,
+    )
+    return pd.DataFrame({
+        "headlines_are_memorised": headline_checks["all_copied"],
+        "descriptions_are_memorised": description_checks["all_copied"],
+        "n_memorised_headlines": headline_checks["n_memorised"],
+        "n_memorised_descriptions": description_checks["n_memorised"],
+    })
 
   def calculate_similarity_metrics_batch(
       self,
       *,
       ad_copies: list[GoogleAd],
       keywords: list[str],
+      keywords_embeddings: Sequence[Sequence[float]] | np.ndarray | None = None,
   ) -> list[dict[str, float]]:
     """Evaluates the generated ad copies against the training data and keywords.
 
@@ -271,124 +563,183 @@ class AdCopyEvaluator:
     Args:
       ad_copies: The generated ads.
       keywords: The keywords used to generate the ads.
+      keywords_embeddings: The query embeddings of the keywords, if they have
+        already been calculated to retrieve the in context examples, so they are
+        not embedded again. If None, the keywords are embedded.
 
     Returns:
       A list of dicts containing the style_similarity and keyword_similarity for
       each ad. The dict will be empty if the vectorstore is not provided or
       if the ad has no headlines and descriptions.
     """
+    style_similarities, keyword_similarities = (
+        self._calculate_similarity_arrays(
+            ad_copies, keywords, keywords_embeddings
+        )
+    )
+    similarity_metrics = [dict() for _ in ad_copies]
+    for i in np.flatnonzero(~np.isnan(style_similarities)).tolist():
+      similarity_metrics[i] = {
+          "style_similarity": float(style_similarities[i]),
+          "keyword_similarity": float(keyword_similarities[i]),
+      }
+    return similarity_metrics
+
+  def _calculate_similarity_arrays(
+      self,
+      ad_copies: Sequence[GoogleAd],
+      keywords: Sequence[str],
+      keywords_embeddings: Sequence[Sequence[float]] | np.ndarray | None,
+  ) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the style and keyword similarity of each ad, or NaN if empty.
+
+    See calculate_similarity_metrics_batch for how the metrics are calculated.
+    The metrics are NaN for empty ads, or for all the ads if the vectorstore
+    is not provided.
+
+    Args:
+      ad_copies: The generated ads.
+      keywords: The keywords used to generate the ads.
+      keywords_embeddings: The query embeddings of the keywords, or None to
+        embed the keywords.
+    """
+    style_similarities = np.full(len(ad_copies), np.nan)
+    keyword_similarities = np.full(len(ad_copies), np.nan)
     if self.ad_copy_vectorstore is None:
-      return [dict()] * len(ad_copies)
+      return style_similarities, keyword_similarities
 
-    keywords_embeddings = self.ad_copy_vectorstore.embed_queries(keywords)
-    ad_embeddings = self.ad_copy_vectorstore.embed_documents(
-        list(map(str, ad_copies))
+    non_empty_ids = [
+        i for i, ad_copy in enumerate(ad_copies) if not self.is_empty(ad_copy)
+    ]
+    if not non_empty_ids:
+      return style_similarities, keyword_similarities
+
+    # The embeddings are converted to unit length float32 arrays once, since
+    # converting the lists is slower than calculating the metrics.
+    if keywords_embeddings is None:
+      keywords_embeddings = self.ad_copy_vectorstore.embed_queries(
+          [keywords[i] for i in non_empty_ids]
+      )
+    else:
+      keywords_embeddings = np.asarray(keywords_embeddings)[non_empty_ids]
+    keywords_embeddings = _normalize_rows(keywords_embeddings)
+    ad_embeddings = np.asarray(
+        self.ad_copy_vectorstore.embed_documents(
+            [str(ad_copies[i]) for i in non_empty_ids]
+        ),
+        dtype=np.float32,
     )
-
-    _, similar_training_ads_embeddings = (
-        self.ad_copy_vectorstore.get_relevant_ads_and_embeddings_from_embeddings(
+    _, nearest_exemplar_ids = (
+        self.ad_copy_vectorstore.get_nearest_exemplar_ids_from_embeddings(
             ad_embeddings, k=1
         )
     )
-    most_similar_training_ads_embeddings = [
-        similar_embeddings[0]
-        for similar_embeddings in similar_training_ads_embeddings
-    ]
-
-    similarity_metrics = []
-    for (
-        keywords_embedding,
-        ad_embedding,
-        ad_copy,
-        most_similar_training_ad_embeddings,
-    ) in zip(
-        keywords_embeddings,
-        ad_embeddings,
-        ad_copies,
-        most_similar_training_ads_embeddings,
-    ):
-      if self.is_empty(ad_copy):
-        similarity_metrics.append(dict())
-        continue
-
-      keyword_similarity = _normalized_cosine_similarity(
-          keywords_embedding, ad_embedding
-      )
-
-      style_similarity = _normalized_cosine_similarity(
-          most_similar_training_ad_embeddings, ad_embedding
-      )
-
-      similarity_metrics.append({
-          "style_similarity": style_similarity,
-          "keyword_similarity": keyword_similarity,
-      })
+    ad_embeddings = _normalize_rows(ad_embeddings)
+    most_similar_training_ads_embeddings = _normalize_rows(
+        self.ad_copy_vectorstore.embeddings[nearest_exemplar_ids[:, 0]]
+    )
 
-    return similarity_metrics
+    keyword_similarities[non_empty_ids] = _normalized_cosine_similarity_rows(
+        keywords_embeddings, ad_embeddings
+    )
+    style_similarities[non_empty_ids] = _normalized_cosine_similarity_rows(
+        most_similar_training_ads_embeddings, ad_embeddings
+    )
+    return style_similarities, keyword_similarities
 
-  def _evaluate_simple_metrics(
+  def evaluate_batch_as_dataframe(
       self,
-      ad_copy: GoogleAd,
+      ad_copies: Sequence[GoogleAd],
       *,
       allow_memorised_headlines: bool = False,
       allow_memorised_descriptions: bool = False,
-  ) -> EvaluationResults:
-    """Evaluates the generated ad copy.
+      keywords: Sequence[str] | None = None,
+      keywords_embeddings: Sequence[Sequence[float]] | np.ndarray | None = None,
+  ) -> pd.DataFrame:
+    """Evaluates the generated ad copies, with one row per ad.
 
-    This checks that the number of headlines and descriptions is within the
-    limits for the ad format, the headlines and descriptions are unique, and
-    that the length of each headline and description is within the limits.
+    The headlines and descriptions of all the ads are flattened and every rule
+    is checked in a single vectorized pass over all the ads (see
+    check_validity_batch and check_memorisation_batch). The errors and
+    warnings are only built for the ads that break a rule.
 
     Args:
-      ad_copy: The ad copy to evaluate.
+      ad_copies: The generated ads.
       allow_memorised_headlines: Whether to allow the headlines to be memorised.
       allow_memorised_descriptions: Whether to allow the descriptions to be
         memorised.
+      keywords: The list of keywords used to generate the ads. Only required for
+        the style and keyword similarity metrics. If not provided, these metrics
+        will be NaN.
+      keywords_embeddings: The query embeddings of the keywords, if they have
+        already been calculated, so they are not embedded again.
 
     Returns:
-      The evaluation results for the ad copy.
+      A dataframe with a column for each field of EvaluationResults, where the
+      similarity metrics are NaN if they are not calculated, followed by the
+      boolean columns returned by check_validity_batch.
     """
-    errors = []
-    warnings = []
-
-    if not self.has_valid_number_of_headlines(ad_copy):
-      errors.append("Invalid number of headlines for the ad format.")
-    if not self.has_valid_number_of_descriptions(ad_copy):
-      errors.append("Invalid number of descriptions for the ad format.")
-    if not self.has_valid_headline_lengths(ad_copy):
-      errors.append("At least one headline too long for the ad format.")
-    if not self.has_valid_description_lengths(ad_copy):
-      errors.append("At least one description too long for the ad format.")
-    if not self.has_unique_headlines(ad_copy):
-      errors.append("Duplicate headlines found.")
-    if not self.has_unique_descriptions(ad_copy):
-      errors.append("Duplicate descriptions found.")
-
-    headlines_are_memorised = self.headlines_are_memorised(ad_copy)
-    descriptions_are_memorised = self.descriptions_are_memorised(ad_copy)
-
-    if headlines_are_memorised:
-      if allow_memorised_headlines:
-        warnings.append("All headlines are memorised from the training data.")
-      else:
-        errors.append("All headlines are memorised from the training data.")
-    if descriptions_are_memorised:
-      if allow_memorised_descriptions:
-        warnings.append(
-            "All descriptions are memorised from the training data."
-        )
-      else:
-        errors.append("All descriptions are memorised from the training data.")
-
-    return EvaluationResults(
-        errors=errors,
-        warnings=warnings,
-        headlines_are_memorised=headlines_are_memorised,
-        descriptions_are_memorised=descriptions_are_memorised,
-        style_similarity=None,
-        keyword_similarity=None,
+    headlines = [ad_copy.headlines for ad_copy in ad_copies]
+    descriptions = [ad_copy.descriptions for ad_copy in ad_copies]
+    invalid_reasons = self.check_validity_batch(headlines, descriptions)
+    memorisation_results = self.check_memorisation_batch(
+        headlines, descriptions
     )
 
+    errors = [[] for _ in ad_copies]
+    warnings = [[] for _ in ad_copies]
+    ad_ids, reason_ids = np.nonzero(
+        invalid_reasons[list(_VALIDITY_ERROR_MESSAGES)].to_numpy()
+    )
+    validity_error_messages = list(_VALIDITY_ERROR_MESSAGES.values())
+    for i, reason_id in zip(ad_ids.tolist(), reason_ids.tolist()):
+      errors[i].append(validity_error_messages[reason_id])
+
+    memorisation_checks = [
+        ("headlines", headlines, allow_memorised_headlines),
+        ("descriptions", descriptions, allow_memorised_descriptions),
+    ]
+    for kind, _, allow_memorised in memorisation_checks:
+      messages = warnings if allow_memorised else errors
+      is_memorised = memorisation_results[f"{kind}_are_memorised"].to_numpy()
+      for i in np.flatnonzero(is_memorised).tolist():
+        messages[i].append(f"All {kind} are memorised from the training data.")
+    for kind, texts_per_ad, _ in memorisation_checks:
+      is_memorised = memorisation_results[f"{kind}_are_memorised"].to_numpy()
+      n_memorised = memorisation_results[f"n_memorised_{kind}"].to_numpy()
+      for i in np.flatnonzero((n_memorised > 0) & ~is_memorised).tolist():
+        warnings[i].append(
+            f"{n_memorised[i]} of {len(texts_per_ad[i])} {kind} are copied"
+            " from or near duplicates of the training data."
+        )
+
+    style_similarities = np.full(len(ad_copies), np.nan)
+    keyword_similarities = np.full(len(ad_copies), np.nan)
+    if keywords is not None:
+      style_similarities, keyword_similarities = (
+          self._calculate_similarity_arrays(
+              ad_copies, keywords, keywords_embeddings
+          )
+      )
+
+    evaluation_results = pd.DataFrame({
+        "headlines_are_memorised": memorisation_results[
+            "headlines_are_memorised"
+        ],
+        "descriptions_are_memorised": memorisation_results[
+            "descriptions_are_memorised"
+        ],
+        "errors": errors,
+        "warnings": warnings,
+        "style_similarity": style_similarities,
+        "keyword_similarity": keyword_similarities,
+        "n_memorised_headlines": memorisation_results["n_memorised_headlines"],
+        "n_memorised_descriptions": memorisation_results[
+            "n_memorised_descriptions"
+        ],
+    })
+    return pd.concat([evaluation_results, invalid_reasons], axis=1)
+
   def evaluate_batch(
       self,
       ad_copies: list[GoogleAd],
@@ -396,9 +747,13 @@ class AdCopyEvaluator:
       allow_memorised_headlines: bool = False,
       allow_memorised_descriptions: bool = False,
       keywords: list[str] | None = None,
+      keywords_embeddings: Sequence[Sequence[float]] | np.ndarray | None = None,
   ) -> list[EvaluationResults]:
     """Evaluates the generated ad copies.
 
+    The ads are evaluated together with evaluate_batch_as_dataframe, and the
+    results are then converted to EvaluationResults.
+
     Args:
       ad_copies: The generated ads.
       allow_memorised_headlines: Whether to allow the headlines to be memorised.
@@ -407,36 +762,27 @@ class AdCopyEvaluator:
       keywords: The list of keywords used to generate the ads. Only required for
         the style and keyword similarity metrics. If not provided, these metrics
         will be None.
+      keywords_embeddings: The query embeddings of the keywords, if they have
+        already been calculated, so they are not embedded again.
 
     Returns:
       The list of evaluation results for each ad.
     """
-
-    results = [
-        self._evaluate_simple_metrics(
-            ad_copy=ad_copy,
-            allow_memorised_headlines=allow_memorised_headlines,
-            allow_memorised_descriptions=allow_memorised_descriptions,
-        )
-        for ad_copy in ad_copies
-    ]
-
-    if keywords is None:
-      return results
-
-    similarity_metrics = self.calculate_similarity_metrics_batch(
-        ad_copies=ad_copies, keywords=keywords
+    evaluation_results = self.evaluate_batch_as_dataframe(
+        ad_copies,
+        allow_memorised_headlines=allow_memorised_headlines,
+        allow_memorised_descriptions=allow_memorised_descriptions,
+        keywords=keywords,
+        keywords_embeddings=keywords_embeddings,
     )
-
-    results = [
-        results_i.model_copy(
-            update=dict(
-                style_similarity=similarity_metrics_i.get("style_similarity"),
-                keyword_similarity=similarity_metrics_i.get(
-                    "keyword_similarity"
-                ),
-            )
-        )
-        for results_i, similarity_metrics_i in zip(results, similarity_metrics)
+    # The columns are converted to lists of python values once. Validating the
+    # models is faster than model_construct, which runs in Python.
+    field_names = list(EvaluationResults.model_fields)
+    for name in ["style_similarity", "keyword_similarity"]:
+      evaluation_results[name] = evaluation_results[name].astype(object)
+      evaluation_results.loc[evaluation_results[name].isna(), name] = None
+    columns = [evaluation_results[name].tolist() for name in field_names]
+    return [
+        EvaluationResults(**dict(zip(field_names, values)))
+        for values in zip(*columns)
     ]
-    return results
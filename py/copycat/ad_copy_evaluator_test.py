@@ -15,11 +15,13 @@
 from absl.testing import absltest
 from absl.testing import parameterized
 import mock
+import numpy as np
 import pandas as pd
 
 from copycat import ad_copy_evaluator
 from copycat import ad_copy_generator
 from copycat import google_ads
+from copycat import memorisation
 from copycat import testing_utils
 
 
@@ -79,11 +81,65 @@ class AdCopyEvaluatorTest(parameterized.TestCase):
     )[0]
 
     expected_metrics = dict(
-        style_similarity=0.5366996856066526,
-        keyword_similarity=0.48784862680427793,
+        style_similarity=0.536699652671814,
+        keyword_similarity=0.4878486096858978,
     )
     self.assertDictEqual(actual_metrics, expected_metrics)
 
+  def test_similarity_metrics_are_calculated_in_batch(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format,
+        ad_copy_vectorstore=self.ad_copy_vectorstore,
+    )
+    generated_ad = google_ads.GoogleAd(
+        headlines=["generated headline"], descriptions=["generated description"]
+    )
+    empty_ad = google_ads.GoogleAd(headlines=[], descriptions=[])
+
+    actual_metrics = evaluator.calculate_similarity_metrics_batch(
+        ad_copies=[empty_ad, generated_ad, empty_ad],
+        keywords=["keyword 3", "keyword 1, keyword 2", "keyword 4"],
+    )
+
+    self.assertEqual(
+        actual_metrics,
+        [
+            dict(),
+            dict(
+                style_similarity=0.536699652671814,
+                keyword_similarity=0.4878486096858978,
+            ),
+            dict(),
+        ],
+    )
+
+  def test_similarity_metrics_use_precomputed_keywords_embeddings(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format,
+        ad_copy_vectorstore=self.ad_copy_vectorstore,
+    )
+    generated_ad = google_ads.GoogleAd(
+        headlines=["generated headline"], descriptions=["generated description"]
+    )
+    empty_ad = google_ads.GoogleAd(headlines=[], descriptions=[])
+    keywords = ["keyword 3", "keyword 1, keyword 2"]
+    keywords_embeddings = self.ad_copy_vectorstore.embed_queries(keywords)
+
+    with mock.patch.object(
+        self.ad_copy_vectorstore, "embed_queries", autospec=True
+    ) as mock_embed_queries:
+      actual_metrics = evaluator.calculate_similarity_metrics_batch(
+          ad_copies=[empty_ad, generated_ad],
+          keywords=keywords,
+          keywords_embeddings=keywords_embeddings,
+      )
+    expected_metrics = evaluator.calculate_similarity_metrics_batch(
+        ad_copies=[empty_ad, generated_ad], keywords=keywords
+    )
+
+    mock_embed_queries.assert_not_called()
+    self.assertEqual(actual_metrics, expected_metrics)
+
   @parameterized.named_parameters([
       {
           "testcase_name": "valid",
@@ -469,6 +525,230 @@ class AdCopyEvaluatorTest(parameterized.TestCase):
     )
     self.assertCountEqual(expected_errors, results.errors)
 
+  def test_headlines_are_memorised_ignores_case_and_whitespace(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format, self.ad_copy_vectorstore
+    )
+    ad_copy = google_ads.GoogleAd(
+        headlines=["Train  Headline 1", "{KeyWord:train headline 2}"],
+        descriptions=["TRAIN DESCRIPTION 1", "new description"],
+    )
+
+    self.assertTrue(evaluator.headlines_are_memorised(ad_copy))
+    self.assertFalse(evaluator.descriptions_are_memorised(ad_copy))
+
+  def test_check_memorisation_batch_counts_partially_memorised_ads(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format,
+        self.ad_copy_vectorstore,
+        near_duplicate_threshold=memorisation.DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+    )
+
+    results = evaluator.check_memorisation_batch(
+        headlines=[
+            ["train headline 1", "a brand new headline"],
+            ["Train headline 2!", "another new headline"],
+            ["train headline 3", "train headline 4"],
+            [],
+        ],
+        descriptions=[
+            ["a brand new description"],
+            ["train description 1"],
+            [],
+            ["train description 2", "another new description"],
+        ],
+    )
+
+    pd.testing.assert_frame_equal(
+        results,
+        pd.DataFrame({
+            "headlines_are_memorised": [False, False, True, False],
+            "descriptions_are_memorised": [False, True, False, False],
+            "n_memorised_headlines": [1, 1, 2, 0],
+            "n_memorised_descriptions": [0, 1, 0, 1],
+        }),
+    )
+
+  def test_check_memorisation_batch_only_counts_copies_by_default(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format, self.ad_copy_vectorstore
+    )
+
+    results = evaluator.check_memorisation_batch(
+        headlines=[["train headline 1", "Train headline 2!"]],
+        descriptions=[["train description 1"]],
+    )
+
+    self.assertEqual(results["n_memorised_headlines"].tolist(), [1])
+    self.assertEqual(results["n_memorised_descriptions"].tolist(), [1])
+
+  def test_memorisation_with_same_ngrams_is_not_an_exact_copy(self):
+    # The texts have the same character 3-grams, so their estimated similarity
+    # is 1.0, but the generated description is not copied.
+    ad_copy_vectorstore = (
+        ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+            training_data=pd.DataFrame({
+                "headlines": [["train headline"]],
+                "descriptions": [["Buy now buy now"]],
+                "keywords": ["keyword"],
+            }),
+            embedding_model_name="text-embedding-004",
+            dimensionality=256,
+            max_initial_ads=100,
+            max_exemplar_ads=20,
+            affinity_preference=None,
+            embeddings_batch_size=10,
+            exemplar_selection_method="random",
+        )
+    )
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format,
+        ad_copy_vectorstore,
+        near_duplicate_threshold=memorisation.DEFAULT_NEAR_DUPLICATE_THRESHOLD,
+    )
+    ad_copy = google_ads.GoogleAd(
+        headlines=["new headline 1", "new headline 2", "new headline 3"],
+        descriptions=["buy now buy now buy now"],
+    )
+
+    batch_results = evaluator.check_memorisation_batch(
+        [ad_copy.headlines], [ad_copy.descriptions]
+    )
+    results = evaluator.evaluate_batch([ad_copy])[0]
+
+    self.assertFalse(evaluator.descriptions_are_memorised(ad_copy))
+    self.assertEqual(
+        batch_results["descriptions_are_memorised"].tolist(), [False]
+    )
+    self.assertEqual(batch_results["n_memorised_descriptions"].tolist(), [1])
+    self.assertFalse(results.descriptions_are_memorised)
+    self.assertNotIn(
+        "All descriptions are memorised from the training data.",
+        results.errors,
+    )
+
+  def test_evaluate_batch_warns_about_partially_memorised_ads(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format, self.ad_copy_vectorstore
+    )
+    ad_copy = google_ads.GoogleAd(
+        headlines=["train headline 1", "new headline", "another headline"],
+        descriptions=["train description 1", "train description 2"],
+    )
+
+    results = evaluator.evaluate_batch(
+        [ad_copy], allow_memorised_descriptions=True
+    )[0]
+
+    self.assertEqual(results.n_memorised_headlines, 1)
+    self.assertEqual(results.n_memorised_descriptions, 2)
+    self.assertEqual(
+        results.warnings,
+        [
+            "All descriptions are memorised from the training data.",
+            "1 of 3 headlines are copied from or near duplicates of the"
+            " training data.",
+        ],
+    )
+    self.assertEmpty(results.errors)
+
+  def test_evaluate_batch_as_dataframe_returns_one_row_per_ad(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format, self.ad_copy_vectorstore
+    )
+    valid_ad = google_ads.GoogleAd(
+        headlines=["new headline 1", "new headline 2", "new headline 3"],
+        descriptions=["new description 1", "new description 2"],
+    )
+    invalid_ad = google_ads.GoogleAd(
+        headlines=["train headline 1", "train headline 1"],
+        descriptions=["a" * 91, "train description 2"],
+    )
+    empty_ad = google_ads.GoogleAd(headlines=[], descriptions=[])
+
+    results = evaluator.evaluate_batch_as_dataframe(
+        [valid_ad, invalid_ad, empty_ad],
+        allow_memorised_headlines=True,
+        keywords=["keyword 1", "keyword 2", "keyword 3"],
+    )
+
+    self.assertEqual(
+        results["errors"].tolist(),
+        [
+            [],
+            [
+                "Invalid number of headlines for the ad format.",
+                "At least one description too long for the ad format.",
+                "Duplicate headlines found.",
+            ],
+            [
+                "Invalid number of headlines for the ad format.",
+                "Invalid number of descriptions for the ad format.",
+            ],
+        ],
+    )
+    self.assertEqual(
+        results["warnings"].tolist(),
+        [
+            [],
+            [
+                "All headlines are memorised from the training data.",
+                "1 of 2 descriptions are copied from or near duplicates of"
+                " the training data.",
+            ],
+            [],
+        ],
+    )
+    self.assertEqual(
+        results["headlines_are_memorised"].tolist(), [False, True, False]
+    )
+    self.assertEqual(results["n_memorised_headlines"].tolist(), [0, 2, 0])
+    self.assertEqual(results["n_memorised_descriptions"].tolist(), [0, 1, 0])
+    self.assertEqual(
+        results["duplicate_headlines"].tolist(), [False, True, False]
+    )
+    self.assertTrue(results["style_similarity"].iloc[:2].notna().all())
+    self.assertTrue(np.isnan(results["style_similarity"].iloc[2]))
+    self.assertTrue(np.isnan(results["keyword_similarity"].iloc[2]))
+
+  def test_evaluate_batch_matches_evaluate_batch_as_dataframe(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(
+        self.ad_format, self.ad_copy_vectorstore
+    )
+    ad_copies = [
+        google_ads.GoogleAd(
+            headlines=["train headline 1", "new headline", "new headline"],
+            descriptions=["new description 1", "new description 2"],
+        ),
+        google_ads.GoogleAd(headlines=[], descriptions=[]),
+    ]
+
+    results = evaluator.evaluate_batch(
+        ad_copies, keywords=["keyword 1", "keyword 2"]
+    )
+    results_dataframe = evaluator.evaluate_batch_as_dataframe(
+        ad_copies, keywords=["keyword 1", "keyword 2"]
+    )
+
+    self.assertEqual(
+        results[0],
+        ad_copy_evaluator.EvaluationResults(
+            errors=["Duplicate headlines found."],
+            warnings=[
+                "1 of 3 headlines are copied from or near duplicates of the"
+                " training data."
+            ],
+            headlines_are_memorised=False,
+            descriptions_are_memorised=False,
+            style_similarity=results_dataframe["style_similarity"].iloc[0],
+            keyword_similarity=results_dataframe["keyword_similarity"].iloc[0],
+            n_memorised_headlines=1,
+            n_memorised_descriptions=0,
+        ),
+    )
+    self.assertIsNone(results[1].style_similarity)
+    self.assertIsNone(results[1].keyword_similarity)
+
   def test_evaluate_returns_expected_results_with_vectorstore(self):
     evaluator = ad_copy_evaluator.AdCopyEvaluator(
         self.ad_format,
@@ -492,8 +772,10 @@ class AdCopyEvaluatorTest(parameterized.TestCase):
         warnings=[],
         headlines_are_memorised=False,
         descriptions_are_memorised=False,
-        keyword_similarity=0.5023139051908866,
-        style_similarity=0.5617324461155475,
+        n_memorised_headlines=0,
+        n_memorised_descriptions=0,
+        keyword_similarity=0.5023139119148254,
+        style_similarity=0.5617324113845825,
     )
     self.assertEqual(results, expected_results)
 
@@ -519,6 +801,8 @@ class AdCopyEvaluatorTest(parameterized.TestCase):
         warnings=[],
         headlines_are_memorised=False,
         descriptions_are_memorised=False,
+        n_memorised_headlines=0,
+        n_memorised_descriptions=0,
         keyword_similarity=None,
         style_similarity=None,
     )
@@ -546,6 +830,8 @@ class AdCopyEvaluatorTest(parameterized.TestCase):
         warnings=[],
         headlines_are_memorised=False,
         descriptions_are_memorised=False,
+        n_memorised_headlines=0,
+        n_memorised_descriptions=0,
         keyword_similarity=None,
         style_similarity=None,
     )
@@ -574,6 +860,8 @@ class AdCopyEvaluatorTest(parameterized.TestCase):
         warnings=[],
         headlines_are_memorised=False,
         descriptions_are_memorised=False,
+        n_memorised_headlines=0,
+        n_memorised_descriptions=0,
         keyword_similarity=None,
         style_similarity=None,
     )
@@ -642,6 +930,88 @@ class AdCopyEvaluatorTest(parameterized.TestCase):
         expected_response,
     )
 
+  def test_check_validity_batch_matches_row_wise_checks(self):
+    ads = [
+        google_ads.GoogleAd(
+            headlines=["headline 1", "headline 2", "headline 3"],
+            descriptions=["description 1", "description 2"],
+        ),
+        google_ads.GoogleAd(
+            headlines=["headline 1", "headline 2"],
+            descriptions=["description 1", "description 2"],
+        ),
+        google_ads.GoogleAd(
+            headlines=["headline 1", "headline 2", "a" * 31],
+            descriptions=["description 1", "description 2"],
+        ),
+        google_ads.GoogleAd(
+            headlines=["headline 1", "headline 2", "headline 1"],
+            descriptions=["description 1", "description 1"],
+        ),
+        google_ads.GoogleAd(
+            headlines=[
+                "headline 1",
+                "headline 2",
+                "{KeyWord:" + "a" * 25 + "}",
+            ],
+            descriptions=["description 1", "description {CUSTOMIZER.product}"],
+        ),
+        google_ads.GoogleAd(
+            headlines=[
+                "headline 1",
+                "headline 2",
+                "{KeyWord:" + "a" * 31 + "}",
+            ],
+            descriptions=["description 1", "description 2"],
+        ),
+        google_ads.GoogleAd(headlines=[], descriptions=[]),
+    ]
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(self.ad_format)
+
+    invalid_reasons = evaluator.check_validity_batch(
+        [ad.headlines for ad in ads],
+        [ad.descriptions for ad in ads],
+        check_unfillable_special_variables=True,
+    )
+
+    self.assertListEqual(
+        invalid_reasons.drop(columns="unfillable_special_variables")
+        .any(axis=1)
+        .tolist(),
+        [not evaluator.is_valid(ad) for ad in ads],
+    )
+    self.assertListEqual(
+        invalid_reasons["unfillable_special_variables"].tolist(),
+        [
+            evaluator.has_unfillable_google_ads_special_variables(ad)
+            for ad in ads
+        ],
+    )
+
+  def test_check_validity_batch_returns_reasons_for_invalid_ads(self):
+    evaluator = ad_copy_evaluator.AdCopyEvaluator(self.ad_format)
+
+    invalid_reasons = evaluator.check_validity_batch(
+        [
+            ["headline 1", "headline 2", "headline 3"],
+            ["headline 1", "headline 1", "a" * 31],
+        ],
+        [
+            ["description 1", "description 2"],
+            ["description 1"],
+        ],
+    )
+
+    expected_invalid_reasons = pd.DataFrame({
+        "invalid_number_of_headlines": [False, False],
+        "invalid_number_of_descriptions": [False, True],
+        "headline_too_long": [False, True],
+        "description_too_long": [False, False],
+        "duplicate_headlines": [False, True],
+        "duplicate_descriptions": [False, False],
+    })
+    pd.testing.assert_frame_equal(invalid_reasons, expected_invalid_reasons)
+
 
 if __name__ == "__main__":
   absltest.main()
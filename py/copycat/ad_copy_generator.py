@@ -13,27 +13,44 @@
 # limitations under the License.
 
 import asyncio
-from collections.abc import Sequence
+import collections
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from concurrent import futures
 import dataclasses
 import enum
 import functools
 import json
 import logging
+import os
 import re
-from typing import Any, AsyncIterable, Coroutine, Hashable, TypeVar
+import threading
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Coroutine,
+    Hashable,
+    TypeVar,
+)
+import weakref
 
-import bs4
 from vertexai import generative_models
 from vertexai import language_models
 import numpy as np
 import pandas as pd
 import pydantic
-import requests
 from sklearn import cluster
-from sklearn import neighbors
 import tqdm
 
+from copycat import embedding_cache as embedding_cache_lib
+from copycat import event_loops
+from copycat import exemplar_selection
 from copycat import google_ads
+from copycat import landing_pages
+from copycat import memorisation
+from copycat import nearest_neighbors as nearest_neighbors_lib
+from copycat import rate_limiting
+from copycat import response_cache as response_cache_lib
 
 
 LOGGER = logging.getLogger(__name__)
@@ -46,6 +63,30 @@ LOGGER.setLevel(logging.INFO)
 # token count.
 MAX_CHARACTERS_PER_TEXT_EMBEDDING = 2000
 
+# Embedding requests that fail with a transient error (e.g. quota exceeded) are
+# retried with jittered exponential backoff.
+EMBEDDING_MAX_ATTEMPTS = 5
+EMBEDDING_RETRY_MAX_WAIT_SECONDS = 60.0
+
+# Defaults for the generation scheduler, which limits the number of generation
+# requests in flight and retries the ones that fail with a transient error.
+GENERATION_MAX_CONCURRENT_REQUESTS = 10
+GENERATION_MAX_ATTEMPTS = 5
+GENERATION_RETRY_MAX_WAIT_SECONDS = 60.0
+GENERATION_REQUEST_TIMEOUT_SECONDS = 300.0
+
+# The maximum number of chat models kept per event loop for reuse between
+# requests with the same parameters.
+GENERATIVE_MODEL_CACHE_SIZE = 32
+
+# The maximum number of in-context example messages memoized for reuse between
+# prompts.
+EXAMPLE_AD_MESSAGES_CACHE_SIZE = 10_000
+
+# The suffix added to keywords specific instructions or web page content that
+# has been truncated.
+TRUNCATED_TEXT_SUFFIX = " [truncated]"
+
 
 class TqdmLogger:
   """File-like class redirecting tqdm progress bar to LOGGER."""
@@ -76,7 +117,10 @@ SafetySettingsType = (
 )
 
 VECTORSTORE_PARAMS_FILE_NAME = "vectorstore_params.json"
-VECTORSTORE_AD_EXEMPLARS_FILE_NAME = "vectorstore_ad_exemplars.csv"
+VECTORSTORE_AD_EXEMPLARS_FILE_NAME = "vectorstore_ad_exemplars.json"
+VECTORSTORE_EMBEDDINGS_FILE_NAME = "vectorstore_embeddings.npy"
+
+SUPPORTED_EMBEDDINGS_DTYPES = ("float32", "float16")
 
 
 class ModelName(enum.Enum):
@@ -98,6 +142,8 @@ class EmbeddingModelName(enum.Enum):
 class ExemplarSelectionMethod(enum.Enum):
   AFFINITY_PROPAGATION = "affinity_propagation"
   RANDOM = "random"
+  KMEANS_MEDOIDS = "kmeans_medoids"
+  FARTHEST_POINT = "farthest_point"
 
 
 class TextGenerationRequest(pydantic.BaseModel):
@@ -184,20 +230,115 @@ class AdCopyVectorstore:
   matched to the query based on the most relavent individual headline or
   description, rather than an average over all of them.
 
+  The embeddings of the exemplar ads are stored in a single contiguous matrix,
+  where row i is the embedding of row i of ad_exemplars. The ad_exemplars
+  dataframe only contains the text of the ads.
+
   Attributes:
     embedding_model_name: The name of the embedding model to use.
     ad_exemplars: The example ads available to be used as in context examples.
     dimensionality: The dimensionality of the embedding model.
     embeddings_batch_size: The batch size to use when generating embeddings.
+    embeddings: The embeddings of the exemplar ads, as a matrix with one row
+      per exemplar. If not provided, they are taken from the "embeddings"
+      column of ad_exemplars.
+    embeddings_dtype: The dtype used to store the embeddings, either "float32"
+      or "float16". Defaults to "float32".
     unique_headlines: The unique headlines in the vectorstore.
     unique_descriptions: The unique descriptions in the vectorstore.
+    headlines_memorisation_index: The index of the normalised headlines in the
+      vectorstore, used to find copied and near duplicate headlines.
+    descriptions_memorisation_index: The index of the normalised descriptions
+      in the vectorstore.
     n_exemplars: The total number of exemplars in the vectorstore.
+    embeddings_max_concurrent_requests: The maximum number of embedding
+      batches to send to the embedding model at the same time.
+    embedding_cache: An optional cache for the embeddings, so that texts that
+      have already been embedded are not sent to the embedding model again. It
+      is not serialized with the vectorstore.
+    embeddings_rate_limiter: An optional rate limiter to keep the embedding
+      requests within the quota. It is not serialized with the vectorstore.
+    nearest_neighbors_index_type: The type of index used to find the most
+      relevant exemplars for a query, one of "euclidean" (exact), "cosine"
+      (exact) or "ivf_cosine" (approximate, for large vectorstores). Defaults
+      to "euclidean".
+    nearest_neighbors_index_params: Parameters for the nearest neighbors index,
+      only used by the "ivf_cosine" index (n_lists, n_probe and random_state).
   """
 
   embedding_model_name: EmbeddingModelName
   ad_exemplars: pd.DataFrame
   dimensionality: int
   embeddings_batch_size: int
+  embeddings: np.ndarray | None = dataclasses.field(
+      default=None, repr=False, compare=False
+  )
+  embeddings_dtype: str = "float32"
+  embeddings_max_concurrent_requests: int = 1
+  embedding_cache: embedding_cache_lib.EmbeddingCache | None = (
+      dataclasses.field(default=None, repr=False, compare=False)
+  )
+  embeddings_rate_limiter: rate_limiting.RateLimiter | None = (
+      dataclasses.field(default=None, repr=False, compare=False)
+  )
+  nearest_neighbors_index_type: (
+      nearest_neighbors_lib.NearestNeighborsIndexType
+  ) = nearest_neighbors_lib.NearestNeighborsIndexType.EUCLIDEAN
+  nearest_neighbors_index_params: dict[str, Any] = dataclasses.field(
+      default_factory=dict
+  )
+
+  def __post_init__(self):
+    """Moves the embeddings out of ad_exemplars into the embeddings matrix.
+
+    Raises:
+      ValueError: If the embeddings dtype is not supported, the embeddings of
+        the exemplars are missing, or the number of embeddings does not match
+        the number of exemplars.
+    """
+    if self.embeddings_dtype not in SUPPORTED_EMBEDDINGS_DTYPES:
+      LOGGER.error(
+          "Unsupported embeddings dtype: %s. Must be one of %s.",
+          self.embeddings_dtype,
+          SUPPORTED_EMBEDDINGS_DTYPES,
+      )
+      raise ValueError(
+          f"Unsupported embeddings dtype: {self.embeddings_dtype}. Must be one"
+          f" of {SUPPORTED_EMBEDDINGS_DTYPES}."
+      )
+
+    self.embedding_model_name = EmbeddingModelName(self.embedding_model_name)
+    self.nearest_neighbors_index_type = (
+        nearest_neighbors_lib.NearestNeighborsIndexType(
+            self.nearest_neighbors_index_type
+        )
+    )
+
+    if self.embeddings is None:
+      if "embeddings" in self.ad_exemplars.columns:
+        embeddings = self.ad_exemplars["embeddings"].values.tolist()
+      elif self.ad_exemplars.empty:
+        embeddings = np.zeros((0, self.dimensionality))
+      else:
+        LOGGER.error(
+            "The embeddings of the %d ad exemplars are missing. Pass them as"
+            " embeddings or as an embeddings column of ad_exemplars.",
+            len(self.ad_exemplars),
+        )
+        raise ValueError(
+            f"The embeddings of the {len(self.ad_exemplars)} ad exemplars are"
+            " missing. Pass them as embeddings or as an embeddings column of"
+            " ad_exemplars."
+        )
+    else:
+      embeddings = self.embeddings
+
+    self.embeddings = np.ascontiguousarray(
+        embeddings, dtype=self.embeddings_dtype
+    ).reshape(len(self.ad_exemplars), self.dimensionality)
+    if "embeddings" in self.ad_exemplars.columns:
+      self.ad_exemplars = self.ad_exemplars.drop(columns=["embeddings"])
+    self.ad_exemplars = self.ad_exemplars.reset_index(drop=True)
 
   @classmethod
   def _generate_embeddings(
@@ -209,9 +350,17 @@ class AdCopyVectorstore:
       batch_size: int,
       task_type: str,
       progress_bar: bool = False,
+      embedding_cache: embedding_cache_lib.EmbeddingCache | None = None,
+      max_concurrent_requests: int = 1,
+      rate_limiter: rate_limiting.RateLimiter | None = None,
   ) -> list[list[float]]:
     """Generates embeddings for the provided texts.
 
+    Each unique text is only embedded once. If an embedding cache is provided,
+    the cache is checked first and only the texts that are not in the cache are
+    sent to the embedding model. The newly generated embeddings are then added
+    to the cache.
+
     Args:
       texts: The texts to generate embeddings for.
       embedding_model_name: The name of the embedding model to use.
@@ -219,10 +368,110 @@ class AdCopyVectorstore:
       batch_size: The batch size to use when generating embeddings.
       task_type: The task type to use when generating embeddings.
       progress_bar: Whether to show a progress bar.
+      embedding_cache: The cache to read and write the embeddings from. If
+        None, then all the embeddings are generated.
+      max_concurrent_requests: The maximum number of batches to send to the
+        embedding model at the same time.
+      rate_limiter: An optional rate limiter to keep the embedding requests
+        within the quota.
 
     Returns:
       The generated embeddings.
     """
+    if embedding_cache is None:
+      # Identical texts, e.g. the same keywords for several versions of an ad,
+      # are only embedded once.
+      unique_texts = list(dict.fromkeys(texts))
+      unique_embeddings = cls._generate_embeddings_from_model(
+          unique_texts,
+          embedding_model_name=embedding_model_name,
+          dimensionality=dimensionality,
+          batch_size=batch_size,
+          task_type=task_type,
+          progress_bar=progress_bar,
+          max_concurrent_requests=max_concurrent_requests,
+          rate_limiter=rate_limiter,
+      )
+      embeddings_by_text = dict(zip(unique_texts, unique_embeddings))
+      return [embeddings_by_text[text] for text in texts]
+
+    cache_keys = [
+        embedding_cache_lib.make_cache_key(
+            text,
+            embedding_model_name=embedding_model_name.value,
+            dimensionality=dimensionality,
+            task_type=task_type,
+        )
+        for text in texts
+    ]
+    cached_embeddings = embedding_cache.get_many(cache_keys)
+
+    missing_texts = {
+        key: text
+        for key, text in zip(cache_keys, texts)
+        if key not in cached_embeddings
+    }
+    LOGGER.debug(
+        "Found %d of %d embeddings in the cache.",
+        len(texts) - len(missing_texts),
+        len(texts),
+    )
+    if missing_texts:
+      new_embeddings = cls._generate_embeddings_from_model(
+          list(missing_texts.values()),
+          embedding_model_name=embedding_model_name,
+          dimensionality=dimensionality,
+          batch_size=batch_size,
+          task_type=task_type,
+          progress_bar=progress_bar,
+          max_concurrent_requests=max_concurrent_requests,
+          rate_limiter=rate_limiter,
+      )
+      new_embeddings = dict(zip(missing_texts.keys(), new_embeddings))
+      embedding_cache.set_many(new_embeddings)
+      cached_embeddings = cached_embeddings | new_embeddings
+
+    return [cached_embeddings[key] for key in cache_keys]
+
+  @classmethod
+  def _generate_embeddings_from_model(
+      cls,
+      texts: list[str],
+      *,
+      embedding_model_name: EmbeddingModelName,
+      dimensionality: int,
+      batch_size: int,
+      task_type: str,
+      progress_bar: bool = False,
+      max_concurrent_requests: int = 1,
+      rate_limiter: rate_limiting.RateLimiter | None = None,
+  ) -> list[list[float]]:
+    """Generates embeddings for the provided texts with the embedding model.
+
+    The texts are split into batches, which are sent to the embedding model
+    from a pool of max_concurrent_requests threads. Each batch is retried with
+    jittered exponential backoff if it fails with a transient error, such as
+    exceeding the quota. The returned embeddings are in the same order as the
+    texts.
+
+    Args:
+      texts: The texts to generate embeddings for.
+      embedding_model_name: The name of the embedding model to use.
+      dimensionality: The dimensionality of the embedding model.
+      batch_size: The batch size to use when generating embeddings.
+      task_type: The task type to use when generating embeddings.
+      progress_bar: Whether to show a progress bar.
+      max_concurrent_requests: The maximum number of batches to send to the
+        embedding model at the same time.
+      rate_limiter: An optional rate limiter to keep the embedding requests
+        within the quota.
+
+    Returns:
+      The generated embeddings.
+    """
+    if not texts:
+      return []
+
     embedding_model = language_models.TextEmbeddingModel.from_pretrained(
         embedding_model_name.value
     )
@@ -234,29 +483,50 @@ class AdCopyVectorstore:
         task_type,
     )
     LOGGER.debug(
-        "Generating %d embeddings in %d batches.", len(texts), n_batches
+        "Generating %d embeddings in %d batches with up to %d concurrent"
+        " requests.",
+        len(texts),
+        n_batches,
+        max_concurrent_requests,
     )
 
-    embeddings = []
-
-    texts_batch_iterator = np.array_split(texts, n_batches)
-    if progress_bar:
-      texts_batch_iterator = tqdm.tqdm(
-          texts_batch_iterator,
-          desc="Generating embeddings",
-          file=TqdmLogger(),
-          mininterval=5,
-      )
-
-    for texts_batch in texts_batch_iterator:
+    def embed_batch(texts_batch: Sequence[str]) -> list[list[float]]:
       embedding_inputs = [
           language_models.TextEmbeddingInput(ad_markdown, task_type)
           for ad_markdown in texts_batch
       ]
-      embedding_outputs = embedding_model.get_embeddings(
-          embedding_inputs, output_dimensionality=dimensionality
-      )
-      embeddings.extend([emb.values for emb in embedding_outputs])
+      n_tokens = sum(map(rate_limiting.estimate_tokens, texts_batch))
+      for attempt in rate_limiting.retry_on_transient_errors(
+          max_attempts=EMBEDDING_MAX_ATTEMPTS,
+          max_wait_seconds=EMBEDDING_RETRY_MAX_WAIT_SECONDS,
+      ):
+        with attempt:
+          if rate_limiter is not None:
+            rate_limiter.acquire(tokens=n_tokens)
+          embedding_outputs = embedding_model.get_embeddings(
+              embedding_inputs, output_dimensionality=dimensionality
+          )
+      return [emb.values for emb in embedding_outputs]
+
+    embeddings = []
+    texts_batches = np.array_split(texts, n_batches)
+    with futures.ThreadPoolExecutor(
+        max_workers=max_concurrent_requests
+    ) as executor:
+      # Executor.map yields the results in the order of the inputs, so the
+      # embeddings stay aligned with the texts.
+      embeddings_batch_iterator = executor.map(embed_batch, texts_batches)
+      if progress_bar:
+        embeddings_batch_iterator = tqdm.tqdm(
+            embeddings_batch_iterator,
+            total=len(texts_batches),
+            desc="Generating embeddings",
+            file=TqdmLogger(),
+            mininterval=5,
+        )
+
+      for embeddings_batch in embeddings_batch_iterator:
+        embeddings.extend(embeddings_batch)
 
     LOGGER.debug("Embeddings generated.")
     return embeddings
@@ -286,6 +556,9 @@ class AdCopyVectorstore:
         batch_size=self.embeddings_batch_size,
         task_type="RETRIEVAL_DOCUMENT",
         progress_bar=False,
+        embedding_cache=self.embedding_cache,
+        max_concurrent_requests=self.embeddings_max_concurrent_requests,
+        rate_limiter=self.embeddings_rate_limiter,
     )
 
   def embed_queries(self, texts: list[str]) -> list[list[float]]:
@@ -313,40 +586,50 @@ class AdCopyVectorstore:
         batch_size=self.embeddings_batch_size,
         task_type="RETRIEVAL_QUERY",
         progress_bar=False,
+        embedding_cache=self.embedding_cache,
+        max_concurrent_requests=self.embeddings_max_concurrent_requests,
+        rate_limiter=self.embeddings_rate_limiter,
     )
 
   @classmethod
   def _get_exemplars(
       cls,
-      data: pd.DataFrame,
+      embeddings: np.ndarray,
       *,
-      embeddings_column: str,
       affinity_preference: float | None,
       max_exemplars: int,
-  ) -> pd.DataFrame:
-    """Uses Affinity Propagation to find exemplar ads."""
-    LOGGER.info("Getting exemplars with Affinity Propagation.")
-    embeddings = np.asarray(data[embeddings_column].values.tolist())
+  ) -> np.ndarray:
+    """Uses Affinity Propagation to find exemplar ads.
+
+    Args:
+      embeddings: The embeddings of the ads, with one row per ad.
+      affinity_preference: The affinity preference to use.
+      max_exemplars: The maximum number of exemplars to return. If Affinity
+        Propagation finds more exemplars, a random sample is returned.
 
+    Returns:
+      The row indices of the exemplar ads.
+    """
+    LOGGER.info("Getting exemplars with Affinity Propagation.")
     clusterer = cluster.AffinityPropagation(preference=affinity_preference)
     clusterer.fit(embeddings)
-    exemplars = (
-        data.iloc[clusterer.cluster_centers_indices_]
-        .copy()
-        .reset_index(drop=True)
-    )
+    exemplar_indices = np.asarray(clusterer.cluster_centers_indices_)
 
-    if len(exemplars) > max_exemplars:
+    if len(exemplar_indices) > max_exemplars:
       LOGGER.info(
           "Affinity Propagation returned too many exemplars (%d). Sampling to"
           " get %d.",
-          len(exemplars),
+          len(exemplar_indices),
           max_exemplars,
       )
-      exemplars = exemplars.sample(max_exemplars)
+      exemplar_indices = np.random.choice(
+          exemplar_indices, max_exemplars, replace=False
+      )
 
-    LOGGER.info("Got %d exemplars with Affinity Propagation.", len(exemplars))
-    return exemplars
+    LOGGER.info(
+        "Got %d exemplars with Affinity Propagation.", len(exemplar_indices)
+    )
+    return exemplar_indices
 
   @classmethod
   def _deduplicate_ads(cls, data: pd.DataFrame) -> pd.DataFrame:
@@ -398,6 +681,14 @@ class AdCopyVectorstore:
       exemplar_selection_method: (
           str | ExemplarSelectionMethod
       ) = "affinity_propagation",
+      embedding_cache: embedding_cache_lib.EmbeddingCache | None = None,
+      embeddings_max_concurrent_requests: int = 1,
+      embeddings_rate_limiter: rate_limiting.RateLimiter | None = None,
+      embeddings_dtype: str = "float32",
+      nearest_neighbors_index_type: (
+          str | nearest_neighbors_lib.NearestNeighborsIndexType
+      ) = "euclidean",
+      nearest_neighbors_index_params: dict[str, Any] | None = None,
   ) -> "AdCopyVectorstore":
     """Creates a vector store containing the ad copies from pandas.
 
@@ -426,6 +717,15 @@ class AdCopyVectorstore:
       5.  Sampling the exemplar ads to a maximum of max_exemplar_ads. This
           ensures that the vectorstore does not become too large.
 
+    Affinity propagation is quadratic in the number of ads, so it becomes slow
+    and memory hungry above a few thousand ads. For larger training data use
+    one of the scalable exemplar selection methods, which select exactly
+    max_exemplar_ads exemplars in time linear in the number of ads:
+      - kmeans_medoids: The ads closest to the centroids of mini-batch k-means
+        clusters. These are the most typical ads in the training data.
+      - farthest_point: Greedy farthest point (k-center) selection. These cover
+        the full range of the training data, including unusual ads.
+
     The affinity propogation algorithm depends on the affinity_preference
     parameter. A higher affinity_preference will result in more exemplar ads
     being selected, while a lower affinity_preference will result in fewer
@@ -446,8 +746,21 @@ class AdCopyVectorstore:
         ads.
       embeddings_batch_size: The batch size to use when generating embeddings.
       exemplar_selection_method: The method to use to select the exemplar ads.
-        Either "affinity_propagation" or "random". Defaults to
-        "affinity_propagation".
+        One of "affinity_propagation", "random", "kmeans_medoids" or
+        "farthest_point". Defaults to "affinity_propagation".
+      embedding_cache: An optional cache for the embeddings. It is used both
+        when creating the vectorstore and when embedding queries later.
+      embeddings_max_concurrent_requests: The maximum number of embedding
+        batches to send to the embedding model at the same time.
+      embeddings_rate_limiter: An optional rate limiter to keep the embedding
+        requests within the quota.
+      embeddings_dtype: The dtype used to store the embeddings, either
+        "float32" or "float16". Defaults to "float32".
+      nearest_neighbors_index_type: The type of index used to retrieve the
+        most relevant exemplars, one of "euclidean", "cosine" or "ivf_cosine".
+        Defaults to "euclidean".
+      nearest_neighbors_index_params: Optional parameters for the nearest
+        neighbors index, only used by the "ivf_cosine" index.
 
     Returns:
       An instance of the AdCopyVectorstore containing the exemplar ads.
@@ -479,38 +792,65 @@ class AdCopyVectorstore:
         "Finding exemplar ads with method = %s.",
         exemplar_selection_method.value,
     )
-    if (
-        exemplar_selection_method
-        is ExemplarSelectionMethod.AFFINITY_PROPAGATION
+    if exemplar_selection_method in (
+        ExemplarSelectionMethod.AFFINITY_PROPAGATION,
+        ExemplarSelectionMethod.KMEANS_MEDOIDS,
+        ExemplarSelectionMethod.FARTHEST_POINT,
     ):
-      data["embeddings"] = cls._generate_embeddings(
-          data["ad_markdown"].values.tolist(),
-          embedding_model_name=embedding_model_name,
-          dimensionality=dimensionality,
-          batch_size=embeddings_batch_size,
-          task_type="RETRIEVAL_DOCUMENT",
-          progress_bar=True,
+      embeddings = np.asarray(
+          cls._generate_embeddings(
+              data["ad_markdown"].values.tolist(),
+              embedding_model_name=embedding_model_name,
+              dimensionality=dimensionality,
+              batch_size=embeddings_batch_size,
+              task_type="RETRIEVAL_DOCUMENT",
+              progress_bar=True,
+              embedding_cache=embedding_cache,
+              max_concurrent_requests=embeddings_max_concurrent_requests,
+              rate_limiter=embeddings_rate_limiter,
+          ),
+          dtype=embeddings_dtype,
       )
 
-      ad_exemplars = cls._get_exemplars(
-          data,
-          embeddings_column="embeddings",
-          affinity_preference=affinity_preference,
-          max_exemplars=max_exemplar_ads,
-      )
+      if (
+          exemplar_selection_method
+          is ExemplarSelectionMethod.AFFINITY_PROPAGATION
+      ):
+        exemplar_indices = cls._get_exemplars(
+            embeddings,
+            affinity_preference=affinity_preference,
+            max_exemplars=max_exemplar_ads,
+        )
+      elif (
+          exemplar_selection_method is ExemplarSelectionMethod.KMEANS_MEDOIDS
+      ):
+        # A fixed random state, like Affinity Propagation uses, so the same
+        # training data always gives the same exemplars.
+        exemplar_indices = exemplar_selection.select_kmeans_medoids(
+            embeddings, max_exemplar_ads, random_state=0
+        )
+      else:
+        exemplar_indices = exemplar_selection.select_farthest_points(
+            embeddings, max_exemplar_ads, random_state=0
+        )
+      ad_exemplars = data.iloc[exemplar_indices]
+      exemplar_embeddings = embeddings[exemplar_indices]
     elif exemplar_selection_method is ExemplarSelectionMethod.RANDOM:
       if len(data) > max_exemplar_ads:
         ad_exemplars = data.sample(max_exemplar_ads)
       else:
         ad_exemplars = data
 
-      ad_exemplars["embeddings"] = cls._generate_embeddings(
+      exemplar_embeddings = cls._generate_embeddings(
           ad_exemplars["ad_markdown"].values.tolist(),
           embedding_model_name=embedding_model_name,
           dimensionality=dimensionality,
           batch_size=embeddings_batch_size,
           task_type="RETRIEVAL_DOCUMENT",
           progress_bar=True,
+          embedding_cache=embedding_cache,
+          max_concurrent_requests=embeddings_max_concurrent_requests,
+          rate_limiter=embeddings_rate_limiter,
       )
 
     else:
@@ -531,8 +871,15 @@ class AdCopyVectorstore:
     return cls(
         embedding_model_name=embedding_model_name,
         ad_exemplars=ad_exemplars,
+        embeddings=exemplar_embeddings,
+        embeddings_dtype=embeddings_dtype,
         dimensionality=dimensionality,
         embeddings_batch_size=embeddings_batch_size,
+        embeddings_max_concurrent_requests=embeddings_max_concurrent_requests,
+        embedding_cache=embedding_cache,
+        embeddings_rate_limiter=embeddings_rate_limiter,
+        nearest_neighbors_index_type=nearest_neighbors_index_type,
+        nearest_neighbors_index_params=nearest_neighbors_index_params or {},
     )
 
   @classmethod
@@ -542,9 +889,18 @@ class AdCopyVectorstore:
     Schema of params:
       embedding_model_name: The name of the embedding model to use.
       ad_exemplars: The ad exemplars to use in the vectorstore, as a pandas
-        dataframe that has been converted to a dict with to_dict("tight").
+        dataframe that has been converted to a dict with to_dict("tight"). The
+        "embeddings" column contains the embedding of each exemplar.
       dimensionality: The dimensionality of the embedding model.
       embeddings_batch_size: The batch size to use when generating embeddings.
+      embeddings_max_concurrent_requests: (Optional) The maximum number of
+        embedding batches to send at the same time. Defaults to 1.
+      embeddings_dtype: (Optional) The dtype used to store the embeddings.
+        Defaults to "float32".
+      nearest_neighbors_index_type: (Optional) The type of nearest neighbors
+        index. Defaults to "euclidean".
+      nearest_neighbors_index_params: (Optional) The parameters of the nearest
+        neighbors index. Defaults to {}.
 
     Args:
       params: The dict containing the parameters to use to create the
@@ -583,9 +939,18 @@ class AdCopyVectorstore:
     Schema of params:
       embedding_model_name: The name of the embedding model to use.
       ad_exemplars: The ad exemplars to use in the vectorstore, as a pandas
-        dataframe that has been converted to a dict with to_dict("tight").
+        dataframe that has been converted to a dict with to_dict("tight"). The
+        "embeddings" column contains the embedding of each exemplar.
       dimensionality: The dimensionality of the embedding model.
       embeddings_batch_size: The batch size to use when generating embeddings.
+      embeddings_max_concurrent_requests: (Optional) The maximum number of
+        embedding batches to send at the same time. Defaults to 1.
+      embeddings_dtype: (Optional) The dtype used to store the embeddings.
+        Defaults to "float32".
+      nearest_neighbors_index_type: (Optional) The type of nearest neighbors
+        index. Defaults to "euclidean".
+      nearest_neighbors_index_params: (Optional) The parameters of the nearest
+        neighbors index. Defaults to {}.
 
     Args:
       json_string: The json string containing the parameters to use to create
@@ -600,25 +965,109 @@ class AdCopyVectorstore:
     return cls.from_dict(json.loads(json_string))
 
   def to_dict(self) -> dict[str, Any]:
-    """Serializes the vectorstore to a dict."""
+    """Serializes the vectorstore to a dict.
+
+    The embeddings are stored as the "embeddings" column of the ad exemplars,
+    so the dict has the same schema as before the embeddings were stored as a
+    matrix.
+    """
+    ad_exemplars = self.ad_exemplars.assign(
+        embeddings=self.embeddings.astype(np.float64).tolist()
+    )
     return {
         "embedding_model_name": self.embedding_model_name.value,
         "dimensionality": self.dimensionality,
         "embeddings_batch_size": self.embeddings_batch_size,
-        "ad_exemplars": self.ad_exemplars.to_dict(orient="tight"),
+        "embeddings_max_concurrent_requests": (
+            self.embeddings_max_concurrent_requests
+        ),
+        "embeddings_dtype": self.embeddings_dtype,
+        "nearest_neighbors_index_type": self.nearest_neighbors_index_type.value,
+        "nearest_neighbors_index_params": self.nearest_neighbors_index_params,
+        "ad_exemplars": ad_exemplars.to_dict(orient="tight"),
     }
 
   def to_json(self) -> str:
     """Serializes the vectorstore to a json string."""
     return json.dumps(self.to_dict())
 
+  def save(self, path: str) -> None:
+    """Saves the vectorstore to a directory in a binary format.
+
+    This is much faster to write and read than to_json for large vectorstores,
+    because the embeddings are stored as a binary numpy array instead of as
+    text. The directory contains three files:
+      - vectorstore_params.json: The parameters of the vectorstore.
+      - vectorstore_ad_exemplars.json: The text of the ad exemplars, as a pandas
+        dataframe converted to a dict with to_dict("tight").
+      - vectorstore_embeddings.npy: The embeddings matrix.
+
+    Args:
+      path: The directory to save the vectorstore to. It is created if it does
+        not exist.
+    """
+    os.makedirs(path, exist_ok=True)
+    params = {
+        "embedding_model_name": self.embedding_model_name.value,
+        "dimensionality": self.dimensionality,
+        "embeddings_batch_size": self.embeddings_batch_size,
+        "embeddings_max_concurrent_requests": (
+            self.embeddings_max_concurrent_requests
+        ),
+        "embeddings_dtype": self.embeddings_dtype,
+        "nearest_neighbors_index_type": self.nearest_neighbors_index_type.value,
+        "nearest_neighbors_index_params": self.nearest_neighbors_index_params,
+    }
+    with open(os.path.join(path, VECTORSTORE_PARAMS_FILE_NAME), "w") as f:
+      json.dump(params, f)
+    with open(
+        os.path.join(path, VECTORSTORE_AD_EXEMPLARS_FILE_NAME), "w"
+    ) as f:
+      json.dump(self.ad_exemplars.to_dict(orient="tight"), f)
+    np.save(
+        os.path.join(path, VECTORSTORE_EMBEDDINGS_FILE_NAME), self.embeddings
+    )
+
+  @classmethod
+  def load(
+      cls, path: str, *, mmap_mode: str | None = None
+  ) -> "AdCopyVectorstore":
+    """Loads the vectorstore from a directory written by save().
+
+    Args:
+      path: The directory containing the vectorstore.
+      mmap_mode: If set, the embeddings are memory mapped instead of being read
+        into memory, using this mode (e.g. "r" for read only). See numpy.load
+        for the available modes.
+
+    Returns:
+      An instance of the AdCopyVectorstore.
+    """
+    with open(os.path.join(path, VECTORSTORE_PARAMS_FILE_NAME)) as f:
+      params = json.load(f)
+    with open(os.path.join(path, VECTORSTORE_AD_EXEMPLARS_FILE_NAME)) as f:
+      ad_exemplars = pd.DataFrame.from_dict(json.load(f), orient="tight")
+    embeddings = np.load(
+        os.path.join(path, VECTORSTORE_EMBEDDINGS_FILE_NAME),
+        mmap_mode=mmap_mode,
+    )
+    return cls(ad_exemplars=ad_exemplars, embeddings=embeddings, **params)
+
   @functools.cached_property
-  def nearest_neighbors(self) -> neighbors.NearestNeighbors:
-    """The nearest neighbors model used to find similar ads."""
-    embeddings = np.asarray(self.ad_exemplars["embeddings"].values.tolist())
-    model = neighbors.NearestNeighbors()
-    model.fit(embeddings)
-    return model
+  def nearest_neighbors(self) -> nearest_neighbors_lib.NearestNeighborsIndex:
+    """The nearest neighbors index used to find similar ads."""
+    index = nearest_neighbors_lib.create_index(
+        self.nearest_neighbors_index_type,
+        **self.nearest_neighbors_index_params,
+    )
+    return index.fit(self.embeddings)
+
+  @functools.cached_property
+  def _exemplar_records(self) -> list[dict[str, Any]]:
+    """The headlines, descriptions and keywords of each exemplar."""
+    return self.ad_exemplars[["headlines", "descriptions", "keywords"]].to_dict(
+        "records"
+    )
 
   @functools.cached_property
   def unique_headlines(self) -> set[str]:
@@ -628,16 +1077,224 @@ class AdCopyVectorstore:
   def unique_descriptions(self) -> set[str]:
     return set(self.ad_exemplars["descriptions"].explode().unique().tolist())
 
+  @functools.cached_property
+  def headlines_memorisation_index(self) -> memorisation.MemorisationIndex:
+    return memorisation.MemorisationIndex(
+        self.ad_exemplars["headlines"].explode().dropna()
+    )
+
+  @functools.cached_property
+  def descriptions_memorisation_index(self) -> memorisation.MemorisationIndex:
+    return memorisation.MemorisationIndex(
+        self.ad_exemplars["descriptions"].explode().dropna()
+    )
+
   @property
   def n_exemplars(self) -> int:
     """The total number of exemplars in the vectorstore."""
     return len(self.ad_exemplars)
 
+  @staticmethod
+  def _ad_keys(data: pd.DataFrame) -> list[tuple[tuple[str, ...], ...]]:
+    """Returns a hashable key for each ad, from its headlines and descriptions."""
+    return list(
+        zip(
+            data["headlines"].map(tuple),
+            data["descriptions"].map(tuple),
+        )
+    )
+
+  def add_ads(
+      self,
+      new_ads: pd.DataFrame,
+      *,
+      min_distance: float | None = None,
+      max_exemplar_ads: int | None = None,
+  ) -> pd.DataFrame:
+    """Adds new ads to the vectorstore without rebuilding it.
+
+    Only the new ads are embedded. Ads that are already exemplars are ignored,
+    and the remaining new ads are compared to the existing exemplars. Ads that
+    are within min_distance of an existing exemplar are considered to be
+    represented by it and are not added, while the outliers are promoted to
+    exemplars (using farthest point selection, so that several similar new ads
+    only add a single exemplar). The nearest neighbors index and the cached
+    unique headlines and descriptions are updated in place.
+
+    The new_ads must contain the same columns as the training data in
+    create_from_pandas: headlines, descriptions and keywords.
+
+    Args:
+      new_ads: The new ads to add.
+      min_distance: New ads closer than this (euclidean distance between
+        embeddings) to an existing exemplar are not added. If None, the median
+        distance between each exemplar and its closest other exemplar is used.
+        Set to 0.0 to add all new ads that are not already exemplars, even if
+        their embeddings are the same as an existing exemplar.
+      max_exemplar_ads: The maximum total number of exemplars in the
+        vectorstore after adding the new ads, or None for no limit.
+
+    Returns:
+      The ads that were added as exemplars.
+
+    Raises:
+      ValueError: If new_ads does not contain the required columns.
+    """
+    required_columns = {"headlines", "descriptions", "keywords"}
+    missing_columns = required_columns - set(new_ads.columns)
+    if missing_columns:
+      LOGGER.error(
+          "New ads must contain the columns %s. Missing columns: %s.",
+          sorted(required_columns),
+          sorted(missing_columns),
+      )
+      raise ValueError(
+          f"New ads must contain the columns {sorted(required_columns)}."
+          f" Missing columns: {sorted(missing_columns)}."
+      )
+
+    data = (
+        new_ads[["headlines", "descriptions", "keywords"]]
+        .copy()
+        .pipe(self._deduplicate_ads)
+    )
+    existing_keys = set(self._ad_keys(self.ad_exemplars))
+    is_new = [key not in existing_keys for key in self._ad_keys(data)]
+    data = data.loc[is_new].reset_index(drop=True)
+    if data.empty:
+      LOGGER.info("No new ads to add to the vectorstore.")
+      return data
+
+    data["ad_markdown"] = data.apply(lambda x: str(GoogleAd(**x)), axis=1)
+    candidate_embeddings = np.asarray(
+        self.embed_documents(data["ad_markdown"].values.tolist()),
+        dtype=self.embeddings_dtype,
+    )
+
+    if min_distance is None:
+      min_distance = exemplar_selection.typical_exemplar_distance(
+          self.embeddings, random_state=0
+      )
+    max_new_exemplars = None
+    if max_exemplar_ads is not None:
+      max_new_exemplars = max(0, max_exemplar_ads - self.n_exemplars)
+
+    new_exemplar_indices = exemplar_selection.select_new_exemplars(
+        candidate_embeddings,
+        self.embeddings,
+        min_distance=min_distance,
+        max_new_exemplars=max_new_exemplars,
+    )
+    new_exemplars = data.iloc[new_exemplar_indices].reset_index(drop=True)
+    new_embeddings = candidate_embeddings[new_exemplar_indices]
+
+    self.ad_exemplars = pd.concat(
+        [self.ad_exemplars, new_exemplars], ignore_index=True
+    )
+    self.embeddings = np.concatenate([self.embeddings, new_embeddings])
+
+    # Update the cached properties in place, if they have been computed.
+    if "nearest_neighbors" in self.__dict__:
+      self.nearest_neighbors.add(new_embeddings)
+    if "_exemplar_records" in self.__dict__:
+      self._exemplar_records.extend(
+          new_exemplars[["headlines", "descriptions", "keywords"]].to_dict(
+              "records"
+          )
+      )
+    if "unique_headlines" in self.__dict__:
+      self.unique_headlines.update(new_exemplars["headlines"].explode())
+    if "unique_descriptions" in self.__dict__:
+      self.unique_descriptions.update(new_exemplars["descriptions"].explode())
+    if "headlines_memorisation_index" in self.__dict__:
+      self.headlines_memorisation_index.add(
+          new_exemplars["headlines"].explode().dropna()
+      )
+    if "descriptions_memorisation_index" in self.__dict__:
+      self.descriptions_memorisation_index.add(
+          new_exemplars["descriptions"].explode().dropna()
+      )
+
+    LOGGER.info(
+        "Added %d of %d new ads as exemplars, the rest are represented by"
+        " existing exemplars.",
+        len(new_exemplars),
+        len(data),
+    )
+    return new_exemplars
+
+  def remove_ads(self, ads: pd.DataFrame) -> int:
+    """Removes ads from the vectorstore without rebuilding it.
+
+    Exemplars are removed if they have the same headlines and descriptions as
+    one of the ads. The nearest neighbors index is updated in place.
+
+    Args:
+      ads: The ads to remove, containing the headlines and descriptions
+        columns.
+
+    Returns:
+      The number of exemplars that were removed.
+    """
+    keys_to_remove = set(self._ad_keys(ads))
+    is_removed = np.array(
+        [key in keys_to_remove for key in self._ad_keys(self.ad_exemplars)],
+        dtype=bool,
+    )
+    removed_indices = np.flatnonzero(is_removed)
+    if not len(removed_indices):
+      LOGGER.info("None of the ads to remove are in the vectorstore.")
+      return 0
+
+    self.ad_exemplars = self.ad_exemplars.loc[~is_removed].reset_index(
+        drop=True
+    )
+    self.embeddings = np.delete(self.embeddings, removed_indices, axis=0)
+
+    if "nearest_neighbors" in self.__dict__:
+      self.nearest_neighbors.remove(removed_indices)
+    if "_exemplar_records" in self.__dict__:
+      self._exemplar_records = [
+          record
+          for record, removed in zip(self._exemplar_records, is_removed)
+          if not removed
+      ]
+    # Other exemplars may share the removed headlines and descriptions, so these
+    # are recomputed the next time they are used.
+    self.__dict__.pop("unique_headlines", None)
+    self.__dict__.pop("unique_descriptions", None)
+    self.__dict__.pop("headlines_memorisation_index", None)
+    self.__dict__.pop("descriptions_memorisation_index", None)
+
+    LOGGER.info("Removed %d exemplars.", len(removed_indices))
+    return len(removed_indices)
+
+  def get_nearest_exemplar_ids_from_embeddings(
+      self,
+      query_embeddings: list[list[float]] | np.ndarray,
+      k: int,
+  ) -> tuple[np.ndarray, np.ndarray]:
+    """Gets the indices of the exemplars nearest to the query embeddings.
+
+    This only queries the nearest neighbors index, without constructing the
+    example ads, so it is cheap to call for many queries.
+
+    Args:
+      query_embeddings: The query embeddings.
+      k: The number of exemplars to return for each query.
+
+    Returns:
+      The distances and indices of the k nearest exemplars for each query, as
+      arrays of shape (number of queries, k), sorted from nearest to farthest.
+    """
+    k = min(self.n_exemplars, k)
+    return self.nearest_neighbors.query(np.asarray(query_embeddings), k=k)
+
   def get_relevant_ads_and_embeddings_from_embeddings(
       self,
-      query_embeddings: list[list[float]],
+      query_embeddings: list[list[float]] | np.ndarray,
       k: int,
-  ) -> tuple[list[list[ExampleAd]], list[list[float]]]:
+  ) -> tuple[list[list[ExampleAd]], np.ndarray]:
     """Gets the most relevant ads and their embeddings for the query embeddings.
 
     Args:
@@ -647,28 +1304,17 @@ class AdCopyVectorstore:
       k: The number of ads to return for each query.
 
     Returns:
-      The k most relevant ads and their embeddings for each query as two lists.
+      The k most relevant ads for each query, and their embeddings as an array
+      of shape (number of queries, k, dimensionality).
     """
-    k = min(self.n_exemplars, k)
-
-    similar_ad_ids = self.nearest_neighbors.kneighbors(
-        query_embeddings, n_neighbors=k, return_distance=False
+    _, similar_ad_ids = self.get_nearest_exemplar_ids_from_embeddings(
+        query_embeddings, k
     )
     similar_ads = [
-        list(
-            map(
-                lambda x: ExampleAd.from_flat_values(**x),
-                self.ad_exemplars.iloc[ids][
-                    ["headlines", "descriptions", "keywords"]
-                ].to_dict("records"),
-            )
-        )
-        for ids in similar_ad_ids
-    ]
-    similar_ad_embeddings = [
-        self.ad_exemplars.iloc[ids]["embeddings"].values.tolist()
+        [ExampleAd.from_flat_values(**self._exemplar_records[i]) for i in ids]
         for ids in similar_ad_ids
     ]
+    similar_ad_embeddings = self.embeddings[similar_ad_ids]
     return similar_ads, similar_ad_embeddings
 
   def get_relevant_ads(
@@ -851,6 +1497,51 @@ def construct_system_instruction(
   return system_instruction
 
 
+@functools.lru_cache(maxsize=EXAMPLE_AD_MESSAGES_CACHE_SIZE)
+def _construct_example_ad_messages(
+    keywords: str,
+    headlines: tuple[str, ...],
+    descriptions: tuple[str, ...],
+    ad_format_json: str,
+) -> tuple[generative_models.Content, generative_models.Content]:
+  """Returns the user and model messages for an in-context example ad.
+
+  The same exemplars are retrieved for many keywords, so the messages are
+  memoized and shared between the prompts, rather than rebuilding them (and
+  re-serializing the example ad) for every prompt.
+
+  Args:
+    keywords: The keywords of the example ad.
+    headlines: The headlines of the example ad.
+    descriptions: The descriptions of the example ad.
+    ad_format_json: The ad format to generate, as json.
+  """
+  example_ad = GoogleAd(
+      headlines=list(headlines), descriptions=list(descriptions)
+  )
+  example_ad_format = GoogleAdFormat.model_validate_json(
+      ad_format_json
+  ).model_copy(
+      update={
+          "max_headlines": example_ad.headline_count,
+          "max_descriptions": example_ad.description_count,
+      }
+  )
+  user_message = _construct_new_ad_copy_user_message(
+      keywords, ad_format=example_ad_format
+  )
+  model_message = generative_models.Content(
+      role="model",
+      parts=[generative_models.Part.from_text(example_ad.model_dump_json())],
+  )
+  return user_message, model_message
+
+
+def clear_example_ad_messages_cache() -> None:
+  """Clears the memoized in-context example messages."""
+  _construct_example_ad_messages.cache_clear()
+
+
 def construct_new_ad_copy_prompt(
     example_ads: list[ExampleAd],
     keywords: str,
@@ -870,6 +1561,9 @@ def construct_new_ad_copy_prompt(
   copy for, and the additional context for the new keywords from the
   keywords_specific_instructions if it exists.
 
+  The messages for the in-context examples are memoized, so prompts that use
+  the same example ads share the same Content objects for them.
+
   Args:
     example_ads: The list of example ads to use as in-context examples.
     keywords: The keywords to generate the ad copy for.
@@ -886,27 +1580,15 @@ def construct_new_ad_copy_prompt(
   Returns:
     A list of Content representing the prompt.
   """
+  ad_format_json = ad_format.model_dump_json()
   prompt = []
   for example in reversed(example_ads):
-    example_ad_format = ad_format.model_copy(
-        update={
-            "max_headlines": example.google_ad.headline_count,
-            "max_descriptions": example.google_ad.description_count,
-        }
-    )
-    prompt.append(
-        _construct_new_ad_copy_user_message(
-            example.keywords, ad_format=example_ad_format
-        )
-    )
-    prompt.append(
-        generative_models.Content(
-            role="model",
-            parts=[
-                generative_models.Part.from_text(
-                    example.google_ad.model_dump_json()
-                )
-            ],
+    prompt.extend(
+        _construct_example_ad_messages(
+            example.keywords,
+            tuple(example.google_ad.headlines),
+            tuple(example.google_ad.descriptions),
+            ad_format_json,
         )
     )
 
@@ -922,6 +1604,163 @@ def construct_new_ad_copy_prompt(
   return prompt
 
 
+def _content_text_length(contents: Iterable[generative_models.Content]) -> int:
+  """Returns the total number of characters of text in the contents."""
+  return sum(
+      len(part.to_dict().get("text", ""))
+      for content in contents
+      for part in content.parts
+  )
+
+
+def fit_prompt_to_token_budget(
+    *,
+    example_ads: list[ExampleAd],
+    keywords: str,
+    ad_format: GoogleAdFormat,
+    system_instruction: str,
+    max_prompt_tokens: int,
+    existing_ad_copy: GoogleAd | None = None,
+    keywords_specific_instructions: str = "",
+    min_in_context_examples: int = 1,
+) -> tuple[list[ExampleAd], str]:
+  """Trims the in-context examples and instructions to fit the token budget.
+
+  The min_in_context_examples most relevant examples are always kept. The
+  keywords specific instructions, which can be very long if they contain the
+  content of a landing page, are truncated so that the prompt with those
+  examples fits the budget. Then the remaining examples are added in order of
+  relevance while they fit, so the least relevant examples are dropped first.
+  The number of tokens is estimated from the number of characters, in the same
+  way as estimate_request_tokens.
+
+  Args:
+    example_ads: The example ads, with the most relevant first.
+    keywords: The keywords to generate the ad copy for.
+    ad_format: The ad format to generate.
+    system_instruction: The formatted system instruction for the request.
+    max_prompt_tokens: The maximum estimated number of tokens in the system
+      instruction and prompt.
+    existing_ad_copy: The existing headlines and descriptions for this ad.
+    keywords_specific_instructions: Any additional context to use for the new
+      keywords.
+    min_in_context_examples: The minimum number of examples to keep, even if
+      the prompt does not fit the budget.
+
+  Returns:
+    The example ads to use and the (possibly truncated) keywords specific
+    instructions.
+  """
+  ad_format_json = ad_format.model_dump_json()
+  example_lengths = [
+      _content_text_length(
+          _construct_example_ad_messages(
+              example.keywords,
+              tuple(example.google_ad.headlines),
+              tuple(example.google_ad.descriptions),
+              ad_format_json,
+          )
+      )
+      for example in example_ads
+  ]
+  final_message_length = _content_text_length([
+      _construct_new_ad_copy_user_message(
+          keywords, ad_format=ad_format, existing_ad_copy=existing_ad_copy
+      )
+  ])
+  instructions_overhead = (
+      _content_text_length([
+          _construct_new_ad_copy_user_message(
+              keywords,
+              ad_format=ad_format,
+              existing_ad_copy=existing_ad_copy,
+              keywords_specific_instructions=keywords_specific_instructions,
+          )
+      ])
+      - final_message_length
+      - len(keywords_specific_instructions)
+  )
+
+  max_characters = max_prompt_tokens * rate_limiting.CHARACTERS_PER_TOKEN
+  n_examples = min(min_in_context_examples, len(example_ads))
+  n_characters = (
+      len(system_instruction)
+      + final_message_length
+      + sum(example_lengths[:n_examples])
+  )
+
+  if keywords_specific_instructions:
+    max_instructions_length = (
+        max_characters - n_characters - instructions_overhead
+    )
+    if len(keywords_specific_instructions) > max_instructions_length:
+      truncated_length = max_instructions_length - len(TRUNCATED_TEXT_SUFFIX)
+      if truncated_length > 0:
+        keywords_specific_instructions = (
+            keywords_specific_instructions[:truncated_length]
+            + TRUNCATED_TEXT_SUFFIX
+        )
+      else:
+        keywords_specific_instructions = ""
+    if keywords_specific_instructions:
+      n_characters += instructions_overhead + len(
+          keywords_specific_instructions
+      )
+
+  for example_length in example_lengths[n_examples:]:
+    if n_characters + example_length > max_characters:
+      break
+    n_characters += example_length
+    n_examples += 1
+
+  if n_characters > max_characters:
+    LOGGER.warning(
+        "The prompt for keywords %r has an estimated %d tokens, which exceeds"
+        " the budget of %d tokens even with %d in-context examples.",
+        keywords,
+        n_characters // rate_limiting.CHARACTERS_PER_TOKEN,
+        max_prompt_tokens,
+        n_examples,
+    )
+
+  return example_ads[:n_examples], keywords_specific_instructions
+
+
+def group_requests_by_prompt_prefix(
+    requests: Sequence[TextGenerationRequest],
+) -> list[list[int]]:
+  """Groups the requests that share the same prompt prefix.
+
+  The prefix is everything except the final user message: the model, system
+  instruction, sampling parameters and in-context examples. Requests in the
+  same group can share a cached context (e.g. Vertex AI context caching) for
+  the prefix, and only send their final message.
+
+  Args:
+    requests: The text generation requests.
+
+  Returns:
+    The indices of the requests in each group. The groups are ordered by their
+    first request, and the indices within each group are in order.
+  """
+  groups: dict[Hashable, list[int]] = {}
+  for index, request in enumerate(requests):
+    prefix_key = (
+        request.chat_model_name,
+        request.system_instruction,
+        request.temperature,
+        request.top_k,
+        request.top_p,
+        _safety_settings_key(request.safety_settings),
+        tuple(
+            (content.role, content.parts[0].text)
+            for content in request.prompt[:-1]
+        ),
+    )
+    groups.setdefault(prefix_key, []).append(index)
+  return list(groups.values())
+
+
 HashableTypeVar = TypeVar("HashableTypeVar", bound=Hashable)
 
 
@@ -970,6 +1809,142 @@ def remove_invalid_headlines_and_descriptions(
     ]
 
 
+_GOOGLE_AD_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "headlines": {
+            "type": "ARRAY",
+            "items": {
+                "type": "string",
+                "description": (
+                    "The headlines for the ad. Must be fewer than 30"
+                    " characters."
+                ),
+            },
+        },
+        "descriptions": {
+            "type": "ARRAY",
+            "items": {
+                "type": "string",
+                "description": (
+                    "The descriptions for the ad. Must be fewer than 90"
+                    " characters."
+                ),
+            },
+        },
+    },
+    "required": ["headlines", "descriptions"],
+}
+
+# The async client of a chat model is bound to the event loop it was first used
+# in, so the models are cached separately for each event loop.
+_GENERATIVE_MODEL_CACHE: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop,
+    collections.OrderedDict[Hashable, generative_models.GenerativeModel],
+] = weakref.WeakKeyDictionary()
+_GENERATIVE_MODEL_CACHE_LOCK = threading.Lock()
+
+
+def _safety_settings_key(
+    safety_settings: SafetySettingsType | None,
+) -> Hashable:
+  """Returns a hashable representation of the safety settings."""
+  if safety_settings is None:
+    return None
+  if isinstance(safety_settings, dict):
+    return tuple(
+        sorted(
+            (int(category), int(threshold))
+            for category, threshold in safety_settings.items()
+        )
+    )
+  return tuple(
+      json.dumps(safety_setting.to_dict(), sort_keys=True)
+      for safety_setting in safety_settings
+  )
+
+
+def make_generation_config(
+    request: TextGenerationRequest,
+) -> generative_models.GenerationConfig:
+  """Returns the generation config for the text generation request.
+
+  The config includes the GoogleAd response schema, so the responses are valid
+  json representations of GoogleAds.
+
+  Args:
+    request: The text generation request.
+  """
+  return generative_models.GenerationConfig(
+      temperature=request.temperature,
+      top_k=request.top_k,
+      top_p=request.top_p,
+      response_mime_type="application/json",
+      response_schema=_GOOGLE_AD_RESPONSE_SCHEMA,
+  )
+
+
+def _create_generative_model(
+    request: TextGenerationRequest,
+) -> generative_models.GenerativeModel:
+  """Creates the chat model for the text generation request."""
+  return generative_models.GenerativeModel(
+      model_name=request.chat_model_name.value,
+      generation_config=make_generation_config(request),
+      system_instruction=request.system_instruction,
+      safety_settings=request.safety_settings,
+  )
+
+
+def get_generative_model(
+    request: TextGenerationRequest,
+) -> generative_models.GenerativeModel:
+  """Returns the chat model for the text generation request.
+
+  All requests with the same model name, system instruction, sampling
+  parameters and safety settings share the same model (and so the same
+  connection) within an event loop, instead of constructing a new model for
+  every request. Outside of a running event loop a new model is returned.
+
+  Args:
+    request: The text generation request.
+
+  Returns:
+    The chat model to send the request to.
+  """
+  try:
+    loop = asyncio.get_running_loop()
+  except RuntimeError:
+    return _create_generative_model(request)
+
+  key = (
+      generative_models.GenerativeModel,
+      request.chat_model_name,
+      request.system_instruction,
+      request.temperature,
+      request.top_k,
+      request.top_p,
+      _safety_settings_key(request.safety_settings),
+  )
+  with _GENERATIVE_MODEL_CACHE_LOCK:
+    models = _GENERATIVE_MODEL_CACHE.setdefault(loop, collections.OrderedDict())
+    if key in models:
+      models.move_to_end(key)
+      return models[key]
+
+    model = _create_generative_model(request)
+    models[key] = model
+    if len(models) > GENERATIVE_MODEL_CACHE_SIZE:
+      models.popitem(last=False)
+    return model
+
+
+def clear_generative_model_cache() -> None:
+  """Clears the chat models cached by get_generative_model."""
+  with _GENERATIVE_MODEL_CACHE_LOCK:
+    _GENERATIVE_MODEL_CACHE.clear()
+
+
 def async_generate_google_ad_json(
     request: TextGenerationRequest,
 ) -> AsyncGenerationResponse:
@@ -987,62 +1962,363 @@ def async_generate_google_ad_json(
   Returns:
     The generated response, which is a valid json representation of a GoogleAd.
   """
-  generation_config_params = dict(
-      temperature=request.temperature,
-      top_k=request.top_k,
-      top_p=request.top_p,
-      response_mime_type="application/json",
+  LOGGER.debug("System instruction: %s", request.system_instruction)
+  LOGGER.debug("Prompt: %s", request.prompt)
+
+  model = get_generative_model(request)
+  response = model.generate_content_async(request.prompt)
+
+  return response
+
+
+def estimate_request_tokens(request: TextGenerationRequest) -> int:
+  """Returns a rough estimate of the number of tokens in the request.
+
+  The estimate covers the system instruction and all the messages in the
+  prompt, and does not call the token counting API.
+
+  Args:
+    request: The text generation request.
+  """
+  prompt_text = "".join(
+      part.to_dict().get("text", "")
+      for content in request.prompt
+      for part in content.parts
   )
+  return rate_limiting.estimate_tokens(request.system_instruction + prompt_text)
 
-  generation_config_params["response_schema"] = {
-      "type": "OBJECT",
-      "properties": {
-          "headlines": {
-              "type": "ARRAY",
-              "items": {
-                  "type": "string",
-                  "description": (
-                      "The headlines for the ad. Must be fewer than 30"
-                      " characters."
-                  ),
-              },
-          },
-          "descriptions": {
-              "type": "ARRAY",
-              "items": {
-                  "type": "string",
-                  "description": (
-                      "The descriptions for the ad. Must be fewer than 90"
-                      " characters."
-                  ),
-              },
-          },
-      },
-      "required": ["headlines", "descriptions"],
+
+def summarize_request_tokens(
+    requests: Sequence[TextGenerationRequest],
+) -> dict[str, int | float]:
+  """Returns the estimated number of prompt tokens for a batch of requests.
+
+  Args:
+    requests: The text generation requests in the batch.
+
+  Returns:
+    A dictionary with the number of requests, and the total, mean and maximum
+    estimated number of prompt tokens per request.
+  """
+  n_tokens = [estimate_request_tokens(request) for request in requests]
+  return {
+      "n_requests": len(n_tokens),
+      "total_tokens": sum(n_tokens),
+      "mean_tokens": sum(n_tokens) / len(n_tokens) if n_tokens else 0.0,
+      "max_tokens": max(n_tokens, default=0),
   }
 
-  generation_config = generative_models.GenerationConfig(
-      **generation_config_params
-  )
 
-  LOGGER.debug("System instruction: %s", request.system_instruction)
-  LOGGER.debug("Prompt: %s", request.prompt)
+def make_response_cache_key(
+    request: TextGenerationRequest, sample_index: int = 0
+) -> str:
+  """Returns the response cache key for the text generation request.
 
-  model = generative_models.GenerativeModel(
+  The key covers everything sent to the chat model: the model name, system
+  instruction, prompt, sampling parameters, response schema and safety
+  settings. The keywords and existing ad copy only affect the response through
+  the prompt, so they are not part of the key.
+
+  Identical requests, e.g. for several versions of the same ad, are sampled
+  separately, so the sample index is part of the key too. Otherwise every
+  version would get the same cached response.
+
+  Args:
+    request: The text generation request.
+    sample_index: Which of the identical requests in the same call this is.
+  """
+  return response_cache_lib.make_cache_key(
       model_name=request.chat_model_name.value,
-      generation_config=generation_config,
       system_instruction=request.system_instruction,
-      safety_settings=request.safety_settings,
+      prompt=[content.to_dict() for content in request.prompt],
+      generation_config={
+          "temperature": request.temperature,
+          "top_k": request.top_k,
+          "top_p": request.top_p,
+          "response_schema": _GOOGLE_AD_RESPONSE_SCHEMA,
+      },
+      safety_settings=_safety_settings_key(request.safety_settings),
+      sample_index=sample_index,
   )
 
-  response = model.generate_content_async(request.prompt)
 
-  return response
+def _is_complete_response(
+    response: generative_models.GenerationResponse,
+) -> bool:
+  """Returns whether the model finished generating the first candidate."""
+  return bool(response.candidates) and (
+      response.candidates[0].finish_reason
+      == generative_models.FinishReason.STOP
+  )
+
+
+class GenerationScheduler:
+  """Schedules the generation requests sent to the chat models.
+
+  The scheduler limits the number of requests in flight, keeps the requests to
+  each model within its quota with a token bucket rate limiter, retries
+  requests that fail with a transient error (e.g. quota exceeded) with jittered
+  exponential backoff, and times out requests that take too long.
+
+  The same scheduler can be shared between multiple batches and Copycat
+  instances, to keep them all within the same limits.
+
+  Attributes:
+    max_concurrent_requests: The maximum number of requests in flight at once,
+      per event loop.
+    requests_per_minute: The maximum number of requests per minute to each
+      model, or None for no limit.
+    tokens_per_minute: The maximum number of (estimated) tokens per minute to
+      each model, or None for no limit.
+    max_attempts: The maximum number of attempts per request, including the
+      first one.
+    retry_max_wait_seconds: The maximum time to wait between attempts.
+    request_timeout_seconds: The maximum time to wait for a single attempt, or
+      None for no timeout. Timed out attempts are retried.
+    rate_limiters: Rate limiters to use for specific models instead of creating
+      them from requests_per_minute and tokens_per_minute, e.g. to share them
+      with other schedulers or processes.
+    response_cache: An optional cache for the responses, so identical requests
+      are only sent to the chat model once.
+    bypass_response_cache: Whether to skip looking up the responses in the
+      response cache, e.g. when fresh samples are wanted. The new responses
+      are still written to the cache.
+  """
+
+  def __init__(
+      self,
+      *,
+      max_concurrent_requests: int = GENERATION_MAX_CONCURRENT_REQUESTS,
+      requests_per_minute: float | None = None,
+      tokens_per_minute: float | None = None,
+      max_attempts: int = GENERATION_MAX_ATTEMPTS,
+      retry_max_wait_seconds: float = GENERATION_RETRY_MAX_WAIT_SECONDS,
+      request_timeout_seconds: float | None = (
+          GENERATION_REQUEST_TIMEOUT_SECONDS
+      ),
+      rate_limiters: (
+          Mapping[ModelName | str, rate_limiting.RateLimiter] | None
+      ) = None,
+      response_cache: response_cache_lib.ResponseCache | None = None,
+      bypass_response_cache: bool = False,
+  ):
+    """Initialises the generation scheduler.
+
+    Args:
+      max_concurrent_requests: The maximum number of requests in flight at
+        once, per event loop.
+      requests_per_minute: The maximum number of requests per minute to each
+        model, or None for no limit.
+      tokens_per_minute: The maximum number of (estimated) tokens per minute to
+        each model, or None for no limit.
+      max_attempts: The maximum number of attempts per request, including the
+        first one.
+      retry_max_wait_seconds: The maximum time to wait between attempts.
+      request_timeout_seconds: The maximum time to wait for a single attempt,
+        or None for no timeout. Timed out attempts are retried.
+      rate_limiters: Rate limiters to use for specific models instead of
+        creating them from requests_per_minute and tokens_per_minute, e.g. to
+        share them with other schedulers or processes.
+      response_cache: An optional cache for the responses, so identical
+        requests are only sent to the chat model once.
+      bypass_response_cache: Whether to skip looking up the responses in the
+        response cache, e.g. when fresh samples are wanted. The new responses
+        are still written to the cache.
+
+    Raises:
+      ValueError: If max_concurrent_requests or max_attempts is not positive.
+    """
+    for name, value in [
+        ("max_concurrent_requests", max_concurrent_requests),
+        ("max_attempts", max_attempts),
+    ]:
+      if value < 1:
+        LOGGER.error("%s must be positive, got %s.", name, value)
+        raise ValueError(f"{name} must be positive, got {value}.")
+
+    self.max_concurrent_requests = max_concurrent_requests
+    self.requests_per_minute = requests_per_minute
+    self.tokens_per_minute = tokens_per_minute
+    self.max_attempts = max_attempts
+    self.retry_max_wait_seconds = retry_max_wait_seconds
+    self.request_timeout_seconds = request_timeout_seconds
+    self.response_cache = response_cache
+    self.bypass_response_cache = bypass_response_cache
+
+    self._lock = threading.Lock()
+    self._rate_limiters: dict[ModelName, rate_limiting.RateLimiter] = {
+        ModelName(model_name): rate_limiter
+        for model_name, rate_limiter in (rate_limiters or {}).items()
+    }
+    self._semaphores: weakref.WeakKeyDictionary[
+        asyncio.AbstractEventLoop, asyncio.Semaphore
+    ] = weakref.WeakKeyDictionary()
+
+  def get_rate_limiter(
+      self, model_name: ModelName
+  ) -> rate_limiting.RateLimiter | None:
+    """Returns the rate limiter for the model, or None if there is no limit."""
+    with self._lock:
+      if model_name in self._rate_limiters:
+        return self._rate_limiters[model_name]
+      if self.requests_per_minute is None and self.tokens_per_minute is None:
+        return None
+      self._rate_limiters[model_name] = rate_limiting.RateLimiter(
+          requests_per_minute=self.requests_per_minute,
+          tokens_per_minute=self.tokens_per_minute,
+      )
+      return self._rate_limiters[model_name]
+
+  def _get_semaphore(self) -> asyncio.Semaphore:
+    """Returns the semaphore limiting the requests in the running loop."""
+    loop = asyncio.get_running_loop()
+    with self._lock:
+      if loop not in self._semaphores:
+        self._semaphores[loop] = asyncio.Semaphore(self.max_concurrent_requests)
+      return self._semaphores[loop]
+
+  async def generate(
+      self, request: TextGenerationRequest, sample_index: int = 0
+  ) -> generative_models.GenerationResponse:
+    """Generates a GoogleAd from the request within the scheduler limits.
+
+    If there is a response cache, a cached response for an identical request
+    with the same sample index is returned without calling the chat model,
+    unless bypass_response_cache is set. Only complete responses are cached.
+
+    Args:
+      request: The text generation request.
+      sample_index: Which of the identical requests in the same call this is,
+        see make_response_cache_key.
+
+    Returns:
+      The generated response, which is a valid json representation of a
+      GoogleAd.
+
+    Raises:
+      RuntimeError: If the response is not a GenerationResponse. This shouldn't
+        happen unless the gemini api changes.
+      Exception: The last error if the request still fails after all attempts,
+        or the first error that is not transient.
+    """
+    cache_key = None
+    if self.response_cache is not None:
+      cache_key = make_response_cache_key(request, sample_index)
+      if not self.bypass_response_cache:
+        cached_output = self.response_cache.get(cache_key)
+        if cached_output is not None:
+          return cached_output
+
+    rate_limiter = self.get_rate_limiter(request.chat_model_name)
+    n_tokens = estimate_request_tokens(request)
+    async for attempt in rate_limiting.async_retry_on_transient_errors(
+        max_attempts=self.max_attempts,
+        max_wait_seconds=self.retry_max_wait_seconds,
+        transient_errors=rate_limiting.TRANSIENT_ERRORS
+        + (asyncio.TimeoutError,),
+    ):
+      with attempt:
+        # The semaphore is only held during each attempt, so requests waiting
+        # to be retried do not stop other requests from being sent.
+        async with self._get_semaphore():
+          if rate_limiter is not None:
+            await rate_limiter.acquire_async(tokens=n_tokens)
+          output = await asyncio.wait_for(
+              async_generate_google_ad_json(request),
+              timeout=self.request_timeout_seconds,
+          )
+    _check_is_generation_response(output)
+    if cache_key is not None and _is_complete_response(output):
+      self.response_cache.set(cache_key, output)
+    return output
+
+  async def generate_or_error(
+      self, request: TextGenerationRequest, sample_index: int = 0
+  ) -> generative_models.GenerationResponse | Exception:
+    """Same as generate, but returns the error instead of raising it.
+
+    This lets a batch return the responses that succeeded, rather than failing
+    the whole batch because of a single request.
+
+    Args:
+      request: The text generation request.
+      sample_index: Which of the identical requests in the same call this is,
+        see make_response_cache_key.
+
+    Returns:
+      The generated response, or the error if the request failed.
+    """
+    try:
+      return await self.generate(request, sample_index)
+    except Exception as e:
+      LOGGER.error(
+          "Generation failed for keywords %s. Error: %r",
+          request.keywords,
+          e,
+      )
+      return e
+
+
+def _make_sample_indexer(
+    scheduler: GenerationScheduler,
+) -> Callable[[TextGenerationRequest], int]:
+  """Returns a function numbering the identical requests within a call.
+
+  The k-th identical request in the call (counting from 0), e.g. the k-th
+  version of an ad, gets sample index k, so on a re-run with a response cache
+  it gets the k-th cached sample. The sample index is only used for the cache
+  key, so without a response cache it is always 0.
+
+  Args:
+    scheduler: The scheduler the requests are sent through.
+  """
+  if scheduler.response_cache is None:
+    return lambda request: 0
+
+  counts = collections.Counter()
+
+  def get_sample_index(request: TextGenerationRequest) -> int:
+    cache_key = make_response_cache_key(request)
+    sample_index = counts[cache_key]
+    counts[cache_key] += 1
+    return sample_index
+
+  return get_sample_index
+
+
+async def agenerate_google_ad_json_batch(
+    requests: list[TextGenerationRequest],
+    *,
+    scheduler: GenerationScheduler | None = None,
+) -> list[generative_models.GenerationResponse | Exception]:
+  """Generates GoogleAds from the text generation requests asynchronously.
+
+  This is the async version of generate_google_ad_json_batch, see that function
+  for details.
+
+  Args:
+    requests: A list of text generation requests, containing the prompts, system
+      instructions, style guides, and other parameters.
+    scheduler: The scheduler for the requests. If None, a scheduler with the
+      default limits is used.
+
+  Returns:
+    The generated responses, which are valid json representations of GoogleAds,
+    or the errors for the requests that failed.
+  """
+  scheduler = scheduler or GenerationScheduler()
+  get_sample_index = _make_sample_indexer(scheduler)
+  return await asyncio.gather(*[
+      scheduler.generate_or_error(request, get_sample_index(request))
+      for request in requests
+  ])
 
 
 def generate_google_ad_json_batch(
     requests: list[TextGenerationRequest],
-) -> list[generative_models.GenerationResponse]:
+    *,
+    scheduler: GenerationScheduler | None = None,
+) -> list[generative_models.GenerationResponse | Exception]:
   """Generates a GoogleAd from the provided text generation request.
 
   This function ensures that the generated response is a valid json
@@ -1050,71 +2326,187 @@ def generate_google_ad_json_batch(
   system instruction and including a response schema in the generation config
   for models that accept it.
 
+  The requests are sent through the scheduler, which limits the number of
+  requests in flight, rate limits and retries them. If a request still fails,
+  its error is returned in place of the response, so the other responses in
+  the batch are not lost.
+
+  The requests are run on the Copycat background event loop, so this can be
+  called from inside a running event loop or from any thread. Async code should
+  use agenerate_google_ad_json_batch instead.
+
   Args:
     requests: A list of text generation requests, containing the prompts, system
       instructions, style guides, and other parameters.
+    scheduler: The scheduler for the requests. If None, a scheduler with the
+      default limits is used.
 
   Returns:
-    The generated responses, which are valid json representations of GoogleAds.
+    The generated responses, which are valid json representations of GoogleAds,
+    or the errors for the requests that failed.
+  """
+  return event_loops.run_in_background_loop(
+      agenerate_google_ad_json_batch(requests, scheduler=scheduler)
+  )
 
-  Raises:
-    RuntimeError: If one of the responses is not a valid json representation of
-    a GoogleAd. This shouldn't happen unless the gemini api changes.
+
+def _check_is_generation_response(output: Any) -> None:
+  """Raises a RuntimeError if the output is not a GenerationResponse."""
+  if not isinstance(output, generative_models.GenerationResponse):
+    LOGGER.error(
+        "One of the responses is not a GenerationResponse. Instead got: %s",
+        output,
+    )
+    raise RuntimeError(
+        "One of the responses is not a GenerationResponse. Instead got:"
+        f" {output}"
+    )
+
+
+async def _aiterate_requests(
+    requests: (
+        Iterable[TextGenerationRequest] | AsyncIterable[TextGenerationRequest]
+    ),
+) -> AsyncIterator[TextGenerationRequest]:
+  """Iterates over a sync or async iterable of requests asynchronously."""
+  if isinstance(requests, AsyncIterable):
+    async for request in requests:
+      yield request
+  else:
+    for request in requests:
+      yield request
+
+
+async def stream_google_ad_json(
+    requests: (
+        Iterable[TextGenerationRequest] | AsyncIterable[TextGenerationRequest]
+    ),
+    *,
+    scheduler: GenerationScheduler | None = None,
+) -> AsyncIterator[
+    tuple[int, generative_models.GenerationResponse | Exception]
+]:
+  """Generates GoogleAds from the requests, yielding them as they complete.
+
+  Unlike generate_google_ad_json_batch, the responses are yielded in the order
+  they complete rather than the order of the requests, together with the index
+  of the request they belong to. The requests are consumed lazily, and at most
+  scheduler.max_concurrent_requests of them are in flight at once, so a slow
+  request does not hold back the others and memory stays bounded for a very
+  large number of requests.
+
+  Args:
+    requests: The text generation requests. This can be a lazy iterable, it is
+      only consumed as requests are sent. If building the requests blocks, e.g.
+      to embed the keywords, pass an async iterable that builds them in a
+      worker thread, so the requests in flight are not held up.
+    scheduler: The scheduler for the requests. If None, a scheduler with the
+      default limits is used.
+
+  Yields:
+    Tuples of the index of the request and the generated response, which is a
+    valid json representation of a GoogleAd, or the error if the request
+    failed.
   """
+  scheduler = scheduler or GenerationScheduler()
+
+  get_sample_index = _make_sample_indexer(scheduler)
+
+  async def generate(
+      index: int, request: TextGenerationRequest, sample_index: int
+  ) -> tuple[int, generative_models.GenerationResponse | Exception]:
+    return index, await scheduler.generate_or_error(request, sample_index)
+
+  requests_iterator = _aiterate_requests(requests)
+  n_requests = 0
+  requests_exhausted = False
+  pending = set()
   try:
-    loop = asyncio.get_running_loop()
-  except RuntimeError:
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    while True:
+      while (
+          not requests_exhausted
+          and len(pending) < scheduler.max_concurrent_requests
+      ):
+        try:
+          request = await anext(requests_iterator)
+        except StopAsyncIteration:
+          requests_exhausted = True
+          break
+        pending.add(
+            asyncio.ensure_future(
+                generate(n_requests, request, get_sample_index(request))
+            )
+        )
+        n_requests += 1
+      if not pending:
+        return
 
-  outputs = loop.run_until_complete(
-      asyncio.gather(*list(map(async_generate_google_ad_json, requests)))
-  )
-  for output in outputs:
-    if not isinstance(output, generative_models.GenerationResponse):
-      LOGGER.error(
-          "One of the responses is not a GenerationResponse. Instead got: %s",
-          output,
-      )
-      raise RuntimeError(
-          "One of the responses is not a GenerationResponse. Instead got:"
-          f" {output}"
+      done, pending = await asyncio.wait(
+          pending, return_when=asyncio.FIRST_COMPLETED
       )
-
-  return outputs
+      for task in done:
+        yield task.result()
+  finally:
+    for task in pending:
+      task.cancel()
 
 
 def extract_urls_for_keyword_instructions(
     keyword_instructions: list[str],
+    max_characters_per_page: int | None = None,
+    fetcher: landing_pages.LandingPageFetcher | None = None,
 ) -> list[str]:
   """Extracts pages from keyword instructions.
 
+  The landing pages are fetched concurrently, and each unique url is only
+  fetched once. Only the main text of each page is kept, without the
+  navigation, scripts and other boilerplate.
+
   Args:
       keyword_instructions: keyword instructions or a string that may contain a
         URL.
+      max_characters_per_page: The maximum number of characters of the web
+        page content to keep. Longer content is truncated. If None, the full
+        content is kept.
+      fetcher: The fetcher to use for the landing pages, e.g. with an on-disk
+        cache. If None, a fetcher with the default limits and no cache is used.
 
   Returns:
       list of keyword instructions with retrieved web page content if a URL is
       found and successfully fetched.
   """
+  urls = [
+      extract_url_from_string(instruction)
+      for instruction in keyword_instructions
+  ]
+  urls = [url if url and is_valid_url(url) else None for url in urls]
+
+  owns_fetcher = fetcher is None
+  fetcher = fetcher or landing_pages.LandingPageFetcher()
+  try:
+    page_contents = fetcher.fetch_texts(url for url in urls if url)
+  finally:
+    if owns_fetcher:
+      fetcher.close()
+
   pages = []
-  for instruction in keyword_instructions:
-    url = extract_url_from_string(instruction)
-    if url and is_valid_url(url):
-      try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = bs4.BeautifulSoup(response.content, "html.parser")
-        if len(instruction) == len(url):  # if the instruction is only the url
-          pages.append(f"Web page content of {url}: {soup.get_text()}")
-        else:
-          pages.append(f"{instruction} ## Content of {url}: {soup.get_text()}")
-      except requests.exceptions.RequestException as e:
-        pages.append(
-            instruction
-        )  # Keep the original instruction if there's an error
-    else:
+  for instruction, url in zip(keyword_instructions, urls):
+    page_content = page_contents.get(url) if url else None
+    if page_content is None or isinstance(page_content, Exception):
+      # Keep the original instruction if there's no url or an error.
       pages.append(instruction)
+      continue
+    if (
+        max_characters_per_page is not None
+        and len(page_content) > max_characters_per_page
+    ):
+      page_content = (
+          page_content[:max_characters_per_page] + TRUNCATED_TEXT_SUFFIX
+      )
+    if len(instruction) == len(url):  # if the instruction is only the url
+      pages.append(f"Web page content of {url}: {page_content}")
+    else:
+      pages.append(f"{instruction} ## Content of {url}: {page_content}")
   return pages
 
 
@@ -12,18 +12,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import textwrap
 
 from absl.testing import absltest
 from absl.testing import parameterized
+from google.api_core import exceptions as api_core_exceptions
 from vertexai import generative_models
 from vertexai import language_models
 import mock
+import numpy as np
 import pandas as pd
 import requests
 
 from copycat import ad_copy_generator
+from copycat import embedding_cache
 from copycat import google_ads
+from copycat import landing_pages
+from copycat import nearest_neighbors
+from copycat import rate_limiting
+from copycat import response_cache
 from copycat import testing_utils
 
 
@@ -45,6 +53,17 @@ def mock_training_data(
   })
 
 
+def make_generation_response(
+    text: str,
+) -> generative_models.GenerationResponse:
+  return generative_models.GenerationResponse.from_dict({
+      "candidates": [{
+          "finish_reason": generative_models.FinishReason.STOP,
+          "content": {"role": "model", "parts": [{"text": text}]},
+      }]
+  })
+
+
 class TextGenerationRequestTest(parameterized.TestCase):
 
   def test_to_markdown_returns_expected_markdown(self):
@@ -360,10 +379,371 @@ class AdCopyVectorstoreTest(parameterized.TestCase):
             ),
         ),
     ]]
-    expected_embeddings = [[[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]]
-    expected_results = (expected_ads, expected_embeddings)
+    expected_embeddings = np.array([[[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]])
+
+    similar_ads, similar_ad_embeddings = results
+    self.assertEqual(similar_ads, expected_ads)
+    np.testing.assert_array_equal(similar_ad_embeddings, expected_embeddings)
+
+  def test_get_nearest_exemplar_ids_from_embeddings(self):
+    ad_exemplars = pd.DataFrame.from_records([
+        {
+            "headlines": [f"headline {i}"],
+            "descriptions": [f"description {i}"],
+            "keywords": f"keyword {i}",
+            "embeddings": embeddings,
+        }
+        for i, embeddings in enumerate(
+            [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 9.0]]
+        )
+    ])
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=ad_exemplars,
+        embedding_model_name="text-embedding-004",
+        dimensionality=3,
+        embeddings_batch_size=10,
+    )
+
+    distances, ids = (
+        ad_copy_vectorstore.get_nearest_exemplar_ids_from_embeddings(
+            [[2.0, 3.0, 4.0], [8.0, 9.0, 10.0]], k=5
+        )
+    )
+
+    np.testing.assert_array_equal(ids, [[0, 1, 2], [2, 1, 0]])
+    self.assertEqual(distances.shape, (2, 3))
+    self.assertTrue(np.all(np.diff(distances, axis=1) >= 0))
+
+  @parameterized.parameters(
+      ("euclidean", [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]]),
+      ("cosine", [[10.0, 1.0, 0.0], [1.0, 0.0, 0.0]]),
+      ("ivf_cosine", [[10.0, 1.0, 0.0], [1.0, 0.0, 0.0]]),
+  )
+  def test_get_relevant_ads_and_embeddings_uses_nearest_neighbors_index_type(
+      self, nearest_neighbors_index_type, expected_embeddings
+  ):
+    ad_exemplars = pd.DataFrame.from_records([
+        {
+            "headlines": [f"headline {i}"],
+            "descriptions": [f"description {i}"],
+            "keywords": f"keyword {i}",
+            "embeddings": embeddings,
+        }
+        for i, embeddings in enumerate(
+            [[1.0, 0.0, 0.0], [10.0, 1.0, 0.0], [0.0, 1.0, 0.0]]
+        )
+    ])
+
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=ad_exemplars,
+        embedding_model_name="text-embedding-004",
+        dimensionality=3,
+        embeddings_batch_size=10,
+        nearest_neighbors_index_type=nearest_neighbors_index_type,
+        nearest_neighbors_index_params=(
+            {"n_lists": 2, "n_probe": 2}
+            if nearest_neighbors_index_type == "ivf_cosine"
+            else {}
+        ),
+    )
+
+    _, similar_ad_embeddings = (
+        ad_copy_vectorstore.get_relevant_ads_and_embeddings_from_embeddings(
+            [[1.0, 0.05, 0.0]], k=2
+        )
+    )
 
-    self.assertEqual(results, expected_results)
+    np.testing.assert_array_equal(
+        similar_ad_embeddings, np.array([expected_embeddings])
+    )
+
+  def test_nearest_neighbors_index_is_persisted_with_vectorstore(self):
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+        training_data=mock_training_data([2, 1, 3], [2, 1, 2]),
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        max_initial_ads=100,
+        max_exemplar_ads=10,
+        affinity_preference=None,
+        embeddings_batch_size=10,
+        exemplar_selection_method="random",
+        nearest_neighbors_index_type="ivf_cosine",
+        nearest_neighbors_index_params={"n_lists": 2, "n_probe": 1},
+    )
+
+    ad_copy_vectorstore.save(self.tmp_dir.full_path)
+    reloaded_from_directory = ad_copy_generator.AdCopyVectorstore.load(
+        self.tmp_dir.full_path
+    )
+    reloaded_from_json = ad_copy_generator.AdCopyVectorstore.from_json(
+        ad_copy_vectorstore.to_json()
+    )
+
+    for reloaded_ad_copy_vectorstore in [
+        reloaded_from_directory,
+        reloaded_from_json,
+    ]:
+      self.assertEqual(
+          reloaded_ad_copy_vectorstore.nearest_neighbors_index_type,
+          nearest_neighbors.NearestNeighborsIndexType.IVF_COSINE,
+      )
+      self.assertDictEqual(
+          reloaded_ad_copy_vectorstore.nearest_neighbors_index_params,
+          {"n_lists": 2, "n_probe": 1},
+      )
+      self.assertIsInstance(
+          reloaded_ad_copy_vectorstore.nearest_neighbors,
+          nearest_neighbors.IvfCosineIndex,
+      )
+
+  def _create_vectorstore_for_updates(
+      self, nearest_neighbors_index_type: str = "euclidean"
+  ) -> ad_copy_generator.AdCopyVectorstore:
+    return ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+        training_data=mock_training_data([1, 1, 1], [1, 1, 1]),
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        max_initial_ads=100,
+        max_exemplar_ads=10,
+        affinity_preference=None,
+        embeddings_batch_size=10,
+        exemplar_selection_method="random",
+        nearest_neighbors_index_type=nearest_neighbors_index_type,
+    )
+
+  @parameterized.parameters("euclidean", "cosine", "ivf_cosine")
+  def test_add_ads_updates_exemplars_embeddings_and_index(
+      self, nearest_neighbors_index_type
+  ):
+    ad_copy_vectorstore = self._create_vectorstore_for_updates(
+        nearest_neighbors_index_type
+    )
+    # Build the cached properties before adding the ads.
+    ad_copy_vectorstore.get_relevant_ads(["query"], k=1)
+    self.assertNotIn("new headline", ad_copy_vectorstore.unique_headlines)
+    headlines_index = ad_copy_vectorstore.headlines_memorisation_index
+    new_ads = pd.DataFrame.from_records([{
+        "headlines": ["new headline"],
+        "descriptions": ["new description"],
+        "keywords": "new keyword",
+    }])
+
+    added_ads = ad_copy_vectorstore.add_ads(new_ads, min_distance=0.0)
+
+    self.assertLen(added_ads, 1)
+    self.assertEqual(ad_copy_vectorstore.n_exemplars, 4)
+    self.assertEqual(ad_copy_vectorstore.embeddings.shape, (4, 256))
+    self.assertIn("new headline", ad_copy_vectorstore.unique_headlines)
+    self.assertIn("new description", ad_copy_vectorstore.unique_descriptions)
+    self.assertTrue(headlines_index.contains_batch(["New Headline"])[0])
+    self.assertTrue(
+        ad_copy_vectorstore.descriptions_memorisation_index.contains_batch(
+            ["new description"]
+        )[0]
+    )
+    # The new ad's own embedding retrieves it.
+    new_ad_embedding = ad_copy_vectorstore.embed_documents(
+        added_ads["ad_markdown"].values.tolist()
+    )
+    relevant_ads, _ = (
+        ad_copy_vectorstore.get_relevant_ads_and_embeddings_from_embeddings(
+            new_ad_embedding, k=1
+        )
+    )
+    self.assertEqual(relevant_ads[0][0].keywords, "new keyword")
+
+  def test_add_ads_only_embeds_new_ads(self):
+    ad_copy_vectorstore = self._create_vectorstore_for_updates()
+    existing_ads = ad_copy_vectorstore.ad_exemplars[
+        ["headlines", "descriptions", "keywords"]
+    ]
+    new_ads = pd.DataFrame.from_records([{
+        "headlines": ["new headline"],
+        "descriptions": ["new description"],
+        "keywords": "new keyword",
+    }])
+
+    with mock.patch.object(
+        ad_copy_vectorstore,
+        "embed_documents",
+        wraps=ad_copy_vectorstore.embed_documents,
+    ) as mock_embed_documents:
+      ad_copy_vectorstore.add_ads(
+          pd.concat([existing_ads, new_ads]), min_distance=0.0
+      )
+
+    mock_embed_documents.assert_called_once()
+    self.assertLen(mock_embed_documents.call_args.args[0], 1)
+    self.assertEqual(ad_copy_vectorstore.n_exemplars, 4)
+
+  def test_add_ads_does_not_add_ads_close_to_existing_exemplars(self):
+    ad_copy_vectorstore = self._create_vectorstore_for_updates()
+    new_ads = mock_training_data([1, 1], [1, 1]).assign(
+        headlines=[["new headline 1"], ["new headline 2"]]
+    )
+
+    added_ads = ad_copy_vectorstore.add_ads(new_ads, min_distance=1e6)
+
+    self.assertEmpty(added_ads)
+    self.assertEqual(ad_copy_vectorstore.n_exemplars, 3)
+
+  def test_add_ads_respects_max_exemplar_ads(self):
+    ad_copy_vectorstore = self._create_vectorstore_for_updates()
+    new_ads = pd.DataFrame.from_records([
+        {
+            "headlines": [f"new headline {i}"],
+            "descriptions": [f"new description {i}"],
+            "keywords": f"new keyword {i}",
+        }
+        for i in range(5)
+    ])
+
+    added_ads = ad_copy_vectorstore.add_ads(
+        new_ads, min_distance=0.0, max_exemplar_ads=5
+    )
+
+    self.assertLen(added_ads, 2)
+    self.assertEqual(ad_copy_vectorstore.n_exemplars, 5)
+
+  def test_add_ads_raises_value_error_if_columns_are_missing(self):
+    ad_copy_vectorstore = self._create_vectorstore_for_updates()
+
+    with self.assertRaisesWithLiteralMatch(
+        ValueError,
+        "New ads must contain the columns ['descriptions', 'headlines',"
+        " 'keywords']. Missing columns: ['keywords'].",
+    ):
+      ad_copy_vectorstore.add_ads(
+          pd.DataFrame({"headlines": [["h"]], "descriptions": [["d"]]})
+      )
+
+  @parameterized.parameters("euclidean", "cosine", "ivf_cosine")
+  def test_remove_ads_updates_exemplars_embeddings_and_index(
+      self, nearest_neighbors_index_type
+  ):
+    ad_copy_vectorstore = self._create_vectorstore_for_updates(
+        nearest_neighbors_index_type
+    )
+    ad_copy_vectorstore.get_relevant_ads(["query"], k=1)
+    removed_ad = ad_copy_vectorstore.ad_exemplars.iloc[[1]]
+    removed_headline = removed_ad["headlines"].iloc[0][0]
+    self.assertIn(removed_headline, ad_copy_vectorstore.unique_headlines)
+    self.assertTrue(
+        ad_copy_vectorstore.headlines_memorisation_index.contains_batch(
+            [removed_headline]
+        )[0]
+    )
+
+    n_removed = ad_copy_vectorstore.remove_ads(removed_ad)
+
+    self.assertEqual(n_removed, 1)
+    self.assertEqual(ad_copy_vectorstore.n_exemplars, 2)
+    self.assertEqual(ad_copy_vectorstore.embeddings.shape, (2, 256))
+    self.assertNotIn(removed_headline, ad_copy_vectorstore.unique_headlines)
+    self.assertFalse(
+        ad_copy_vectorstore.headlines_memorisation_index.contains_batch(
+            [removed_headline]
+        )[0]
+    )
+    relevant_ads = ad_copy_vectorstore.get_relevant_ads(
+        removed_ad["ad_markdown"].values.tolist(), k=3
+    )
+    self.assertNotIn(
+        removed_ad["keywords"].iloc[0],
+        [ad.keywords for ad in relevant_ads[0]],
+    )
+    self.assertLen(relevant_ads[0], 2)
+
+  def test_remove_ads_returns_zero_if_ads_are_not_in_vectorstore(self):
+    ad_copy_vectorstore = self._create_vectorstore_for_updates()
+
+    n_removed = ad_copy_vectorstore.remove_ads(
+        pd.DataFrame({"headlines": [["other"]], "descriptions": [["other"]]})
+    )
+
+    self.assertEqual(n_removed, 0)
+    self.assertEqual(ad_copy_vectorstore.n_exemplars, 3)
+
+  def test_embeddings_are_stored_as_a_contiguous_matrix(self):
+    ad_exemplars = pd.DataFrame.from_records([
+        {
+            "headlines": ["headline 1"],
+            "descriptions": ["description 1"],
+            "keywords": "keyword 1",
+            "embeddings": [1.0, 2.0, 3.0],
+        },
+        {
+            "headlines": ["headline 2"],
+            "descriptions": ["description 2"],
+            "keywords": "keyword 2",
+            "embeddings": [4.0, 5.0, 6.0],
+        },
+    ])
+
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=ad_exemplars,
+        embedding_model_name="text-embedding-004",
+        dimensionality=3,
+        embeddings_batch_size=10,
+    )
+
+    self.assertNotIn("embeddings", ad_copy_vectorstore.ad_exemplars.columns)
+    self.assertEqual(ad_copy_vectorstore.embeddings.dtype, np.float32)
+    self.assertTrue(ad_copy_vectorstore.embeddings.flags["C_CONTIGUOUS"])
+    np.testing.assert_array_equal(
+        ad_copy_vectorstore.embeddings, [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]
+    )
+
+  def test_embeddings_can_be_stored_as_float16(self):
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+        training_data=mock_training_data([2, 3], [2, 2]),
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        max_initial_ads=100,
+        max_exemplar_ads=10,
+        affinity_preference=None,
+        embeddings_batch_size=10,
+        exemplar_selection_method="random",
+        embeddings_dtype="float16",
+    )
+    reloaded_ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.from_json(
+        ad_copy_vectorstore.to_json()
+    )
+
+    self.assertEqual(ad_copy_vectorstore.embeddings.dtype, np.float16)
+    self.assertEqual(ad_copy_vectorstore.embeddings.shape, (2, 256))
+    self.assertTrue(
+        testing_utils.vectorstore_instances_are_equal(
+            ad_copy_vectorstore, reloaded_ad_copy_vectorstore
+        )
+    )
+
+  def test_raises_value_error_for_unsupported_embeddings_dtype(self):
+    with self.assertRaisesRegex(ValueError, "Unsupported embeddings dtype"):
+      ad_copy_generator.AdCopyVectorstore(
+          ad_exemplars=pd.DataFrame(),
+          embedding_model_name="text-embedding-004",
+          dimensionality=3,
+          embeddings_batch_size=10,
+          embeddings_dtype="int8",
+      )
+
+  def test_raises_value_error_if_exemplar_embeddings_are_missing(self):
+    with self.assertRaisesWithLiteralMatch(
+        ValueError,
+        "The embeddings of the 1 ad exemplars are missing. Pass them as"
+        " embeddings or as an embeddings column of ad_exemplars.",
+    ):
+      ad_copy_generator.AdCopyVectorstore(
+          ad_exemplars=pd.DataFrame({
+              "headlines": [["headline 1"]],
+              "descriptions": [["description 1"]],
+              "keywords": ["keyword 1"],
+          }),
+          embedding_model_name="text-embedding-004",
+          dimensionality=3,
+          embeddings_batch_size=10,
+      )
 
   def test_affinity_propagation_is_used_to_select_ads_if_provided(self):
     training_data = pd.DataFrame.from_records([
@@ -379,9 +759,10 @@ class AdCopyVectorstoreTest(parameterized.TestCase):
         },
     ])
 
-    with mock.patch(
-        "google3.third_party.professional_services.solutions.copycat.ad_copy_generator.cluster.AffinityPropagation"
+    with mock.patch.object(
+        ad_copy_generator.cluster, "AffinityPropagation"
     ) as mock_affinity_propagation:
+      mock_affinity_propagation.return_value.cluster_centers_indices_ = [0]
       (
           ad_copy_generator.AdCopyVectorstore.create_from_pandas(
               training_data=training_data,
@@ -397,6 +778,69 @@ class AdCopyVectorstoreTest(parameterized.TestCase):
 
       mock_affinity_propagation.assert_called_once()
 
+  @parameterized.parameters("kmeans_medoids", "farthest_point")
+  def test_scalable_exemplar_selection_selects_max_exemplar_ads(
+      self, exemplar_selection_method
+  ):
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+        training_data=mock_training_data([1] * 20, [1] * 20),
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        max_initial_ads=100,
+        max_exemplar_ads=5,
+        affinity_preference=None,
+        embeddings_batch_size=10,
+        exemplar_selection_method=exemplar_selection_method,
+    )
+
+    self.assertEqual(ad_copy_vectorstore.n_exemplars, 5)
+    self.assertEqual(ad_copy_vectorstore.embeddings.shape, (5, 256))
+
+  @parameterized.parameters("kmeans_medoids", "farthest_point")
+  def test_scalable_exemplar_selection_is_reproducible(
+      self, exemplar_selection_method
+  ):
+    ad_copy_vectorstores = [
+        ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+            training_data=mock_training_data([1] * 20, [1] * 20),
+            embedding_model_name="text-embedding-004",
+            dimensionality=256,
+            max_initial_ads=100,
+            max_exemplar_ads=5,
+            affinity_preference=None,
+            embeddings_batch_size=10,
+            exemplar_selection_method=exemplar_selection_method,
+        )
+        for _ in range(2)
+    ]
+
+    self.assertEqual(
+        ad_copy_vectorstores[0].ad_exemplars["ad_markdown"].tolist(),
+        ad_copy_vectorstores[1].ad_exemplars["ad_markdown"].tolist(),
+    )
+
+  @parameterized.parameters("kmeans_medoids", "farthest_point")
+  def test_scalable_exemplar_selection_keeps_embeddings_aligned_with_ads(
+      self, exemplar_selection_method
+  ):
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+        training_data=mock_training_data([1] * 20, [1] * 20),
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        max_initial_ads=100,
+        max_exemplar_ads=5,
+        affinity_preference=None,
+        embeddings_batch_size=10,
+        exemplar_selection_method=exemplar_selection_method,
+    )
+
+    expected_embeddings = ad_copy_vectorstore.embed_documents(
+        ad_copy_vectorstore.ad_exemplars["ad_markdown"].values.tolist()
+    )
+    np.testing.assert_allclose(
+        ad_copy_vectorstore.embeddings, expected_embeddings, rtol=1e-6
+    )
+
   def test_to_dict_and_from_dict_returns_same_ad_copy_vectorstore(self):
     training_data = pd.DataFrame.from_records([
         {
@@ -530,6 +974,55 @@ class AdCopyVectorstoreTest(parameterized.TestCase):
         )
     )
 
+  def test_save_and_load_returns_same_ad_copy_vectorstore(self):
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+        training_data=mock_training_data([2, 1, 3], [2, 1, 2]),
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        max_initial_ads=100,
+        max_exemplar_ads=10,
+        affinity_preference=None,
+        embeddings_batch_size=10,
+        exemplar_selection_method="random",
+    )
+
+    ad_copy_vectorstore.save(self.tmp_dir.full_path)
+    reloaded_ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.load(
+        self.tmp_dir.full_path
+    )
+
+    self.assertTrue(
+        testing_utils.vectorstore_instances_are_equal(
+            ad_copy_vectorstore, reloaded_ad_copy_vectorstore
+        )
+    )
+
+  def test_load_with_mmap_mode_memory_maps_the_embeddings(self):
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.create_from_pandas(
+        training_data=mock_training_data([2, 1, 3], [2, 1, 2]),
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        max_initial_ads=100,
+        max_exemplar_ads=10,
+        affinity_preference=None,
+        embeddings_batch_size=10,
+        exemplar_selection_method="random",
+    )
+
+    ad_copy_vectorstore.save(self.tmp_dir.full_path)
+    reloaded_ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore.load(
+        self.tmp_dir.full_path, mmap_mode="r"
+    )
+
+    # The embeddings are a view on the memory mapped file, not a copy.
+    base = reloaded_ad_copy_vectorstore.embeddings
+    while base.base is not None and not isinstance(base, np.memmap):
+      base = base.base
+    self.assertIsInstance(base, np.memmap)
+    self.assertLen(
+        reloaded_ad_copy_vectorstore.get_relevant_ads(["query"], k=2)[0], 2
+    )
+
   def test_unique_headlines_and_descriptions_are_set_correctly(self):
     training_data = pd.DataFrame.from_records([
         {
@@ -705,6 +1198,119 @@ class AdCopyVectorstoreTest(parameterized.TestCase):
         output_dimensionality=256,
     )
 
+  def test_embed_queries_only_embeds_texts_missing_from_the_cache(self):
+    cache = embedding_cache.InMemoryEmbeddingCache()
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=pd.DataFrame(),
+        embedding_model_name=ad_copy_generator.EmbeddingModelName.TEXT_EMBEDDING,
+        dimensionality=256,
+        embeddings_batch_size=10,
+        embedding_cache=cache,
+    )
+    mock_get_embeddings = (
+        self.embedding_model_patcher.mock_embeddings_model.get_embeddings
+    )
+
+    first_embeddings = ad_copy_vectorstore.embed_queries(["query 1"])
+    second_embeddings = ad_copy_vectorstore.embed_queries(
+        ["query 1", "query 2"]
+    )
+
+    mock_get_embeddings.assert_called_with(
+        [language_models.TextEmbeddingInput("query 2", "RETRIEVAL_QUERY")],
+        output_dimensionality=256,
+    )
+    self.assertEqual(mock_get_embeddings.call_count, 2)
+    self.assertEqual(second_embeddings[0], first_embeddings[0])
+    self.assertEqual(cache.hits, 1)
+    self.assertEqual(cache.misses, 2)
+
+  def test_embed_queries_embeds_each_unique_text_once(self):
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=pd.DataFrame(),
+        embedding_model_name=ad_copy_generator.EmbeddingModelName.TEXT_EMBEDDING,
+        dimensionality=256,
+        embeddings_batch_size=10,
+    )
+    mock_get_embeddings = (
+        self.embedding_model_patcher.mock_embeddings_model.get_embeddings
+    )
+
+    embeddings = ad_copy_vectorstore.embed_queries(
+        ["query 1", "query 2", "query 1"]
+    )
+
+    mock_get_embeddings.assert_called_once_with(
+        [
+            language_models.TextEmbeddingInput("query 1", "RETRIEVAL_QUERY"),
+            language_models.TextEmbeddingInput("query 2", "RETRIEVAL_QUERY"),
+        ],
+        output_dimensionality=256,
+    )
+    self.assertLen(embeddings, 3)
+    self.assertEqual(embeddings[2], embeddings[0])
+
+  def test_embed_documents_with_concurrent_requests_preserves_order(self):
+    texts = [f"text {i}" for i in range(23)]
+    sequential_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=pd.DataFrame(),
+        embedding_model_name=ad_copy_generator.EmbeddingModelName.TEXT_EMBEDDING,
+        dimensionality=16,
+        embeddings_batch_size=2,
+    )
+    concurrent_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=pd.DataFrame(),
+        embedding_model_name=ad_copy_generator.EmbeddingModelName.TEXT_EMBEDDING,
+        dimensionality=16,
+        embeddings_batch_size=2,
+        embeddings_max_concurrent_requests=4,
+    )
+
+    self.assertEqual(
+        concurrent_vectorstore.embed_documents(texts),
+        sequential_vectorstore.embed_documents(texts),
+    )
+
+  def test_embed_documents_retries_transient_errors(self):
+    mock_get_embeddings = (
+        self.embedding_model_patcher.mock_embeddings_model.get_embeddings
+    )
+    mock_get_embeddings.side_effect = [
+        api_core_exceptions.ResourceExhausted("Quota exceeded."),
+        testing_utils.random_embeddings(
+            [language_models.TextEmbeddingInput("text", "RETRIEVAL_DOCUMENT")],
+            output_dimensionality=16,
+        ),
+    ]
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=pd.DataFrame(),
+        embedding_model_name=ad_copy_generator.EmbeddingModelName.TEXT_EMBEDDING,
+        dimensionality=16,
+        embeddings_batch_size=2,
+    )
+
+    with mock.patch.object(
+        ad_copy_generator, "EMBEDDING_RETRY_MAX_WAIT_SECONDS", 0.0
+    ):
+      embeddings = ad_copy_vectorstore.embed_documents(["text"])
+
+    self.assertLen(embeddings, 1)
+    self.assertEqual(mock_get_embeddings.call_count, 2)
+
+  def test_embed_documents_uses_rate_limiter(self):
+    rate_limiter = mock.MagicMock(spec=rate_limiting.RateLimiter)
+    ad_copy_vectorstore = ad_copy_generator.AdCopyVectorstore(
+        ad_exemplars=pd.DataFrame(),
+        embedding_model_name=ad_copy_generator.EmbeddingModelName.TEXT_EMBEDDING,
+        dimensionality=16,
+        embeddings_batch_size=2,
+        embeddings_rate_limiter=rate_limiter,
+    )
+
+    ad_copy_vectorstore.embed_documents(["text 1", "text 2", "text 3"])
+
+    self.assertEqual(rate_limiter.acquire.call_count, 2)
+
 
 class AdCopyGeneratorTest(parameterized.TestCase):
 
@@ -1000,6 +1606,223 @@ class AdCopyGeneratorTest(parameterized.TestCase):
           ),
       )
 
+  def test_construct_new_ad_copy_prompt_reuses_example_messages(self):
+    ad_copy_generator.clear_example_ad_messages_cache()
+    example_ads = [
+        ad_copy_generator.ExampleAd(
+            keywords=f"keyword {i}",
+            google_ad=google_ads.GoogleAd(
+                headlines=[f"headline {i}"],
+                descriptions=[f"description {i}"],
+            ),
+        )
+        for i in range(3)
+    ]
+
+    prompt_1 = ad_copy_generator.construct_new_ad_copy_prompt(
+        example_ads=example_ads,
+        keywords="new keyword 1",
+        ad_format=google_ads.TEXT_AD_FORMAT,
+    )
+    prompt_2 = ad_copy_generator.construct_new_ad_copy_prompt(
+        example_ads=example_ads[1:],
+        keywords="new keyword 2",
+        ad_format=google_ads.TEXT_AD_FORMAT,
+    )
+
+    # The prompts contain the examples in reverse order, so the last two
+    # examples come first in both prompts.
+    self.assertIs(prompt_1[0], prompt_2[0])
+    self.assertIs(prompt_1[3], prompt_2[3])
+    self.assertEqual(
+        ad_copy_generator._construct_example_ad_messages.cache_info().hits, 2
+    )
+
+  def test_group_requests_by_prompt_prefix_groups_same_examples(self):
+    def make_request(keywords, example_keywords, temperature=0.9):
+      return ad_copy_generator.TextGenerationRequest(
+          keywords=keywords,
+          prompt=ad_copy_generator.construct_new_ad_copy_prompt(
+              example_ads=[
+                  ad_copy_generator.ExampleAd(
+                      keywords=example_keywords,
+                      google_ad=google_ads.GoogleAd(
+                          headlines=["headline"], descriptions=["description"]
+                      ),
+                  )
+              ],
+              keywords=keywords,
+              ad_format=google_ads.TEXT_AD_FORMAT,
+          ),
+          system_instruction="Example system instruction",
+          chat_model_name=ad_copy_generator.ModelName.GEMINI_1_5_FLASH,
+          temperature=temperature,
+          top_k=40,
+          top_p=0.95,
+          safety_settings=None,
+          existing_ad_copy=google_ads.GoogleAd(headlines=[], descriptions=[]),
+      )
+
+    requests = [
+        make_request("new keyword 0", "example a"),
+        make_request("new keyword 1", "example b"),
+        make_request("new keyword 2", "example a"),
+        make_request("new keyword 3", "example a", temperature=0.5),
+        make_request("new keyword 4", "example b"),
+    ]
+
+    self.assertEqual(
+        ad_copy_generator.group_requests_by_prompt_prefix(requests),
+        [[0, 2], [1, 4], [3]],
+    )
+
+  def _make_example_ads(self, n_examples):
+    return [
+        ad_copy_generator.ExampleAd(
+            keywords=f"keyword {i}",
+            google_ad=google_ads.GoogleAd(
+                headlines=[f"headline {i}"],
+                descriptions=[f"description {i}"],
+            ),
+        )
+        for i in range(n_examples)
+    ]
+
+  def test_fit_prompt_to_token_budget_keeps_everything_under_budget(self):
+    example_ads = self._make_example_ads(3)
+
+    fitted_example_ads, fitted_instructions = (
+        ad_copy_generator.fit_prompt_to_token_budget(
+            example_ads=example_ads,
+            keywords="new keyword",
+            ad_format=google_ads.TEXT_AD_FORMAT,
+            system_instruction="Example system instruction",
+            max_prompt_tokens=10_000,
+            keywords_specific_instructions="Some instructions.",
+        )
+    )
+
+    self.assertEqual(fitted_example_ads, example_ads)
+    self.assertEqual(fitted_instructions, "Some instructions.")
+
+  def test_fit_prompt_to_token_budget_drops_least_relevant_examples(self):
+    example_ads = self._make_example_ads(5)
+    request_without_budget = ad_copy_generator.TextGenerationRequest(
+        keywords="new keyword",
+        prompt=ad_copy_generator.construct_new_ad_copy_prompt(
+            example_ads=example_ads,
+            keywords="new keyword",
+            ad_format=google_ads.TEXT_AD_FORMAT,
+        ),
+        system_instruction="Example system instruction",
+        chat_model_name=ad_copy_generator.ModelName.GEMINI_1_5_FLASH,
+        temperature=0.9,
+        top_k=40,
+        top_p=0.95,
+        safety_settings=None,
+        existing_ad_copy=google_ads.GoogleAd(headlines=[], descriptions=[]),
+    )
+    max_prompt_tokens = (
+        ad_copy_generator.estimate_request_tokens(request_without_budget) - 1
+    )
+
+    fitted_example_ads, _ = ad_copy_generator.fit_prompt_to_token_budget(
+        example_ads=example_ads,
+        keywords="new keyword",
+        ad_format=google_ads.TEXT_AD_FORMAT,
+        system_instruction="Example system instruction",
+        max_prompt_tokens=max_prompt_tokens,
+    )
+
+    self.assertEqual(fitted_example_ads, example_ads[:4])
+
+  def test_fit_prompt_to_token_budget_truncates_instructions(self):
+    example_ads = self._make_example_ads(3)
+
+    fitted_example_ads, fitted_instructions = (
+        ad_copy_generator.fit_prompt_to_token_budget(
+            example_ads=example_ads,
+            keywords="new keyword",
+            ad_format=google_ads.TEXT_AD_FORMAT,
+            system_instruction="Example system instruction",
+            max_prompt_tokens=300,
+            keywords_specific_instructions="Web page content: " + "a" * 10_000,
+            min_in_context_examples=2,
+        )
+    )
+    request = ad_copy_generator.TextGenerationRequest(
+        keywords="new keyword",
+        prompt=ad_copy_generator.construct_new_ad_copy_prompt(
+            example_ads=fitted_example_ads,
+            keywords="new keyword",
+            ad_format=google_ads.TEXT_AD_FORMAT,
+            keywords_specific_instructions=fitted_instructions,
+        ),
+        system_instruction="Example system instruction",
+        chat_model_name=ad_copy_generator.ModelName.GEMINI_1_5_FLASH,
+        temperature=0.9,
+        top_k=40,
+        top_p=0.95,
+        safety_settings=None,
+        existing_ad_copy=google_ads.GoogleAd(headlines=[], descriptions=[]),
+    )
+
+    self.assertEqual(fitted_example_ads, example_ads[:2])
+    self.assertStartsWith(fitted_instructions, "Web page content: aaa")
+    self.assertEndsWith(fitted_instructions, " [truncated]")
+    self.assertBetween(
+        ad_copy_generator.estimate_request_tokens(request), 290, 300
+    )
+
+  def test_fit_prompt_to_token_budget_keeps_min_examples_over_budget(self):
+    example_ads = self._make_example_ads(3)
+
+    with self.assertLogs(ad_copy_generator.LOGGER, level="WARNING"):
+      fitted_example_ads, fitted_instructions = (
+          ad_copy_generator.fit_prompt_to_token_budget(
+              example_ads=example_ads,
+              keywords="new keyword",
+              ad_format=google_ads.TEXT_AD_FORMAT,
+              system_instruction="Example system instruction",
+              max_prompt_tokens=1,
+              keywords_specific_instructions="Some instructions.",
+          )
+      )
+
+    self.assertEqual(fitted_example_ads, example_ads[:1])
+    self.assertEqual(fitted_instructions, "")
+
+  def test_summarize_request_tokens_returns_estimated_tokens_per_batch(self):
+    requests = [
+        ad_copy_generator.TextGenerationRequest(
+            keywords=f"keyword {i}",
+            prompt=[
+                generative_models.Content(
+                    role="user",
+                    parts=[generative_models.Part.from_text("a" * 40 * i)],
+                )
+            ],
+            system_instruction="b" * 40,
+            chat_model_name=ad_copy_generator.ModelName.GEMINI_1_5_FLASH,
+            temperature=0.9,
+            top_k=40,
+            top_p=0.95,
+            safety_settings=None,
+            existing_ad_copy=google_ads.GoogleAd(headlines=[], descriptions=[]),
+        )
+        for i in range(1, 4)
+    ]
+
+    self.assertEqual(
+        ad_copy_generator.summarize_request_tokens(requests),
+        {
+            "n_requests": 3,
+            "total_tokens": 90,
+            "mean_tokens": 30.0,
+            "max_tokens": 40,
+        },
+    )
+
   @parameterized.named_parameters([
       {
           "testcase_name": "too many headlines",
@@ -1310,6 +2133,468 @@ class AdCopyGeneratorTest(parameterized.TestCase):
 
     self.assertLen(response, 2)
 
+  def _make_text_generation_requests(
+      self, n_requests: int
+  ) -> list[ad_copy_generator.TextGenerationRequest]:
+    return [
+        ad_copy_generator.TextGenerationRequest(
+            keywords=f"keyword {i}",
+            prompt=[
+                generative_models.Content(
+                    role="user",
+                    parts=[generative_models.Part.from_text(f"Prompt {i}")],
+                )
+            ],
+            system_instruction="Example system instruction",
+            chat_model_name=ad_copy_generator.ModelName.GEMINI_1_5_FLASH,
+            temperature=0.9,
+            top_k=40,
+            top_p=0.95,
+            safety_settings=None,
+            existing_ad_copy=google_ads.GoogleAd(headlines=[], descriptions=[]),
+        )
+        for i in range(n_requests)
+    ]
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_stream_google_ad_json_yields_every_request_index_once(
+      self, generative_model_patcher
+  ):
+    requests = self._make_text_generation_requests(7)
+
+    async def collect():
+      return [
+          (index, response.candidates[0].content.parts[0].text)
+          async for index, response in ad_copy_generator.stream_google_ad_json(
+              iter(requests),
+              scheduler=ad_copy_generator.GenerationScheduler(
+                  max_concurrent_requests=3
+              ),
+          )
+      ]
+
+    results = asyncio.run(collect())
+
+    self.assertCountEqual(
+        results, [(i, "Response text") for i in range(len(requests))]
+    )
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_stream_google_ad_json_accepts_async_iterable_of_requests(
+      self, generative_model_patcher
+  ):
+    requests = self._make_text_generation_requests(7)
+
+    async def iterate_requests():
+      for request in requests:
+        await asyncio.sleep(0)
+        yield request
+
+    async def collect():
+      return [
+          index
+          async for index, _ in ad_copy_generator.stream_google_ad_json(
+              iterate_requests(),
+              scheduler=ad_copy_generator.GenerationScheduler(
+                  max_concurrent_requests=3
+              ),
+          )
+      ]
+
+    indices = asyncio.run(collect())
+
+    self.assertCountEqual(indices, range(len(requests)))
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_stream_google_ad_json_limits_the_number_of_requests_in_flight(
+      self, generative_model_patcher
+  ):
+    response = (
+        generative_model_patcher.mock_generative_model.generate_content_async.return_value
+    )
+    n_in_flight = 0
+    max_in_flight = 0
+
+    async def generate_content_async(prompt):
+      del prompt
+      nonlocal n_in_flight, max_in_flight
+      n_in_flight += 1
+      max_in_flight = max(max_in_flight, n_in_flight)
+      await asyncio.sleep(0.001)
+      n_in_flight -= 1
+      return response
+
+    generative_model_patcher.mock_generative_model.generate_content_async.side_effect = (
+        generate_content_async
+    )
+
+    async def collect():
+      return [
+          index
+          async for index, _ in ad_copy_generator.stream_google_ad_json(
+              self._make_text_generation_requests(10),
+              scheduler=ad_copy_generator.GenerationScheduler(
+                  max_concurrent_requests=3
+              ),
+          )
+      ]
+
+    indices = asyncio.run(collect())
+
+    self.assertCountEqual(indices, range(10))
+    self.assertEqual(max_in_flight, 3)
+
+  @parameterized.parameters("max_concurrent_requests", "max_attempts")
+  def test_generation_scheduler_raises_error_for_non_positive_limit(
+      self, limit_name
+  ):
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, f"{limit_name} must be positive, got 0."
+    ):
+      ad_copy_generator.GenerationScheduler(**{limit_name: 0})
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generate_google_ad_json_batch_retries_transient_errors(
+      self, generative_model_patcher
+  ):
+    mock_generate_content_async = (
+        generative_model_patcher.mock_generative_model.generate_content_async
+    )
+    mock_generate_content_async.side_effect = [
+        api_core_exceptions.ResourceExhausted("quota"),
+        mock_generate_content_async.return_value,
+    ]
+    scheduler = ad_copy_generator.GenerationScheduler(
+        retry_max_wait_seconds=0
+    )
+
+    responses = ad_copy_generator.generate_google_ad_json_batch(
+        self._make_text_generation_requests(1), scheduler=scheduler
+    )
+
+    self.assertEqual(
+        responses[0].candidates[0].content.parts[0].text, "Response text"
+    )
+    self.assertEqual(mock_generate_content_async.call_count, 2)
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generation_scheduler_sends_other_requests_while_retrying(
+      self, generative_model_patcher
+  ):
+    mock_generate_content_async = (
+        generative_model_patcher.mock_generative_model.generate_content_async
+    )
+    response = mock_generate_content_async.return_value
+    prompts = []
+
+    async def generate_content_async(prompt):
+      prompts.append(prompt)
+      if len(prompts) == 1:
+        raise api_core_exceptions.ResourceExhausted("quota")
+      return response
+
+    mock_generate_content_async.side_effect = generate_content_async
+    scheduler = ad_copy_generator.GenerationScheduler(
+        max_concurrent_requests=1, retry_max_wait_seconds=0.01
+    )
+
+    ad_copy_generator.generate_google_ad_json_batch(
+        self._make_text_generation_requests(2), scheduler=scheduler
+    )
+
+    # The second request is sent while the first waits to be retried.
+    self.assertLen(prompts, 3)
+    self.assertNotEqual(prompts[1], prompts[0])
+    self.assertEqual(prompts[2], prompts[0])
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generate_google_ad_json_batch_returns_errors_for_failed_requests(
+      self, generative_model_patcher
+  ):
+    mock_generate_content_async = (
+        generative_model_patcher.mock_generative_model.generate_content_async
+    )
+    response = mock_generate_content_async.return_value
+    error = api_core_exceptions.InvalidArgument("bad request")
+    mock_generate_content_async.side_effect = [response, error, response]
+
+    responses = ad_copy_generator.generate_google_ad_json_batch(
+        self._make_text_generation_requests(3),
+        scheduler=ad_copy_generator.GenerationScheduler(
+            max_concurrent_requests=1
+        ),
+    )
+
+    self.assertEqual(responses, [response, error, response])
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generate_google_ad_json_batch_retries_timed_out_requests(
+      self, generative_model_patcher
+  ):
+    mock_generate_content_async = (
+        generative_model_patcher.mock_generative_model.generate_content_async
+    )
+    n_calls = 0
+
+    async def generate_content_async(prompt):
+      del prompt
+      nonlocal n_calls
+      n_calls += 1
+      await asyncio.sleep(10)
+
+    mock_generate_content_async.side_effect = generate_content_async
+    scheduler = ad_copy_generator.GenerationScheduler(
+        max_attempts=2,
+        retry_max_wait_seconds=0,
+        request_timeout_seconds=0.01,
+    )
+
+    responses = ad_copy_generator.generate_google_ad_json_batch(
+        self._make_text_generation_requests(1), scheduler=scheduler
+    )
+
+    self.assertIsInstance(responses[0], asyncio.TimeoutError)
+    self.assertEqual(n_calls, 2)
+
+  def test_generation_scheduler_has_one_rate_limiter_per_model(self):
+    scheduler = ad_copy_generator.GenerationScheduler(requests_per_minute=60)
+
+    flash_rate_limiter = scheduler.get_rate_limiter(
+        ad_copy_generator.ModelName.GEMINI_1_5_FLASH
+    )
+    pro_rate_limiter = scheduler.get_rate_limiter(
+        ad_copy_generator.ModelName.GEMINI_1_5_PRO
+    )
+
+    self.assertIsNot(flash_rate_limiter, pro_rate_limiter)
+    self.assertIs(
+        scheduler.get_rate_limiter(
+            ad_copy_generator.ModelName.GEMINI_1_5_FLASH
+        ),
+        flash_rate_limiter,
+    )
+    self.assertEqual(flash_rate_limiter.requests_per_minute, 60)
+
+  def test_generation_scheduler_uses_given_rate_limiters(self):
+    rate_limiter = rate_limiting.RateLimiter(requests_per_minute=10)
+    scheduler = ad_copy_generator.GenerationScheduler(
+        rate_limiters={"gemini-1.5-flash": rate_limiter}
+    )
+
+    self.assertIs(
+        scheduler.get_rate_limiter(
+            ad_copy_generator.ModelName.GEMINI_1_5_FLASH
+        ),
+        rate_limiter,
+    )
+    self.assertIsNone(
+        scheduler.get_rate_limiter(ad_copy_generator.ModelName.GEMINI_1_5_PRO)
+    )
+
+  def test_generation_scheduler_has_no_rate_limiter_without_limits(self):
+    scheduler = ad_copy_generator.GenerationScheduler()
+
+    self.assertIsNone(
+        scheduler.get_rate_limiter(ad_copy_generator.ModelName.GEMINI_1_5_FLASH)
+    )
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generate_google_ad_json_batch_uses_rate_limiter_for_model(
+      self, generative_model_patcher
+  ):
+    scheduler = ad_copy_generator.GenerationScheduler(requests_per_minute=60)
+    rate_limiter = scheduler.get_rate_limiter(
+        ad_copy_generator.ModelName.GEMINI_1_5_FLASH
+    )
+
+    with mock.patch.object(
+        rate_limiter, "acquire_async", autospec=True
+    ) as mock_acquire_async:
+      ad_copy_generator.generate_google_ad_json_batch(
+          self._make_text_generation_requests(3), scheduler=scheduler
+      )
+
+    self.assertEqual(mock_acquire_async.call_count, 3)
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generate_google_ad_json_batch_reuses_model_for_same_parameters(
+      self, generative_model_patcher
+  ):
+    ad_copy_generator.generate_google_ad_json_batch(
+        self._make_text_generation_requests(5)
+    )
+
+    generative_model_patcher.mock_init.assert_called_once()
+    self.assertEqual(
+        generative_model_patcher.mock_generative_model.generate_content_async.call_count,
+        5,
+    )
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generate_google_ad_json_batch_creates_model_per_set_of_parameters(
+      self, generative_model_patcher
+  ):
+    requests = self._make_text_generation_requests(4)
+    requests[1] = requests[1].model_copy(update=dict(temperature=0.5))
+    requests[2] = requests[2].model_copy(
+        update=dict(system_instruction="Another system instruction")
+    )
+
+    ad_copy_generator.generate_google_ad_json_batch(requests)
+
+    self.assertEqual(generative_model_patcher.mock_init.call_count, 3)
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generation_scheduler_returns_cached_response_for_same_request(
+      self, generative_model_patcher
+  ):
+    scheduler = ad_copy_generator.GenerationScheduler(
+        response_cache=response_cache.InMemoryResponseCache()
+    )
+    requests = self._make_text_generation_requests(2)
+
+    ad_copy_generator.generate_google_ad_json_batch(
+        requests, scheduler=scheduler
+    )
+    responses = ad_copy_generator.generate_google_ad_json_batch(
+        requests, scheduler=scheduler
+    )
+
+    self.assertEqual(
+        generative_model_patcher.mock_generative_model.generate_content_async.call_count,
+        2,
+    )
+    self.assertEqual(
+        [
+            response.candidates[0].content.parts[0].text
+            for response in responses
+        ],
+        ["Response text"] * 2,
+    )
+    self.assertEqual(scheduler.response_cache.hits, 2)
+
+  @parameterized.parameters("batch", "stream")
+  def test_generation_scheduler_caches_identical_requests_separately(
+      self, generate_with
+  ):
+    # Identical requests in one call, e.g. two versions of the same ad, must
+    # each get their own cached sample when the call is re-run.
+    scheduler = ad_copy_generator.GenerationScheduler(
+        response_cache=response_cache.InMemoryResponseCache()
+    )
+    requests = self._make_text_generation_requests(1) * 2
+
+    def generate():
+      if generate_with == "batch":
+        responses = ad_copy_generator.generate_google_ad_json_batch(
+            requests, scheduler=scheduler
+        )
+      else:
+
+        async def collect():
+          return dict([
+              result
+              async for result in ad_copy_generator.stream_google_ad_json(
+                  requests, scheduler=scheduler
+              )
+          ])
+
+        indexed_responses = asyncio.run(collect())
+        responses = [indexed_responses[i] for i in range(len(requests))]
+      return [
+          response.candidates[0].content.parts[0].text
+          for response in responses
+      ]
+
+    with testing_utils.PatchGenerativeModel(
+        response=""
+    ) as generative_model_patcher:
+      generative_model_patcher.mock_generative_model.generate_content_async.side_effect = [
+          make_generation_response("Version 1"),
+          make_generation_response("Version 2"),
+      ]
+      first_run_texts = generate()
+      second_run_texts = generate()
+
+    self.assertCountEqual(first_run_texts, ["Version 1", "Version 2"])
+    self.assertEqual(second_run_texts, first_run_texts)
+    self.assertEqual(scheduler.response_cache.hits, 2)
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_generation_scheduler_bypasses_response_cache_if_requested(
+      self, generative_model_patcher
+  ):
+    scheduler = ad_copy_generator.GenerationScheduler(
+        response_cache=response_cache.InMemoryResponseCache()
+    )
+    requests = self._make_text_generation_requests(2)
+    ad_copy_generator.generate_google_ad_json_batch(
+        requests, scheduler=scheduler
+    )
+
+    scheduler.bypass_response_cache = True
+    ad_copy_generator.generate_google_ad_json_batch(
+        requests, scheduler=scheduler
+    )
+
+    self.assertEqual(
+        generative_model_patcher.mock_generative_model.generate_content_async.call_count,
+        4,
+    )
+    self.assertEqual(scheduler.response_cache.hits, 0)
+    self.assertLen(scheduler.response_cache, 2)
+
+  def test_make_response_cache_key_ignores_keywords_but_not_prompt(self):
+    request = self._make_text_generation_requests(1)[0]
+
+    self.assertEqual(
+        ad_copy_generator.make_response_cache_key(request),
+        ad_copy_generator.make_response_cache_key(
+            request.model_copy(update=dict(keywords="other keywords"))
+        ),
+    )
+    self.assertNotEqual(
+        ad_copy_generator.make_response_cache_key(request),
+        ad_copy_generator.make_response_cache_key(
+            request.model_copy(update=dict(top_k=10))
+        ),
+    )
+    self.assertNotEqual(
+        ad_copy_generator.make_response_cache_key(request),
+        ad_copy_generator.make_response_cache_key(
+            self._make_text_generation_requests(2)[1]
+        ),
+    )
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_get_generative_model_creates_model_per_event_loop(
+      self, generative_model_patcher
+  ):
+    request = self._make_text_generation_requests(1)[0]
+
+    async def get_model():
+      return ad_copy_generator.get_generative_model(request)
+
+    asyncio.run(get_model())
+    asyncio.run(get_model())
+
+    self.assertEqual(generative_model_patcher.mock_init.call_count, 2)
+
+  @testing_utils.PatchGenerativeModel(response="Response text")
+  def test_clear_generative_model_cache_creates_new_model(
+      self, generative_model_patcher
+  ):
+    request = self._make_text_generation_requests(1)[0]
+
+    async def get_model_twice():
+      ad_copy_generator.get_generative_model(request)
+      ad_copy_generator.clear_generative_model_cache()
+      ad_copy_generator.get_generative_model(request)
+
+    asyncio.run(get_model_twice())
+
+    self.assertEqual(generative_model_patcher.mock_init.call_count, 2)
+
   def test_extract_url_with_http(self):
     text = "Check out this website: http://www.example.com for more info."
     expected_url = "http://www.example.com"
@@ -1367,25 +2652,17 @@ class AdCopyGeneratorTest(parameterized.TestCase):
     for url in invalid_urls:
       self.assertFalse(ad_copy_generator.is_valid_url(url))
 
-  @mock.patch("bs4.BeautifulSoup")
-  @mock.patch("requests.get")
-  def test_extract_urls_for_keyword_instructions(
-      self,
-      mock_requests_get,
-      mock_beautiful_soup,
-  ):
-
-    mock_requests_get.return_value.raise_for_status.return_value = None
-    mock_requests_get.return_value.content = (
-        "<html><body><h1>Test Page</h1></body></html>"
+  def test_extract_urls_for_keyword_instructions(self):
+    fetcher = mock.create_autospec(
+        landing_pages.LandingPageFetcher, instance=True
     )
-    mock_beautiful_soup.return_value.get_text.return_value = "Test Page"
-
-    mock_requests_get.side_effect = [
-        mock.DEFAULT,
-        mock.DEFAULT,
-        requests.exceptions.RequestException("Simulated Error"),
-    ]
+    fetcher.fetch_texts.return_value = {
+        "https://www.example.com": "Test Page",
+        "https://www.google.com": "Test Page",
+        "https://www.error.com": requests.exceptions.RequestException(
+            "Simulated Error"
+        ),
+    }
 
     keyword_instructions = [
         "This is some text without a URL.",
@@ -1406,11 +2683,33 @@ class AdCopyGeneratorTest(parameterized.TestCase):
     ]
 
     result = ad_copy_generator.extract_urls_for_keyword_instructions(
-        keyword_instructions
+        keyword_instructions, fetcher=fetcher
     )
     self.assertEqual(len(result), len(expected_output))
     self.assertEqual(result, expected_output)
+    self.assertEqual(
+        list(fetcher.fetch_texts.call_args.args[0]),
+        [
+            "https://www.example.com",
+            "https://www.google.com",
+            "https://www.error.com",
+        ],
+    )
 
+  def test_extract_urls_for_keyword_instructions_truncates_long_pages(self):
+    fetcher = mock.create_autospec(
+        landing_pages.LandingPageFetcher, instance=True
+    )
+    fetcher.fetch_texts.return_value = {"https://www.google.com": "a" * 100}
+
+    result = ad_copy_generator.extract_urls_for_keyword_instructions(
+        ["https://www.google.com"], max_characters_per_page=10, fetcher=fetcher
+    )
+
+    self.assertEqual(
+        result,
+        ["Web page content of https://www.google.com: aaaaaaaaaa [truncated]"],
+    )
 
 if __name__ == "__main__":
   absltest.main()
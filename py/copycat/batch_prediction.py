@@ -0,0 +1,247 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline generation with the Vertex AI batch prediction API.
+
+For very large backfills the text generation requests can be written to a
+JSONL file and sent to Gemini as a single batch prediction job, instead of
+calling the model online for every request. Each line of the input file
+contains a "key", which is the index of the request, and the "request" in the
+Vertex AI GenerateContentRequest format. Each line of the output file contains
+the same key, together with the "response" or the error "status".
+
+The output file is turned into CopycatResponses with
+Copycat.ingest_new_ad_copy_batch_prediction_output. For testing, or for small
+batches, run_batch_prediction_locally writes the output file by calling the
+model online.
+"""
+
+from collections.abc import Iterable
+import json
+import logging
+from typing import Any
+
+from vertexai import batch_prediction
+from vertexai import generative_models
+
+from copycat import ad_copy_generator
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+def _safety_settings_to_dicts(
+    safety_settings: ad_copy_generator.SafetySettingsType | None,
+) -> list[dict[str, Any]]:
+  """Returns the safety settings as a list of dicts."""
+  if safety_settings is None:
+    return []
+  if isinstance(safety_settings, dict):
+    return [
+        {
+            "category": generative_models.HarmCategory(category).name,
+            "threshold": generative_models.HarmBlockThreshold(threshold).name,
+        }
+        for category, threshold in safety_settings.items()
+    ]
+  return [safety_setting.to_dict() for safety_setting in safety_settings]
+
+
+def request_to_batch_prediction_dict(
+    request: ad_copy_generator.TextGenerationRequest,
+) -> dict[str, Any]:
+  """Returns the request in the Vertex AI GenerateContentRequest format.
+
+  The generation config is the same as for online generation, including the
+  response schema, so the responses are valid json representations of
+  GoogleAds.
+
+  Args:
+    request: The text generation request.
+  """
+  return {
+      "contents": [content.to_dict() for content in request.prompt],
+      "system_instruction": {
+          "parts": [{"text": request.system_instruction}],
+      },
+      "generation_config": (
+          ad_copy_generator.make_generation_config(request).to_dict()
+      ),
+      "safety_settings": _safety_settings_to_dicts(request.safety_settings),
+  }
+
+
+def write_batch_prediction_input(
+    requests: Iterable[ad_copy_generator.TextGenerationRequest],
+    path: str,
+    *,
+    start_index: int = 0,
+    append: bool = False,
+) -> int:
+  """Writes the requests to a batch prediction input JSONL file.
+
+  Args:
+    requests: The text generation requests to write.
+    path: The path of the JSONL file.
+    start_index: The key of the first request, so a large batch can be written
+      in chunks.
+    append: Whether to append to the file instead of overwriting it.
+
+  Returns:
+    The number of requests written.
+  """
+  n_requests = 0
+  with open(path, "a" if append else "w") as f:
+    for index, request in enumerate(requests, start=start_index):
+      line = {
+          "key": str(index),
+          "request": request_to_batch_prediction_dict(request),
+      }
+      f.write(json.dumps(line) + "\n")
+      n_requests += 1
+  return n_requests
+
+
+def read_batch_prediction_output(
+    path: str, n_requests: int
+) -> list[generative_models.GenerationResponse | Exception]:
+  """Reads the responses from a batch prediction output JSONL file.
+
+  The lines of the output file can be in any order, they are matched to the
+  requests by their key.
+
+  Args:
+    path: The path of the JSONL file.
+    n_requests: The number of requests in the batch.
+
+  Returns:
+    The responses in the order of the requests. Requests that failed, or that
+    have no result in the output file, have a RuntimeError instead.
+
+  Raises:
+    ValueError: If a line does not have a valid key.
+  """
+  responses: list[generative_models.GenerationResponse | Exception | None] = [
+      None
+  ] * n_requests
+  with open(path) as f:
+    for line in f:
+      if not line.strip():
+        continue
+      result = json.loads(line)
+      key = result.get("key")
+      if key is None or not str(key).isdigit() or int(key) >= n_requests:
+        LOGGER.error("Invalid key in batch prediction output: %s", key)
+        raise ValueError(f"Invalid key in batch prediction output: {key}")
+
+      status = result.get("status")
+      if status or "response" not in result:
+        responses[int(key)] = RuntimeError(
+            f"Batch prediction failed: {status or 'no response'}"
+        )
+      else:
+        responses[int(key)] = generative_models.GenerationResponse.from_dict(
+            result["response"]
+        )
+
+  n_missing = sum(response is None for response in responses)
+  if n_missing:
+    LOGGER.warning(
+        "%d of %d requests have no batch prediction result.",
+        n_missing,
+        n_requests,
+    )
+  return [
+      RuntimeError("Batch prediction failed: no result")
+      if response is None
+      else response
+      for response in responses
+  ]
+
+
+def run_batch_prediction_locally(
+    input_path: str,
+    output_path: str,
+    model_name: ad_copy_generator.ModelName | str,
+) -> None:
+  """Writes the batch prediction output by calling the chat model online.
+
+  This is a local stand-in for a Vertex AI batch prediction job, which reads
+  the same input file and writes the same output format. It is useful for
+  testing and for small batches.
+
+  Args:
+    input_path: The path of the batch prediction input JSONL file.
+    output_path: The path to write the batch prediction output JSONL file to.
+    model_name: The name of the chat model.
+  """
+  model_name = ad_copy_generator.ModelName(model_name)
+  with open(input_path) as input_file, open(output_path, "w") as output_file:
+    for line in input_file:
+      if not line.strip():
+        continue
+      batch_input = json.loads(line)
+      request = batch_input["request"]
+      result = {"key": batch_input["key"], "request": request, "status": ""}
+      try:
+        model = generative_models.GenerativeModel(
+            model_name=model_name.value,
+            generation_config=generative_models.GenerationConfig.from_dict(
+                request["generation_config"]
+            ),
+            system_instruction=request["system_instruction"]["parts"][0][
+                "text"
+            ],
+            safety_settings=[
+                generative_models.SafetySetting.from_dict(safety_setting)
+                for safety_setting in request["safety_settings"]
+            ],
+        )
+        response = model.generate_content(
+            [
+                generative_models.Content.from_dict(content)
+                for content in request["contents"]
+            ],
+        )
+        result["response"] = response.to_dict()
+      except Exception as e:
+        LOGGER.error(
+            "Generation failed for key %s. Error: %r", batch_input["key"], e
+        )
+        result["status"] = f"{type(e).__name__}: {e}"
+      output_file.write(json.dumps(result) + "\n")
+
+
+def submit_batch_prediction_job(
+    *,
+    input_uri: str,
+    output_uri_prefix: str,
+    model_name: ad_copy_generator.ModelName | str,
+) -> batch_prediction.BatchPredictionJob:
+  """Submits a Vertex AI batch prediction job for the input file.
+
+  Args:
+    input_uri: The Cloud Storage uri of the batch prediction input JSONL file.
+    output_uri_prefix: The Cloud Storage uri prefix for the output files.
+    model_name: The name of the chat model.
+
+  Returns:
+    The submitted batch prediction job. Once it has succeeded, the output
+    files are under job.output_location.
+  """
+  return batch_prediction.BatchPredictionJob.submit(
+      source_model=ad_copy_generator.ModelName(model_name).value,
+      input_dataset=input_uri,
+      output_uri_prefix=output_uri_prefix,
+  )
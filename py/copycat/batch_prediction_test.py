@@ -0,0 +1,318 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from vertexai import batch_prediction as vertexai_batch_prediction
+from vertexai import generative_models
+import pandas as pd
+
+from copycat import ad_copy_generator
+from copycat import batch_prediction
+from copycat import copycat
+from copycat import google_ads
+from copycat import testing_utils
+
+
+GENERATED_AD_JSON = (
+    '{"headlines": ["generated headline 1", "generated headline 2"],'
+    ' "descriptions": ["generated description"]}'
+)
+
+
+def make_text_generation_request(
+    i: int,
+) -> ad_copy_generator.TextGenerationRequest:
+  return ad_copy_generator.TextGenerationRequest(
+      keywords=f"keyword {i}",
+      prompt=[
+          generative_models.Content(
+              role="user",
+              parts=[generative_models.Part.from_text(f"Prompt {i}")],
+          )
+      ],
+      system_instruction="Example system instruction",
+      chat_model_name=ad_copy_generator.ModelName.GEMINI_1_5_FLASH,
+      temperature=0.9,
+      top_k=40,
+      top_p=0.95,
+      safety_settings=copycat.ALL_SAFETY_SETTINGS_ONLY_HIGH,
+      existing_ad_copy=google_ads.GoogleAd(headlines=[], descriptions=[]),
+  )
+
+
+def read_jsonl(path: str) -> list[dict[str, object]]:
+  with open(path) as f:
+    return [json.loads(line) for line in f]
+
+
+def write_jsonl(path: str, lines: list[dict[str, object]]) -> None:
+  with open(path, "w") as f:
+    for line in lines:
+      f.write(json.dumps(line) + "\n")
+
+
+def make_response_dict(text: str) -> dict[str, object]:
+  return {
+      "candidates": [{
+          "finish_reason": "STOP",
+          "content": {"role": "model", "parts": [{"text": text}]},
+      }]
+  }
+
+
+class BatchPredictionTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tmp_dir = self.create_tempdir().full_path
+    self.input_path = os.path.join(self.tmp_dir, "input.jsonl")
+    self.output_path = os.path.join(self.tmp_dir, "output.jsonl")
+
+  def test_write_batch_prediction_input_writes_one_keyed_request_per_line(
+      self,
+  ):
+    requests = [make_text_generation_request(i) for i in range(3)]
+
+    n_requests = batch_prediction.write_batch_prediction_input(
+        requests, self.input_path
+    )
+
+    lines = read_jsonl(self.input_path)
+    self.assertEqual(n_requests, 3)
+    self.assertEqual([line["key"] for line in lines], ["0", "1", "2"])
+    self.assertEqual(
+        lines[1]["request"]["contents"],
+        [{"role": "user", "parts": [{"text": "Prompt 1"}]}],
+    )
+    self.assertEqual(
+        lines[1]["request"]["system_instruction"],
+        {"parts": [{"text": "Example system instruction"}]},
+    )
+    self.assertEqual(
+        lines[1]["request"]["generation_config"]["response_mime_type"],
+        "application/json",
+    )
+    self.assertIn(
+        {
+            "category": "HARM_CATEGORY_HATE_SPEECH",
+            "threshold": "BLOCK_ONLY_HIGH",
+        },
+        lines[1]["request"]["safety_settings"],
+    )
+
+  def test_write_batch_prediction_input_appends_chunks(self):
+    batch_prediction.write_batch_prediction_input(
+        [make_text_generation_request(i) for i in range(2)], self.input_path
+    )
+    batch_prediction.write_batch_prediction_input(
+        [make_text_generation_request(i) for i in range(2, 4)],
+        self.input_path,
+        start_index=2,
+        append=True,
+    )
+
+    lines = read_jsonl(self.input_path)
+    self.assertEqual([line["key"] for line in lines], ["0", "1", "2", "3"])
+
+  def test_read_batch_prediction_output_matches_results_by_key(self):
+    write_jsonl(
+        self.output_path,
+        [
+            {"key": "2", "status": "", "response": make_response_dict("c")},
+            {"key": "0", "status": "", "response": make_response_dict("a")},
+            {"key": "1", "status": "Quota exceeded."},
+        ],
+    )
+
+    responses = batch_prediction.read_batch_prediction_output(
+        self.output_path, n_requests=4
+    )
+
+    self.assertEqual(responses[0].candidates[0].content.parts[0].text, "a")
+    self.assertEqual(
+        str(responses[1]), "Batch prediction failed: Quota exceeded."
+    )
+    self.assertEqual(responses[2].candidates[0].content.parts[0].text, "c")
+    self.assertEqual(str(responses[3]), "Batch prediction failed: no result")
+
+  def test_read_batch_prediction_output_raises_error_for_invalid_key(self):
+    write_jsonl(
+        self.output_path,
+        [{"key": "5", "status": "", "response": make_response_dict("a")}],
+    )
+
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, "Invalid key in batch prediction output: 5"
+    ):
+      batch_prediction.read_batch_prediction_output(
+          self.output_path, n_requests=2
+      )
+
+  @testing_utils.PatchGenerativeModel(response=GENERATED_AD_JSON)
+  def test_run_batch_prediction_locally_writes_output_for_every_request(
+      self, generative_model_patcher
+  ):
+    batch_prediction.write_batch_prediction_input(
+        [make_text_generation_request(i) for i in range(3)], self.input_path
+    )
+
+    batch_prediction.run_batch_prediction_locally(
+        self.input_path, self.output_path, model_name="gemini-1.5-flash"
+    )
+
+    responses = batch_prediction.read_batch_prediction_output(
+        self.output_path, n_requests=3
+    )
+    self.assertEqual(
+        [
+            response.candidates[0].content.parts[0].text
+            for response in responses
+        ],
+        [GENERATED_AD_JSON] * 3,
+    )
+    self.assertEqual(
+        generative_model_patcher.mock_generative_model.generate_content.call_count,
+        3,
+    )
+
+  def test_submit_batch_prediction_job_submits_input_file(self):
+    with mock.patch.object(
+        vertexai_batch_prediction.BatchPredictionJob, "submit"
+    ) as mock_submit:
+      batch_prediction.submit_batch_prediction_job(
+          input_uri="gs://bucket/input.jsonl",
+          output_uri_prefix="gs://bucket/output",
+          model_name="gemini-1.5-flash",
+      )
+
+    mock_submit.assert_called_once_with(
+        source_model="gemini-1.5-flash",
+        input_dataset="gs://bucket/input.jsonl",
+        output_uri_prefix="gs://bucket/output",
+    )
+
+
+class CopycatBatchPredictionTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.embedding_model_patcher = testing_utils.PatchEmbeddingsModel()
+    self.embedding_model_patcher.start()
+    self.generative_model_patcher = testing_utils.PatchGenerativeModel(
+        response=GENERATED_AD_JSON
+    )
+    self.generative_model_patcher.start()
+
+    training_data = pd.DataFrame({
+        "headlines": [
+            [f"train headline {i}", f"train headline {i} (2)"]
+            for i in range(10)
+        ],
+        "descriptions": [[f"train description {i}"] for i in range(10)],
+        "keywords": [f"keyword {i}a, keyword {i}b" for i in range(10)],
+    })
+    self.copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=training_data,
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    self.tmp_dir = self.create_tempdir().full_path
+    self.input_path = os.path.join(self.tmp_dir, "input.jsonl")
+    self.output_path = os.path.join(self.tmp_dir, "output.jsonl")
+    self.generation_params = dict(
+        style_guide="This is my style guide.",
+        num_in_context_examples=2,
+        system_instruction_kwargs=dict(
+            company_name="My company",
+            language="english",
+        ),
+        temperature=0.0,
+        model_name="gemini-1.5-flash",
+    )
+
+  def tearDown(self):
+    super().tearDown()
+    self.generative_model_patcher.stop()
+    self.embedding_model_patcher.stop()
+
+  def test_batch_prediction_round_trip_matches_online_generation(self):
+    keywords = [f"new keyword {i}" for i in range(5)]
+    existing_headlines = [["existing headline"]] + [[]] * 4
+    existing_descriptions = [[]] * 5
+
+    n_requests = self.copycat_instance.write_new_ad_copy_batch_prediction_input(
+        self.input_path,
+        keywords=keywords,
+        existing_headlines=existing_headlines,
+        existing_descriptions=existing_descriptions,
+        chunk_size=2,
+        **self.generation_params,
+    )
+    batch_prediction.run_batch_prediction_locally(
+        self.input_path, self.output_path, model_name="gemini-1.5-flash"
+    )
+    responses = (
+        self.copycat_instance.ingest_new_ad_copy_batch_prediction_output(
+            self.output_path,
+            keywords=keywords,
+            existing_headlines=existing_headlines,
+            existing_descriptions=existing_descriptions,
+        )
+    )
+
+    expected_responses = self.copycat_instance.generate_new_ad_copy(
+        keywords=keywords,
+        existing_headlines=existing_headlines,
+        existing_descriptions=existing_descriptions,
+        **self.generation_params,
+    )
+    self.assertEqual(n_requests, 5)
+    self.assertEqual(responses, expected_responses)
+
+  def test_ingest_returns_error_for_failed_requests(self):
+    keywords = ["new keyword 0", "new keyword 1"]
+    write_jsonl(
+        self.output_path,
+        [
+            {
+                "key": "0",
+                "status": "",
+                "response": make_response_dict(GENERATED_AD_JSON),
+            },
+            {"key": "1", "status": "Quota exceeded."},
+        ],
+    )
+
+    responses = (
+        self.copycat_instance.ingest_new_ad_copy_batch_prediction_output(
+            self.output_path, keywords=keywords
+        )
+    )
+
+    self.assertTrue(responses[0].success)
+    self.assertEqual(
+        responses[1].error_message,
+        "- Generation failed: RuntimeError: Batch prediction failed: Quota"
+        " exceeded.",
+    )
+
+
+if __name__ == "__main__":
+  absltest.main()
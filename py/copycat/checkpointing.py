@@ -0,0 +1,322 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resumable generation jobs, which checkpoint every response to disk.
+
+Each generated CopycatResponse is written to a local SQLite store as soon as it
+is ready, keyed by the row it was generated for (e.g. the campaign, ad group
+and version) and a hash of the inputs that determine its prompt. If the job is
+interrupted, running it again skips the rows that are already in the store, so
+only the unfinished rows are sent to Gemini again.
+
+Usage:
+```
+store = checkpointing.SqliteResponseStore("generation_checkpoints.db")
+job = checkpointing.CheckpointedGenerationJob(copycat_instance, store)
+responses = job.run(generation_data, style_guide="", model_name=model_name)
+```
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Hashable
+
+import pandas as pd
+
+from copycat import copycat as copycat_lib
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+def _to_json(value: Any) -> str:
+  """Returns a canonical json string, for hashing and storing keys."""
+  return json.dumps(value, sort_keys=True, default=str)
+
+
+def make_row_id(index_label: Hashable) -> str:
+  """Returns the row id for the index label of a row.
+
+  Args:
+    index_label: The index label of the row, e.g. a tuple of the campaign, ad
+      group and version for the generation data in the Copycat UI.
+  """
+  if isinstance(index_label, tuple):
+    index_label = list(index_label)
+  return _to_json(index_label)
+
+
+def make_prompt_hash(
+    *,
+    keywords: str,
+    keywords_specific_instructions: str | None,
+    existing_headlines: list[str] | None,
+    existing_descriptions: list[str] | None,
+    generation_params: dict[str, Any],
+) -> str:
+  """Returns a hash of the inputs that determine the prompt for a row.
+
+  If any of these change, e.g. the keywords or the style guide, the row is
+  generated again instead of reusing the stored response.
+
+  Args:
+    keywords: The keywords for the row.
+    keywords_specific_instructions: The keywords specific instructions for the
+      row.
+    existing_headlines: The existing headlines for the row.
+    existing_descriptions: The existing descriptions for the row.
+    generation_params: The parameters shared by all rows, such as the style
+      guide, system instruction and model parameters.
+  """
+  key_material = _to_json({
+      "keywords": keywords,
+      "keywords_specific_instructions": keywords_specific_instructions or "",
+      "existing_headlines": list(existing_headlines or []),
+      "existing_descriptions": list(existing_descriptions or []),
+      "generation_params": generation_params,
+  })
+  return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+class SqliteResponseStore:
+  """An append-only store of CopycatResponses in a SQLite database on disk.
+
+  Responses are only ever appended. If the same row is generated again (e.g.
+  to retry a failed generation), the latest response is the one returned.
+
+  Attributes:
+    path: The path to the SQLite database file.
+  """
+
+  def __init__(self, path: str):
+    """Initialises the store, creating the database if required.
+
+    Args:
+      path: The path to the SQLite database file.
+    """
+    self.path = path
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    with self._connection:
+      self._connection.execute(
+          "CREATE TABLE IF NOT EXISTS responses ("
+          " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+          " row_id TEXT NOT NULL,"
+          " prompt_hash TEXT NOT NULL,"
+          " success INTEGER NOT NULL,"
+          " response TEXT NOT NULL,"
+          " created_at REAL NOT NULL)"
+      )
+      self._connection.execute(
+          "CREATE INDEX IF NOT EXISTS responses_key"
+          " ON responses (row_id, prompt_hash)"
+      )
+
+  def append(
+      self,
+      row_id: str,
+      prompt_hash: str,
+      response: copycat_lib.CopycatResponse,
+  ) -> None:
+    """Appends a response to the store and commits it to disk.
+
+    Args:
+      row_id: The id of the row the response was generated for.
+      prompt_hash: The hash of the inputs that determine the prompt.
+      response: The response to store.
+    """
+    with self._lock, self._connection:
+      self._connection.execute(
+          "INSERT INTO responses"
+          " (row_id, prompt_hash, success, response, created_at)"
+          " VALUES (?, ?, ?, ?, ?)",
+          (
+              row_id,
+              prompt_hash,
+              int(response.success),
+              response.model_dump_json(),
+              time.time(),
+          ),
+      )
+
+  def load_latest(
+      self,
+  ) -> dict[tuple[str, str], copycat_lib.CopycatResponse]:
+    """Returns the latest response for each row id and prompt hash."""
+    with self._lock:
+      rows = self._connection.execute(
+          "SELECT row_id, prompt_hash, response FROM responses WHERE id IN"
+          " (SELECT MAX(id) FROM responses GROUP BY row_id, prompt_hash)"
+      ).fetchall()
+    return {
+        (row_id, prompt_hash): copycat_lib.CopycatResponse.model_validate_json(
+            response
+        )
+        for row_id, prompt_hash, response in rows
+    }
+
+  def __len__(self) -> int:
+    with self._lock:
+      (n_rows,) = self._connection.execute(
+          "SELECT COUNT(*) FROM responses"
+      ).fetchone()
+    return n_rows
+
+  def close(self) -> None:
+    """Closes the connection to the database."""
+    self._connection.close()
+
+
+class CheckpointedGenerationJob:
+  """Generates new ad copy for a dataframe, checkpointing every response.
+
+  Attributes:
+    copycat_instance: The Copycat instance to generate the ad copy with.
+    store: The store that the responses are checkpointed to.
+  """
+
+  def __init__(
+      self,
+      copycat_instance: copycat_lib.Copycat,
+      store: SqliteResponseStore,
+  ):
+    self.copycat_instance = copycat_instance
+    self.store = store
+
+  def run(
+      self,
+      data: pd.DataFrame,
+      *,
+      keywords_column: str = "keywords",
+      keywords_specific_instructions_column: (
+          str
+      ) = "keywords_specific_instructions",
+      existing_headlines_column: str = "existing_headlines",
+      existing_descriptions_column: str = "existing_descriptions",
+      retry_failed: bool = False,
+      **static_params: Any,
+  ) -> pd.Series:
+    """Generates new ad copy for the rows that are not in the store yet.
+
+    The arguments are the same as for
+    Copycat.generate_new_ad_copy_for_dataframe. Each response is written to the
+    store as soon as it is generated, and rows with a stored response for the
+    same prompt inputs are not generated again.
+
+    Args:
+      data: The dataframe to generate the new ad copy for. The index must be
+        unique, because it identifies the rows in the store.
+      keywords_column: The name of the column containing the keywords.
+      keywords_specific_instructions_column: The name of the column containing
+        the keywords specific instructions.
+      existing_headlines_column: The name of the column containing the existing
+        headlines.
+      existing_descriptions_column: The name of the column containing the
+        existing descriptions.
+      retry_failed: Whether to generate the rows whose stored response was not
+        successful again.
+      **static_params: The static parameters to pass to the generation, see
+        Copycat.generate_new_ad_copy for the list of available parameters.
+
+    Returns:
+      A series of CopycatResponses for all the rows, with the same index as the
+      data, containing both the stored and the newly generated responses.
+
+    Raises:
+      ValueError: If the index of the data is not unique, or the data does not
+        contain the keywords column.
+    """
+    if not data.index.is_unique:
+      LOGGER.error("The index of the data must be unique.")
+      raise ValueError("The index of the data must be unique.")
+
+    copycat_instance = self.copycat_instance
+    generation_inputs = copycat_instance.get_generation_inputs_from_dataframe(
+        data,
+        keywords_column=keywords_column,
+        keywords_specific_instructions_column=(
+            keywords_specific_instructions_column
+        ),
+        existing_headlines_column=existing_headlines_column,
+        existing_descriptions_column=existing_descriptions_column,
+    )
+    generation_params = {
+        "copycat_style_guide": copycat_instance.style_guide,
+        **static_params,
+    }
+    generation_params.pop("generation_scheduler", None)
+    row_inputs = zip(
+        generation_inputs["keywords"],
+        generation_inputs["keywords_specific_instructions"],
+        generation_inputs["existing_headlines"],
+        generation_inputs["existing_descriptions"],
+    )
+    row_keys = pd.Series(
+        [
+            (
+                make_row_id(index_label),
+                make_prompt_hash(
+                    keywords=keywords,
+                    keywords_specific_instructions=instructions,
+                    existing_headlines=headlines,
+                    existing_descriptions=descriptions,
+                    generation_params=generation_params,
+                ),
+            )
+            for index_label, (keywords, instructions, headlines, descriptions)
+            in zip(data.index, row_inputs)
+        ],
+        index=data.index,
+    )
+
+    stored_responses = self.store.load_latest()
+    responses = {
+        index_label: stored_responses.get(key)
+        for index_label, key in row_keys.items()
+    }
+    is_done = pd.Series(
+        [
+            response is not None and (response.success or not retry_failed)
+            for response in responses.values()
+        ],
+        index=data.index,
+    )
+
+    LOGGER.info(
+        "Skipping %d rows that are already complete, generating %d rows.",
+        int(is_done.sum()),
+        int((~is_done).sum()),
+    )
+    if not is_done.all():
+      for index_label, response in (
+          copycat_instance.stream_new_ad_copy_for_dataframe(
+              data.loc[~is_done],
+              keywords_column=keywords_column,
+              keywords_specific_instructions_column=(
+                  keywords_specific_instructions_column
+              ),
+              existing_headlines_column=existing_headlines_column,
+              existing_descriptions_column=existing_descriptions_column,
+              **static_params,
+          )
+      ):
+        row_id, prompt_hash = row_keys.loc[index_label]
+        self.store.append(row_id, prompt_hash, response)
+        responses[index_label] = response
+
+    return pd.Series(list(responses.values()), index=data.index, dtype=object)
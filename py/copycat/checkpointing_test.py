@@ -0,0 +1,296 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from google.api_core import exceptions as api_core_exceptions
+import pandas as pd
+
+from copycat import checkpointing
+from copycat import copycat
+from copycat import testing_utils
+
+
+GENERATED_AD_JSON = (
+    '{"headlines": ["generated headline 1", "generated headline 2"],'
+    ' "descriptions": ["generated description"]}'
+)
+
+
+def make_response(
+    keywords: str, success: bool = True
+) -> copycat.CopycatResponse:
+  return copycat.CopycatResponse(
+      google_ad=copycat.GoogleAd(
+          headlines=[f"headline for {keywords}"],
+          descriptions=[f"description for {keywords}"],
+      ),
+      keywords=keywords,
+      evaluation_results=copycat.EvaluationResults(
+          headlines_are_memorised=False,
+          descriptions_are_memorised=False,
+          style_similarity=None,
+          keyword_similarity=None,
+          errors=[] if success else ["Some error."],
+          warnings=[],
+      ),
+  )
+
+
+class SqliteResponseStoreTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.path = os.path.join(self.create_tempdir().full_path, "responses.db")
+
+  def test_load_latest_returns_appended_responses(self):
+    store = checkpointing.SqliteResponseStore(self.path)
+    store.append("row_1", "hash_1", make_response("keyword 1"))
+    store.append("row_2", "hash_2", make_response("keyword 2"))
+
+    self.assertDictEqual(
+        store.load_latest(),
+        {
+            ("row_1", "hash_1"): make_response("keyword 1"),
+            ("row_2", "hash_2"): make_response("keyword 2"),
+        },
+    )
+
+  def test_load_latest_returns_latest_response_for_each_key(self):
+    store = checkpointing.SqliteResponseStore(self.path)
+    store.append("row_1", "hash_1", make_response("keyword 1", success=False))
+    store.append("row_1", "hash_1", make_response("keyword 1"))
+
+    self.assertLen(store, 2)
+    self.assertDictEqual(
+        store.load_latest(),
+        {("row_1", "hash_1"): make_response("keyword 1")},
+    )
+
+  def test_responses_are_persisted_across_connections(self):
+    store = checkpointing.SqliteResponseStore(self.path)
+    store.append("row_1", "hash_1", make_response("keyword 1"))
+    store.close()
+
+    reopened_store = checkpointing.SqliteResponseStore(self.path)
+
+    self.assertDictEqual(
+        reopened_store.load_latest(),
+        {("row_1", "hash_1"): make_response("keyword 1")},
+    )
+
+
+class MakeKeysTest(parameterized.TestCase):
+
+  def test_make_row_id_is_same_for_equal_multi_index_labels(self):
+    self.assertEqual(
+        checkpointing.make_row_id(("campaign 1", "ad group 1", "1")),
+        checkpointing.make_row_id(("campaign 1", "ad group 1", "1")),
+    )
+    self.assertNotEqual(
+        checkpointing.make_row_id(("campaign 1", "ad group 1", "1")),
+        checkpointing.make_row_id(("campaign 1", "ad group 1", "2")),
+    )
+
+  @parameterized.parameters(
+      dict(changed_param="keywords", changed_value="other keywords"),
+      dict(
+          changed_param="keywords_specific_instructions",
+          changed_value="other instructions",
+      ),
+      dict(changed_param="existing_headlines", changed_value=["headline"]),
+      dict(changed_param="existing_descriptions", changed_value=["desc"]),
+      dict(
+          changed_param="generation_params",
+          changed_value={"style_guide": "other style guide"},
+      ),
+  )
+  def test_make_prompt_hash_changes_when_inputs_change(
+      self, changed_param, changed_value
+  ):
+    inputs = dict(
+        keywords="keyword 1, keyword 2",
+        keywords_specific_instructions="",
+        existing_headlines=None,
+        existing_descriptions=None,
+        generation_params={"style_guide": "my style guide"},
+    )
+
+    changed_inputs = inputs | {changed_param: changed_value}
+
+    self.assertEqual(
+        checkpointing.make_prompt_hash(**inputs),
+        checkpointing.make_prompt_hash(**inputs),
+    )
+    self.assertNotEqual(
+        checkpointing.make_prompt_hash(**inputs),
+        checkpointing.make_prompt_hash(**changed_inputs),
+    )
+
+
+class CheckpointedGenerationJobTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.embedding_model_patcher = testing_utils.PatchEmbeddingsModel()
+    self.embedding_model_patcher.start()
+    self.generative_model_patcher = testing_utils.PatchGenerativeModel(
+        response=GENERATED_AD_JSON
+    )
+    self.generative_model_patcher.start()
+
+    training_data = pd.DataFrame({
+        "headlines": [
+            [f"train headline {i}", f"train headline {i} (2)"]
+            for i in range(10)
+        ],
+        "descriptions": [[f"train description {i}"] for i in range(10)],
+        "keywords": [f"keyword {i}a, keyword {i}b" for i in range(10)],
+    })
+    self.copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=training_data,
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    self.data = pd.DataFrame(
+        {"keywords": [f"new keyword {i}" for i in range(4)]},
+        index=pd.MultiIndex.from_tuples(
+            [("campaign 1", f"ad group {i}", "1") for i in range(4)],
+            names=["Campaign ID", "Ad Group", "Version"],
+        ),
+    )
+    self.generation_params = dict(
+        style_guide="This is my style guide.",
+        num_in_context_examples=2,
+        system_instruction_kwargs=dict(
+            company_name="My company",
+            language="english",
+        ),
+    )
+    self.store = checkpointing.SqliteResponseStore(
+        os.path.join(self.create_tempdir().full_path, "responses.db")
+    )
+
+  def tearDown(self):
+    super().tearDown()
+    self.store.close()
+    self.generative_model_patcher.stop()
+    self.embedding_model_patcher.stop()
+
+  @property
+  def mock_generate_content_async(self):
+    mock_generative_model = self.generative_model_patcher.mock_generative_model
+    return mock_generative_model.generate_content_async
+
+  def test_run_returns_responses_aligned_with_data(self):
+    job = checkpointing.CheckpointedGenerationJob(
+        self.copycat_instance, self.store
+    )
+
+    responses = job.run(self.data, **self.generation_params)
+
+    self.assertTrue(responses.index.equals(self.data.index))
+    self.assertListEqual(
+        [response.keywords for response in responses],
+        self.data["keywords"].tolist(),
+    )
+    self.assertTrue(all(response.success for response in responses))
+    self.assertLen(self.store, 4)
+
+  def test_run_skips_rows_already_in_store(self):
+    job = checkpointing.CheckpointedGenerationJob(
+        self.copycat_instance, self.store
+    )
+    first_responses = job.run(self.data.iloc[:2], **self.generation_params)
+    self.mock_generate_content_async.reset_mock()
+
+    responses = job.run(self.data, **self.generation_params)
+
+    self.assertEqual(self.mock_generate_content_async.call_count, 2)
+    self.assertLen(self.store, 4)
+    self.assertEqual(responses.iloc[0], first_responses.iloc[0])
+    self.assertEqual(responses.iloc[1], first_responses.iloc[1])
+
+  def test_run_generates_rows_again_when_params_change(self):
+    job = checkpointing.CheckpointedGenerationJob(
+        self.copycat_instance, self.store
+    )
+    job.run(self.data, **self.generation_params)
+    self.mock_generate_content_async.reset_mock()
+
+    job.run(
+        self.data,
+        **(self.generation_params | {"style_guide": "Other style guide."}),
+    )
+
+    self.assertEqual(self.mock_generate_content_async.call_count, 4)
+    self.assertLen(self.store, 8)
+
+  def test_run_repairs_failed_rows_if_max_repair_attempts_is_set(self):
+    response = self.mock_generate_content_async.return_value
+    self.mock_generate_content_async.side_effect = [
+        api_core_exceptions.InvalidArgument("bad request")
+    ] + [response] * 10
+    job = checkpointing.CheckpointedGenerationJob(
+        self.copycat_instance, self.store
+    )
+
+    responses = job.run(
+        self.data, max_repair_attempts=1, **self.generation_params
+    )
+
+    self.assertGreater(self.mock_generate_content_async.call_count, 4)
+    self.assertTrue(all(response.success for response in responses))
+    self.assertLen(self.store, 4)
+
+  @parameterized.parameters(True, False)
+  def test_run_retries_failed_rows_only_if_retry_failed(self, retry_failed):
+    self.mock_generate_content_async.side_effect = (
+        api_core_exceptions.InvalidArgument("bad request")
+    )
+    job = checkpointing.CheckpointedGenerationJob(
+        self.copycat_instance, self.store
+    )
+    failed_responses = job.run(self.data, **self.generation_params)
+    self.mock_generate_content_async.reset_mock(side_effect=True)
+
+    responses = job.run(
+        self.data, retry_failed=retry_failed, **self.generation_params
+    )
+
+    self.assertFalse(any(response.success for response in failed_responses))
+    self.assertEqual(
+        self.mock_generate_content_async.call_count, 4 if retry_failed else 0
+    )
+    self.assertEqual(
+        all(response.success for response in responses), retry_failed
+    )
+
+  def test_run_raises_error_if_index_is_not_unique(self):
+    job = checkpointing.CheckpointedGenerationJob(
+        self.copycat_instance, self.store
+    )
+    data = pd.DataFrame({"keywords": ["keyword 1", "keyword 2"]}, index=[0, 0])
+
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, "The index of the data must be unique."
+    ):
+      job.run(data, **self.generation_params)
+
+
+if __name__ == "__main__":
+  absltest.main()
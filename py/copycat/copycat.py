@@ -17,21 +17,31 @@
 Contains the code to generate copycat ad copies.
 """
 
-from collections.abc import Mapping
+import asyncio
+from collections.abc import AsyncIterator, Iterator, Mapping
 import dataclasses
 import json
 import logging
+import os
 from typing import Any, Callable
 import warnings
 
 from vertexai import generative_models
+import numpy as np
 import pandas as pd
 import pydantic
 
 from copycat import ad_copy_evaluator
 from copycat import ad_copy_generator
+from copycat import batch_prediction
+from copycat import embedding_cache as embedding_cache_lib
+from copycat import event_loops
 from copycat import google_ads
 from copycat import keyword_organiser
+from copycat import landing_pages
+from copycat import nearest_neighbors
+from copycat import rate_limiting
+from copycat import response_cache as response_cache_lib
 from copycat import style_guide as style_guide_generator
 
 GoogleAd = google_ads.GoogleAd
@@ -41,9 +51,18 @@ ModelName = ad_copy_generator.ModelName
 EmbeddingModelName = ad_copy_generator.EmbeddingModelName
 TextGenerationRequest = ad_copy_generator.TextGenerationRequest
 ExemplarSelectionMethod = ad_copy_generator.ExemplarSelectionMethod
+NearestNeighborsIndexType = nearest_neighbors.NearestNeighborsIndexType
 EvaluationResults = ad_copy_evaluator.EvaluationResults
 StyleGuideGenerator = style_guide_generator.StyleGuideGenerator
 BirchAgglomerativeKeywordClusterer = keyword_organiser.BirchAgglomerativeKeywordClusterer
+InMemoryEmbeddingCache = embedding_cache_lib.InMemoryEmbeddingCache
+SqliteEmbeddingCache = embedding_cache_lib.SqliteEmbeddingCache
+RateLimiter = rate_limiting.RateLimiter
+GenerationScheduler = ad_copy_generator.GenerationScheduler
+InMemoryResponseCache = response_cache_lib.InMemoryResponseCache
+SqliteResponseCache = response_cache_lib.SqliteResponseCache
+LandingPageFetcher = landing_pages.LandingPageFetcher
+LandingPageCache = landing_pages.LandingPageCache
 
 # Below are not used in this file, they are included for the user to easily
 # adjust the safety settings in copycat without having to import
@@ -81,6 +100,28 @@ must be no longer than {max_description_length} characters.
 COPYCAT_PARAMS_FILE_NAME = "copycat_params.json"
 
 
+def _check_repair_limits(
+    max_repair_attempts: int, max_repair_requests: int | None
+) -> None:
+  """Raises a ValueError if the repair limits are negative."""
+  for name, value in [
+      ("max_repair_attempts", max_repair_attempts),
+      ("max_repair_requests", max_repair_requests),
+  ]:
+    if value is not None and value < 0:
+      LOGGER.error("%s must not be negative, got %d.", name, value)
+      raise ValueError(f"{name} must not be negative, got {value}.")
+
+
+def _first_candidate_or_error(
+    response: generative_models.GenerationResponse | Exception,
+) -> generative_models.Candidate | Exception:
+  """Returns the first candidate of the response, or the error if it failed."""
+  if isinstance(response, Exception):
+    return response
+  return response.candidates[0]
+
+
 class CopycatResponseError(ValueError):
   """The error raised when the CopycatResponse is not successful."""
 
@@ -194,38 +235,21 @@ class Copycat:
       )
 
     if replace_special_variables_with_default:
-      data["headlines"] = data["headlines"].apply(
-          lambda headlines: list(
-              map(google_ads.parse_google_ads_special_variables, headlines)
-          )
-      )
-      data["descriptions"] = data["descriptions"].apply(
-          lambda descriptions: list(
-              map(google_ads.parse_google_ads_special_variables, descriptions)
-          )
-      )
-      is_invalid = data.apply(
-          lambda row: not evaluator.is_valid(
-              GoogleAd(
-                  headlines=row["headlines"], descriptions=row["descriptions"]
-              )
-          )
-          or evaluator.has_unfillable_google_ads_special_variables(
-              GoogleAd(
-                  headlines=row["headlines"], descriptions=row["descriptions"]
-              )
-          ),
-          axis=1,
+      data["headlines"] = data["headlines"].map(
+          google_ads.parse_google_ads_special_variables_batch
       )
-    else:
-      is_invalid = data.apply(
-          lambda row: not evaluator.is_valid(
-              GoogleAd(
-                  headlines=row["headlines"], descriptions=row["descriptions"]
-              )
-          ),
-          axis=1,
+      data["descriptions"] = data["descriptions"].map(
+          google_ads.parse_google_ads_special_variables_batch
       )
+
+    invalid_reasons = evaluator.check_validity_batch(
+        data["headlines"].tolist(),
+        data["descriptions"].tolist(),
+        check_unfillable_special_variables=(
+            replace_special_variables_with_default
+        ),
+    ).set_index(data.index)
+    is_invalid = invalid_reasons.any(axis=1)
     n_invalid_ads = is_invalid.sum()
     frac_invalid_ads = n_invalid_ads / len(data)
     error_message = (
@@ -234,6 +258,11 @@ class Copycat:
     )
 
     if n_invalid_ads > 0:
+      LOGGER.info(
+          "Number of invalid ads by reason (an ad can have several reasons):"
+          " %s",
+          invalid_reasons.sum().to_dict(),
+      )
       if on_invalid_ad == "raise":
         LOGGER.error(error_message)
         raise ValueError(error_message)
@@ -268,6 +297,11 @@ class Copycat:
       ) = "affinity_propagation",
       embedding_model_batch_size: int = 50,
       replace_special_variables_with_default: bool = False,
+      embedding_cache: embedding_cache_lib.EmbeddingCache | None = None,
+      embedding_model_max_concurrent_requests: int = 1,
+      embedding_model_rate_limiter: rate_limiting.RateLimiter | None = None,
+      vectorstore_index_type: str | NearestNeighborsIndexType = "euclidean",
+      vectorstore_index_params: dict[str, Any] | None = None,
   ) -> "Copycat":
     """Creates a Copycat model from a pandas dataframe.
 
@@ -293,7 +327,10 @@ class Copycat:
       vectorstore_affinity_preference: The affinity preference to use when
         finding exemplar ads.
       vectorstore_exemplar_selection_method: The method to use to select the
-        exemplar ads. Either "affinity_propagation" or "random". Defaults to
+        exemplar ads. One of "affinity_propagation", "random", "kmeans_medoids"
+        or "farthest_point". Affinity propagation is quadratic in the number of
+        ads, so prefer "kmeans_medoids" or "farthest_point" when
+        vectorstore_max_initial_ads is more than a few thousand. Defaults to
         "affinity_propagation".
       embedding_model_batch_size: The batch size to use when generating
         embeddings.
@@ -304,6 +341,22 @@ class Copycat:
         just generate generic ads without DKI or Customizers. If you keep them
         then it might try to generate them, but this can sometimes not work
         well.
+      embedding_cache: An optional cache for the embeddings, which avoids
+        re-embedding texts that have been embedded before. It is not serialized
+        with the model, so after loading a model it must be set again on
+        `ad_copy_vectorstore.embedding_cache`.
+      embedding_model_max_concurrent_requests: The maximum number of embedding
+        batches to send to the embedding model at the same time.
+      embedding_model_rate_limiter: An optional rate limiter to keep the
+        embedding requests within the quota. It is not serialized with the
+        model.
+      vectorstore_index_type: The nearest neighbors index used to retrieve the
+        most relevant exemplar ads. One of "euclidean" (exact), "cosine" (exact)
+        or "ivf_cosine" (approximate, faster for large numbers of exemplars).
+        Defaults to "euclidean".
+      vectorstore_index_params: Optional parameters for the nearest neighbors
+        index, only used by the "ivf_cosine" index (n_lists, n_probe and
+        random_state).
 
     Returns:
       A Copycat model.
@@ -346,6 +399,13 @@ class Copycat:
             affinity_preference=vectorstore_affinity_preference,
             embeddings_batch_size=embedding_model_batch_size,
             exemplar_selection_method=vectorstore_exemplar_selection_method,
+            embedding_cache=embedding_cache,
+            embeddings_max_concurrent_requests=(
+                embedding_model_max_concurrent_requests
+            ),
+            embeddings_rate_limiter=embedding_model_rate_limiter,
+            nearest_neighbors_index_type=vectorstore_index_type,
+            nearest_neighbors_index_params=vectorstore_index_params,
         )
     )
 
@@ -431,9 +491,97 @@ class Copycat:
     """Serializes the model to a json string."""
     return json.dumps(self.to_dict())
 
+  def save(self, path: str) -> None:
+    """Saves the model to a directory in a binary format.
+
+    This is much faster to write and read than to_json, because the
+    vectorstore embeddings are stored as a binary numpy array. The directory
+    contains copycat_params.json with the ad format and style guide, and the
+    vectorstore files written by AdCopyVectorstore.save.
+
+    Args:
+      path: The directory to save the model to. It is created if it does not
+        exist.
+    """
+    os.makedirs(path, exist_ok=True)
+    params = {
+        "ad_format_params": self.ad_format.model_dump(),
+        "style_guide": self.style_guide,
+    }
+    with open(os.path.join(path, COPYCAT_PARAMS_FILE_NAME), "w") as f:
+      json.dump(params, f)
+    self.ad_copy_vectorstore.save(path)
+
+  @classmethod
+  def load(cls, path: str, *, mmap_mode: str | None = None) -> "Copycat":
+    """Loads the model from a directory written by save().
+
+    Args:
+      path: The directory containing the model.
+      mmap_mode: If set, the vectorstore embeddings are memory mapped instead
+        of being read into memory, using this mode (e.g. "r" for read only).
+
+    Returns:
+      A Copycat model.
+    """
+    with open(os.path.join(path, COPYCAT_PARAMS_FILE_NAME)) as f:
+      params = json.load(f)
+    return cls(
+        ad_copy_vectorstore=ad_copy_generator.AdCopyVectorstore.load(
+            path, mmap_mode=mmap_mode
+        ),
+        ad_format=GoogleAdFormat(**params["ad_format_params"]),
+        style_guide=params.get("style_guide", ""),
+    )
+
+  def add_ads(
+      self,
+      new_ads: pd.DataFrame,
+      *,
+      on_invalid_ad: str = "drop",
+      replace_special_variables_with_default: bool = False,
+      min_distance: float | None = None,
+      max_exemplar_ads: int | None = None,
+  ) -> pd.DataFrame:
+    """Adds new ads to the model's vectorstore without rebuilding it.
+
+    The new ads are cleaned in the same way as the training data in
+    create_from_pandas, and then added with AdCopyVectorstore.add_ads. Only
+    the new ads are embedded, and only the ads that are not well represented by
+    the existing exemplars are added. To remove ads, use
+    ad_copy_vectorstore.remove_ads.
+
+    Args:
+      new_ads: The new ads, with the columns "headlines", "descriptions" and
+        "keywords".
+      on_invalid_ad: How to handle invalid ads. Must be one of "drop", "raise",
+        or "skip".
+      replace_special_variables_with_default: Whether to replace Google Ads
+        special variables with their default values.
+      min_distance: New ads closer than this to an existing exemplar are not
+        added. If None, it is set from the distances between the existing
+        exemplars. See AdCopyVectorstore.add_ads.
+      max_exemplar_ads: The maximum total number of exemplars after adding the
+        new ads, or None for no limit.
+
+    Returns:
+      The ads that were added as exemplars.
+    """
+    new_ads = self._clean_invalid_ads(
+        new_ads.copy(),
+        self.ad_format,
+        on_invalid_ad,
+        replace_special_variables_with_default,
+    )
+    return self.ad_copy_vectorstore.add_ads(
+        new_ads,
+        min_distance=min_distance,
+        max_exemplar_ads=max_exemplar_ads,
+    )
+
   def construct_responses(
       self,
-      raw_generated_ads: list[generative_models.Candidate],
+      raw_generated_ads: list[generative_models.Candidate | Exception],
       keywords: list[str],
       existing_ad_copies: list[GoogleAd],
   ) -> list[CopycatResponse]:
@@ -441,7 +589,7 @@ class Copycat:
 
     Args:
       raw_generated_ads: The unprocessed generated ads as a generation
-        candidates.
+        candidates, or the errors for the generations that failed.
       keywords: The keywords used to generate the ads.
       existing_ad_copies: The existing ad copies if they exist, to be merged
         with the generated ad copies.
@@ -462,6 +610,24 @@ class Copycat:
     for keywords_i, raw_generated_ad_i, existing_ad_copy_i in zip(
         keywords, raw_generated_ads, existing_ad_copies
     ):
+      if isinstance(raw_generated_ad_i, Exception):
+        responses.append(
+            CopycatResponse(
+                google_ad=existing_ad_copy_i.model_copy(),
+                keywords=keywords_i,
+                evaluation_results=empty_evaluation_results.model_copy(
+                    update=dict(
+                        errors=[
+                            "Generation failed:"
+                            f" {type(raw_generated_ad_i).__name__}:"
+                            f" {raw_generated_ad_i}"
+                        ]
+                    )
+                ),
+            )
+        )
+        continue
+
       if (
           raw_generated_ad_i.finish_reason
           is not ad_copy_generator.FinishReason.STOP
@@ -527,6 +693,7 @@ class Copycat:
       responses: list[CopycatResponse],
       allow_memorised_headlines: bool,
       allow_memorised_descriptions: bool,
+      keywords_embeddings: list[list[float]] | np.ndarray | None = None,
   ) -> list[CopycatResponse]:
     """Evaluates the responses if the ad copy is not empty.
 
@@ -536,6 +703,9 @@ class Copycat:
       responses: The responses to evaluate.
       allow_memorised_headlines: Whether to allow memorised headlines.
       allow_memorised_descriptions: Whether to allow memorised descriptions.
+      keywords_embeddings: The query embeddings of the keywords of each
+        response, if they were already calculated to retrieve the in context
+        examples. If None, the keywords are embedded again.
 
     Returns:
       The evaluated responses.
@@ -545,6 +715,7 @@ class Copycat:
         allow_memorised_headlines=allow_memorised_headlines,
         allow_memorised_descriptions=allow_memorised_descriptions,
         keywords=[response.keywords for response in responses],
+        keywords_embeddings=keywords_embeddings,
     )
     evaluated_responses = []
     for response, evaluation_results in zip(responses, evaluation_results_list):
@@ -582,6 +753,8 @@ class Copycat:
       system_instruction_kwargs: dict[str, Any] | None = None,
       existing_headlines: list[list[str]] | None = None,
       existing_descriptions: list[list[str]] | None = None,
+      max_prompt_tokens: int | None = None,
+      keywords_embeddings: list[list[float]] | np.ndarray | None = None,
   ) -> list[TextGenerationRequest]:
     """Constructs a request for generating a new ad copy.
 
@@ -614,11 +787,27 @@ class Copycat:
         headlines then pass None.
       existing_descriptions: The existing descriptions for the ad copy. If no
         descriptions then pass None.
+      max_prompt_tokens: The maximum estimated number of tokens in the system
+        instruction and prompt of each request. Prompts over the budget have
+        their keywords specific instructions truncated and their least relevant
+        in context examples dropped. If None, there is no budget.
+      keywords_embeddings: The query embeddings of the keywords, used to
+        retrieve the in context examples. If None, the keywords are embedded.
 
     Returns:
       A text generation request, containing the prompt, system instruction, and
       model parameters.
+
+    Raises:
+      ValueError: If max_prompt_tokens is not positive.
     """
+    if max_prompt_tokens is not None and max_prompt_tokens <= 0:
+      LOGGER.error(
+          "max_prompt_tokens must be positive, got %d.", max_prompt_tokens
+      )
+      raise ValueError(
+          f"max_prompt_tokens must be positive, got {max_prompt_tokens}."
+      )
     if keywords_specific_instructions is None:
       keywords_specific_instructions = [""] * len(keywords)
     if existing_headlines is None:
@@ -642,10 +831,19 @@ class Copycat:
         system_instruction_kwargs=system_instruction_kwargs,
     )
 
-    relavent_example_ads = self.ad_copy_vectorstore.get_relevant_ads(
-        keywords,
-        k=num_in_context_examples,
-    )
+    if keywords_embeddings is None:
+      relavent_example_ads = self.ad_copy_vectorstore.get_relevant_ads(
+          keywords,
+          k=num_in_context_examples,
+      )
+    else:
+      vectorstore = self.ad_copy_vectorstore
+      relavent_example_ads, _ = (
+          vectorstore.get_relevant_ads_and_embeddings_from_embeddings(
+              keywords_embeddings,
+              k=num_in_context_examples,
+          )
+      )
 
     existing_ad_copies = [
         GoogleAd(
@@ -658,6 +856,31 @@ class Copycat:
         )
     ]
 
+    if max_prompt_tokens is not None:
+      fitted_prompt_inputs = [
+          ad_copy_generator.fit_prompt_to_token_budget(
+              example_ads=relevant_example_ads_i,
+              keywords=keywords_i,
+              ad_format=self.ad_format,
+              system_instruction=system_instruction,
+              max_prompt_tokens=max_prompt_tokens,
+              existing_ad_copy=existing_ad_copy_i,
+              keywords_specific_instructions=keywords_specific_instructions_i,
+          )
+          for keywords_i, keywords_specific_instructions_i, relevant_example_ads_i, existing_ad_copy_i in zip(
+              keywords,
+              keywords_specific_instructions,
+              relavent_example_ads,
+              existing_ad_copies,
+          )
+      ]
+      relavent_example_ads = [
+          example_ads_i for example_ads_i, _ in fitted_prompt_inputs
+      ]
+      keywords_specific_instructions = [
+          instructions_i for _, instructions_i in fitted_prompt_inputs
+      ]
+
     prompts = [
         ad_copy_generator.construct_new_ad_copy_prompt(
             example_ads=relevant_example_ads_i,
@@ -691,24 +914,97 @@ class Copycat:
         )
     ]
 
+    token_summary = ad_copy_generator.summarize_request_tokens(requests)
+    LOGGER.info(
+        "Constructed %d requests with an estimated %d prompt tokens (mean %.0f,"
+        " max %d per request).",
+        token_summary["n_requests"],
+        token_summary["total_tokens"],
+        token_summary["mean_tokens"],
+        token_summary["max_tokens"],
+    )
+
     return requests
 
-  def _generate_new_ad_copy_from_requests(
+  def _check_new_ad_copy_inputs(
+      self,
+      *,
+      keywords: list[str],
+      keywords_specific_instructions: list[str] | None,
+      existing_headlines: list[list[str]] | None,
+      existing_descriptions: list[list[str]] | None,
+  ) -> tuple[list[str], list[list[str] | None], list[list[str] | None]]:
+    """Fills in the defaults and checks the inputs for generating new ad copy.
+
+    Args:
+      keywords: The list of keywords to use to generate the ad copies.
+      keywords_specific_instructions: The list of keywords specific instructions
+        to use, or None to use empty strings.
+      existing_headlines: The existing headlines for the ad copy, or None.
+      existing_descriptions: The existing descriptions for the ad copy, or None.
+
+    Returns:
+      The keywords specific instructions, existing headlines and existing
+      descriptions, with the defaults filled in.
+
+    Raises:
+      ValueError: If keywords, keywords_specific_instructions, existing
+        headlines or existing descriptions have different lengths.
+    """
+    if keywords_specific_instructions is None:
+      keywords_specific_instructions = [""] * len(keywords)
+    if existing_headlines is None:
+      existing_headlines = [None] * len(keywords)
+    if existing_descriptions is None:
+      existing_descriptions = [None] * len(keywords)
+
+    if len(keywords) != len(keywords_specific_instructions):
+      LOGGER.error(
+          "keywords and keywords_specific_instructions must have the same"
+          " length."
+      )
+      raise ValueError(
+          "keywords and keywords_specific_instructions must have the same"
+          " length."
+      )
+    if len(existing_headlines) != len(keywords):
+      LOGGER.error("keywords and existing_headlines must have the same length.")
+      raise ValueError(
+          "keywords and existing_headlines must have the same length."
+      )
+    if len(existing_descriptions) != len(keywords):
+      LOGGER.error(
+          "keywords and existing_descriptions must have the same length."
+      )
+      raise ValueError(
+          "keywords and existing_descriptions must have the same length."
+      )
+
+    return (
+        keywords_specific_instructions,
+        existing_headlines,
+        existing_descriptions,
+    )
+
+  async def _agenerate_new_ad_copy_from_requests(
       self,
       requests: list[TextGenerationRequest],
+      generation_scheduler: ad_copy_generator.GenerationScheduler | None = None,
   ) -> list[CopycatResponse]:
     """Generates a new ad copy from a list of requests.
 
     Args:
       requests: The requests to generate the ad copy from.
+      generation_scheduler: The scheduler for the generation requests. If None,
+        a scheduler with the default limits is used.
 
     Returns:
       A list of CopycatResponses.
     """
     generations = [
-        response.candidates[0]
-        for response in ad_copy_generator.generate_google_ad_json_batch(
-            requests
+        _first_candidate_or_error(response)
+        for response in await ad_copy_generator.agenerate_google_ad_json_batch(
+            requests, scheduler=generation_scheduler
         )
     ]
     keywords = [request.keywords for request in requests]
@@ -721,7 +1017,171 @@ class Copycat:
     )
     return responses
 
-  def generate_new_ad_copy(
+  def _get_ad_copy_to_repair(
+      self,
+      response: CopycatResponse,
+      existing_ad_copy: GoogleAd,
+      allow_memorised_headlines: bool,
+      allow_memorised_descriptions: bool,
+  ) -> GoogleAd | None:
+    """Returns the ad copy to extend to repair the response, if it is needed.
+
+    The response needs repairing if it is not complete, or if it has errors. The
+    headlines or descriptions are reset to the existing ones if they are all
+    memorised and that is not allowed, so new ones are generated. Other invalid
+    headlines and descriptions have already been removed from the ad copy, so
+    the remaining ones are kept and the ad is extended with new ones.
+
+    Args:
+      response: The evaluated response.
+      existing_ad_copy: The existing ad copy the response was generated from.
+      allow_memorised_headlines: Whether to allow memorised headlines.
+      allow_memorised_descriptions: Whether to allow memorised descriptions.
+
+    Returns:
+      The ad copy to extend, or None if the response does not need repairing or
+      cannot be repaired by extending it.
+    """
+    if response.success and self.ad_copy_evaluator.is_complete(
+        response.google_ad
+    ):
+      return None
+
+    evaluation_results = response.evaluation_results
+    headlines = response.google_ad.headlines
+    if evaluation_results.headlines_are_memorised and (
+        not allow_memorised_headlines
+    ):
+      headlines = existing_ad_copy.headlines
+    descriptions = response.google_ad.descriptions
+    if evaluation_results.descriptions_are_memorised and (
+        not allow_memorised_descriptions
+    ):
+      descriptions = existing_ad_copy.descriptions
+
+    ad_copy = GoogleAd(
+        headlines=list(headlines), descriptions=list(descriptions)
+    )
+    if self.ad_copy_evaluator.is_complete(ad_copy):
+      return None
+    return ad_copy
+
+  async def _arepair_new_ad_copy(
+      self,
+      responses: list[CopycatResponse],
+      *,
+      keywords_specific_instructions: list[str],
+      existing_ad_copies: list[GoogleAd],
+      keywords_embeddings: np.ndarray,
+      allow_memorised_headlines: bool,
+      allow_memorised_descriptions: bool,
+      max_repair_attempts: int,
+      max_repair_requests: int | None,
+      generation_scheduler: ad_copy_generator.GenerationScheduler | None,
+      **request_params: Any,
+  ) -> tuple[list[CopycatResponse], int]:
+    """Regenerates the responses that failed or are not complete.
+
+    In each attempt, all the responses that need repairing are re-queued
+    together as requests to extend their valid headlines and descriptions. A
+    repaired response replaces the previous one, unless the previous one was
+    successful and the repaired one is not.
+
+    Args:
+      responses: The evaluated responses.
+      keywords_specific_instructions: The keywords specific instructions used
+        for each response.
+      existing_ad_copies: The existing ad copies used for each response.
+      keywords_embeddings: The query embeddings of the keywords of each
+        response.
+      allow_memorised_headlines: Whether to allow memorised headlines.
+      allow_memorised_descriptions: Whether to allow memorised descriptions.
+      max_repair_attempts: The maximum number of times to regenerate each
+        response.
+      max_repair_requests: The maximum total number of requests to make for
+        the repairs, or None for no limit.
+      generation_scheduler: The scheduler for the generation requests.
+      **request_params: The other parameters for constructing the requests,
+        passed to construct_text_generation_requests_for_new_ad_copy.
+
+    Returns:
+      The responses, with the repaired ones replaced, and the number of repair
+      requests that were made.
+    """
+    responses = list(responses)
+    n_repair_requests = 0
+    for attempt in range(1, max_repair_attempts + 1):
+      ad_copies_to_repair = {}
+      for i, (response, existing_ad_copy) in enumerate(
+          zip(responses, existing_ad_copies)
+      ):
+        ad_copy = self._get_ad_copy_to_repair(
+            response,
+            existing_ad_copy,
+            allow_memorised_headlines=allow_memorised_headlines,
+            allow_memorised_descriptions=allow_memorised_descriptions,
+        )
+        if ad_copy is not None:
+          ad_copies_to_repair[i] = ad_copy
+      if not ad_copies_to_repair:
+        break
+
+      if max_repair_requests is not None:
+        n_remaining_requests = max_repair_requests - n_repair_requests
+        if len(ad_copies_to_repair) > n_remaining_requests:
+          LOGGER.warning(
+              "The repair budget of %d requests allows %d of the %d ads that"
+              " need repairing to be regenerated.",
+              max_repair_requests,
+              max(n_remaining_requests, 0),
+              len(ad_copies_to_repair),
+          )
+          ad_copies_to_repair = dict(
+              list(ad_copies_to_repair.items())[:n_remaining_requests]
+          )
+        if not ad_copies_to_repair:
+          break
+
+      LOGGER.info(
+          "Repair attempt %d of %d: regenerating %d ads.",
+          attempt,
+          max_repair_attempts,
+          len(ad_copies_to_repair),
+      )
+      n_repair_requests += len(ad_copies_to_repair)
+      indices = list(ad_copies_to_repair)
+      requests = await asyncio.to_thread(
+          self.construct_text_generation_requests_for_new_ad_copy,
+          keywords=[responses[i].keywords for i in indices],
+          keywords_specific_instructions=[
+              keywords_specific_instructions[i] for i in indices
+          ],
+          existing_headlines=[
+              ad_copies_to_repair[i].headlines for i in indices
+          ],
+          existing_descriptions=[
+              ad_copies_to_repair[i].descriptions for i in indices
+          ],
+          keywords_embeddings=keywords_embeddings[indices],
+          **request_params,
+      )
+      repaired_responses = await self._agenerate_new_ad_copy_from_requests(
+          requests, generation_scheduler=generation_scheduler
+      )
+      repaired_responses = await asyncio.to_thread(
+          self._evaluate_responses,
+          repaired_responses,
+          allow_memorised_headlines=allow_memorised_headlines,
+          allow_memorised_descriptions=allow_memorised_descriptions,
+          keywords_embeddings=keywords_embeddings[indices],
+      )
+      for i, repaired_response in zip(indices, repaired_responses):
+        if repaired_response.success or not responses[i].success:
+          responses[i] = repaired_response
+
+    return responses, n_repair_requests
+
+  async def agenerate_new_ad_copy(
       self,
       *,
       keywords: list[str],
@@ -739,8 +1199,17 @@ class Copycat:
       system_instruction_kwargs: dict[str, Any] | None = None,
       existing_headlines: list[list[str]] | None = None,
       existing_descriptions: list[list[str]] | None = None,
+      generation_scheduler: ad_copy_generator.GenerationScheduler | None = None,
+      max_prompt_tokens: int | None = None,
+      max_repair_attempts: int = 0,
+      max_repair_requests: int | None = None,
   ) -> list[CopycatResponse]:
-    """Generates a new ad copy.
+    """Generates a new ad copy asynchronously.
+
+    This is the async version of generate_new_ad_copy, for use inside a running
+    event loop, such as an async web server. The retrieval of the in context
+    examples and the evaluation of the ad copies are run in a worker thread, so
+    they do not block the event loop, and multiple calls can run concurrently.
 
     Args:
       keywords: The list of keywords to use to generate the ad copies. This
@@ -765,49 +1234,45 @@ class Copycat:
         headlines then pass None.
       existing_descriptions: The existing descriptions for the ad copy. If no
         descriptions then pass None.
+      generation_scheduler: The scheduler for the generation requests, which
+        limits the number of requests in flight, rate limits and retries them.
+        If None, a scheduler with the default limits is used.
+      max_prompt_tokens: The maximum estimated number of tokens in the prompt
+        of each request. Prompts over the budget have their keywords specific
+        instructions truncated and their least relevant in context examples
+        dropped. If None, there is no budget.
+      max_repair_attempts: The maximum number of times to regenerate the ads
+        that fail the evaluation or are not complete. Each time, the ads that
+        need repairing are regenerated together, extending their valid
+        headlines and descriptions. If 0, the ads are not repaired.
+      max_repair_requests: The maximum total number of requests to make for
+        repairing the ads, to limit the cost. If None, there is no limit.
 
     Returns:
       A CopycatResponse object.
 
     Raises:
       ValueError: If keywords, keywords_specific_instructions, existing
-        headlines or existing descriptions have different lengths.
+        headlines or existing descriptions have different lengths, or if
+        max_repair_attempts or max_repair_requests are negative.
       RuntimeError: If the number of responses does not match the number of
         keywords. This shouldn't happen, if it happens it indicates a bug in the
         code.
     """
-    if keywords_specific_instructions is None:
-      keywords_specific_instructions = [""] * len(keywords)
-    if existing_headlines is None:
-      existing_headlines = [None] * len(keywords)
-    if existing_descriptions is None:
-      existing_descriptions = [None] * len(keywords)
-
-    if len(keywords) != len(keywords_specific_instructions):
-      LOGGER.error(
-          "keywords and keywords_specific_instructions must have the same"
-          " length."
-      )
-      raise ValueError(
-          "keywords and keywords_specific_instructions must have the same"
-          " length."
-      )
-    if len(existing_headlines) != len(keywords):
-      LOGGER.error("keywords and existing_headlines must have the same length.")
-      raise ValueError(
-          "keywords and existing_headlines must have the same length."
-      )
-    if len(existing_descriptions) != len(keywords):
-      LOGGER.error(
-          "keywords and existing_descriptions must have the same length."
-      )
-      raise ValueError(
-          "keywords and existing_descriptions must have the same length."
-      )
+    _check_repair_limits(max_repair_attempts, max_repair_requests)
 
-    requests = self.construct_text_generation_requests_for_new_ad_copy(
+    (
+        keywords_specific_instructions,
+        existing_headlines,
+        existing_descriptions,
+    ) = self._check_new_ad_copy_inputs(
         keywords=keywords,
         keywords_specific_instructions=keywords_specific_instructions,
+        existing_headlines=existing_headlines,
+        existing_descriptions=existing_descriptions,
+    )
+
+    request_params = dict(
         num_in_context_examples=num_in_context_examples,
         style_guide=style_guide,
         system_instruction=system_instruction,
@@ -817,18 +1282,51 @@ class Copycat:
         top_p=top_p,
         safety_settings=safety_settings,
         system_instruction_kwargs=system_instruction_kwargs,
+        max_prompt_tokens=max_prompt_tokens,
+    )
+    # The keywords are embedded once, and the embeddings are used both to
+    # retrieve the in context examples and to evaluate the keyword similarity.
+    keywords_embeddings = np.asarray(
+        await asyncio.to_thread(
+            self.ad_copy_vectorstore.embed_queries, keywords
+        )
+    )
+    requests = await asyncio.to_thread(
+        self.construct_text_generation_requests_for_new_ad_copy,
+        keywords=keywords,
+        keywords_specific_instructions=keywords_specific_instructions,
         existing_headlines=existing_headlines,
         existing_descriptions=existing_descriptions,
+        keywords_embeddings=keywords_embeddings,
+        **request_params,
     )
 
-    responses = self._generate_new_ad_copy_from_requests(requests)
+    responses = await self._agenerate_new_ad_copy_from_requests(
+        requests, generation_scheduler=generation_scheduler
+    )
 
-    evaluated_responses = self._evaluate_responses(
+    evaluated_responses = await asyncio.to_thread(
+        self._evaluate_responses,
         responses,
         allow_memorised_headlines=allow_memorised_headlines,
         allow_memorised_descriptions=allow_memorised_descriptions,
+        keywords_embeddings=keywords_embeddings,
     )
 
+    if max_repair_attempts:
+      evaluated_responses, _ = await self._arepair_new_ad_copy(
+          evaluated_responses,
+          keywords_specific_instructions=list(keywords_specific_instructions),
+          existing_ad_copies=[request.existing_ad_copy for request in requests],
+          keywords_embeddings=keywords_embeddings,
+          allow_memorised_headlines=allow_memorised_headlines,
+          allow_memorised_descriptions=allow_memorised_descriptions,
+          max_repair_attempts=max_repair_attempts,
+          max_repair_requests=max_repair_requests,
+          generation_scheduler=generation_scheduler,
+          **request_params,
+      )
+
     if len(evaluated_responses) != len(keywords):
       LOGGER.error(
           "The number of responses does not match the number of keywords."
@@ -839,35 +1337,582 @@ class Copycat:
 
     return evaluated_responses
 
-  def generate_new_ad_copy_for_dataframe(
+  def generate_new_ad_copy(
       self,
-      data: pd.DataFrame,
       *,
-      keywords_column: str = "keywords",
-      keywords_specific_instructions_column: (
-          str
-      ) = "keywords_specific_instructions",
-      existing_headlines_column: str = "existing_headlines",
-      existing_descriptions_column: str = "existing_descriptions",
-      **static_params: Any,
-  ) -> pd.Series:
-    """Applies the generate new ad copy function to a dataframe.
+      keywords: list[str],
+      keywords_specific_instructions: list[str] | None = None,
+      style_guide: str | None = None,
+      system_instruction: str = DEFAULT_SYSTEM_INSTRUCTION,
+      num_in_context_examples: int = 10,
+      model_name: ModelName | str = ModelName.GEMINI_2_5_FLASH,
+      temperature: float = 0.95,
+      top_k: int = 20,
+      top_p: float = 0.95,
+      allow_memorised_headlines: bool = True,
+      allow_memorised_descriptions: bool = False,
+      safety_settings: ad_copy_generator.SafetySettingsType | None = None,
+      system_instruction_kwargs: dict[str, Any] | None = None,
+      existing_headlines: list[list[str]] | None = None,
+      existing_descriptions: list[list[str]] | None = None,
+      generation_scheduler: ad_copy_generator.GenerationScheduler | None = None,
+      max_prompt_tokens: int | None = None,
+      max_repair_attempts: int = 0,
+      max_repair_requests: int | None = None,
+  ) -> list[CopycatResponse]:
+    """Generates a new ad copy.
 
-    This will generate a new ad copy for each row in the dataframe, using the
-    keywords, keywords_specific_instructions, existing_headlines and
-    existing_descriptions columns from that row. All other parameters are
-    static and will be passed to the generate_new_ad_copy function.
+    The generation runs on the Copycat background event loop, so this can be
+    called from inside a running event loop (e.g. Jupyter) or from any thread.
+    Async code should use agenerate_new_ad_copy instead.
 
     Args:
-      data: The dataframe to apply the generate new ad copy function to.
-      keywords_column: The name of the column containing the keywords.
-      keywords_specific_instructions_column: The name of the column containing
-        the keywords specific instructions. If the column is not present then
-        None will be used as the value.
-      existing_headlines_column: The name of the column containing the existing
-        headlines. If the column is not present then None will be used as the
-        value.
-      existing_descriptions_column: The name of the column containing the
+      keywords: The list of keywords to use to generate the ad copies. This
+        should be a list of strings, where each string is a comma separated list
+        of keywords.
+      keywords_specific_instructions: The list of keywords specific instructions
+        to use. Defaults to a list of empty strings.
+      style_guide: The style guide to use. If None, then the style guide from
+        the Copycat model will be used.
+      system_instruction: The system instruction to use.
+      num_in_context_examples: The number of in context examples to use.
+      model_name: The name of the chat model to use.
+      temperature: The temperature to use for the chat model.
+      top_k: The top-k to use for the chat model.
+      top_p: The top-p to use for the chat model.
+      allow_memorised_headlines: Whether to allow memorised headlines.
+      allow_memorised_descriptions: Whether to allow memorised descriptions.
+      safety_settings: The safety settings for the chat model.
+      system_instruction_kwargs: Additional arguments to pass to the system
+        instruction.
+      existing_headlines: The existing headlines for the ad copy. If no
+        headlines then pass None.
+      existing_descriptions: The existing descriptions for the ad copy. If no
+        descriptions then pass None.
+      generation_scheduler: The scheduler for the generation requests, which
+        limits the number of requests in flight, rate limits and retries them.
+        If None, a scheduler with the default limits is used.
+      max_prompt_tokens: The maximum estimated number of tokens in the prompt
+        of each request. Prompts over the budget have their keywords specific
+        instructions truncated and their least relevant in context examples
+        dropped. If None, there is no budget.
+      max_repair_attempts: The maximum number of times to regenerate the ads
+        that fail the evaluation or are not complete. Each time, the ads that
+        need repairing are regenerated together, extending their valid
+        headlines and descriptions. If 0, the ads are not repaired.
+      max_repair_requests: The maximum total number of requests to make for
+        repairing the ads, to limit the cost. If None, there is no limit.
+
+    Returns:
+      A CopycatResponse object.
+
+    Raises:
+      ValueError: If keywords, keywords_specific_instructions, existing
+        headlines or existing descriptions have different lengths, or if
+        max_repair_attempts or max_repair_requests are negative.
+      RuntimeError: If the number of responses does not match the number of
+        keywords. This shouldn't happen, if it happens it indicates a bug in the
+        code.
+    """
+    return event_loops.run_in_background_loop(
+        self.agenerate_new_ad_copy(
+            keywords=keywords,
+            keywords_specific_instructions=keywords_specific_instructions,
+            style_guide=style_guide,
+            system_instruction=system_instruction,
+            num_in_context_examples=num_in_context_examples,
+            model_name=model_name,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            allow_memorised_headlines=allow_memorised_headlines,
+            allow_memorised_descriptions=allow_memorised_descriptions,
+            safety_settings=safety_settings,
+            system_instruction_kwargs=system_instruction_kwargs,
+            existing_headlines=existing_headlines,
+            existing_descriptions=existing_descriptions,
+            generation_scheduler=generation_scheduler,
+            max_prompt_tokens=max_prompt_tokens,
+            max_repair_attempts=max_repair_attempts,
+            max_repair_requests=max_repair_requests,
+        )
+    )
+
+  async def astream_new_ad_copy(
+      self,
+      *,
+      keywords: list[str],
+      keywords_specific_instructions: list[str] | None = None,
+      style_guide: str | None = None,
+      system_instruction: str = DEFAULT_SYSTEM_INSTRUCTION,
+      num_in_context_examples: int = 10,
+      model_name: ModelName | str = ModelName.GEMINI_2_5_FLASH,
+      temperature: float = 0.95,
+      top_k: int = 20,
+      top_p: float = 0.95,
+      allow_memorised_headlines: bool = True,
+      allow_memorised_descriptions: bool = False,
+      safety_settings: ad_copy_generator.SafetySettingsType | None = None,
+      system_instruction_kwargs: dict[str, Any] | None = None,
+      existing_headlines: list[list[str]] | None = None,
+      existing_descriptions: list[list[str]] | None = None,
+      generation_scheduler: ad_copy_generator.GenerationScheduler | None = None,
+      max_prompt_tokens: int | None = None,
+      max_repair_attempts: int = 0,
+      max_repair_requests: int | None = None,
+  ) -> AsyncIterator[tuple[int, CopycatResponse]]:
+    """Generates new ad copies, yielding each one as soon as it is ready.
+
+    This is the streaming version of generate_new_ad_copy. The evaluated
+    responses are yielded in the order they complete, together with the index
+    of the keywords they were generated for, so that they can be written out
+    continuously. The requests are constructed in chunks of
+    generation_scheduler.max_concurrent_requests as they are needed, so memory
+    stays bounded for very large lists of keywords. The completed responses are
+    evaluated and yielded in batches of the larger of that and the embeddings
+    batch size of the vectorstore, so that the ads are embedded together.
+
+    Args:
+      keywords: The list of keywords to use to generate the ad copies. This
+        should be a list of strings, where each string is a comma separated list
+        of keywords.
+      keywords_specific_instructions: The list of keywords specific instructions
+        to use. Defaults to a list of empty strings.
+      style_guide: The style guide to use. If None, then the style guide from
+        the Copycat model will be used.
+      system_instruction: The system instruction to use.
+      num_in_context_examples: The number of in context examples to use.
+      model_name: The name of the chat model to use.
+      temperature: The temperature to use for the chat model.
+      top_k: The top-k to use for the chat model.
+      top_p: The top-p to use for the chat model.
+      allow_memorised_headlines: Whether to allow memorised headlines.
+      allow_memorised_descriptions: Whether to allow memorised descriptions.
+      safety_settings: The safety settings for the chat model.
+      system_instruction_kwargs: Additional arguments to pass to the system
+        instruction.
+      existing_headlines: The existing headlines for the ad copy. If no
+        headlines then pass None.
+      existing_descriptions: The existing descriptions for the ad copy. If no
+        descriptions then pass None.
+      generation_scheduler: The scheduler for the generation requests, which
+        limits the number of requests in flight, rate limits and retries them.
+        If None, a scheduler with the default limits is used.
+      max_prompt_tokens: The maximum estimated number of tokens in the prompt
+        of each request. Prompts over the budget have their keywords specific
+        instructions truncated and their least relevant in context examples
+        dropped. If None, there is no budget.
+      max_repair_attempts: The maximum number of times to regenerate the ads
+        that fail the evaluation or are not complete. The ads in each evaluated
+        batch are repaired together, before they are yielded. If 0, the ads are
+        not repaired.
+      max_repair_requests: The maximum total number of requests to make for
+        repairing the ads, to limit the cost. If None, there is no limit.
+
+    Yields:
+      Tuples of the index of the keywords and the evaluated CopycatResponse.
+
+    Raises:
+      ValueError: If keywords, keywords_specific_instructions, existing
+        headlines or existing descriptions have different lengths, or if
+        max_repair_attempts or max_repair_requests are negative.
+    """
+    _check_repair_limits(max_repair_attempts, max_repair_requests)
+    (
+        keywords_specific_instructions,
+        existing_headlines,
+        existing_descriptions,
+    ) = self._check_new_ad_copy_inputs(
+        keywords=keywords,
+        keywords_specific_instructions=keywords_specific_instructions,
+        existing_headlines=existing_headlines,
+        existing_descriptions=existing_descriptions,
+    )
+    keywords = list(keywords)
+    keywords_specific_instructions = list(keywords_specific_instructions)
+    existing_headlines = list(existing_headlines)
+    existing_descriptions = list(existing_descriptions)
+    generation_scheduler = (
+        generation_scheduler or ad_copy_generator.GenerationScheduler()
+    )
+    chunk_size = generation_scheduler.max_concurrent_requests
+    request_params = dict(
+        num_in_context_examples=num_in_context_examples,
+        style_guide=style_guide,
+        system_instruction=system_instruction,
+        model_name=model_name,
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        safety_settings=safety_settings,
+        system_instruction_kwargs=system_instruction_kwargs,
+        max_prompt_tokens=max_prompt_tokens,
+    )
+
+    in_flight_requests = {}
+    n_repair_requests = 0
+
+    def construct_chunk(
+        start: int, stop: int
+    ) -> tuple[list[TextGenerationRequest], np.ndarray]:
+      keywords_embeddings = np.asarray(
+          self.ad_copy_vectorstore.embed_queries(keywords[start:stop])
+      )
+      requests = self.construct_text_generation_requests_for_new_ad_copy(
+          keywords=keywords[start:stop],
+          keywords_specific_instructions=keywords_specific_instructions[
+              start:stop
+          ],
+          existing_headlines=existing_headlines[start:stop],
+          existing_descriptions=existing_descriptions[start:stop],
+          keywords_embeddings=keywords_embeddings,
+          **request_params,
+      )
+      return requests, keywords_embeddings
+
+    async def iterate_requests() -> AsyncIterator[TextGenerationRequest]:
+      for start in range(0, len(keywords), chunk_size):
+        # Embedding the keywords and retrieving the examples block, so they
+        # run in a worker thread to keep the shared event loop responsive.
+        requests, keywords_embeddings = await asyncio.to_thread(
+            construct_chunk, start, start + chunk_size
+        )
+        for index, (request, keywords_embedding) in enumerate(
+            zip(requests, keywords_embeddings), start=start
+        ):
+          in_flight_requests[index] = (request, keywords_embedding)
+          yield request
+
+    async def evaluate_completed(
+        completed: list[
+            tuple[int, generative_models.GenerationResponse | Exception]
+        ],
+    ) -> list[tuple[int, CopycatResponse]]:
+      nonlocal n_repair_requests
+      indices = [index for index, _ in completed]
+      requests, keywords_embeddings = zip(
+          *(in_flight_requests.pop(index) for index in indices)
+      )
+      keywords_embeddings = np.asarray(keywords_embeddings)
+      responses = self.construct_responses(
+          [
+              _first_candidate_or_error(generation)
+              for _, generation in completed
+          ],
+          [request.keywords for request in requests],
+          [request.existing_ad_copy for request in requests],
+      )
+      evaluated_responses = await asyncio.to_thread(
+          self._evaluate_responses,
+          responses,
+          allow_memorised_headlines=allow_memorised_headlines,
+          allow_memorised_descriptions=allow_memorised_descriptions,
+          keywords_embeddings=keywords_embeddings,
+      )
+      if max_repair_attempts:
+        evaluated_responses, n_requests = await self._arepair_new_ad_copy(
+            evaluated_responses,
+            keywords_specific_instructions=[
+                keywords_specific_instructions[index] for index in indices
+            ],
+            existing_ad_copies=[
+                request.existing_ad_copy for request in requests
+            ],
+            keywords_embeddings=keywords_embeddings,
+            allow_memorised_headlines=allow_memorised_headlines,
+            allow_memorised_descriptions=allow_memorised_descriptions,
+            max_repair_attempts=max_repair_attempts,
+            max_repair_requests=(
+                None
+                if max_repair_requests is None
+                else max_repair_requests - n_repair_requests
+            ),
+            generation_scheduler=generation_scheduler,
+            **request_params,
+        )
+        n_repair_requests += n_requests
+      return list(zip(indices, evaluated_responses))
+
+    # The completed generations are evaluated together, so the ads are
+    # embedded in batches like in generate_new_ad_copy, not one at a time.
+    evaluation_batch_size = max(
+        chunk_size, self.ad_copy_vectorstore.embeddings_batch_size
+    )
+    completed = []
+    async for index, generation in ad_copy_generator.stream_google_ad_json(
+        iterate_requests(), scheduler=generation_scheduler
+    ):
+      completed.append((index, generation))
+      if len(completed) >= evaluation_batch_size:
+        for result in await evaluate_completed(completed):
+          yield result
+        completed = []
+    if completed:
+      for result in await evaluate_completed(completed):
+        yield result
+
+  def stream_new_ad_copy(
+      self,
+      *,
+      keywords: list[str],
+      keywords_specific_instructions: list[str] | None = None,
+      style_guide: str | None = None,
+      system_instruction: str = DEFAULT_SYSTEM_INSTRUCTION,
+      num_in_context_examples: int = 10,
+      model_name: ModelName | str = ModelName.GEMINI_2_5_FLASH,
+      temperature: float = 0.95,
+      top_k: int = 20,
+      top_p: float = 0.95,
+      allow_memorised_headlines: bool = True,
+      allow_memorised_descriptions: bool = False,
+      safety_settings: ad_copy_generator.SafetySettingsType | None = None,
+      system_instruction_kwargs: dict[str, Any] | None = None,
+      existing_headlines: list[list[str]] | None = None,
+      existing_descriptions: list[list[str]] | None = None,
+      generation_scheduler: ad_copy_generator.GenerationScheduler | None = None,
+      max_prompt_tokens: int | None = None,
+      max_repair_attempts: int = 0,
+      max_repair_requests: int | None = None,
+  ) -> Iterator[tuple[int, CopycatResponse]]:
+    """Generates new ad copies, yielding each one as soon as it is ready.
+
+    This is a synchronous wrapper around astream_new_ad_copy, which runs on the
+    Copycat background event loop. For example:
+
+    ```
+    for index, response in copycat_instance.stream_new_ad_copy(
+        keywords=keywords
+    ):
+      write_response(index, response)
+    ```
+
+    Args:
+      keywords: The list of keywords to use to generate the ad copies. This
+        should be a list of strings, where each string is a comma separated list
+        of keywords.
+      keywords_specific_instructions: The list of keywords specific instructions
+        to use. Defaults to a list of empty strings.
+      style_guide: The style guide to use. If None, then the style guide from
+        the Copycat model will be used.
+      system_instruction: The system instruction to use.
+      num_in_context_examples: The number of in context examples to use.
+      model_name: The name of the chat model to use.
+      temperature: The temperature to use for the chat model.
+      top_k: The top-k to use for the chat model.
+      top_p: The top-p to use for the chat model.
+      allow_memorised_headlines: Whether to allow memorised headlines.
+      allow_memorised_descriptions: Whether to allow memorised descriptions.
+      safety_settings: The safety settings for the chat model.
+      system_instruction_kwargs: Additional arguments to pass to the system
+        instruction.
+      existing_headlines: The existing headlines for the ad copy. If no
+        headlines then pass None.
+      existing_descriptions: The existing descriptions for the ad copy. If no
+        descriptions then pass None.
+      generation_scheduler: The scheduler for the generation requests, which
+        limits the number of requests in flight, rate limits and retries them.
+        If None, a scheduler with the default limits is used.
+      max_prompt_tokens: The maximum estimated number of tokens in the prompt
+        of each request. Prompts over the budget have their keywords specific
+        instructions truncated and their least relevant in context examples
+        dropped. If None, there is no budget.
+      max_repair_attempts: The maximum number of times to regenerate the ads
+        that fail the evaluation or are not complete. The ads in each evaluated
+        batch are repaired together, before they are yielded. If 0, the ads are
+        not repaired.
+      max_repair_requests: The maximum total number of requests to make for
+        repairing the ads, to limit the cost. If None, there is no limit.
+
+    Returns:
+      An iterator over tuples of the index of the keywords and the evaluated
+      CopycatResponse.
+    """
+    return event_loops.iterate_in_background_loop(
+        self.astream_new_ad_copy(
+            keywords=keywords,
+            keywords_specific_instructions=keywords_specific_instructions,
+            style_guide=style_guide,
+            system_instruction=system_instruction,
+            num_in_context_examples=num_in_context_examples,
+            model_name=model_name,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            allow_memorised_headlines=allow_memorised_headlines,
+            allow_memorised_descriptions=allow_memorised_descriptions,
+            safety_settings=safety_settings,
+            system_instruction_kwargs=system_instruction_kwargs,
+            existing_headlines=existing_headlines,
+            existing_descriptions=existing_descriptions,
+            generation_scheduler=generation_scheduler,
+            max_prompt_tokens=max_prompt_tokens,
+            max_repair_attempts=max_repair_attempts,
+            max_repair_requests=max_repair_requests,
+        )
+    )
+
+  def write_new_ad_copy_batch_prediction_input(
+      self,
+      path: str,
+      *,
+      keywords: list[str],
+      keywords_specific_instructions: list[str] | None = None,
+      existing_headlines: list[list[str]] | None = None,
+      existing_descriptions: list[list[str]] | None = None,
+      chunk_size: int = 1000,
+      **request_params: Any,
+  ) -> int:
+    """Writes the requests for new ad copy to a batch prediction input file.
+
+    This is the first step of offline generation with a Vertex AI batch
+    prediction job, for backfills that are too large to generate online. The
+    requests are constructed and written in chunks, so only one chunk is held
+    in memory at once. Once the job has finished, pass the output file and the
+    same keywords and existing ad copy to
+    ingest_new_ad_copy_batch_prediction_output.
+
+    Args:
+      path: The path of the JSONL file to write.
+      keywords: The list of keywords to use to generate the ad copies.
+      keywords_specific_instructions: The list of keywords specific instructions
+        to use. Defaults to a list of empty strings.
+      existing_headlines: The existing headlines for the ad copy. If no
+        headlines then pass None.
+      existing_descriptions: The existing descriptions for the ad copy. If no
+        descriptions then pass None.
+      chunk_size: The number of requests to construct at once.
+      **request_params: The other parameters for
+        construct_text_generation_requests_for_new_ad_copy, such as the style
+        guide and model name.
+
+    Returns:
+      The number of requests written.
+
+    Raises:
+      ValueError: If keywords, keywords_specific_instructions, existing
+        headlines or existing descriptions have different lengths.
+    """
+    (
+        keywords_specific_instructions,
+        existing_headlines,
+        existing_descriptions,
+    ) = self._check_new_ad_copy_inputs(
+        keywords=keywords,
+        keywords_specific_instructions=keywords_specific_instructions,
+        existing_headlines=existing_headlines,
+        existing_descriptions=existing_descriptions,
+    )
+
+    n_requests = 0
+    for start in range(0, len(keywords), chunk_size):
+      end = start + chunk_size
+      requests = self.construct_text_generation_requests_for_new_ad_copy(
+          keywords=keywords[start:end],
+          keywords_specific_instructions=keywords_specific_instructions[
+              start:end
+          ],
+          existing_headlines=existing_headlines[start:end],
+          existing_descriptions=existing_descriptions[start:end],
+          **request_params,
+      )
+      n_requests += batch_prediction.write_batch_prediction_input(
+          requests, path, start_index=start, append=start > 0
+      )
+    LOGGER.info("Wrote %d batch prediction requests to %s.", n_requests, path)
+    return n_requests
+
+  def ingest_new_ad_copy_batch_prediction_output(
+      self,
+      path: str,
+      *,
+      keywords: list[str],
+      existing_headlines: list[list[str]] | None = None,
+      existing_descriptions: list[list[str]] | None = None,
+      allow_memorised_headlines: bool = True,
+      allow_memorised_descriptions: bool = False,
+  ) -> list[CopycatResponse]:
+    """Constructs and evaluates the responses from a batch prediction output.
+
+    Args:
+      path: The path of the batch prediction output JSONL file.
+      keywords: The same keywords as passed to
+        write_new_ad_copy_batch_prediction_input.
+      existing_headlines: The same existing headlines as passed to
+        write_new_ad_copy_batch_prediction_input.
+      existing_descriptions: The same existing descriptions as passed to
+        write_new_ad_copy_batch_prediction_input.
+      allow_memorised_headlines: Whether to allow memorised headlines.
+      allow_memorised_descriptions: Whether to allow memorised descriptions.
+
+    Returns:
+      The CopycatResponses, in the same order as the keywords. The requests
+      that failed, or are missing from the output, have an error message.
+
+    Raises:
+      ValueError: If keywords, existing headlines or existing descriptions
+        have different lengths, or the output contains an invalid key.
+    """
+    _, existing_headlines, existing_descriptions = (
+        self._check_new_ad_copy_inputs(
+            keywords=keywords,
+            keywords_specific_instructions=None,
+            existing_headlines=existing_headlines,
+            existing_descriptions=existing_descriptions,
+        )
+    )
+    generations = [
+        _first_candidate_or_error(response)
+        for response in batch_prediction.read_batch_prediction_output(
+            path, n_requests=len(keywords)
+        )
+    ]
+    existing_ad_copies = [
+        GoogleAd(
+            headlines=headlines_i or [],
+            descriptions=descriptions_i or [],
+        )
+        for headlines_i, descriptions_i in zip(
+            existing_headlines, existing_descriptions
+        )
+    ]
+    responses = self.construct_responses(
+        generations, keywords, existing_ad_copies
+    )
+    return self._evaluate_responses(
+        responses,
+        allow_memorised_headlines=allow_memorised_headlines,
+        allow_memorised_descriptions=allow_memorised_descriptions,
+    )
+
+  def generate_new_ad_copy_for_dataframe(
+      self,
+      data: pd.DataFrame,
+      *,
+      keywords_column: str = "keywords",
+      keywords_specific_instructions_column: (
+          str
+      ) = "keywords_specific_instructions",
+      existing_headlines_column: str = "existing_headlines",
+      existing_descriptions_column: str = "existing_descriptions",
+      **static_params: Any,
+  ) -> pd.Series:
+    """Applies the generate new ad copy function to a dataframe.
+
+    This will generate a new ad copy for each row in the dataframe, using the
+    keywords, keywords_specific_instructions, existing_headlines and
+    existing_descriptions columns from that row. All other parameters are
+    static and will be passed to the generate_new_ad_copy function.
+
+    Args:
+      data: The dataframe to apply the generate new ad copy function to.
+      keywords_column: The name of the column containing the keywords.
+      keywords_specific_instructions_column: The name of the column containing
+        the keywords specific instructions. If the column is not present then
+        None will be used as the value.
+      existing_headlines_column: The name of the column containing the existing
+        headlines. If the column is not present then None will be used as the
+        value.
+      existing_descriptions_column: The name of the column containing the
         existing descriptions. If the column is not present then None will be
         used as the value.
       **static_params: The static parameters to pass to the generate new ad copy
@@ -877,6 +1922,105 @@ class Copycat:
     Returns:
       A series of CopycatResponses.
 
+    Raises:
+      ValueError: If the dataframe does not contain the required keywords
+        column.
+    """
+    generation_inputs = self.get_generation_inputs_from_dataframe(
+        data,
+        keywords_column=keywords_column,
+        keywords_specific_instructions_column=(
+            keywords_specific_instructions_column
+        ),
+        existing_headlines_column=existing_headlines_column,
+        existing_descriptions_column=existing_descriptions_column,
+    )
+    generated_responses = self.generate_new_ad_copy(
+        **generation_inputs, **static_params
+    )
+    return pd.Series(generated_responses, index=data.index)
+
+  def stream_new_ad_copy_for_dataframe(
+      self,
+      data: pd.DataFrame,
+      *,
+      keywords_column: str = "keywords",
+      keywords_specific_instructions_column: (
+          str
+      ) = "keywords_specific_instructions",
+      existing_headlines_column: str = "existing_headlines",
+      existing_descriptions_column: str = "existing_descriptions",
+      **static_params: Any,
+  ) -> Iterator[tuple[Any, CopycatResponse]]:
+    """Generates new ad copy for each row, yielding each one when it is ready.
+
+    This is the streaming version of generate_new_ad_copy_for_dataframe, see
+    that method for the columns used. The responses are yielded in the order
+    they complete.
+
+    Args:
+      data: The dataframe to generate the new ad copy for.
+      keywords_column: The name of the column containing the keywords.
+      keywords_specific_instructions_column: The name of the column containing
+        the keywords specific instructions.
+      existing_headlines_column: The name of the column containing the existing
+        headlines.
+      existing_descriptions_column: The name of the column containing the
+        existing descriptions.
+      **static_params: The static parameters to pass to astream_new_ad_copy.
+
+    Returns:
+      An iterator over tuples of the index label of the row and the evaluated
+      CopycatResponse.
+
+    Raises:
+      ValueError: If the dataframe does not contain the required keywords
+        column.
+    """
+    generation_inputs = self.get_generation_inputs_from_dataframe(
+        data,
+        keywords_column=keywords_column,
+        keywords_specific_instructions_column=(
+            keywords_specific_instructions_column
+        ),
+        existing_headlines_column=existing_headlines_column,
+        existing_descriptions_column=existing_descriptions_column,
+    )
+    return (
+        (data.index[i], response)
+        for i, response in self.stream_new_ad_copy(
+            **generation_inputs, **static_params
+        )
+    )
+
+  def get_generation_inputs_from_dataframe(
+      self,
+      data: pd.DataFrame,
+      *,
+      keywords_column: str,
+      keywords_specific_instructions_column: str,
+      existing_headlines_column: str,
+      existing_descriptions_column: str,
+  ) -> dict[str, Any]:
+    """Returns the per row generation inputs from the dataframe columns.
+
+    Args:
+      data: The dataframe containing the generation inputs.
+      keywords_column: The name of the column containing the keywords.
+      keywords_specific_instructions_column: The name of the column containing
+        the keywords specific instructions. If the column is not present then
+        None will be used as the value.
+      existing_headlines_column: The name of the column containing the existing
+        headlines. If the column is not present then None will be used as the
+        value.
+      existing_descriptions_column: The name of the column containing the
+        existing descriptions. If the column is not present then None will be
+        used as the value.
+
+    Returns:
+      The keywords, keywords_specific_instructions, existing_headlines and
+      existing_descriptions arguments for generate_new_ad_copy.
+
     Raises:
       ValueError: If the dataframe does not contain the required keywords
         column.
@@ -922,14 +2066,12 @@ class Copycat:
       )
       existing_descriptions = [None] * len(keywords)
 
-    generated_responses = self.generate_new_ad_copy(
+    return dict(
         keywords=keywords,
         keywords_specific_instructions=keywords_specific_instructions,
         existing_headlines=existing_headlines,
         existing_descriptions=existing_descriptions,
-        **static_params,
     )
-    return pd.Series(generated_responses, index=data.index)
 
   def generate_style_guide(
       self,
@@ -12,10 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import json
+import threading
 
 from absl.testing import absltest
 from absl.testing import parameterized
+from google.api_core import exceptions as api_core_exceptions
 from vertexai import generative_models
 import mock
 import pandas as pd
@@ -681,15 +684,15 @@ class CopycatTest(parameterized.TestCase):
           testcase_name="with existing ad copy",
           existing_headlines=["existing headline"],
           existing_descriptions=["existing description"],
-          expected_style_similarity=0.5590658228752543,
-          expected_keyword_similarity=0.5056089825975687,
+          expected_style_similarity=0.5590658187866211,
+          expected_keyword_similarity=0.5056089758872986,
       ),
       dict(
           testcase_name="without existing ad copy",
           existing_headlines=None,
           existing_descriptions=None,
-          expected_style_similarity=0.5338446522650305,
-          expected_keyword_similarity=0.4766861086664519,
+          expected_style_similarity=0.5338446497917175,
+          expected_keyword_similarity=0.47668612003326416,
       ),
   )
   @testing_utils.PatchGenerativeModel(
@@ -743,6 +746,8 @@ class CopycatTest(parameterized.TestCase):
                 warnings=[],
                 headlines_are_memorised=False,
                 descriptions_are_memorised=False,
+                n_memorised_headlines=0,
+                n_memorised_descriptions=0,
                 style_similarity=expected_style_similarity,
                 keyword_similarity=expected_keyword_similarity,
             ),
@@ -892,6 +897,237 @@ class CopycatTest(parameterized.TestCase):
     )
     self.assertEqual(expected_system_instruction, request.system_instruction)
 
+  def test_construct_text_generation_requests_fits_prompts_to_token_budget(
+      self,
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(n_rows=20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+
+    requests = (
+        copycat_instance.construct_text_generation_requests_for_new_ad_copy(
+            keywords=["my keyword 1", "my keyword 2"],
+            keywords_specific_instructions=["", "a" * 10_000],
+            num_in_context_examples=10,
+            system_instruction="Example system instruction",
+            max_prompt_tokens=500,
+        )
+    )
+
+    for request in requests:
+      self.assertLessEqual(
+          copycat.ad_copy_generator.estimate_request_tokens(request), 500
+      )
+    # Without instructions all the examples fit, with the long instructions
+    # they are truncated to fit with at least one example.
+    self.assertLen(requests[0].prompt, 21)
+    self.assertLen(requests[1].prompt, 3)
+    self.assertIn("[truncated]", requests[1].prompt[-1].parts[0].text)
+
+  def test_construct_text_generation_requests_raises_error_for_invalid_budget(
+      self,
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(n_rows=3),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, "max_prompt_tokens must be positive, got 0."
+    ):
+      copycat_instance.construct_text_generation_requests_for_new_ad_copy(
+          keywords=["my keyword 1"], max_prompt_tokens=0
+      )
+
+  def _make_generation_response(self, text):
+    return generative_models.GenerationResponse.from_dict({
+        "candidates": [{
+            "finish_reason": generative_models.FinishReason.STOP,
+            "content": {"role": "model", "parts": [{"text": text}]},
+        }]
+    })
+
+  def test_generate_new_ad_copy_repairs_incomplete_ads(self):
+    with testing_utils.PatchGenerativeModel(
+        response=""
+    ) as generative_model_patcher:
+      mock_generate_content_async = (
+          generative_model_patcher.mock_generative_model.generate_content_async
+      )
+      mock_generate_content_async.side_effect = [
+          self._make_generation_response(
+              '{"headlines": ["generated headline 1"],'
+              ' "descriptions": ["generated description 1"]}'
+          ),
+          self._make_generation_response(
+              '{"headlines": ["generated headline 2", "generated headline 3"],'
+              ' "descriptions": ["generated description 2"]}'
+          ),
+      ]
+      copycat_instance = copycat.Copycat.create_from_pandas(
+          training_data=self.training_data(20),
+          embedding_model_name="text-embedding-004",
+          ad_format="text_ad",
+          vectorstore_exemplar_selection_method="random",
+      )
+
+      response = copycat_instance.generate_new_ad_copy(
+          keywords=["my keyword 1, my keyword 2"],
+          num_in_context_examples=2,
+          system_instruction="Example system instruction",
+          max_repair_attempts=2,
+      )[0]
+
+    self.assertTrue(response.success)
+    self.assertEqual(
+        response.google_ad,
+        google_ads.GoogleAd(
+            headlines=[
+                "generated headline 1",
+                "generated headline 2",
+                "generated headline 3",
+            ],
+            descriptions=["generated description 1", "generated description 2"],
+        ),
+    )
+    self.assertEqual(mock_generate_content_async.call_count, 2)
+
+  def test_stream_new_ad_copy_repairs_incomplete_ads(self):
+    with testing_utils.PatchGenerativeModel(
+        response=""
+    ) as generative_model_patcher:
+      mock_generate_content_async = (
+          generative_model_patcher.mock_generative_model.generate_content_async
+      )
+      mock_generate_content_async.side_effect = [
+          self._make_generation_response(
+              '{"headlines": ["generated headline 1"],'
+              ' "descriptions": ["generated description 1"]}'
+          ),
+          self._make_generation_response(
+              '{"headlines": ["generated headline 2", "generated headline 3"],'
+              ' "descriptions": ["generated description 2"]}'
+          ),
+      ]
+      copycat_instance = copycat.Copycat.create_from_pandas(
+          training_data=self.training_data(20),
+          embedding_model_name="text-embedding-004",
+          ad_format="text_ad",
+          vectorstore_exemplar_selection_method="random",
+      )
+
+      streamed_responses = list(
+          copycat_instance.stream_new_ad_copy(
+              keywords=["my keyword 1, my keyword 2"],
+              num_in_context_examples=2,
+              system_instruction="Example system instruction",
+              max_repair_attempts=2,
+          )
+      )
+
+    self.assertLen(streamed_responses, 1)
+    index, response = streamed_responses[0]
+    self.assertEqual(index, 0)
+    self.assertTrue(response.success)
+    self.assertLen(response.google_ad.headlines, 3)
+    self.assertLen(response.google_ad.descriptions, 2)
+    self.assertEqual(mock_generate_content_async.call_count, 2)
+
+  def test_generate_new_ad_copy_repairs_memorised_descriptions(self):
+    with testing_utils.PatchGenerativeModel(
+        response=""
+    ) as generative_model_patcher:
+      mock_generate_content_async = (
+          generative_model_patcher.mock_generative_model.generate_content_async
+      )
+      mock_generate_content_async.side_effect = [
+          self._make_generation_response(
+              '{"headlines": ["generated headline 1", "generated headline 2",'
+              ' "generated headline 3"], "descriptions": ["train description'
+              ' 1", "train description 2"]}'
+          ),
+          self._make_generation_response(
+              '{"headlines": [], "descriptions": ["generated description 1",'
+              ' "generated description 2"]}'
+          ),
+      ]
+      copycat_instance = copycat.Copycat.create_from_pandas(
+          training_data=self.training_data(20),
+          embedding_model_name="text-embedding-004",
+          ad_format="text_ad",
+          vectorstore_exemplar_selection_method="random",
+      )
+
+      response = copycat_instance.generate_new_ad_copy(
+          keywords=["my keyword 1, my keyword 2"],
+          num_in_context_examples=2,
+          system_instruction="Example system instruction",
+          allow_memorised_descriptions=False,
+          max_repair_attempts=1,
+      )[0]
+
+    self.assertTrue(response.success)
+    self.assertEqual(
+        response.google_ad.descriptions,
+        ["generated description 1", "generated description 2"],
+    )
+    self.assertLen(response.google_ad.headlines, 3)
+
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1"], "descriptions":'
+          ' ["generated description 1"]}'
+      )
+  )
+  def test_generate_new_ad_copy_limits_repairs_to_budget(
+      self, generative_model_patcher
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+
+    responses = copycat_instance.generate_new_ad_copy(
+        keywords=["my keyword 1", "my keyword 2", "my keyword 3"],
+        num_in_context_examples=2,
+        system_instruction="Example system instruction",
+        max_repair_attempts=5,
+        max_repair_requests=4,
+    )
+
+    # 3 initial requests, then 3 repairs in the first attempt and 1 in the
+    # second attempt, when the budget runs out.
+    self.assertLen(responses, 3)
+    self.assertEqual(
+        generative_model_patcher.mock_generative_model.generate_content_async.call_count,
+        7,
+    )
+
+  @parameterized.parameters("max_repair_attempts", "max_repair_requests")
+  def test_generate_new_ad_copy_raises_error_for_negative_repair_limits(
+      self, name
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(n_rows=3),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, f"{name} must not be negative, got -1."
+    ):
+      copycat_instance.generate_new_ad_copy(
+          keywords=["my keyword 1"], **{name: -1}
+      )
+
   @testing_utils.PatchGenerativeModel(
       response='{"descriptions": ["generated description"]}'
   )
@@ -934,6 +1170,8 @@ class CopycatTest(parameterized.TestCase):
                 warnings=[],
                 headlines_are_memorised=False,
                 descriptions_are_memorised=False,
+                n_memorised_headlines=0,
+                n_memorised_descriptions=0,
                 style_similarity=None,
                 keyword_similarity=None,
             ),
@@ -982,6 +1220,8 @@ class CopycatTest(parameterized.TestCase):
                 warnings=[],
                 headlines_are_memorised=False,
                 descriptions_are_memorised=False,
+                n_memorised_headlines=0,
+                n_memorised_descriptions=0,
                 style_similarity=None,
                 keyword_similarity=None,
             ),
@@ -1015,6 +1255,293 @@ class CopycatTest(parameterized.TestCase):
     )
     self.assertLen(responses, 2)
 
+  def _embedded_query_texts(self) -> list[str]:
+    mock_embeddings_model = self.embedding_model_patcher.mock_embeddings_model
+    return [
+        text_input.text
+        for call in mock_embeddings_model.get_embeddings.call_args_list
+        for text_input in call.args[0]
+        if text_input.task_type == "RETRIEVAL_QUERY"
+    ]
+
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1", "generated headline 2"],'
+          ' "descriptions": ["generated description"]}'
+      )
+  )
+  def test_generate_new_ad_copy_embeds_each_unique_keyword_once(
+      self, generative_model_patcher
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    mock_embeddings_model = self.embedding_model_patcher.mock_embeddings_model
+    mock_embeddings_model.get_embeddings.reset_mock()
+
+    responses = copycat_instance.generate_new_ad_copy(
+        keywords=["keyword 1", "keyword 2", "keyword 1"],
+        num_in_context_examples=2,
+        system_instruction_kwargs=dict(
+            company_name="My company",
+            language="english",
+        ),
+    )
+
+    self.assertLen(responses, 3)
+    self.assertIsNotNone(responses[0].evaluation_results.keyword_similarity)
+    self.assertCountEqual(
+        self._embedded_query_texts(), ["keyword 1", "keyword 2"]
+    )
+
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1", "generated headline 2"],'
+          ' "descriptions": ["generated description"]}'
+      )
+  )
+  def test_stream_new_ad_copy_yields_same_responses_as_generate_new_ad_copy(
+      self, generative_model_patcher
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    generation_params = dict(
+        keywords=[f"keyword {i}" for i in range(7)],
+        existing_headlines=[["existing headline"]] + [None] * 6,
+        style_guide="This is my style guide.",
+        num_in_context_examples=2,
+        system_instruction_kwargs=dict(
+            company_name="My company",
+            language="english",
+        ),
+    )
+
+    streamed_responses = dict(
+        copycat_instance.stream_new_ad_copy(
+            generation_scheduler=copycat.GenerationScheduler(
+                max_concurrent_requests=3
+            ),
+            **generation_params,
+        )
+    )
+    expected_responses = copycat_instance.generate_new_ad_copy(
+        **generation_params
+    )
+
+    self.assertCountEqual(streamed_responses.keys(), range(7))
+    self.assertEqual(
+        [streamed_responses[i] for i in range(7)], expected_responses
+    )
+
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1", "generated headline 2"],'
+          ' "descriptions": ["generated description"]}'
+      )
+  )
+  def test_stream_new_ad_copy_embeds_completed_ads_together(
+      self, generative_model_patcher
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    vectorstore = copycat_instance.ad_copy_vectorstore
+
+    with mock.patch.object(
+        vectorstore, "embed_documents", wraps=vectorstore.embed_documents
+    ) as mock_embed_documents:
+      streamed_responses = dict(
+          copycat_instance.stream_new_ad_copy(
+              keywords=[f"keyword {i}" for i in range(7)],
+              num_in_context_examples=2,
+              system_instruction_kwargs=dict(
+                  company_name="My company",
+                  language="english",
+              ),
+              generation_scheduler=copycat.GenerationScheduler(
+                  max_concurrent_requests=3
+              ),
+          )
+      )
+
+    self.assertCountEqual(streamed_responses.keys(), range(7))
+    mock_embed_documents.assert_called_once()
+
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1", "generated headline 2"],'
+          ' "descriptions": ["generated description"]}'
+      )
+  )
+  def test_astream_new_ad_copy_keeps_event_loop_responsive_while_embedding(
+      self, generative_model_patcher
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    vectorstore = copycat_instance.ad_copy_vectorstore
+    embed_queries = vectorstore.embed_queries
+    embedding_started = threading.Event()
+    loop_ran_while_embedding = threading.Event()
+    loop_was_responsive = []
+
+    def blocking_embed_queries(texts):
+      # Waits for the event loop to run, which it only can if the embedding
+      # does not block it.
+      embedding_started.set()
+      loop_was_responsive.append(loop_ran_while_embedding.wait(timeout=1))
+      return embed_queries(texts)
+
+    async def run_loop_while_embedding():
+      while not embedding_started.is_set():
+        await asyncio.sleep(0.001)
+      loop_ran_while_embedding.set()
+
+    async def collect():
+      responses = [
+          response
+          async for response in copycat_instance.astream_new_ad_copy(
+              keywords=["keyword 1", "keyword 2"],
+              num_in_context_examples=2,
+              system_instruction_kwargs=dict(
+                  company_name="My company",
+                  language="english",
+              ),
+          )
+      ]
+      embedding_started.set()
+      return responses
+
+    async def collect_and_run_loop():
+      responses, _ = await asyncio.gather(
+          collect(), run_loop_while_embedding()
+      )
+      return responses
+
+    with mock.patch.object(
+        vectorstore, "embed_queries", side_effect=blocking_embed_queries
+    ):
+      responses = asyncio.run(collect_and_run_loop())
+
+    self.assertLen(responses, 2)
+    self.assertEqual(loop_was_responsive, [True])
+
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1", "generated headline 2"],'
+          ' "descriptions": ["generated description"]}'
+      )
+  )
+  def test_agenerate_new_ad_copy_returns_same_responses_as_generate_new_ad_copy(
+      self, generative_model_patcher
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    generation_params = dict(
+        keywords=["keyword 1", "keyword 2", "keyword 3"],
+        style_guide="This is my style guide.",
+        num_in_context_examples=2,
+        system_instruction_kwargs=dict(
+            company_name="My company",
+            language="english",
+        ),
+    )
+
+    async def generate_concurrently():
+      return await asyncio.gather(
+          copycat_instance.agenerate_new_ad_copy(**generation_params),
+          copycat_instance.agenerate_new_ad_copy(**generation_params),
+      )
+
+    async_responses = asyncio.run(generate_concurrently())
+    expected_responses = copycat_instance.generate_new_ad_copy(
+        **generation_params
+    )
+
+    self.assertEqual(async_responses[0], expected_responses)
+    self.assertEqual(async_responses[1], expected_responses)
+
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1", "generated headline 2"],'
+          ' "descriptions": ["generated description"]}'
+      )
+  )
+  def test_generate_new_ad_copy_works_inside_running_event_loop(
+      self, generative_model_patcher
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+
+    async def generate_from_async_code():
+      return copycat_instance.generate_new_ad_copy(
+          keywords=["keyword 1", "keyword 2"],
+          style_guide="This is my style guide.",
+          num_in_context_examples=2,
+          system_instruction_kwargs=dict(
+              company_name="My company",
+              language="english",
+          ),
+      )
+
+    responses = asyncio.run(generate_from_async_code())
+
+    self.assertLen(responses, 2)
+    self.assertTrue(all(response.success for response in responses))
+
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1", "generated headline 2"],'
+          ' "descriptions": ["generated description"]}'
+      )
+  )
+  def test_astream_new_ad_copy_raises_exception_if_different_number_of_keywords_and_instructions(
+      self, generative_model_patcher
+  ):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+
+    async def collect():
+      return [
+          response
+          async for response in copycat_instance.astream_new_ad_copy(
+              keywords=["my keyword 1, my keyword 2"],
+              keywords_specific_instructions=["instructions", "another set"],
+          )
+      ]
+
+    with self.assertRaisesWithLiteralMatch(
+        ValueError,
+        "keywords and keywords_specific_instructions must have the same"
+        " length.",
+    ):
+      asyncio.run(collect())
+
   @parameterized.named_parameters(
       dict(
           testcase_name="with existing ad copy",
@@ -1081,6 +1608,8 @@ class CopycatTest(parameterized.TestCase):
                 descriptions_are_memorised=False
                 if existing_descriptions
                 else None,
+                n_memorised_headlines=0 if existing_headlines else None,
+                n_memorised_descriptions=0 if existing_descriptions else None,
                 style_similarity=None,
                 keyword_similarity=None,
             ),
@@ -1190,6 +1719,8 @@ class CopycatTest(parameterized.TestCase):
               warnings=[],
               headlines_are_memorised=expected_headlines_are_memorised,
               descriptions_are_memorised=expected_descriptions_are_memorised,
+              n_memorised_headlines=int(expected_headlines_are_memorised),
+              n_memorised_descriptions=int(expected_descriptions_are_memorised),
               style_similarity=None,
               keyword_similarity=None,
           ),
@@ -1202,8 +1733,8 @@ class CopycatTest(parameterized.TestCase):
           testcase_name="with existing ad copy",
           existing_headlines=["existing headline"],
           existing_descriptions=["existing description"],
-          expected_style_similarity=0.569982855557986,
-          expected_keyword_similarity=0.49631553094971914,
+          expected_style_similarity=0.5699828863143921,
+          expected_keyword_similarity=0.49631553888320923,
       ),
       dict(
           testcase_name="without existing ad copy",
@@ -1263,12 +1794,61 @@ class CopycatTest(parameterized.TestCase):
               descriptions_are_memorised=False
               if existing_descriptions
               else None,
+              n_memorised_headlines=0 if existing_headlines else None,
+              n_memorised_descriptions=0 if existing_descriptions else None,
               style_similarity=expected_style_similarity,
               keyword_similarity=expected_keyword_similarity,
           ),
       )
       self.assertEqual(response, expected_response)
 
+  @testing_utils.PatchGenerativeModel(
+      response=(
+          '{"headlines": ["generated headline 1", "generated headline 2"],'
+          ' "descriptions": ["generated description"]}'
+      )
+  )
+  def test_generate_new_ad_copy_returns_error_response_only_for_failed_requests(
+      self, generative_model_patcher
+  ):
+    mock_generate_content_async = (
+        generative_model_patcher.mock_generative_model.generate_content_async
+    )
+    response = mock_generate_content_async.return_value
+    mock_generate_content_async.side_effect = [
+        response,
+        api_core_exceptions.InvalidArgument("bad request"),
+        response,
+    ]
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(20),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+
+    responses = copycat_instance.generate_new_ad_copy(
+        keywords=["keyword 1", "keyword 2", "keyword 3"],
+        style_guide="This is my style guide.",
+        num_in_context_examples=2,
+        system_instruction_kwargs=dict(
+            company_name="My company",
+            language="english",
+        ),
+        generation_scheduler=copycat.GenerationScheduler(
+            max_concurrent_requests=1
+        ),
+    )
+
+    self.assertEqual(
+        [response.success for response in responses], [True, False, True]
+    )
+    self.assertEqual(
+        responses[1].error_message,
+        "- Generation failed: InvalidArgument: 400 bad request",
+    )
+    self.assertEqual(responses[1].google_ad, google_ads.GoogleAd())
+
   def test_to_dict_and_from_dict_returns_same_copycat_instance(self):
 
     copycat_instance = copycat.Copycat.create_from_pandas(
@@ -1327,6 +1907,51 @@ class CopycatTest(parameterized.TestCase):
         )
     )
 
+  @parameterized.parameters(None, "r")
+  def test_save_and_load_returns_same_copycat_instance(self, mmap_mode):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(3),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    copycat_instance.style_guide = "This is my style guide."
+    path = self.create_tempdir().full_path
+
+    copycat_instance.save(path)
+    reloaded_copycat_instance = copycat.Copycat.load(path, mmap_mode=mmap_mode)
+
+    self.assertTrue(
+        testing_utils.copycat_instances_are_equal(
+            copycat_instance, reloaded_copycat_instance
+        )
+    )
+
+  def test_add_ads_adds_valid_ads_and_drops_invalid_ads(self):
+    copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=self.training_data(3),
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    new_ads = pd.DataFrame.from_records([
+        {
+            "headlines": ["new valid headline"],
+            "descriptions": ["new valid description"],
+            "keywords": "new keyword 1",
+        },
+        {
+            "headlines": ["new invalid headline" * 10],
+            "descriptions": ["new description"],
+            "keywords": "new keyword 2",
+        },
+    ])
+
+    added_ads = copycat_instance.add_ads(new_ads, min_distance=0.0)
+
+    self.assertListEqual(added_ads["keywords"].tolist(), ["new keyword 1"])
+    self.assertEqual(copycat_instance.ad_copy_vectorstore.n_exemplars, 4)
+
   @testing_utils.PatchGenerativeModel(
       response=(
           '{"headlines": ["generated headline 1", "generated headline 2"],'
@@ -1572,6 +2197,8 @@ class CopycatTest(parameterized.TestCase):
                 warnings=[],
                 headlines_are_memorised=False,
                 descriptions_are_memorised=False,
+                n_memorised_headlines=0,
+                n_memorised_descriptions=0,
                 style_similarity=None,
                 keyword_similarity=None,
             ),
@@ -1587,6 +2214,8 @@ class CopycatTest(parameterized.TestCase):
                 warnings=[],
                 headlines_are_memorised=False,
                 descriptions_are_memorised=False,
+                n_memorised_headlines=0,
+                n_memorised_descriptions=0,
                 style_similarity=None,
                 keyword_similarity=None,
             ),
@@ -1648,6 +2277,8 @@ class CopycatTest(parameterized.TestCase):
                 warnings=[],
                 headlines_are_memorised=False,
                 descriptions_are_memorised=False,
+                n_memorised_headlines=0,
+                n_memorised_descriptions=0,
                 style_similarity=None,
                 keyword_similarity=None,
             ),
@@ -1663,6 +2294,8 @@ class CopycatTest(parameterized.TestCase):
                 warnings=[],
                 headlines_are_memorised=False,
                 descriptions_are_memorised=False,
+                n_memorised_headlines=0,
+                n_memorised_descriptions=0,
                 style_similarity=None,
                 keyword_similarity=None,
             ),
@@ -0,0 +1,288 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Caches for text embeddings, so the same text is never embedded twice."""
+
+import abc
+import collections
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+def make_cache_key(
+    text: str,
+    *,
+    embedding_model_name: str,
+    dimensionality: int,
+    task_type: str,
+) -> str:
+  """Returns the content-addressed cache key for a single embedding.
+
+  The key is a sha256 hash of the embedding model name, dimensionality, task
+  type and text, so the same text embedded with different settings is cached
+  separately.
+
+  Args:
+    text: The text that is embedded.
+    embedding_model_name: The name of the embedding model.
+    dimensionality: The dimensionality of the embedding.
+    task_type: The task type used for the embedding.
+  """
+  key_material = "\x1f".join(
+      [embedding_model_name, str(dimensionality), task_type, text]
+  )
+  return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache(abc.ABC):
+  """Abstract class for caching embeddings.
+
+  Subclasses implement the storage, this class keeps track of the hit and miss
+  counts.
+
+  Attributes:
+    max_entries: The maximum number of embeddings to store. When the cache is
+      full the least recently used embeddings are evicted.
+    hits: The number of keys that were found in the cache.
+    misses: The number of keys that were not found in the cache.
+  """
+
+  max_entries: int
+  hits: int
+  misses: int
+
+  def __init__(self, max_entries: int = 100_000):
+    """Initialises the embedding cache.
+
+    Args:
+      max_entries: The maximum number of embeddings to store.
+
+    Raises:
+      ValueError: If max_entries is not positive.
+    """
+    if max_entries <= 0:
+      LOGGER.error("max_entries must be positive, got %d.", max_entries)
+      raise ValueError(f"max_entries must be positive, got {max_entries}.")
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+
+  @abc.abstractmethod
+  def _get_many(self, keys: list[str]) -> dict[str, list[float]]:
+    """Returns the cached embeddings for the keys that exist in the cache.
+
+    Retrieving an embedding marks it as recently used.
+
+    Args:
+      keys: The cache keys to look up.
+    """
+    ...
+
+  @abc.abstractmethod
+  def _set_many(self, embeddings: dict[str, list[float]]) -> None:
+    """Stores the embeddings, evicting the least recently used if full.
+
+    Args:
+      embeddings: The embeddings to store, keyed by their cache key.
+    """
+    ...
+
+  @abc.abstractmethod
+  def __len__(self) -> int:
+    """The number of embeddings in the cache."""
+    ...
+
+  @abc.abstractmethod
+  def clear(self) -> None:
+    """Removes all embeddings from the cache."""
+    ...
+
+  def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+    """Returns the cached embeddings for the keys that exist in the cache.
+
+    Args:
+      keys: The cache keys to look up.
+
+    Returns:
+      A dict mapping the keys that were found to their embeddings. Keys that
+      were not found are omitted.
+    """
+    unique_keys = list(dict.fromkeys(keys))
+    found = self._get_many(unique_keys)
+    self.hits += len(found)
+    self.misses += len(unique_keys) - len(found)
+    return found
+
+  def set_many(self, embeddings: dict[str, list[float]]) -> None:
+    """Stores the embeddings in the cache.
+
+    Args:
+      embeddings: The embeddings to store, keyed by their cache key.
+    """
+    if embeddings:
+      self._set_many(embeddings)
+
+  @property
+  def hit_rate(self) -> float:
+    """The fraction of lookups that were found in the cache."""
+    total = self.hits + self.misses
+    return self.hits / total if total else 0.0
+
+  def stats(self) -> dict[str, int | float]:
+    """Returns the hit / miss counters and the current size of the cache."""
+    return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": self.hit_rate,
+        "size": len(self),
+        "max_entries": self.max_entries,
+    }
+
+
+class InMemoryEmbeddingCache(EmbeddingCache):
+  """An embedding cache that lives in memory for the lifetime of the process."""
+
+  def __init__(self, max_entries: int = 100_000):
+    super().__init__(max_entries=max_entries)
+    self._lock = threading.Lock()
+    self._embeddings: collections.OrderedDict[str, list[float]] = (
+        collections.OrderedDict()
+    )
+
+  def _get_many(self, keys: list[str]) -> dict[str, list[float]]:
+    found = {}
+    with self._lock:
+      for key in keys:
+        if key in self._embeddings:
+          self._embeddings.move_to_end(key)
+          found[key] = self._embeddings[key]
+    return found
+
+  def _set_many(self, embeddings: dict[str, list[float]]) -> None:
+    with self._lock:
+      for key, embedding in embeddings.items():
+        self._embeddings[key] = list(embedding)
+        self._embeddings.move_to_end(key)
+      while len(self._embeddings) > self.max_entries:
+        self._embeddings.popitem(last=False)
+
+  def __len__(self) -> int:
+    return len(self._embeddings)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._embeddings.clear()
+
+
+class SqliteEmbeddingCache(EmbeddingCache):
+  """An embedding cache persisted to a SQLite database on disk.
+
+  The embeddings are stored as float32 blobs, so the cache can be shared
+  between runs and processes. Each row records when it was last used, which is
+  used for the least recently used eviction.
+
+  Attributes:
+    path: The path to the SQLite database file.
+  """
+
+  _SQLITE_MAX_VARIABLES = 900
+
+  def __init__(self, path: str, max_entries: int = 1_000_000):
+    """Initialises the embedding cache, creating the database if required.
+
+    Args:
+      path: The path to the SQLite database file.
+      max_entries: The maximum number of embeddings to store.
+    """
+    super().__init__(max_entries=max_entries)
+    self.path = path
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    with self._connection:
+      self._connection.execute(
+          "CREATE TABLE IF NOT EXISTS embeddings ("
+          " key TEXT PRIMARY KEY,"
+          " embedding BLOB NOT NULL,"
+          " last_used REAL NOT NULL)"
+      )
+      self._connection.execute(
+          "CREATE INDEX IF NOT EXISTS embeddings_last_used"
+          " ON embeddings (last_used)"
+      )
+
+  def _get_many(self, keys: list[str]) -> dict[str, list[float]]:
+    found = {}
+    now = time.time()
+    with self._lock, self._connection:
+      for start in range(0, len(keys), self._SQLITE_MAX_VARIABLES):
+        keys_chunk = keys[start : start + self._SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(keys_chunk))
+        rows = self._connection.execute(
+            "SELECT key, embedding FROM embeddings"
+            f" WHERE key IN ({placeholders})",
+            keys_chunk,
+        ).fetchall()
+        for key, blob in rows:
+          found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        self._connection.executemany(
+            "UPDATE embeddings SET last_used = ? WHERE key = ?",
+            [(now, key) for key, _ in rows],
+        )
+    return found
+
+  def _set_many(self, embeddings: dict[str, list[float]]) -> None:
+    now = time.time()
+    with self._lock, self._connection:
+      self._connection.executemany(
+          "INSERT OR REPLACE INTO embeddings (key, embedding, last_used)"
+          " VALUES (?, ?, ?)",
+          [
+              (key, np.asarray(embedding, dtype=np.float32).tobytes(), now)
+              for key, embedding in embeddings.items()
+          ],
+      )
+      (n_rows,) = self._connection.execute(
+          "SELECT COUNT(*) FROM embeddings"
+      ).fetchone()
+      n_to_evict = n_rows - self.max_entries
+      if n_to_evict > 0:
+        LOGGER.debug("Evicting %d embeddings from the cache.", n_to_evict)
+        self._connection.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings"
+            " ORDER BY last_used ASC LIMIT ?)",
+            (n_to_evict,),
+        )
+
+  def __len__(self) -> int:
+    with self._lock:
+      (n_rows,) = self._connection.execute(
+          "SELECT COUNT(*) FROM embeddings"
+      ).fetchone()
+    return n_rows
+
+  def clear(self) -> None:
+    with self._lock, self._connection:
+      self._connection.execute("DELETE FROM embeddings")
+
+  def close(self) -> None:
+    """Closes the connection to the database."""
+    self._connection.close()
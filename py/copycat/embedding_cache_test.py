@@ -0,0 +1,174 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+from copycat import embedding_cache
+
+
+class MakeCacheKeyTest(parameterized.TestCase):
+
+  def test_same_inputs_give_same_key(self):
+    key_1 = embedding_cache.make_cache_key(
+        "my text",
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        task_type="RETRIEVAL_QUERY",
+    )
+    key_2 = embedding_cache.make_cache_key(
+        "my text",
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        task_type="RETRIEVAL_QUERY",
+    )
+    self.assertEqual(key_1, key_2)
+
+  @parameterized.named_parameters(
+      dict(
+          testcase_name="text",
+          text="other text",
+          embedding_model_name="text-embedding-004",
+          dimensionality=256,
+          task_type="RETRIEVAL_QUERY",
+      ),
+      dict(
+          testcase_name="embedding_model_name",
+          text="my text",
+          embedding_model_name="text-embedding-005",
+          dimensionality=256,
+          task_type="RETRIEVAL_QUERY",
+      ),
+      dict(
+          testcase_name="dimensionality",
+          text="my text",
+          embedding_model_name="text-embedding-004",
+          dimensionality=128,
+          task_type="RETRIEVAL_QUERY",
+      ),
+      dict(
+          testcase_name="task_type",
+          text="my text",
+          embedding_model_name="text-embedding-004",
+          dimensionality=256,
+          task_type="RETRIEVAL_DOCUMENT",
+      ),
+  )
+  def test_different_inputs_give_different_keys(
+      self, text, embedding_model_name, dimensionality, task_type
+  ):
+    key_1 = embedding_cache.make_cache_key(
+        "my text",
+        embedding_model_name="text-embedding-004",
+        dimensionality=256,
+        task_type="RETRIEVAL_QUERY",
+    )
+    key_2 = embedding_cache.make_cache_key(
+        text,
+        embedding_model_name=embedding_model_name,
+        dimensionality=dimensionality,
+        task_type=task_type,
+    )
+    self.assertNotEqual(key_1, key_2)
+
+
+class EmbeddingCacheTest(parameterized.TestCase):
+
+  def _make_cache(
+      self, cache_type: str, max_entries: int
+  ) -> embedding_cache.EmbeddingCache:
+    if cache_type == "in_memory":
+      return embedding_cache.InMemoryEmbeddingCache(max_entries=max_entries)
+    path = os.path.join(self.create_tempdir().full_path, "cache.db")
+    return embedding_cache.SqliteEmbeddingCache(path, max_entries=max_entries)
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_get_many_returns_stored_embeddings(self, cache_type):
+    cache = self._make_cache(cache_type, max_entries=10)
+    cache.set_many({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+
+    self.assertDictEqual(
+        cache.get_many(["a", "b", "c"]), {"a": [1.0, 2.0], "b": [3.0, 4.0]}
+    )
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_get_many_counts_hits_and_misses(self, cache_type):
+    cache = self._make_cache(cache_type, max_entries=10)
+    cache.set_many({"a": [1.0, 2.0]})
+
+    cache.get_many(["a", "b", "c"])
+
+    self.assertEqual(cache.hits, 1)
+    self.assertEqual(cache.misses, 2)
+    self.assertAlmostEqual(cache.hit_rate, 1 / 3)
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_least_recently_used_embeddings_are_evicted(self, cache_type):
+    cache = self._make_cache(cache_type, max_entries=2)
+    cache.set_many({"a": [1.0]})
+    cache.set_many({"b": [2.0]})
+    cache.get_many(["a"])  # "a" is now more recently used than "b".
+    cache.set_many({"c": [3.0]})
+
+    self.assertLen(cache, 2)
+    self.assertDictEqual(
+        cache.get_many(["a", "b", "c"]), {"a": [1.0], "c": [3.0]}
+    )
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_clear_removes_all_embeddings(self, cache_type):
+    cache = self._make_cache(cache_type, max_entries=10)
+    cache.set_many({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+
+    cache.clear()
+
+    self.assertEmpty(cache)
+
+  def test_sqlite_cache_is_persisted_between_instances(self):
+    path = os.path.join(self.create_tempdir().full_path, "cache.db")
+    cache = embedding_cache.SqliteEmbeddingCache(path)
+    cache.set_many({"a": [1.0, 2.0]})
+    cache.close()
+
+    reloaded_cache = embedding_cache.SqliteEmbeddingCache(path)
+
+    self.assertDictEqual(reloaded_cache.get_many(["a"]), {"a": [1.0, 2.0]})
+
+  def test_stats_returns_counters_and_size(self):
+    cache = embedding_cache.InMemoryEmbeddingCache(max_entries=10)
+    cache.set_many({"a": [1.0]})
+    cache.get_many(["a", "b"])
+
+    self.assertDictEqual(
+        cache.stats(),
+        {
+            "hits": 1,
+            "misses": 1,
+            "hit_rate": 0.5,
+            "size": 1,
+            "max_entries": 10,
+        },
+    )
+
+  def test_raises_value_error_if_max_entries_is_not_positive(self):
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, "max_entries must be positive, got 0."
+    ):
+      embedding_cache.InMemoryEmbeddingCache(max_entries=0)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,142 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Utilities for running asyncio code from synchronous code.
+
+The synchronous Copycat methods run their coroutines on a single event loop in
+a background thread, rather than on the event loop of the calling thread. This
+means they work the same inside an already running event loop (e.g. Jupyter,
+Mesop or an async web server) and in worker threads, and that concurrent calls
+from multiple threads share the same loop, and so the same chat model clients
+and generation limits.
+"""
+
+import asyncio
+from collections.abc import AsyncIterator, Coroutine, Iterator
+import logging
+import os
+import threading
+from typing import Any, TypeVar
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+T = TypeVar("T")
+
+_BACKGROUND_EVENT_LOOP: asyncio.AbstractEventLoop | None = None
+_BACKGROUND_EVENT_LOOP_LOCK = threading.Lock()
+
+
+def _reset_background_event_loop_after_fork() -> None:
+  """Forgets the background event loop in a forked child process.
+
+  Only the forking thread is copied into the child, so the loop inherited from
+  the parent is not running there, and a new one is started when needed.
+  """
+  global _BACKGROUND_EVENT_LOOP, _BACKGROUND_EVENT_LOOP_LOCK
+  _BACKGROUND_EVENT_LOOP = None
+  _BACKGROUND_EVENT_LOOP_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=_reset_background_event_loop_after_fork)
+
+
+def get_background_event_loop() -> asyncio.AbstractEventLoop:
+  """Returns the event loop running in the background thread.
+
+  The loop and its daemon thread are started on the first call, and then
+  reused for the lifetime of the process.
+  """
+  global _BACKGROUND_EVENT_LOOP
+  with _BACKGROUND_EVENT_LOOP_LOCK:
+    if _BACKGROUND_EVENT_LOOP is None or _BACKGROUND_EVENT_LOOP.is_closed():
+      loop = asyncio.new_event_loop()
+      thread = threading.Thread(
+          target=loop.run_forever, name="copycat-event-loop", daemon=True
+      )
+      thread.start()
+      _BACKGROUND_EVENT_LOOP = loop
+    return _BACKGROUND_EVENT_LOOP
+
+
+def run_in_background_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+  """Runs the coroutine on the background event loop and returns its result.
+
+  This can be called from any thread, including one with a running event loop,
+  which is blocked until the coroutine is done. Async code should await the
+  coroutine directly instead.
+
+  Args:
+    coroutine: The coroutine to run.
+
+  Returns:
+    The result of the coroutine.
+
+  Raises:
+    RuntimeError: If called from the background event loop itself, which
+      would deadlock.
+  """
+  loop = get_background_event_loop()
+  try:
+    running_loop = asyncio.get_running_loop()
+  except RuntimeError:
+    running_loop = None
+
+  if running_loop is loop:
+    coroutine.close()
+    LOGGER.error(
+        "Cannot wait for the background event loop from inside it, await the"
+        " coroutine instead."
+    )
+    raise RuntimeError(
+        "Cannot wait for the background event loop from inside it, await the"
+        " coroutine instead."
+    )
+
+  future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+  try:
+    return future.result()
+  except BaseException:
+    # Cancels the coroutine if the caller is interrupted, e.g. by a
+    # KeyboardInterrupt. This does nothing if it has already finished.
+    future.cancel()
+    raise
+
+
+def iterate_in_background_loop(
+    async_iterator: AsyncIterator[T],
+) -> Iterator[T]:
+  """Iterates over an async iterator on the background event loop.
+
+  Args:
+    async_iterator: The async iterator to iterate over. It is closed when the
+      iteration stops, if it is an async generator.
+
+  Yields:
+    The items of the async iterator.
+  """
+
+  async def get_next_item() -> T:
+    return await anext(async_iterator)
+
+  try:
+    while True:
+      try:
+        yield run_in_background_loop(get_next_item())
+      except StopAsyncIteration:
+        return
+  finally:
+    if hasattr(async_iterator, "aclose"):
+      run_in_background_loop(async_iterator.aclose())
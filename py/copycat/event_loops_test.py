@@ -0,0 +1,112 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from concurrent import futures
+import threading
+
+from absl.testing import absltest
+from absl.testing import parameterized
+
+from copycat import event_loops
+
+
+async def get_thread_name() -> str:
+  await asyncio.sleep(0)
+  return threading.current_thread().name
+
+
+class EventLoopsTest(parameterized.TestCase):
+
+  def test_run_in_background_loop_runs_on_background_thread(self):
+    thread_name = event_loops.run_in_background_loop(get_thread_name())
+
+    self.assertEqual(thread_name, "copycat-event-loop")
+
+  def test_run_in_background_loop_works_inside_running_event_loop(self):
+    async def run_from_async_code():
+      return event_loops.run_in_background_loop(get_thread_name())
+
+    thread_name = asyncio.run(run_from_async_code())
+
+    self.assertEqual(thread_name, "copycat-event-loop")
+
+  def test_run_in_background_loop_uses_same_loop_from_all_threads(self):
+    async def get_running_loop():
+      return asyncio.get_running_loop()
+
+    with futures.ThreadPoolExecutor(max_workers=4) as executor:
+      loops = list(
+          executor.map(
+              lambda _: event_loops.run_in_background_loop(get_running_loop()),
+              range(8),
+          )
+      )
+
+    self.assertLen(set(map(id, loops)), 1)
+    self.assertIs(loops[0], event_loops.get_background_event_loop())
+
+  def test_run_in_background_loop_raises_errors_from_coroutine(self):
+    async def fail():
+      raise ValueError("Some error.")
+
+    with self.assertRaisesWithLiteralMatch(ValueError, "Some error."):
+      event_loops.run_in_background_loop(fail())
+
+  def test_run_in_background_loop_raises_error_inside_background_loop(self):
+    async def run_nested():
+      event_loops.run_in_background_loop(get_thread_name())
+
+    with self.assertRaisesWithLiteralMatch(
+        RuntimeError,
+        "Cannot wait for the background event loop from inside it, await the"
+        " coroutine instead.",
+    ):
+      event_loops.run_in_background_loop(run_nested())
+
+  def test_iterate_in_background_loop_yields_all_items(self):
+    async def count(n):
+      for i in range(n):
+        await asyncio.sleep(0)
+        yield i
+
+    items = list(event_loops.iterate_in_background_loop(count(5)))
+
+    self.assertEqual(items, [0, 1, 2, 3, 4])
+
+  def test_iterate_in_background_loop_closes_generator_when_stopped_early(
+      self,
+  ):
+    closed = False
+
+    async def count_forever():
+      nonlocal closed
+      i = 0
+      try:
+        while True:
+          yield i
+          i += 1
+      finally:
+        closed = True
+
+    iterator = event_loops.iterate_in_background_loop(count_forever())
+    first_items = [next(iterator), next(iterator)]
+    iterator.close()
+
+    self.assertEqual(first_items, [0, 1])
+    self.assertTrue(closed)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,276 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scalable methods to select a fixed number of exemplars from embeddings.
+
+Unlike Affinity Propagation, which needs the full pairwise similarity matrix
+and so is quadratic in the number of ads, these methods scale linearly with the
+number of ads and select exactly the requested number of exemplars.
+"""
+
+import logging
+
+import numpy as np
+from sklearn import cluster
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+def select_kmeans_medoids(
+    embeddings: np.ndarray,
+    n_exemplars: int,
+    *,
+    random_state: int | None = None,
+) -> np.ndarray:
+  """Selects the ads closest to the centroids of mini-batch k-means clusters.
+
+  The ads are clustered into n_exemplars clusters, and the ad closest to the
+  centroid of each cluster is selected. The exemplars are representative of the
+  typical ads in the training data.
+
+  Args:
+    embeddings: The embeddings of the ads, with one row per ad.
+    n_exemplars: The number of exemplars to select. If there are fewer ads than
+      this, all the ads are selected.
+    random_state: The random state used for k-means.
+
+  Returns:
+    The row indices of the exemplar ads. There may be slightly fewer than
+    n_exemplars if some of the ads have identical embeddings.
+  """
+  n_ads = len(embeddings)
+  if n_ads <= n_exemplars:
+    return np.arange(n_ads)
+
+  embeddings = np.asarray(embeddings, dtype=np.float32)
+  kmeans = cluster.MiniBatchKMeans(
+      n_clusters=n_exemplars,
+      random_state=random_state,
+      batch_size=max(1024, 3 * n_exemplars),
+      n_init=3,
+  )
+  labels = kmeans.fit_predict(embeddings)
+  distances_to_centroid = np.linalg.norm(
+      embeddings - kmeans.cluster_centers_[labels], axis=1
+  )
+
+  # Sort by cluster and then by distance, so the first ad of each cluster is
+  # its medoid.
+  order = np.lexsort((distances_to_centroid, labels))
+  is_first_in_cluster = np.ones(n_ads, dtype=bool)
+  is_first_in_cluster[1:] = labels[order][1:] != labels[order][:-1]
+  return np.sort(order[is_first_in_cluster])
+
+
+def select_farthest_points(
+    embeddings: np.ndarray,
+    n_exemplars: int,
+    *,
+    random_state: int | None = None,
+) -> np.ndarray:
+  """Selects exemplars with the greedy farthest point (k-center) algorithm.
+
+  The first exemplar is a random ad, and then each next exemplar is the ad that
+  is furthest from all of the exemplars selected so far. The exemplars cover
+  the full range of the training data, including unusual ads, and the maximum
+  distance from any ad to its closest exemplar is at most twice the optimum.
+
+  Args:
+    embeddings: The embeddings of the ads, with one row per ad.
+    n_exemplars: The number of exemplars to select. If there are fewer ads than
+      this, all the ads are selected.
+    random_state: The random state used to choose the first exemplar.
+
+  Returns:
+    The row indices of the exemplar ads. There may be fewer than n_exemplars if
+    some of the ads have identical embeddings.
+  """
+  n_ads = len(embeddings)
+  if n_ads <= n_exemplars:
+    return np.arange(n_ads)
+
+  embeddings = np.asarray(embeddings, dtype=np.float32)
+  squared_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+
+  def squared_distances_to(index: int) -> np.ndarray:
+    return np.maximum(
+        squared_norms
+        - 2.0 * embeddings @ embeddings[index]
+        + squared_norms[index],
+        0.0,
+    )
+
+  first_index = np.random.default_rng(random_state).integers(n_ads)
+  exemplar_indices = [first_index]
+  min_squared_distances = squared_distances_to(first_index)
+  min_squared_distances[first_index] = 0.0
+  for _ in range(n_exemplars - 1):
+    next_index = int(np.argmax(min_squared_distances))
+    if min_squared_distances[next_index] == 0.0:
+      # All remaining ads are identical to an exemplar.
+      break
+    exemplar_indices.append(next_index)
+    np.minimum(
+        min_squared_distances,
+        squared_distances_to(next_index),
+        out=min_squared_distances,
+    )
+    min_squared_distances[next_index] = 0.0
+
+  return np.sort(np.asarray(exemplar_indices))
+
+
+def _min_squared_distances(
+    embeddings: np.ndarray,
+    reference_embeddings: np.ndarray,
+    chunk_size: int = 1024,
+) -> np.ndarray:
+  """Returns the squared distance from each embedding to the closest reference.
+
+  The distances are computed in chunks, so the memory used is linear in the
+  number of reference embeddings.
+
+  Args:
+    embeddings: The embeddings, with one row per item.
+    reference_embeddings: The reference embeddings, with one row per item. If
+      there are none, the distances are all infinite.
+    chunk_size: The number of embeddings to compare at once.
+  """
+  if len(reference_embeddings) == 0:
+    return np.full(len(embeddings), np.inf, dtype=np.float32)
+
+  reference_squared_norms = np.einsum(
+      "ij,ij->i", reference_embeddings, reference_embeddings
+  )
+  min_squared_distances = np.empty(len(embeddings), dtype=np.float32)
+  for start in range(0, len(embeddings), chunk_size):
+    chunk = embeddings[start : start + chunk_size]
+    squared_distances = (
+        np.einsum("ij,ij->i", chunk, chunk)[:, None]
+        - 2.0 * chunk @ reference_embeddings.T
+        + reference_squared_norms[None, :]
+    )
+    min_squared_distances[start : start + chunk_size] = np.maximum(
+        squared_distances.min(axis=1), 0.0
+    )
+  return min_squared_distances
+
+
+def typical_exemplar_distance(
+    exemplar_embeddings: np.ndarray,
+    *,
+    max_samples: int = 1000,
+    random_state: int | None = None,
+) -> float:
+  """Returns the median distance from an exemplar to its closest other exemplar.
+
+  This is a natural scale for deciding whether a new ad is close enough to the
+  existing exemplars to be represented by them. For large numbers of exemplars
+  the median is estimated from a random sample.
+
+  Args:
+    exemplar_embeddings: The embeddings of the exemplars, with one row per
+      exemplar.
+    max_samples: The maximum number of exemplars to estimate the median from.
+    random_state: The random state used to sample the exemplars.
+
+  Returns:
+    The median distance, or 0.0 if there are fewer than two exemplars.
+  """
+  n_exemplars = len(exemplar_embeddings)
+  if n_exemplars < 2:
+    return 0.0
+
+  exemplar_embeddings = np.asarray(exemplar_embeddings, dtype=np.float32)
+  sample_indices = np.arange(n_exemplars)
+  if n_exemplars > max_samples:
+    sample_indices = np.random.default_rng(random_state).choice(
+        n_exemplars, max_samples, replace=False
+    )
+
+  squared_norms = np.einsum(
+      "ij,ij->i", exemplar_embeddings, exemplar_embeddings
+  )
+  min_squared_distances = []
+  for start in range(0, len(sample_indices), 256):
+    chunk_indices = sample_indices[start : start + 256]
+    squared_distances = (
+        squared_norms[chunk_indices, None]
+        - 2.0 * exemplar_embeddings[chunk_indices] @ exemplar_embeddings.T
+        + squared_norms[None, :]
+    )
+    # Exclude the distance from each exemplar to itself.
+    squared_distances[np.arange(len(chunk_indices)), chunk_indices] = np.inf
+    min_squared_distances.append(squared_distances.min(axis=1))
+  return float(
+      np.median(np.sqrt(np.maximum(np.concatenate(min_squared_distances), 0.0)))
+  )
+
+
+def select_new_exemplars(
+    candidate_embeddings: np.ndarray,
+    exemplar_embeddings: np.ndarray,
+    *,
+    min_distance: float,
+    max_new_exemplars: int | None = None,
+) -> np.ndarray:
+  """Selects the candidate ads that are not well represented by the exemplars.
+
+  This continues the farthest point algorithm from the existing exemplars: the
+  candidate furthest from all exemplars is promoted to an exemplar, and this is
+  repeated until every remaining candidate is within min_distance of an
+  exemplar, or max_new_exemplars have been promoted. The other candidates are
+  considered to be represented by their closest exemplar.
+
+  Args:
+    candidate_embeddings: The embeddings of the candidate ads, with one row per
+      ad.
+    exemplar_embeddings: The embeddings of the existing exemplars, with one row
+      per exemplar.
+    min_distance: Candidates closer than this to an exemplar are not promoted.
+      With 0.0 every candidate is promoted, even if it has the same embedding
+      as an exemplar.
+    max_new_exemplars: The maximum number of candidates to promote, or None for
+      no limit.
+
+  Returns:
+    The row indices of the candidates to promote to exemplars.
+  """
+  candidate_embeddings = np.asarray(candidate_embeddings, dtype=np.float32)
+  min_squared_distances = _min_squared_distances(
+      candidate_embeddings, np.asarray(exemplar_embeddings, dtype=np.float32)
+  )
+  if max_new_exemplars is None or max_new_exemplars > len(
+      candidate_embeddings
+  ):
+    max_new_exemplars = len(candidate_embeddings)
+
+  new_exemplar_indices = []
+  while len(new_exemplar_indices) < max_new_exemplars:
+    next_index = int(np.argmax(min_squared_distances))
+    if min_squared_distances[next_index] < min_distance**2:
+      break
+    new_exemplar_indices.append(next_index)
+    np.minimum(
+        min_squared_distances,
+        _min_squared_distances(
+            candidate_embeddings, candidate_embeddings[[next_index]]
+        ),
+        out=min_squared_distances,
+    )
+    # Promoted candidates are never selected again, even with min_distance 0.
+    min_squared_distances[next_index] = -np.inf
+
+  return np.sort(np.asarray(new_exemplar_indices, dtype=np.int64))
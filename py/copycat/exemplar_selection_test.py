@@ -0,0 +1,174 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+from copycat import exemplar_selection
+
+
+SELECTION_FUNCTIONS = (
+    ("kmeans_medoids", exemplar_selection.select_kmeans_medoids),
+    ("farthest_point", exemplar_selection.select_farthest_points),
+)
+
+
+def clustered_embeddings(
+    n_clusters: int, n_per_cluster: int, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+  """Returns well separated clusters of embeddings and their cluster labels."""
+  rng = np.random.default_rng(seed)
+  centers = 10.0 * rng.normal(size=(n_clusters, 8))
+  embeddings = np.repeat(centers, n_per_cluster, axis=0) + rng.normal(
+      size=(n_clusters * n_per_cluster, 8)
+  )
+  labels = np.repeat(np.arange(n_clusters), n_per_cluster)
+  return embeddings, labels
+
+
+class ExemplarSelectionTest(parameterized.TestCase):
+
+  @parameterized.named_parameters(*SELECTION_FUNCTIONS)
+  def test_selects_requested_number_of_unique_exemplars(self, select):
+    embeddings, _ = clustered_embeddings(n_clusters=10, n_per_cluster=20)
+
+    exemplar_indices = select(embeddings, 15, random_state=0)
+
+    self.assertLen(exemplar_indices, 15)
+    self.assertLen(set(exemplar_indices), 15)
+    self.assertTrue(np.all(exemplar_indices < len(embeddings)))
+
+  @parameterized.named_parameters(*SELECTION_FUNCTIONS)
+  def test_selects_one_exemplar_from_each_cluster(self, select):
+    embeddings, labels = clustered_embeddings(n_clusters=10, n_per_cluster=20)
+
+    exemplar_indices = select(embeddings, 10, random_state=0)
+
+    self.assertCountEqual(labels[exemplar_indices], range(10))
+
+  @parameterized.named_parameters(*SELECTION_FUNCTIONS)
+  def test_returns_all_ads_if_fewer_than_requested(self, select):
+    embeddings, _ = clustered_embeddings(n_clusters=2, n_per_cluster=2)
+
+    exemplar_indices = select(embeddings, 10, random_state=0)
+
+    np.testing.assert_array_equal(exemplar_indices, np.arange(4))
+
+  def test_kmeans_medoids_are_the_ads_closest_to_the_cluster_centers(self):
+    embeddings = np.array([
+        [0.0, 0.0],
+        [0.1, 0.0],
+        [0.2, 0.0],
+        [10.0, 10.0],
+        [10.0, 10.1],
+        [10.0, 10.2],
+    ])
+
+    exemplar_indices = exemplar_selection.select_kmeans_medoids(
+        embeddings, 2, random_state=0
+    )
+
+    np.testing.assert_array_equal(exemplar_indices, [1, 4])
+
+  def test_farthest_points_includes_outliers(self):
+    embeddings = np.concatenate([
+        np.random.default_rng(0).normal(scale=0.1, size=(50, 2)),
+        [[100.0, 100.0]],
+    ])
+
+    exemplar_indices = exemplar_selection.select_farthest_points(
+        embeddings, 2, random_state=0
+    )
+
+    self.assertIn(50, exemplar_indices)
+
+  def test_farthest_points_stops_when_remaining_ads_are_duplicates(self):
+    embeddings = np.array([[0.0, 0.0]] * 5 + [[1.0, 1.0]] * 5)
+
+    exemplar_indices = exemplar_selection.select_farthest_points(
+        embeddings, 4, random_state=0
+    )
+
+    self.assertLen(exemplar_indices, 2)
+
+  def test_select_new_exemplars_skips_candidates_close_to_exemplars(self):
+    exemplar_embeddings = np.array([[0.0, 0.0], [10.0, 0.0]])
+    candidate_embeddings = np.array([[0.5, 0.0], [10.0, 0.5], [0.0, 10.0]])
+
+    new_exemplar_indices = exemplar_selection.select_new_exemplars(
+        candidate_embeddings, exemplar_embeddings, min_distance=1.0
+    )
+
+    np.testing.assert_array_equal(new_exemplar_indices, [2])
+
+  def test_select_new_exemplars_promotes_one_of_similar_candidates(self):
+    exemplar_embeddings = np.array([[0.0, 0.0]])
+    candidate_embeddings = np.array([[0.0, 10.0], [0.0, 10.1], [0.0, 9.9]])
+
+    new_exemplar_indices = exemplar_selection.select_new_exemplars(
+        candidate_embeddings, exemplar_embeddings, min_distance=1.0
+    )
+
+    self.assertLen(new_exemplar_indices, 1)
+
+  def test_select_new_exemplars_promotes_furthest_up_to_max(self):
+    exemplar_embeddings = np.array([[0.0, 0.0]])
+    candidate_embeddings = np.array([[0.0, 5.0], [0.0, -20.0], [20.0, 0.0]])
+
+    new_exemplar_indices = exemplar_selection.select_new_exemplars(
+        candidate_embeddings,
+        exemplar_embeddings,
+        min_distance=1.0,
+        max_new_exemplars=2,
+    )
+
+    np.testing.assert_array_equal(new_exemplar_indices, [1, 2])
+
+  def test_select_new_exemplars_promotes_all_if_there_are_no_exemplars(self):
+    candidate_embeddings = np.array([[0.0, 5.0], [0.0, -20.0], [20.0, 0.0]])
+
+    new_exemplar_indices = exemplar_selection.select_new_exemplars(
+        candidate_embeddings, np.zeros((0, 2)), min_distance=1.0
+    )
+
+    np.testing.assert_array_equal(new_exemplar_indices, [0, 1, 2])
+
+  def test_select_new_exemplars_promotes_all_with_zero_min_distance(self):
+    exemplar_embeddings = np.array([[0.0, 0.0]])
+    candidate_embeddings = np.array([[0.0, 0.0], [0.0, 5.0], [0.0, 5.0]])
+
+    new_exemplar_indices = exemplar_selection.select_new_exemplars(
+        candidate_embeddings, exemplar_embeddings, min_distance=0.0
+    )
+
+    np.testing.assert_array_equal(new_exemplar_indices, [0, 1, 2])
+
+  def test_typical_exemplar_distance_is_median_nearest_neighbor_distance(self):
+    exemplar_embeddings = np.array([[0.0], [1.0], [3.0], [7.0]])
+
+    # Nearest neighbour distances are 1, 1, 2 and 4.
+    self.assertAlmostEqual(
+        exemplar_selection.typical_exemplar_distance(exemplar_embeddings), 1.5
+    )
+
+  def test_typical_exemplar_distance_is_zero_for_one_exemplar(self):
+    self.assertEqual(
+        exemplar_selection.typical_exemplar_distance(np.array([[1.0, 2.0]])),
+        0.0,
+    )
+
+
+if __name__ == "__main__":
+  absltest.main()
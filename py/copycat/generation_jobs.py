@@ -0,0 +1,325 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs generation jobs for many Copycat instances across a process pool.
+
+Each job generates new ad copy for one Copycat instance (e.g. one advertiser
+account) with Copycat.generate_new_ad_copy_for_dataframe. The jobs run in
+parallel worker processes, so the CPU heavy parts (retrieval, evaluation and
+data shaping) use all the cores, while the rate limiters for the chat and
+embedding models are shared between the workers to keep the whole run within
+the API quota.
+
+Usage:
+```
+jobs = [
+    generation_jobs.GenerationJob(
+        job_id=account_id,
+        copycat=copycat_path,
+        data=generation_data,
+        generation_params=dict(style_guide=""),
+    )
+    for account_id, copycat_path, generation_data in accounts
+]
+results = generation_jobs.run_generation_jobs(
+    jobs, max_workers=8, generation_requests_per_minute=600
+)
+```
+"""
+
+from concurrent import futures
+import dataclasses
+import logging
+import multiprocessing
+import os
+import time
+from typing import Any
+
+import pandas as pd
+import vertexai
+
+from copycat import ad_copy_generator
+from copycat import checkpointing
+from copycat import copycat as copycat_lib
+from copycat import rate_limiting
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+@dataclasses.dataclass
+class GenerationJob:
+  """A job generating new ad copy for one Copycat instance.
+
+  Attributes:
+    job_id: The unique id of the job, e.g. the advertiser account id.
+    copycat: The serialized Copycat instance, either the path to a directory
+      written by Copycat.save (preferred, as it is memory mapped by the
+      workers) or the json string from Copycat.to_json.
+    data: The data to generate the ad copy for, with the columns expected by
+      Copycat.generate_new_ad_copy_for_dataframe.
+    generation_params: The other parameters for
+      Copycat.generate_new_ad_copy_for_dataframe, such as the column names,
+      style guide or model name.
+    checkpoint_path: The path to a SQLite database to checkpoint the responses
+      to. If set, the rows already generated in a previous run of the job are
+      skipped. If None, the responses are not checkpointed.
+  """
+
+  job_id: str
+  copycat: str
+  data: pd.DataFrame
+  generation_params: dict[str, Any] = dataclasses.field(default_factory=dict)
+  checkpoint_path: str | None = None
+
+
+@dataclasses.dataclass
+class GenerationJobResult:
+  """The result and stats of a generation job.
+
+  Attributes:
+    job_id: The id of the job.
+    responses: The CopycatResponses with the same index as the job data, or
+      None if the job failed.
+    error: The error message if the job failed, otherwise None.
+    n_rows: The number of rows in the job data.
+    n_successful: The number of successful responses.
+    load_seconds: The time taken to load the Copycat instance.
+    generation_seconds: The time taken to generate and evaluate the ad copy.
+    worker_pid: The process id of the worker that ran the job.
+  """
+
+  job_id: str
+  responses: pd.Series | None
+  error: str | None
+  n_rows: int
+  n_successful: int
+  load_seconds: float
+  generation_seconds: float
+  worker_pid: int
+
+  @property
+  def success(self) -> bool:
+    return self.error is None
+
+
+@dataclasses.dataclass
+class _WorkerState:
+  """The state shared by all the jobs run by a worker process."""
+
+  generation_scheduler: ad_copy_generator.GenerationScheduler
+  embeddings_rate_limiter: rate_limiting.RateLimiter | None
+
+
+_WORKER_STATE: _WorkerState | None = None
+
+
+def _initialize_worker(
+    generation_rate_limiters: dict[str, rate_limiting.RateLimiter],
+    embeddings_rate_limiter: rate_limiting.RateLimiter | None,
+    max_concurrent_requests_per_worker: int,
+    vertexai_init_params: dict[str, Any] | None,
+) -> None:
+  """Sets up a worker process with the shared rate limiters."""
+  global _WORKER_STATE
+  if vertexai_init_params is not None:
+    vertexai.init(**vertexai_init_params)
+  _WORKER_STATE = _WorkerState(
+      generation_scheduler=ad_copy_generator.GenerationScheduler(
+          max_concurrent_requests=max_concurrent_requests_per_worker,
+          rate_limiters=generation_rate_limiters,
+      ),
+      embeddings_rate_limiter=embeddings_rate_limiter,
+  )
+
+
+def _load_copycat(serialized_copycat: str) -> copycat_lib.Copycat:
+  """Loads a Copycat instance from a directory or a json string."""
+  if os.path.isdir(serialized_copycat):
+    return copycat_lib.Copycat.load(serialized_copycat, mmap_mode="r")
+  return copycat_lib.Copycat.from_json(serialized_copycat)
+
+
+def _run_job(job: GenerationJob) -> GenerationJobResult:
+  """Runs a single job in a worker process, capturing any error."""
+  if _WORKER_STATE is None:
+    LOGGER.error("The worker process has not been initialized.")
+    raise RuntimeError("The worker process has not been initialized.")
+
+  start_time = time.perf_counter()
+  load_seconds = 0.0
+  try:
+    copycat_instance = _load_copycat(job.copycat)
+    if _WORKER_STATE.embeddings_rate_limiter is not None:
+      copycat_instance.ad_copy_vectorstore.embeddings_rate_limiter = (
+          _WORKER_STATE.embeddings_rate_limiter
+      )
+    load_seconds = time.perf_counter() - start_time
+
+    if job.checkpoint_path is None:
+      responses = copycat_instance.generate_new_ad_copy_for_dataframe(
+          job.data,
+          generation_scheduler=_WORKER_STATE.generation_scheduler,
+          **job.generation_params,
+      )
+    else:
+      store = checkpointing.SqliteResponseStore(job.checkpoint_path)
+      try:
+        responses = checkpointing.CheckpointedGenerationJob(
+            copycat_instance, store
+        ).run(
+            job.data,
+            generation_scheduler=_WORKER_STATE.generation_scheduler,
+            **job.generation_params,
+        )
+      finally:
+        store.close()
+  except Exception as e:
+    LOGGER.exception("Generation job %s failed.", job.job_id)
+    return GenerationJobResult(
+        job_id=job.job_id,
+        responses=None,
+        error=f"{type(e).__name__}: {e}",
+        n_rows=len(job.data),
+        n_successful=0,
+        load_seconds=load_seconds,
+        generation_seconds=time.perf_counter() - start_time - load_seconds,
+        worker_pid=os.getpid(),
+    )
+
+  return GenerationJobResult(
+      job_id=job.job_id,
+      responses=responses,
+      error=None,
+      n_rows=len(job.data),
+      n_successful=int(sum(response.success for response in responses)),
+      load_seconds=load_seconds,
+      generation_seconds=time.perf_counter() - start_time - load_seconds,
+      worker_pid=os.getpid(),
+  )
+
+
+def run_generation_jobs(
+    jobs: list[GenerationJob],
+    *,
+    max_workers: int | None = None,
+    max_concurrent_requests_per_worker: int = (
+        ad_copy_generator.GENERATION_MAX_CONCURRENT_REQUESTS
+    ),
+    generation_requests_per_minute: float | None = None,
+    generation_tokens_per_minute: float | None = None,
+    embedding_requests_per_minute: float | None = None,
+    embedding_tokens_per_minute: float | None = None,
+    vertexai_init_params: dict[str, Any] | None = None,
+    start_method: str = "spawn",
+) -> list[GenerationJobResult]:
+  """Runs the generation jobs across a pool of worker processes.
+
+  The rate limits are shared between all the workers, so they apply to the
+  whole run rather than to each worker. The generation limits apply to each
+  chat model separately. A job that fails does not stop the other jobs, its
+  result contains the error instead of the responses.
+
+  Args:
+    jobs: The generation jobs to run.
+    max_workers: The number of worker processes. Defaults to the number of
+      CPUs.
+    max_concurrent_requests_per_worker: The maximum number of generation
+      requests in flight at once in each worker.
+    generation_requests_per_minute: The maximum number of generation requests
+      per minute to each chat model, or None for no limit.
+    generation_tokens_per_minute: The maximum number of (estimated) tokens per
+      minute to each chat model, or None for no limit.
+    embedding_requests_per_minute: The maximum number of embedding requests
+      per minute, or None for no limit.
+    embedding_tokens_per_minute: The maximum number of (estimated) embedding
+      tokens per minute, or None for no limit.
+    vertexai_init_params: The parameters for vertexai.init in each worker,
+      e.g. the project and location. If None, vertexai.init is not called,
+      which is only enough with the "fork" start method.
+    start_method: The multiprocessing start method for the workers. Defaults
+      to "spawn", because forking a process with running threads is unsafe.
+
+  Returns:
+    The results of the jobs, in the same order as the jobs.
+
+  Raises:
+    ValueError: If the job ids are not unique.
+  """
+  job_ids = [job.job_id for job in jobs]
+  if len(set(job_ids)) != len(job_ids):
+    LOGGER.error("The job ids must be unique.")
+    raise ValueError("The job ids must be unique.")
+
+  mp_context = multiprocessing.get_context(start_method)
+  generation_rate_limiters = {}
+  if generation_requests_per_minute or generation_tokens_per_minute:
+    generation_rate_limiters = {
+        model_name.value: rate_limiting.SharedRateLimiter(
+            requests_per_minute=generation_requests_per_minute,
+            tokens_per_minute=generation_tokens_per_minute,
+            mp_context=mp_context,
+        )
+        for model_name in ad_copy_generator.ModelName
+    }
+  embeddings_rate_limiter = None
+  if embedding_requests_per_minute or embedding_tokens_per_minute:
+    embeddings_rate_limiter = rate_limiting.SharedRateLimiter(
+        requests_per_minute=embedding_requests_per_minute,
+        tokens_per_minute=embedding_tokens_per_minute,
+        mp_context=mp_context,
+    )
+
+  results = {}
+  with futures.ProcessPoolExecutor(
+      max_workers=max_workers,
+      mp_context=mp_context,
+      initializer=_initialize_worker,
+      initargs=(
+          generation_rate_limiters,
+          embeddings_rate_limiter,
+          max_concurrent_requests_per_worker,
+          vertexai_init_params,
+      ),
+  ) as executor:
+    future_to_job_id = {
+        executor.submit(_run_job, job): job.job_id for job in jobs
+    }
+    for future in futures.as_completed(future_to_job_id):
+      result = future.result()
+      results[result.job_id] = result
+      LOGGER.info(
+          "Finished job %s (%d of %d): %d of %d rows successful in %.1f"
+          " seconds.",
+          result.job_id,
+          len(results),
+          len(jobs),
+          result.n_successful,
+          result.n_rows,
+          result.load_seconds + result.generation_seconds,
+      )
+
+  return [results[job_id] for job_id in job_ids]
+
+
+def summarize_results(results: list[GenerationJobResult]) -> pd.DataFrame:
+  """Returns the stats of each job as a dataframe, one row per job."""
+  return pd.DataFrame([
+      {
+          field.name: getattr(result, field.name)
+          for field in dataclasses.fields(result)
+          if field.name != "responses"
+      }
+      for result in results
+  ])
@@ -0,0 +1,207 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import pandas as pd
+
+from copycat import copycat
+from copycat import generation_jobs
+from copycat import testing_utils
+
+
+GENERATED_AD_JSON = (
+    '{"headlines": ["generated headline 1", "generated headline 2"],'
+    ' "descriptions": ["generated description"]}'
+)
+
+
+class GenerationJobsTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.embedding_model_patcher = testing_utils.PatchEmbeddingsModel()
+    self.embedding_model_patcher.start()
+    self.generative_model_patcher = testing_utils.PatchGenerativeModel(
+        response=GENERATED_AD_JSON
+    )
+    self.generative_model_patcher.start()
+
+    training_data = pd.DataFrame({
+        "headlines": [
+            [f"train headline {i}", f"train headline {i} (2)"]
+            for i in range(10)
+        ],
+        "descriptions": [[f"train description {i}"] for i in range(10)],
+        "keywords": [f"keyword {i}a, keyword {i}b" for i in range(10)],
+    })
+    self.copycat_instance = copycat.Copycat.create_from_pandas(
+        training_data=training_data,
+        embedding_model_name="text-embedding-004",
+        ad_format="text_ad",
+        vectorstore_exemplar_selection_method="random",
+    )
+    self.copycat_path = self.create_tempdir().full_path
+    self.copycat_instance.save(self.copycat_path)
+
+    self.generation_params = dict(
+        style_guide="This is my style guide.",
+        num_in_context_examples=2,
+        system_instruction_kwargs=dict(
+            company_name="My company",
+            language="english",
+        ),
+    )
+
+  def tearDown(self):
+    super().tearDown()
+    self.generative_model_patcher.stop()
+    self.embedding_model_patcher.stop()
+
+  def _make_job(
+      self, job_id: str, n_rows: int, copycat_json: bool = False
+  ) -> generation_jobs.GenerationJob:
+    return generation_jobs.GenerationJob(
+        job_id=job_id,
+        copycat=(
+            self.copycat_instance.to_json()
+            if copycat_json
+            else self.copycat_path
+        ),
+        data=pd.DataFrame(
+            {"keywords": [f"new keyword {i}" for i in range(n_rows)]},
+            index=[f"{job_id}_{i}" for i in range(n_rows)],
+        ),
+        generation_params=self.generation_params,
+    )
+
+  @parameterized.parameters(True, False)
+  def test_run_job_returns_responses_and_stats(self, copycat_json):
+    generation_jobs._initialize_worker({}, None, 10, None)
+    job = self._make_job("account_1", n_rows=3, copycat_json=copycat_json)
+
+    result = generation_jobs._run_job(job)
+
+    self.assertTrue(result.success)
+    self.assertIsNone(result.error)
+    self.assertListEqual(
+        result.responses.index.tolist(), job.data.index.tolist()
+    )
+    self.assertEqual(result.n_rows, 3)
+    self.assertEqual(result.n_successful, 3)
+    self.assertEqual(result.worker_pid, os.getpid())
+    self.assertGreaterEqual(result.load_seconds, 0.0)
+    self.assertGreaterEqual(result.generation_seconds, 0.0)
+
+  def test_run_job_returns_error_if_job_fails(self):
+    generation_jobs._initialize_worker({}, None, 10, None)
+    job = self._make_job("account_1", n_rows=3)
+    job.data = job.data.rename(columns={"keywords": "not_keywords"})
+
+    result = generation_jobs._run_job(job)
+
+    self.assertFalse(result.success)
+    self.assertIsNone(result.responses)
+    self.assertEqual(
+        result.error,
+        "ValueError: The dataframe does not contain the required column:"
+        " keywords",
+    )
+    self.assertEqual(result.n_successful, 0)
+
+  def test_run_job_skips_checkpointed_rows(self):
+    generation_jobs._initialize_worker({}, None, 10, None)
+    job = self._make_job("account_1", n_rows=3)
+    job.checkpoint_path = os.path.join(
+        self.create_tempdir().full_path, "responses.db"
+    )
+    first_result = generation_jobs._run_job(job)
+    mock_generative_model = self.generative_model_patcher.mock_generative_model
+    mock_generative_model.generate_content_async.reset_mock()
+
+    result = generation_jobs._run_job(job)
+
+    mock_generative_model.generate_content_async.assert_not_called()
+    self.assertTrue(result.success)
+    self.assertEqual(result.n_successful, 3)
+    self.assertListEqual(
+        result.responses.tolist(), first_result.responses.tolist()
+    )
+
+  def test_run_generation_jobs_returns_results_in_job_order(self):
+    jobs = [
+        self._make_job("account_1", n_rows=3),
+        self._make_job("account_2", n_rows=1),
+        self._make_job("account_3", n_rows=2),
+    ]
+
+    # Forking keeps the patched models in the worker processes.
+    results = generation_jobs.run_generation_jobs(
+        jobs,
+        max_workers=2,
+        generation_requests_per_minute=6000,
+        embedding_requests_per_minute=6000,
+        start_method="fork",
+    )
+
+    self.assertEqual(
+        [result.job_id for result in results],
+        ["account_1", "account_2", "account_3"],
+    )
+    self.assertEqual([result.n_successful for result in results], [3, 1, 2])
+    for job, result in zip(jobs, results):
+      self.assertListEqual(
+          result.responses.index.tolist(), job.data.index.tolist()
+      )
+      self.assertNotEqual(result.worker_pid, os.getpid())
+
+  def test_run_generation_jobs_raises_error_for_duplicate_job_ids(self):
+    jobs = [
+        self._make_job("account_1", n_rows=1),
+        self._make_job("account_1", n_rows=1),
+    ]
+
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, "The job ids must be unique."
+    ):
+      generation_jobs.run_generation_jobs(jobs)
+
+  def test_summarize_results_returns_one_row_of_stats_per_job(self):
+    generation_jobs._initialize_worker({}, None, 10, None)
+    results = [
+        generation_jobs._run_job(self._make_job("account_1", n_rows=2)),
+        generation_jobs._run_job(self._make_job("account_2", n_rows=1)),
+    ]
+
+    summary = generation_jobs.summarize_results(results)
+
+    self.assertListEqual(
+        summary.columns.tolist(),
+        [
+            "job_id",
+            "error",
+            "n_rows",
+            "n_successful",
+            "load_seconds",
+            "generation_seconds",
+            "worker_pid",
+        ],
+    )
+    self.assertListEqual(summary["n_rows"].tolist(), [2, 1])
+
+
+if __name__ == "__main__":
+  absltest.main()
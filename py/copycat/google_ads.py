@@ -14,15 +14,69 @@
 
 """Contains the objects that contain google ad copy."""
 
+from collections.abc import Iterable, Sequence
+import functools
 import re
+
+import numpy as np
+import pandas as pd
 import pydantic
 
 
+# Matches a Dynamic Keyword Insertion (in any of the supported casings) or a
+# customizer with a default value, in a single pass over the text.
+_SPECIAL_VARIABLE_PATTERN = re.compile(
+    r"\{(?:"
+    r"(?P<keyword_casing>KeyWord|Keyword|keyword|KEYWord|KeyWORD):"
+    r"(?P<keyword_default>[^}]+)"
+    r"|CUSTOMIZER\.[a-zA-Z0-9_]+:(?P<customizer_default>[^}]+)"
+    r")\}"
+)
+
+# How the default keyword is inserted for each casing of the DKI.
+_KEYWORD_CASINGS = {
+    # Title Case
+    "KeyWord": lambda keyword: keyword.title(),
+    # First Word Capitalized
+    "Keyword": lambda keyword: keyword.capitalize(),
+    # Lower Case
+    "keyword": lambda keyword: keyword.lower(),
+    # Caps First Word
+    "KEYWord": lambda keyword: (
+        keyword.split()[0].upper() + " " + " ".join(keyword.split()[1:]).title()
+    ),
+    # Caps Last Word
+    "KeyWORD": lambda keyword: (
+        " ".join(keyword.split()[:-1]).title()
+        + " "
+        + keyword.split()[-1].upper()
+    ),
+}
+
+# The maximum number of parsed texts to memoize.
+SPECIAL_VARIABLES_CACHE_SIZE = 2**16
+
+
+def _replace_special_variable(match: re.Match[str]) -> str:
+  """Returns the default value for a matched special variable."""
+  if match.group("keyword_casing") is not None:
+    return _KEYWORD_CASINGS[match.group("keyword_casing")](
+        match.group("keyword_default")
+    )
+  return match.group("customizer_default")
+
+
+@functools.lru_cache(maxsize=SPECIAL_VARIABLES_CACHE_SIZE)
+def _parse_text_with_special_variables(text: str) -> str:
+  """Replaces the special variables in a text containing a "{"."""
+  return _SPECIAL_VARIABLE_PATTERN.sub(_replace_special_variable, text)
+
+
 # See https://support.google.com/google-ads/answer/6371157
 def parse_google_ads_special_variables(text: str) -> str:
   """Replaces any special variables used by Google Ads with the default string.
 
-  First replaces dynamic keyword insertion with the default keyword. How the
+  Dynamic keyword insertion is replaced with the default keyword. How the
   text is inserted depends on the capitalization:
     "Buy {KeyWord:my keyword} now" -> "Buy My Keyword now"
     "Buy {Keyword:my keyword} now" -> "Buy My keyword now"
@@ -30,52 +84,89 @@ def parse_google_ads_special_variables(text: str) -> str:
     "Buy {KEYWord:my keyword} now" -> "Buy MY Keyword now"
     "Buy {KeyWORD:my keyword} now" -> "Buy My KEYWORD now"
 
-  Then replaces any other customizers with the default value:
+  Any other customizers are replaced with the default value:
     "Buy {CUSTOMIZER.product:my product} now" -> "Buy my product now"
 
+  All the special variables are replaced in a single scan of the text. Texts
+  without a "{" cannot contain special variables and are returned immediately,
+  and the results for other texts are memoized, because the same headlines and
+  descriptions are typically parsed many times.
+
   Args:
     text: The text to parse.
 
   Returns:
     The text with the default keyword inserted.
   """
-  # Title Case
-  pattern = r"\{KeyWord:([^}]+)\}"  # The regex pattern
-  text = re.sub(pattern, lambda m: m.group(1).title(), text)
-
-  # First Word Capitalized
-  pattern = r"\{Keyword:([^}]+)\}"  # The regex pattern
-  text = re.sub(pattern, lambda m: m.group(1).capitalize(), text)
-
-  # Lower Case
-  pattern = r"\{keyword:([^}]+)\}"  # The regex pattern
-  text = re.sub(pattern, lambda m: m.group(1).lower(), text)
-
-  # Caps First Word
-  pattern = r"\{KEYWord:([^}]+)\}"  # The regex pattern
-  text = re.sub(
-      pattern,
-      lambda m: m.group(1).split()[0].upper()
-      + " "
-      + " ".join(m.group(1).split()[1:]).title(),
-      text,
-  )
+  if "{" not in text:
+    return text
+  return _parse_text_with_special_variables(text)
+
 
-  # Caps Last Word
-  pattern = r"\{KeyWORD:([^}]+)\}"  # The regex pattern
-  text = re.sub(
-      pattern,
-      lambda m: " ".join(m.group(1).split()[:-1]).title()
-      + " "
-      + m.group(1).split()[-1].upper(),
-      text,
+def find_texts_with_special_variables(texts: Sequence[str]) -> np.ndarray:
+  """Returns the indices of the texts which may contain special variables.
+
+  These are the texts containing a "{". The texts are searched together as a
+  single string, so there is no per-text Python work unless they contain a "{".
+
+  Args:
+    texts: The texts to search.
+
+  Returns:
+    The sorted indices of the texts containing a "{".
+  """
+  joined_texts = "".join(texts)
+  if "{" not in joined_texts:
+    return np.empty(0, dtype=np.int64)
+
+  code_points = np.frombuffer(
+      joined_texts.encode("utf-32-le", "surrogatepass"), dtype=np.uint32
   )
+  lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+  text_starts = np.cumsum(lengths) - lengths
+  # Empty texts start at the same position as the next text, so each "{" is
+  # assigned to the last text starting at or before it.
+  return np.unique(
+      np.searchsorted(
+          text_starts, np.flatnonzero(code_points == ord("{")), side="right"
+      )
+      - 1
+  )
+
+
+def parse_google_ads_special_variables_batch(
+    texts: Iterable[str] | pd.Series,
+) -> list[str] | pd.Series:
+  """Replaces the special variables in many texts at once.
 
-  # Customizers
-  pattern = r"\{CUSTOMIZER\.([a-zA-Z0-9_]+):([^}]+)\}"
-  text = re.sub(pattern, lambda m: m.group(2), text)
+  Only the texts containing a "{" are parsed, and all other texts are returned
+  unchanged. The unique texts of a pandas Series are parsed once.
+
+  Args:
+    texts: The texts to parse, as an iterable of strings or a pandas Series.
+
+  Returns:
+    The parsed texts, as a pandas Series with the same index if texts is a
+    Series, otherwise as a list.
+  """
+  if isinstance(texts, pd.Series):
+    has_special_variables = texts.str.contains("{", regex=False).fillna(False)
+    if not has_special_variables.any():
+      return texts.copy()
+    parsed_texts = texts.copy()
+    parsed_texts[has_special_variables] = texts[has_special_variables].map(
+        {
+            text: _parse_text_with_special_variables(text)
+            for text in texts[has_special_variables].unique()
+        }
+    )
+    return parsed_texts
 
-  return text
+  texts = list(texts)
+  parsed_texts = texts.copy()
+  for i in find_texts_with_special_variables(texts).tolist():
+    parsed_texts[i] = _parse_text_with_special_variables(texts[i])
+  return parsed_texts
 
 
 class GoogleAd(pydantic.BaseModel):
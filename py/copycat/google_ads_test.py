@@ -14,6 +14,8 @@
 
 from absl.testing import absltest
 from absl.testing import parameterized
+import numpy as np
+import pandas as pd
 
 from copycat import google_ads
 
@@ -96,6 +98,51 @@ class GoogleAdTest(parameterized.TestCase):
     got = google_ads.parse_google_ads_special_variables(text=text)
     self.assertEqual(expected, got)
 
+  def test_parse_google_ads_special_variables_returns_text_without_braces(
+      self,
+  ):
+    text = "No special variables here"
+    self.assertIs(google_ads.parse_google_ads_special_variables(text), text)
+
+  def test_parse_google_ads_special_variables_memoizes_parsed_texts(self):
+    google_ads._parse_text_with_special_variables.cache_clear()
+
+    for _ in range(3):
+      google_ads.parse_google_ads_special_variables("Buy {KeyWord:shoes}")
+
+    cache_info = google_ads._parse_text_with_special_variables.cache_info()
+    self.assertEqual(cache_info.misses, 1)
+    self.assertEqual(cache_info.hits, 2)
+
+  def test_parse_google_ads_special_variables_batch_parses_list(self):
+    texts = ["Buy {KeyWord:running shoes}", "No DKI", "{CUSTOMIZER.x:sale}"]
+
+    self.assertListEqual(
+        google_ads.parse_google_ads_special_variables_batch(texts),
+        ["Buy Running Shoes", "No DKI", "sale"],
+    )
+
+  def test_find_texts_with_special_variables(self):
+    texts = ["", "{KeyWord:shoes}", "No DKI", "", "Buy {x} {y}", "{"]
+
+    np.testing.assert_array_equal(
+        google_ads.find_texts_with_special_variables(texts), [1, 4, 5]
+    )
+
+  def test_parse_google_ads_special_variables_batch_parses_series(self):
+    texts = pd.Series(
+        ["Buy {keyword:Running Shoes}", "No DKI", "Buy {keyword:Running Shoes}"],
+        index=[10, 11, 12],
+    )
+
+    pd.testing.assert_series_equal(
+        google_ads.parse_google_ads_special_variables_batch(texts),
+        pd.Series(
+            ["Buy running shoes", "No DKI", "Buy running shoes"],
+            index=[10, 11, 12],
+        ),
+    )
+
 
 if __name__ == "__main__":
   absltest.main()
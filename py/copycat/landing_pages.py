@@ -0,0 +1,318 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fetching the main text of landing pages for keyword instructions.
+
+Ad groups often share the same landing pages, so the pages are fetched once
+per unique url, concurrently, with a shared connection pool and a limit on the
+number of concurrent requests to each host. The extracted text can be cached on
+disk, and is revalidated with the ETag of the page so unchanged pages are not
+downloaded again.
+"""
+
+from collections.abc import Iterable
+import concurrent.futures
+import logging
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import bs4
+import requests
+from requests import adapters
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+# Tags that hold navigation, scripts and other boilerplate rather than the main
+# content of the page.
+BOILERPLATE_TAGS = (
+    "aside",
+    "button",
+    "footer",
+    "form",
+    "header",
+    "iframe",
+    "nav",
+    "noscript",
+    "script",
+    "style",
+    "svg",
+    "template",
+)
+
+DEFAULT_MAX_CONCURRENT_REQUESTS = 10
+DEFAULT_MAX_CONCURRENT_REQUESTS_PER_HOST = 2
+DEFAULT_TIMEOUT_SECONDS = 10.0
+DEFAULT_MAX_BYTES = 2_000_000
+
+
+def extract_main_text(html: bytes | str) -> str:
+  """Returns the main text of a web page, without the boilerplate.
+
+  The boilerplate tags, like scripts, navigation and footers, are removed. If
+  the page has a main or article element then only its text is kept. Blank and
+  repeated lines are dropped, and whitespace within lines is collapsed.
+
+  Args:
+    html: The html of the web page.
+  """
+  soup = bs4.BeautifulSoup(html, "html.parser")
+  for tag in soup(BOILERPLATE_TAGS):
+    tag.decompose()
+  root = soup.find("main") or soup.find("article") or soup.body or soup
+
+  lines = []
+  seen_lines = set()
+  for line in root.get_text(separator="\n").splitlines():
+    line = " ".join(line.split())
+    if line and line not in seen_lines:
+      seen_lines.add(line)
+      lines.append(line)
+  return "\n".join(lines)
+
+
+class LandingPageCache:
+  """A cache of the extracted text of landing pages, persisted with SQLite.
+
+  Each page is stored with its ETag, so it can be revalidated with a
+  conditional request, and the time it was last fetched or revalidated.
+
+  Attributes:
+    path: The path to the SQLite database file.
+  """
+
+  def __init__(self, path: str):
+    """Initialises the landing page cache, creating the database if required.
+
+    Args:
+      path: The path to the SQLite database file.
+    """
+    self.path = path
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    with self._connection:
+      self._connection.execute(
+          "CREATE TABLE IF NOT EXISTS pages ("
+          " url TEXT PRIMARY KEY,"
+          " etag TEXT,"
+          " text TEXT NOT NULL,"
+          " fetched_at REAL NOT NULL)"
+      )
+
+  def get(self, url: str) -> tuple[str | None, str, float] | None:
+    """Returns the ETag, text and fetch time of the page, or None if missing."""
+    with self._lock:
+      return self._connection.execute(
+          "SELECT etag, text, fetched_at FROM pages WHERE url = ?", (url,)
+      ).fetchone()
+
+  def set(self, url: str, etag: str | None, text: str) -> None:
+    """Stores the ETag and text of the page."""
+    with self._lock, self._connection:
+      self._connection.execute(
+          "INSERT OR REPLACE INTO pages (url, etag, text, fetched_at)"
+          " VALUES (?, ?, ?, ?)",
+          (url, etag, text, time.time()),
+      )
+
+  def __len__(self) -> int:
+    with self._lock:
+      (n_rows,) = self._connection.execute(
+          "SELECT COUNT(*) FROM pages"
+      ).fetchone()
+    return n_rows
+
+  def clear(self) -> None:
+    """Removes all the pages from the cache."""
+    with self._lock, self._connection:
+      self._connection.execute("DELETE FROM pages")
+
+  def close(self) -> None:
+    """Closes the connection to the database."""
+    self._connection.close()
+
+
+class LandingPageFetcher:
+  """Fetches the main text of landing pages concurrently.
+
+  The requests share a session, so connections to the same host are reused.
+  Each request has a timeout, and at most max_bytes of each page are
+  downloaded.
+
+  Attributes:
+    cache: The cache of the extracted text, or None to not cache the pages.
+    max_concurrent_requests: The maximum number of pages fetched at once.
+    max_concurrent_requests_per_host: The maximum number of pages fetched at
+      once from the same host.
+    timeout_seconds: The timeout for connecting to the host and for each read.
+    max_bytes: The maximum number of bytes of each page to download. Longer
+      pages are truncated.
+    max_age_seconds: Cached pages fetched more recently than this are used
+      without revalidating them. If None, cached pages are always revalidated
+      with their ETag.
+  """
+
+  def __init__(
+      self,
+      *,
+      cache: LandingPageCache | None = None,
+      max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS,
+      max_concurrent_requests_per_host: int = (
+          DEFAULT_MAX_CONCURRENT_REQUESTS_PER_HOST
+      ),
+      timeout_seconds: float = DEFAULT_TIMEOUT_SECONDS,
+      max_bytes: int = DEFAULT_MAX_BYTES,
+      max_age_seconds: float | None = None,
+  ):
+    """Initialises the landing page fetcher.
+
+    Args:
+      cache: The cache of the extracted text, or None to not cache the pages.
+      max_concurrent_requests: The maximum number of pages fetched at once.
+      max_concurrent_requests_per_host: The maximum number of pages fetched at
+        once from the same host.
+      timeout_seconds: The timeout for connecting to the host and for each
+        read.
+      max_bytes: The maximum number of bytes of each page to download.
+      max_age_seconds: Cached pages fetched more recently than this are used
+        without revalidating them. If None, cached pages are always
+        revalidated.
+
+    Raises:
+      ValueError: If any of the limits are not positive.
+    """
+    for name, value in [
+        ("max_concurrent_requests", max_concurrent_requests),
+        ("max_concurrent_requests_per_host", max_concurrent_requests_per_host),
+        ("timeout_seconds", timeout_seconds),
+        ("max_bytes", max_bytes),
+    ]:
+      if value <= 0:
+        LOGGER.error("%s must be positive, got %s.", name, value)
+        raise ValueError(f"{name} must be positive, got {value}.")
+
+    self.cache = cache
+    self.max_concurrent_requests = max_concurrent_requests
+    self.max_concurrent_requests_per_host = max_concurrent_requests_per_host
+    self.timeout_seconds = timeout_seconds
+    self.max_bytes = max_bytes
+    self.max_age_seconds = max_age_seconds
+
+    self._session = requests.Session()
+    adapter = adapters.HTTPAdapter(
+        pool_connections=max_concurrent_requests,
+        pool_maxsize=max_concurrent_requests_per_host,
+    )
+    self._session.mount("http://", adapter)
+    self._session.mount("https://", adapter)
+    self._host_semaphores: dict[str, threading.BoundedSemaphore] = {}
+    self._host_semaphores_lock = threading.Lock()
+
+  def _get_host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+    """Returns the semaphore limiting the concurrent requests to the host."""
+    host = urllib.parse.urlparse(url).netloc
+    with self._host_semaphores_lock:
+      if host not in self._host_semaphores:
+        self._host_semaphores[host] = threading.BoundedSemaphore(
+            self.max_concurrent_requests_per_host
+        )
+      return self._host_semaphores[host]
+
+  def _read_content(self, response: requests.Response) -> bytes:
+    """Reads the content of the response, up to max_bytes."""
+    chunks = []
+    n_bytes = 0
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+      chunks.append(chunk)
+      n_bytes += len(chunk)
+      if n_bytes >= self.max_bytes:
+        LOGGER.debug(
+            "Truncating %s to %d bytes.", response.url, self.max_bytes
+        )
+        break
+    return b"".join(chunks)[: self.max_bytes]
+
+  def fetch_text(self, url: str) -> str:
+    """Returns the main text of the landing page.
+
+    Args:
+      url: The url of the landing page.
+
+    Raises:
+      requests.exceptions.RequestException: If the page cannot be fetched.
+    """
+    cached_page = self.cache.get(url) if self.cache is not None else None
+    headers = {}
+    if cached_page is not None:
+      etag, text, fetched_at = cached_page
+      if (
+          self.max_age_seconds is not None
+          and time.time() - fetched_at < self.max_age_seconds
+      ):
+        return text
+      if etag:
+        headers["If-None-Match"] = etag
+
+    with self._get_host_semaphore(url), self._session.get(
+        url, headers=headers, timeout=self.timeout_seconds, stream=True
+    ) as response:
+      if response.status_code == 304 and cached_page is not None:
+        LOGGER.debug("Landing page %s is unchanged.", url)
+        self.cache.set(url, etag, text)
+        return text
+      response.raise_for_status()
+      content = self._read_content(response)
+      etag = response.headers.get("ETag")
+
+    text = extract_main_text(content)
+    if self.cache is not None:
+      self.cache.set(url, etag, text)
+    return text
+
+  def fetch_texts(
+      self, urls: Iterable[str]
+  ) -> dict[str, str | requests.exceptions.RequestException]:
+    """Fetches the main text of the landing pages concurrently.
+
+    Each unique url is only fetched once.
+
+    Args:
+      urls: The urls of the landing pages.
+
+    Returns:
+      A dictionary mapping each unique url to the main text of the page, or to
+      the error if the page could not be fetched.
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    texts = {}
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=self.max_concurrent_requests
+    ) as executor:
+      futures = {
+          executor.submit(self.fetch_text, url): url for url in unique_urls
+      }
+      for future in concurrent.futures.as_completed(futures):
+        url = futures[future]
+        try:
+          texts[url] = future.result()
+        except requests.exceptions.RequestException as e:
+          LOGGER.warning("Failed to fetch landing page %s: %r", url, e)
+          texts[url] = e
+    return texts
+
+  def close(self) -> None:
+    """Closes the connections of the session."""
+    self._session.close()
@@ -0,0 +1,237 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+from http import server
+import os
+import threading
+import time
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import requests
+
+from copycat import landing_pages
+
+
+PAGE_HTML = """
+<html>
+  <head><title>Title</title><style>body {color: red;}</style></head>
+  <body>
+    <nav>Home | Products | Contact</nav>
+    <main>
+      <h1>Running   shoes</h1>
+      <p>Lightweight running shoes.</p>
+      <p>Lightweight running shoes.</p>
+      <script>console.log("tracking");</script>
+    </main>
+    <footer>Copyright</footer>
+  </body>
+</html>
+"""
+
+
+class _LandingPageServer(server.ThreadingHTTPServer):
+  """A local web server that records the requests it receives."""
+
+  def __init__(self):
+    super().__init__(("127.0.0.1", 0), _LandingPageHandler)
+    self.lock = threading.Lock()
+    self.request_counts = collections.Counter()
+    self.n_in_flight = 0
+    self.max_in_flight = 0
+    self.response_delay_seconds = 0.0
+
+
+class _LandingPageHandler(server.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    with self.server.lock:
+      self.server.request_counts[self.path] += 1
+      self.server.n_in_flight += 1
+      self.server.max_in_flight = max(
+          self.server.max_in_flight, self.server.n_in_flight
+      )
+    try:
+      time.sleep(self.server.response_delay_seconds)
+      if self.path == "/missing":
+        self.send_response(404)
+        self.end_headers()
+        return
+      if self.path == "/etag":
+        if self.headers.get("If-None-Match") == '"v1"':
+          self.send_response(304)
+          self.end_headers()
+          return
+        body = PAGE_HTML.encode("utf-8")
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+      elif self.path == "/large":
+        body = b"<p>" + b"a" * 100_000 + b"</p>"
+        self.send_response(200)
+      else:
+        body = f"<p>Page {self.path}</p>".encode("utf-8")
+        self.send_response(200)
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+    finally:
+      with self.server.lock:
+        self.server.n_in_flight -= 1
+
+  def log_message(self, format, *args):
+    del format, args  # Unused, keep the test output clean.
+
+
+class ExtractMainTextTest(parameterized.TestCase):
+
+  def test_extract_main_text_strips_boilerplate(self):
+    self.assertEqual(
+        landing_pages.extract_main_text(PAGE_HTML),
+        "Running shoes\nLightweight running shoes.",
+    )
+
+  def test_extract_main_text_uses_body_without_main_element(self):
+    html = "<html><body><header>Menu</header><p>Some text</p></body></html>"
+
+    self.assertEqual(landing_pages.extract_main_text(html), "Some text")
+
+
+class LandingPageFetcherTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.server = _LandingPageServer()
+    self.server_thread = threading.Thread(
+        target=self.server.serve_forever, daemon=True
+    )
+    self.server_thread.start()
+    self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+    self.cache_path = os.path.join(
+        self.create_tempdir().full_path, "landing_pages.db"
+    )
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    super().tearDown()
+
+  def test_fetch_texts_fetches_each_unique_url_once(self):
+    fetcher = landing_pages.LandingPageFetcher()
+    urls = [f"{self.base_url}/page{i % 3}" for i in range(9)]
+
+    texts = fetcher.fetch_texts(urls)
+    fetcher.close()
+
+    self.assertEqual(
+        texts,
+        {f"{self.base_url}/page{i}": f"Page /page{i}" for i in range(3)},
+    )
+    self.assertEqual(
+        self.server.request_counts, {f"/page{i}": 1 for i in range(3)}
+    )
+
+  def test_fetch_texts_limits_concurrent_requests_per_host(self):
+    self.server.response_delay_seconds = 0.05
+    fetcher = landing_pages.LandingPageFetcher(
+        max_concurrent_requests=8, max_concurrent_requests_per_host=2
+    )
+
+    fetcher.fetch_texts(f"{self.base_url}/page{i}" for i in range(8))
+    fetcher.close()
+
+    self.assertEqual(self.server.max_in_flight, 2)
+
+  def test_fetch_texts_returns_error_for_failed_requests(self):
+    fetcher = landing_pages.LandingPageFetcher()
+
+    texts = fetcher.fetch_texts([f"{self.base_url}/missing"])
+    fetcher.close()
+
+    self.assertIsInstance(
+        texts[f"{self.base_url}/missing"], requests.exceptions.HTTPError
+    )
+
+  def test_fetch_text_truncates_large_pages(self):
+    fetcher = landing_pages.LandingPageFetcher(max_bytes=1000)
+
+    text = fetcher.fetch_text(f"{self.base_url}/large")
+    fetcher.close()
+
+    self.assertEqual(text, "a" * 997)
+
+  def test_fetch_text_revalidates_cached_page_with_etag(self):
+    cache = landing_pages.LandingPageCache(self.cache_path)
+    fetcher = landing_pages.LandingPageFetcher(cache=cache)
+
+    first_text = fetcher.fetch_text(f"{self.base_url}/etag")
+    with self.assertLogs(landing_pages.LOGGER, level="DEBUG") as logs:
+      second_text = fetcher.fetch_text(f"{self.base_url}/etag")
+    fetcher.close()
+    cache.close()
+
+    self.assertEqual(first_text, second_text)
+    self.assertEqual(self.server.request_counts["/etag"], 2)
+    self.assertIn("is unchanged", logs.output[0])
+
+  def test_fetch_text_uses_cached_page_within_max_age(self):
+    cache = landing_pages.LandingPageCache(self.cache_path)
+    fetcher = landing_pages.LandingPageFetcher(
+        cache=cache, max_age_seconds=3600
+    )
+
+    first_text = fetcher.fetch_text(f"{self.base_url}/page0")
+    second_text = fetcher.fetch_text(f"{self.base_url}/page0")
+    fetcher.close()
+
+    self.assertEqual(first_text, second_text)
+    self.assertEqual(self.server.request_counts["/page0"], 1)
+    self.assertLen(cache, 1)
+    cache.close()
+
+  def test_cache_is_shared_between_fetchers(self):
+    fetcher = landing_pages.LandingPageFetcher(
+        cache=landing_pages.LandingPageCache(self.cache_path),
+        max_age_seconds=3600,
+    )
+    fetcher.fetch_text(f"{self.base_url}/page0")
+    fetcher.close()
+    fetcher.cache.close()
+
+    new_fetcher = landing_pages.LandingPageFetcher(
+        cache=landing_pages.LandingPageCache(self.cache_path),
+        max_age_seconds=3600,
+    )
+    text = new_fetcher.fetch_text(f"{self.base_url}/page0")
+    new_fetcher.close()
+    new_fetcher.cache.close()
+
+    self.assertEqual(text, "Page /page0")
+    self.assertEqual(self.server.request_counts["/page0"], 1)
+
+  @parameterized.parameters(
+      "max_concurrent_requests",
+      "max_concurrent_requests_per_host",
+      "timeout_seconds",
+      "max_bytes",
+  )
+  def test_raises_error_for_non_positive_limits(self, name):
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, f"{name} must be positive, got 0."
+    ):
+      landing_pages.LandingPageFetcher(**{name: 0})
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,357 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An index of the training headlines or descriptions to detect memorisation.
+
+Generated headlines and descriptions are checked against the training texts
+after normalising them, so changes in case, whitespace or special variables do
+not hide copied text. Near duplicates are found with MinHash signatures of the
+character n-grams of each text, using locality sensitive hashing (LSH) to only
+compare each text with the few training texts that share a band of their
+signature. All the texts are processed as flat arrays, so large batches are
+checked without comparing every pair of strings.
+"""
+
+from collections.abc import Iterable, Sequence
+import logging
+
+import numpy as np
+import pandas as pd
+
+from copycat import google_ads
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+DEFAULT_NGRAM_SIZE = 3
+DEFAULT_NUM_PERMUTATIONS = 128
+DEFAULT_NUM_BANDS = 16
+DEFAULT_NEAR_DUPLICATE_THRESHOLD = 0.8
+
+# The base of the polynomial hash of the character n-grams.
+_NGRAM_HASH_BASE = np.uint64(1_000_003)
+# The number of n-grams hashed at once, which bounds the memory used for the
+# MinHash signatures.
+_MINHASH_CHUNK_SIZE = 4096
+# The number of texts whose LSH candidates are compared at once.
+_QUERY_CHUNK_SIZE = 1024
+# Joins the texts so they are normalised as a single string. It is not split
+# on by str.split(), and does not appear in ad copy.
+_TEXT_SEPARATOR = "\x00"
+# The ASCII characters other than the space that str.split() splits on.
+_ASCII_WHITESPACE = "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f"
+
+
+def normalize_texts(texts: Iterable[str]) -> list[str]:
+  """Normalises the texts so copied text is found despite small edits.
+
+  The special variables are replaced with their defaults, the texts are
+  casefolded, and whitespace is collapsed to single spaces.
+
+  Args:
+    texts: The headlines or descriptions to normalise.
+
+  Returns:
+    The normalised texts.
+  """
+  texts = google_ads.parse_google_ads_special_variables_batch(list(texts))
+  if not texts:
+    return []
+
+  # The texts are normalised as a single string, which is much faster than
+  # normalising each text.
+  joined_texts = _TEXT_SEPARATOR.join(texts).casefold()
+  if joined_texts.count(_TEXT_SEPARATOR) != len(texts) - 1:
+    # A text contains the separator, so the texts cannot be split again.
+    return [" ".join(text.casefold().split()) for text in texts]
+  if _has_irregular_whitespace(joined_texts):
+    joined_texts = (
+        " ".join(joined_texts.split())
+        .replace(" " + _TEXT_SEPARATOR, _TEXT_SEPARATOR)
+        .replace(_TEXT_SEPARATOR + " ", _TEXT_SEPARATOR)
+    )
+  return joined_texts.split(_TEXT_SEPARATOR)
+
+
+def _has_irregular_whitespace(joined_texts: str) -> bool:
+  """Returns whether any of the joined texts has whitespace to collapse."""
+  if not joined_texts.isascii():
+    return True
+  return (
+      joined_texts.startswith(" ")
+      or joined_texts.endswith(" ")
+      or "  " in joined_texts
+      or " " + _TEXT_SEPARATOR in joined_texts
+      or _TEXT_SEPARATOR + " " in joined_texts
+      or any(character in joined_texts for character in _ASCII_WHITESPACE)
+  )
+
+
+def _concatenated_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+  """Returns the concatenation of range(start, start + length) for each pair."""
+  offsets = np.cumsum(lengths) - lengths
+  return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+
+def _ngram_hashes(
+    texts: Sequence[str], ngram_size: int
+) -> tuple[np.ndarray, np.ndarray]:
+  """Hashes the character n-grams of all the texts at once.
+
+  Texts shorter than the n-gram size have a single n-gram, the whole text.
+
+  Args:
+    texts: The normalised texts.
+    ngram_size: The number of characters in each n-gram.
+
+  Returns:
+    The hashes of the n-grams of all the texts, concatenated, and the offset of
+    the first n-gram of each text.
+  """
+  lengths = np.fromiter(
+      (len(text) for text in texts), dtype=np.int64, count=len(texts)
+  )
+  # Each text is padded with zeros, so n-grams never span two texts.
+  padded_lengths = lengths + ngram_size
+  text_starts = np.cumsum(padded_lengths) - padded_lengths
+  code_points = np.zeros(padded_lengths.sum(), dtype=np.uint64)
+  code_points[_concatenated_ranges(text_starts, lengths)] = np.frombuffer(
+      "".join(texts).encode("utf-32-le"), dtype=np.uint32
+  )
+
+  n_ngrams = np.maximum(lengths - ngram_size + 1, 1)
+  ngram_starts = _concatenated_ranges(text_starts, n_ngrams)
+  hashes = np.zeros(len(ngram_starts), dtype=np.uint64)
+  for i in range(ngram_size):
+    hashes = hashes * _NGRAM_HASH_BASE + code_points[ngram_starts + i]
+  return hashes, np.cumsum(n_ngrams) - n_ngrams
+
+
+class MemorisationIndex:
+  """An index of training texts for finding copies and near duplicates.
+
+  The similarity of two texts is the Jaccard similarity of their sets of
+  character n-grams, estimated from their MinHash signatures. Each signature is
+  split into bands, and only texts with an identical band are compared, so
+  texts with a similarity above roughly (1 / num_bands) ** (1 / rows per band)
+  are very likely to be compared, and texts with a lower similarity are mostly
+  skipped.
+
+  Attributes:
+    ngram_size: The number of characters in each n-gram.
+    num_permutations: The number of hash functions in each MinHash signature.
+    num_bands: The number of bands the signatures are split into for LSH.
+  """
+
+  def __init__(
+      self,
+      texts: Iterable[str] = (),
+      *,
+      ngram_size: int = DEFAULT_NGRAM_SIZE,
+      num_permutations: int = DEFAULT_NUM_PERMUTATIONS,
+      num_bands: int = DEFAULT_NUM_BANDS,
+      seed: int = 0,
+  ):
+    """Initialises the index with the training texts.
+
+    Args:
+      texts: The training headlines or descriptions.
+      ngram_size: The number of characters in each n-gram.
+      num_permutations: The number of hash functions in each MinHash signature.
+      num_bands: The number of bands the signatures are split into for LSH.
+        Must divide num_permutations.
+      seed: The seed for the random hash functions.
+
+    Raises:
+      ValueError: If ngram_size or num_bands are not positive, or num_bands
+        does not divide num_permutations.
+    """
+    for name, value in [("ngram_size", ngram_size), ("num_bands", num_bands)]:
+      if value <= 0:
+        LOGGER.error("%s must be positive, got %s.", name, value)
+        raise ValueError(f"{name} must be positive, got {value}.")
+    if num_permutations % num_bands:
+      LOGGER.error(
+          "num_bands (%d) must divide num_permutations (%d).",
+          num_bands,
+          num_permutations,
+      )
+      raise ValueError(
+          f"num_bands ({num_bands}) must divide num_permutations"
+          f" ({num_permutations})."
+      )
+
+    self.ngram_size = ngram_size
+    self.num_permutations = num_permutations
+    self.num_bands = num_bands
+
+    rng = np.random.default_rng(seed)
+    max_uint64 = np.iinfo(np.uint64).max
+    # Multiply-shift hash functions, the multipliers must be odd.
+    self._hash_multipliers = rng.integers(
+        0, max_uint64, size=num_permutations, dtype=np.uint64, endpoint=True
+    ) | np.uint64(1)
+    self._hash_offsets = rng.integers(
+        0, max_uint64, size=num_permutations, dtype=np.uint64, endpoint=True
+    )
+    self._band_multipliers = rng.integers(
+        0,
+        max_uint64,
+        size=num_permutations // num_bands,
+        dtype=np.uint64,
+        endpoint=True,
+    ) | np.uint64(1)
+
+    self._texts = pd.Index([], dtype=object)
+    self._signatures = np.empty((0, num_permutations), dtype=np.uint32)
+    self._band_keys = np.empty((0, num_bands), dtype=np.uint64)
+    self._sorted_band_keys = self._band_keys.T
+    self._band_key_order = self._band_keys.T.astype(np.int64)
+    self.add(texts)
+
+  def __len__(self) -> int:
+    """Returns the number of unique normalised texts in the index."""
+    return len(self._texts)
+
+  def _minhash_signatures(self, texts: Sequence[str]) -> np.ndarray:
+    """Returns the MinHash signature of each normalised text."""
+    signatures = np.empty((len(texts), self.num_permutations), dtype=np.uint32)
+    if not texts:
+      return signatures
+
+    hashes, offsets = _ngram_hashes(texts, self.ngram_size)
+    # The 64 bit hashes are folded to 32 bits for the multiply-shift hashing.
+    hashes = (hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+    ends = np.append(offsets[1:], len(hashes))
+    chunk_start = 0
+    while chunk_start < len(texts):
+      chunk_stop = np.searchsorted(
+          ends, ends[chunk_start] + _MINHASH_CHUNK_SIZE, side="right"
+      )
+      chunk_stop = max(chunk_stop, chunk_start + 1)
+      first_hash = offsets[chunk_start]
+      chunk_hashes = hashes[first_hash : ends[chunk_stop - 1]]
+      # One row per hash function, so the minimum over the n-grams of each text
+      # reduces over contiguous memory, and the hashing is done in place.
+      permuted_hashes = self._hash_multipliers[:, None] * chunk_hashes
+      permuted_hashes += self._hash_offsets[:, None]
+      permuted_hashes >>= np.uint64(32)
+      signatures[chunk_start:chunk_stop] = np.minimum.reduceat(
+          permuted_hashes, offsets[chunk_start:chunk_stop] - first_hash, axis=1
+      ).T
+      chunk_start = chunk_stop
+    return signatures
+
+  def _lsh_band_keys(self, signatures: np.ndarray) -> np.ndarray:
+    """Returns the hash of each band of each signature."""
+    bands = signatures.reshape(len(signatures), self.num_bands, -1)
+    return np.einsum(
+        "ijk,k->ij", bands.astype(np.uint64), self._band_multipliers
+    )
+
+  def _max_candidate_similarities(
+      self, query_signatures: np.ndarray, band_keys: np.ndarray
+  ) -> np.ndarray:
+    """Returns the maximum similarity of each query to its LSH candidates."""
+    n_queries = len(query_signatures)
+    candidate_keys = []
+    for band in range(self.num_bands):
+      sorted_band_keys = self._sorted_band_keys[band]
+      starts = np.searchsorted(sorted_band_keys, band_keys[:, band], "left")
+      stops = np.searchsorted(sorted_band_keys, band_keys[:, band], "right")
+      n_matches = stops - starts
+      query_ids = np.repeat(np.arange(n_queries), n_matches)
+      training_ids = self._band_key_order[band][
+          _concatenated_ranges(starts, n_matches)
+      ]
+      candidate_keys.append(query_ids * len(self._signatures) + training_ids)
+
+    # Each pair of texts is compared once, even if they share several bands.
+    query_ids, training_ids = np.divmod(
+        np.unique(np.concatenate(candidate_keys)), len(self._signatures)
+    )
+    similarities = np.zeros(n_queries, dtype=np.float32)
+    np.maximum.at(
+        similarities,
+        query_ids,
+        np.mean(
+            query_signatures[query_ids] == self._signatures[training_ids],
+            axis=1,
+            dtype=np.float32,
+        ),
+    )
+    return similarities
+
+  def add(self, texts: Iterable[str]) -> None:
+    """Adds training texts to the index.
+
+    Args:
+      texts: The headlines or descriptions to add. Texts that are already in
+        the index after normalisation are ignored.
+    """
+    new_texts = pd.Index(normalize_texts(texts), dtype=object).unique()
+    new_texts = new_texts[~new_texts.isin(self._texts)]
+    if new_texts.empty:
+      return
+
+    self._texts = self._texts.append(new_texts)
+    new_signatures = self._minhash_signatures(new_texts.tolist())
+    self._signatures = np.concatenate([self._signatures, new_signatures])
+    self._band_keys = np.concatenate(
+        [self._band_keys, self._lsh_band_keys(new_signatures)]
+    )
+    self._band_key_order = np.argsort(self._band_keys, axis=0, kind="stable").T
+    self._sorted_band_keys = np.take_along_axis(
+        self._band_keys, self._band_key_order.T, axis=0
+    ).T
+
+  def contains_batch(self, texts: Sequence[str]) -> np.ndarray:
+    """Returns whether each text is in the index, after normalisation."""
+    return self._contains_normalized(normalize_texts(texts))
+
+  def _contains_normalized(self, normalized_texts: list[str]) -> np.ndarray:
+    """Returns whether each normalised text is in the index."""
+    return pd.Index(normalized_texts, dtype=object).isin(self._texts)
+
+  def max_similarity_batch(self, texts: Sequence[str]) -> np.ndarray:
+    """Estimates the similarity of each text to its nearest training text.
+
+    Only training texts which share at least one LSH band with the text are
+    compared, so a similarity of 0.0 means no similar training text was found.
+    Texts that are in the index after normalisation have a similarity of 1.0,
+    but so can different texts with the same n-grams, so use contains_batch
+    to find exact copies.
+
+    Args:
+      texts: The headlines or descriptions to check.
+
+    Returns:
+      The estimated Jaccard similarity of the character n-grams of each text
+      and the most similar training text, between 0 and 1.
+    """
+    normalized_texts = normalize_texts(texts)
+    similarities = np.zeros(len(normalized_texts), dtype=np.float32)
+    if not normalized_texts or self._texts.empty:
+      return similarities
+
+    query_signatures = self._minhash_signatures(normalized_texts)
+    band_keys = self._lsh_band_keys(query_signatures)
+    for chunk_start in range(0, len(normalized_texts), _QUERY_CHUNK_SIZE):
+      chunk = slice(chunk_start, chunk_start + _QUERY_CHUNK_SIZE)
+      similarities[chunk] = self._max_candidate_similarities(
+          query_signatures[chunk], band_keys[chunk]
+      )
+
+    similarities[self._contains_normalized(normalized_texts)] = 1.0
+    return similarities
@@ -0,0 +1,136 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+
+from copycat import memorisation
+
+
+TRAINING_TEXTS = [
+    "Buy running shoes today",
+    "Free delivery on all orders",
+    "Shop {KeyWord:trail shoes} now",
+]
+
+
+class NormalizeTextsTest(parameterized.TestCase):
+
+  def test_normalize_texts(self):
+    self.assertEqual(
+        memorisation.normalize_texts(
+            ["  Buy  RUNNING\tshoes ", "Shop {KeyWord:trail shoes} now", ""]
+        ),
+        ["buy running shoes", "shop trail shoes now", ""],
+    )
+
+  @parameterized.named_parameters(
+      ("regular_whitespace", ["buy shoes", "shop now"]),
+      ("blank_texts", ["buy shoes", " ", "", "\t shop now "]),
+      ("unicode_whitespace", ["buy\u3000shoes", "Stra\u00dfe\xa0 now"]),
+      ("separator_in_text", ["buy\x00 shoes", " shop now"]),
+  )
+  def test_normalize_texts_matches_normalizing_each_text(self, texts):
+    self.assertEqual(
+        memorisation.normalize_texts(texts),
+        [" ".join(text.casefold().split()) for text in texts],
+    )
+
+  def test_normalize_texts_returns_empty_list_for_no_texts(self):
+    self.assertEqual(memorisation.normalize_texts([]), [])
+
+
+class MemorisationIndexTest(parameterized.TestCase):
+
+  def test_index_stores_unique_normalized_texts(self):
+    index = memorisation.MemorisationIndex(
+        TRAINING_TEXTS + ["buy running  shoes TODAY"]
+    )
+
+    self.assertLen(index, 3)
+
+  def test_contains_batch_matches_normalized_texts(self):
+    index = memorisation.MemorisationIndex(TRAINING_TEXTS)
+
+    np.testing.assert_array_equal(
+        index.contains_batch([
+            "BUY running shoes today",
+            "Shop Trail Shoes now",
+            "Buy running shoes today!",
+            "Something else entirely",
+        ]),
+        [True, True, False, False],
+    )
+
+  def test_max_similarity_batch_finds_near_duplicates(self):
+    index = memorisation.MemorisationIndex(TRAINING_TEXTS)
+
+    similarities = index.max_similarity_batch([
+        "Buy running shoes today",
+        "Buy running shoes today!",
+        "Something else entirely",
+        "",
+    ])
+
+    self.assertEqual(similarities[0], 1.0)
+    self.assertGreater(similarities[1], 0.8)
+    self.assertLess(similarities[1], 1.0)
+    np.testing.assert_array_equal(similarities[2:], [0.0, 0.0])
+
+  def test_max_similarity_batch_finds_near_duplicates_in_large_index(self):
+    rng = np.random.default_rng(0)
+    words = [f"word{i}" for i in range(1000)]
+    training_texts = [" ".join(rng.choice(words, 5)) for _ in range(5000)]
+    index = memorisation.MemorisationIndex(training_texts)
+
+    similarities = index.max_similarity_batch(
+        [text + "s" for text in training_texts[:100]]
+    )
+
+    self.assertTrue(np.all(similarities >= 0.8))
+
+  def test_max_similarity_batch_returns_zeros_for_empty_index(self):
+    index = memorisation.MemorisationIndex()
+
+    np.testing.assert_array_equal(
+        index.max_similarity_batch(["Buy running shoes today"]), [0.0]
+    )
+
+  def test_add_adds_texts_to_index(self):
+    index = memorisation.MemorisationIndex(TRAINING_TEXTS[:1])
+
+    index.add(TRAINING_TEXTS)
+
+    self.assertLen(index, 3)
+    np.testing.assert_array_equal(
+        index.max_similarity_batch(TRAINING_TEXTS), [1.0, 1.0, 1.0]
+    )
+
+  @parameterized.parameters("ngram_size", "num_bands")
+  def test_raises_error_for_non_positive_parameters(self, name):
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, f"{name} must be positive, got 0."
+    ):
+      memorisation.MemorisationIndex(**{name: 0})
+
+  def test_raises_error_if_num_bands_does_not_divide_num_permutations(self):
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, "num_bands (3) must divide num_permutations (128)."
+    ):
+      memorisation.MemorisationIndex(num_bands=3)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,309 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Nearest neighbour indexes used to retrieve similar ads from embeddings."""
+
+import abc
+import enum
+import logging
+from typing import Any
+
+import numpy as np
+from sklearn import cluster
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+class NearestNeighborsIndexType(enum.Enum):
+  EUCLIDEAN = "euclidean"
+  COSINE = "cosine"
+  IVF_COSINE = "ivf_cosine"
+
+
+def _as_float32(embeddings: np.ndarray) -> np.ndarray:
+  """Returns the embeddings as float32, which is fast for matrix products."""
+  return np.asarray(embeddings, dtype=np.float32)
+
+
+def _normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+  """Returns the embeddings scaled to unit length (zero rows are unchanged)."""
+  embeddings = _as_float32(embeddings)
+  norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+  return embeddings / np.where(norms == 0.0, 1.0, norms)
+
+
+def _top_k_smallest(distances: np.ndarray, k: int) -> np.ndarray:
+  """Returns the indices of the k smallest distances in each row, sorted."""
+  if k == 1:
+    return np.argmin(distances, axis=1)[:, None]
+  if k < distances.shape[1]:
+    candidate_ids = np.argpartition(distances, k - 1, axis=1)[:, :k]
+  else:
+    candidate_ids = np.broadcast_to(
+        np.arange(distances.shape[1]), distances.shape
+    )
+  candidate_distances = np.take_along_axis(distances, candidate_ids, axis=1)
+  order = np.argsort(candidate_distances, axis=1, kind="stable")
+  return np.take_along_axis(candidate_ids, order, axis=1)
+
+
+class NearestNeighborsIndex(abc.ABC):
+  """Abstract class for a nearest neighbours index over embeddings."""
+
+  @abc.abstractmethod
+  def fit(self, embeddings: np.ndarray) -> "NearestNeighborsIndex":
+    """Builds the index from the embeddings.
+
+    Args:
+      embeddings: The embeddings to index, with one row per item.
+
+    Returns:
+      The fitted index.
+    """
+    ...
+
+  @abc.abstractmethod
+  def query(
+      self, query_embeddings: np.ndarray, k: int
+  ) -> tuple[np.ndarray, np.ndarray]:
+    """Finds the k nearest neighbours of each query embedding.
+
+    Args:
+      query_embeddings: The query embeddings, with one row per query.
+      k: The number of neighbours to return for each query. Must not be larger
+        than the number of indexed items.
+
+    Returns:
+      The distances and the row indices of the neighbours, both with shape
+      (number of queries, k), sorted from nearest to furthest.
+    """
+    ...
+
+  @abc.abstractmethod
+  def add(self, embeddings: np.ndarray) -> None:
+    """Adds embeddings to the end of a fitted index, without rebuilding it.
+
+    Args:
+      embeddings: The embeddings to add, with one row per item. They get the
+        row indices following the existing items.
+    """
+    ...
+
+  @abc.abstractmethod
+  def remove(self, indices: np.ndarray) -> None:
+    """Removes items from a fitted index, without rebuilding it.
+
+    The remaining items are renumbered so that their row indices stay
+    consecutive, matching numpy.delete on the embeddings.
+
+    Args:
+      indices: The row indices of the items to remove.
+    """
+    ...
+
+
+class EuclideanIndex(NearestNeighborsIndex):
+  """Exact nearest neighbours by euclidean distance, using brute force."""
+
+  def fit(self, embeddings: np.ndarray) -> "EuclideanIndex":
+    embeddings = _as_float32(embeddings)
+    self._embeddings = embeddings
+    self._squared_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+    return self
+
+  def add(self, embeddings: np.ndarray) -> None:
+    embeddings = _as_float32(embeddings)
+    self._embeddings = np.concatenate([self._embeddings, embeddings])
+    self._squared_norms = np.concatenate(
+        [self._squared_norms, np.einsum("ij,ij->i", embeddings, embeddings)]
+    )
+
+  def remove(self, indices: np.ndarray) -> None:
+    self._embeddings = np.delete(self._embeddings, indices, axis=0)
+    self._squared_norms = np.delete(self._squared_norms, indices)
+
+  def query(
+      self, query_embeddings: np.ndarray, k: int
+  ) -> tuple[np.ndarray, np.ndarray]:
+    query_embeddings = _as_float32(query_embeddings)
+    query_squared_norms = np.einsum(
+        "ij,ij->i", query_embeddings, query_embeddings
+    )
+    squared_distances = (
+        query_squared_norms[:, None]
+        - 2.0 * query_embeddings @ self._embeddings.T
+        + self._squared_norms[None, :]
+    )
+    squared_distances = np.maximum(squared_distances, 0.0)
+    indices = _top_k_smallest(squared_distances, k)
+    distances = np.sqrt(np.take_along_axis(squared_distances, indices, axis=1))
+    return distances, indices
+
+
+class CosineIndex(NearestNeighborsIndex):
+  """Exact nearest neighbours by cosine distance, using brute force."""
+
+  def fit(self, embeddings: np.ndarray) -> "CosineIndex":
+    self._normalized_embeddings = _normalize_rows(embeddings)
+    return self
+
+  def add(self, embeddings: np.ndarray) -> None:
+    self._normalized_embeddings = np.concatenate(
+        [self._normalized_embeddings, _normalize_rows(embeddings)]
+    )
+
+  def remove(self, indices: np.ndarray) -> None:
+    self._normalized_embeddings = np.delete(
+        self._normalized_embeddings, indices, axis=0
+    )
+
+  def query(
+      self, query_embeddings: np.ndarray, k: int
+  ) -> tuple[np.ndarray, np.ndarray]:
+    query_embeddings = _normalize_rows(query_embeddings)
+    distances = 1.0 - query_embeddings @ self._normalized_embeddings.T
+    indices = _top_k_smallest(distances, k)
+    return np.take_along_axis(distances, indices, axis=1), indices
+
+
+class IvfCosineIndex(NearestNeighborsIndex):
+  """Approximate nearest neighbours by cosine distance, with an inverted file.
+
+  The embeddings are clustered into n_lists lists with k-means. Each query is
+  only compared to the embeddings in the n_probe lists with the closest
+  centroids, which is much faster than brute force for large numbers of
+  embeddings, at the cost of sometimes missing a true nearest neighbour. If the
+  probed lists contain fewer than k embeddings, more lists are probed.
+
+  Embeddings added after the index is fit are assigned to the list with the
+  closest existing centroid; the centroids are only recomputed by fit.
+
+  Attributes:
+    n_lists: The number of lists to cluster the embeddings into. If None, this
+      is set to the square root of the number of embeddings.
+    n_probe: The number of lists to search for each query.
+    random_state: The random state used for k-means, so that the index is
+      deterministic.
+  """
+
+  def __init__(
+      self,
+      n_lists: int | None = None,
+      n_probe: int = 8,
+      random_state: int = 0,
+  ):
+    self.n_lists = n_lists
+    self.n_probe = n_probe
+    self.random_state = random_state
+
+  def fit(self, embeddings: np.ndarray) -> "IvfCosineIndex":
+    normalized_embeddings = _normalize_rows(embeddings)
+    n_embeddings = len(normalized_embeddings)
+    n_lists = self.n_lists or max(1, int(np.sqrt(n_embeddings)))
+    n_lists = min(n_lists, n_embeddings)
+
+    LOGGER.debug(
+        "Building IVF index with %d lists for %d embeddings.",
+        n_lists,
+        n_embeddings,
+    )
+    kmeans = cluster.MiniBatchKMeans(
+        n_clusters=n_lists, random_state=self.random_state, n_init=3
+    )
+    self._assignments = kmeans.fit_predict(normalized_embeddings)
+    self._centroids = _normalize_rows(kmeans.cluster_centers_)
+    self._normalized_embeddings = normalized_embeddings
+    self._build_lists()
+    return self
+
+  def _build_lists(self) -> None:
+    """Sorts the embeddings by list, so each list is a contiguous block."""
+    order = np.argsort(self._assignments, kind="stable")
+    self._list_offsets = np.searchsorted(
+        self._assignments[order], np.arange(len(self._centroids) + 1)
+    )
+    self._ids = order
+    self._sorted_embeddings = self._normalized_embeddings[order]
+
+  def add(self, embeddings: np.ndarray) -> None:
+    normalized_embeddings = _normalize_rows(embeddings)
+    assignments = np.argmax(normalized_embeddings @ self._centroids.T, axis=1)
+    self._normalized_embeddings = np.concatenate(
+        [self._normalized_embeddings, normalized_embeddings]
+    )
+    self._assignments = np.concatenate([self._assignments, assignments])
+    self._build_lists()
+
+  def remove(self, indices: np.ndarray) -> None:
+    self._normalized_embeddings = np.delete(
+        self._normalized_embeddings, indices, axis=0
+    )
+    self._assignments = np.delete(self._assignments, indices)
+    self._build_lists()
+
+  def query(
+      self, query_embeddings: np.ndarray, k: int
+  ) -> tuple[np.ndarray, np.ndarray]:
+    query_embeddings = _normalize_rows(query_embeddings)
+    list_order = np.argsort(-(query_embeddings @ self._centroids.T), axis=1)
+    list_sizes = np.diff(self._list_offsets)
+
+    all_distances = np.empty((len(query_embeddings), k), dtype=np.float64)
+    all_indices = np.empty((len(query_embeddings), k), dtype=np.int64)
+    for i, (query_embedding, lists) in enumerate(
+        zip(query_embeddings, list_order)
+    ):
+      cumulative_sizes = np.cumsum(list_sizes[lists])
+      n_probe = max(
+          self.n_probe, int(np.searchsorted(cumulative_sizes, k) + 1)
+      )
+      positions = np.concatenate([
+          np.arange(self._list_offsets[l], self._list_offsets[l + 1])
+          for l in lists[:n_probe]
+      ])
+      distances = 1.0 - self._sorted_embeddings[positions] @ query_embedding
+      top_k = _top_k_smallest(distances[None, :], k)[0]
+      all_distances[i] = distances[top_k]
+      all_indices[i] = self._ids[positions[top_k]]
+    return all_distances, all_indices
+
+
+def create_index(
+    index_type: str | NearestNeighborsIndexType,
+    **index_params: Any,
+) -> NearestNeighborsIndex:
+  """Creates an empty nearest neighbours index of the requested type.
+
+  Args:
+    index_type: The type of index to create.
+    **index_params: Parameters passed to the index, only used by the
+      "ivf_cosine" index (see IvfCosineIndex).
+
+  Returns:
+    The nearest neighbours index, which must be fit before it is queried.
+
+  Raises:
+    ValueError: If the index type is not supported.
+  """
+  index_type = NearestNeighborsIndexType(index_type)
+  if index_type is NearestNeighborsIndexType.EUCLIDEAN:
+    return EuclideanIndex()
+  elif index_type is NearestNeighborsIndexType.COSINE:
+    return CosineIndex()
+  elif index_type is NearestNeighborsIndexType.IVF_COSINE:
+    return IvfCosineIndex(**index_params)
+  else:
+    LOGGER.error("Unsupported nearest neighbors index type: %s", index_type)
+    raise ValueError(f"Unsupported nearest neighbors index type: {index_type}")
@@ -0,0 +1,221 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from absl.testing import absltest
+from absl.testing import parameterized
+import numpy as np
+from sklearn import neighbors
+
+from copycat import nearest_neighbors
+
+
+def random_embeddings(n: int, dimensionality: int, seed: int) -> np.ndarray:
+  return np.random.default_rng(seed).normal(size=(n, dimensionality))
+
+
+class NearestNeighborsIndexTest(parameterized.TestCase):
+
+  def test_euclidean_index_matches_sklearn(self):
+    embeddings = random_embeddings(200, 16, seed=0)
+    queries = random_embeddings(10, 16, seed=1)
+
+    distances, indices = (
+        nearest_neighbors.EuclideanIndex().fit(embeddings).query(queries, k=5)
+    )
+    expected_distances, expected_indices = (
+        neighbors.NearestNeighbors().fit(embeddings).kneighbors(queries, 5)
+    )
+
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, rtol=1e-4)
+
+  def test_cosine_index_matches_sklearn(self):
+    embeddings = random_embeddings(200, 16, seed=0)
+    queries = random_embeddings(10, 16, seed=1)
+
+    distances, indices = (
+        nearest_neighbors.CosineIndex().fit(embeddings).query(queries, k=5)
+    )
+    expected_distances, expected_indices = (
+        neighbors.NearestNeighbors(metric="cosine", algorithm="brute")
+        .fit(embeddings)
+        .kneighbors(queries, 5)
+    )
+
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+  def test_ivf_cosine_index_is_exact_when_probing_all_lists(self):
+    embeddings = random_embeddings(200, 16, seed=0)
+    queries = random_embeddings(10, 16, seed=1)
+
+    _, indices = (
+        nearest_neighbors.IvfCosineIndex(n_lists=8, n_probe=8)
+        .fit(embeddings)
+        .query(queries, k=5)
+    )
+    _, expected_indices = (
+        nearest_neighbors.CosineIndex().fit(embeddings).query(queries, k=5)
+    )
+
+    np.testing.assert_array_equal(indices, expected_indices)
+
+  def test_ivf_cosine_index_has_high_recall_when_probing_some_lists(self):
+    # Clustered data, like real ad embeddings, so that the lists are meaningful.
+    centers = random_embeddings(20, 16, seed=0)
+    embeddings = np.repeat(centers, 50, axis=0) + 0.1 * random_embeddings(
+        1000, 16, seed=1
+    )
+    queries = embeddings[::50] + 0.05 * random_embeddings(20, 16, seed=2)
+
+    _, indices = (
+        nearest_neighbors.IvfCosineIndex(n_lists=20, n_probe=3)
+        .fit(embeddings)
+        .query(queries, k=10)
+    )
+    _, expected_indices = (
+        nearest_neighbors.CosineIndex().fit(embeddings).query(queries, k=10)
+    )
+
+    recall = np.mean([
+        len(set(row) & set(expected_row)) / 10
+        for row, expected_row in zip(indices, expected_indices)
+    ])
+    self.assertGreater(recall, 0.9)
+
+  def test_ivf_cosine_index_probes_more_lists_if_needed_to_return_k(self):
+    embeddings = random_embeddings(50, 8, seed=0)
+    queries = random_embeddings(3, 8, seed=1)
+
+    distances, indices = (
+        nearest_neighbors.IvfCosineIndex(n_lists=10, n_probe=1)
+        .fit(embeddings)
+        .query(queries, k=20)
+    )
+
+    self.assertEqual(indices.shape, (3, 20))
+    for row in indices:
+      self.assertLen(set(row), 20)
+    self.assertTrue(np.all(np.diff(distances, axis=1) >= 0))
+
+  @parameterized.parameters("euclidean", "cosine", "ivf_cosine")
+  def test_query_returns_all_items_if_k_equals_number_of_items(
+      self, index_type
+  ):
+    embeddings = random_embeddings(5, 4, seed=0)
+    queries = random_embeddings(2, 4, seed=1)
+
+    _, indices = (
+        nearest_neighbors.create_index(index_type)
+        .fit(embeddings)
+        .query(queries, k=5)
+    )
+
+    for row in indices:
+      self.assertCountEqual(row, range(5))
+
+  @parameterized.parameters(
+      ("euclidean", {}),
+      ("cosine", {}),
+      ("ivf_cosine", {"n_lists": 4, "n_probe": 4}),
+  )
+  def test_add_gives_same_results_as_fitting_all_embeddings(
+      self, index_type, index_params
+  ):
+    embeddings = random_embeddings(100, 8, seed=0)
+    queries = random_embeddings(5, 8, seed=1)
+
+    index = nearest_neighbors.create_index(index_type, **index_params)
+    index.fit(embeddings[:60])
+    index.add(embeddings[60:])
+    distances, indices = index.query(queries, k=10)
+
+    expected_index = nearest_neighbors.create_index(index_type, **index_params)
+    expected_distances, expected_indices = expected_index.fit(
+        embeddings
+    ).query(queries, k=10)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+  @parameterized.parameters(
+      ("euclidean", {}),
+      ("cosine", {}),
+      ("ivf_cosine", {"n_lists": 4, "n_probe": 4}),
+  )
+  def test_remove_gives_same_results_as_fitting_remaining_embeddings(
+      self, index_type, index_params
+  ):
+    embeddings = random_embeddings(100, 8, seed=0)
+    queries = random_embeddings(5, 8, seed=1)
+    removed_indices = np.arange(0, 100, 3)
+
+    index = nearest_neighbors.create_index(index_type, **index_params)
+    index.fit(embeddings)
+    index.remove(removed_indices)
+    distances, indices = index.query(queries, k=10)
+
+    expected_index = nearest_neighbors.create_index(index_type, **index_params)
+    expected_distances, expected_indices = expected_index.fit(
+        np.delete(embeddings, removed_indices, axis=0)
+    ).query(queries, k=10)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances, atol=1e-5)
+
+  @parameterized.parameters(np.float16, np.float32, np.float64)
+  def test_query_supports_embeddings_dtype(self, dtype):
+    embeddings = random_embeddings(20, 4, seed=0).astype(dtype)
+
+    _, indices = (
+        nearest_neighbors.CosineIndex().fit(embeddings).query(embeddings, k=1)
+    )
+
+    np.testing.assert_array_equal(indices[:, 0], np.arange(20))
+
+  @parameterized.named_parameters(
+      dict(
+          testcase_name="euclidean",
+          index_type="euclidean",
+          expected_class=nearest_neighbors.EuclideanIndex,
+      ),
+      dict(
+          testcase_name="cosine",
+          index_type="cosine",
+          expected_class=nearest_neighbors.CosineIndex,
+      ),
+      dict(
+          testcase_name="ivf_cosine",
+          index_type=nearest_neighbors.NearestNeighborsIndexType.IVF_COSINE,
+          expected_class=nearest_neighbors.IvfCosineIndex,
+      ),
+  )
+  def test_create_index_returns_index_of_requested_type(
+      self, index_type, expected_class
+  ):
+    self.assertIsInstance(
+        nearest_neighbors.create_index(index_type), expected_class
+    )
+
+  def test_create_index_passes_params_to_ivf_cosine_index(self):
+    index = nearest_neighbors.create_index("ivf_cosine", n_lists=4, n_probe=2)
+
+    self.assertEqual(index.n_lists, 4)
+    self.assertEqual(index.n_probe, 2)
+
+  def test_create_index_raises_value_error_for_unknown_index_type(self):
+    with self.assertRaises(ValueError):
+      nearest_neighbors.create_index("unknown")
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,315 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rate limiting and retry utilities for calls to the Vertex AI APIs."""
+
+import asyncio
+import logging
+import multiprocessing
+from multiprocessing import context as multiprocessing_context
+import threading
+import time
+from typing import Any
+
+from google.api_core import exceptions as api_core_exceptions
+import tenacity
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+# Errors that are worth retrying, because they are caused by quota or temporary
+# unavailability of the service rather than by the request itself.
+TRANSIENT_ERRORS = (
+    api_core_exceptions.TooManyRequests,
+    api_core_exceptions.ResourceExhausted,
+    api_core_exceptions.ServiceUnavailable,
+    api_core_exceptions.InternalServerError,
+    api_core_exceptions.DeadlineExceeded,
+)
+
+# The rough number of characters per token, used to estimate the number of
+# tokens in a text without calling the token counting API.
+CHARACTERS_PER_TOKEN = 4
+
+
+class _TokenBucket:
+  """A token bucket that refills continuously at a fixed rate.
+
+  The bucket holds at most one second's worth of capacity, so requests are
+  spread evenly across the minute rather than being sent in a single burst.
+  """
+
+  def __init__(self, rate_per_minute: float, now: float):
+    self.rate_per_second = rate_per_minute / 60.0
+    self.capacity = max(1.0, self.rate_per_second)
+    self.level = self.capacity
+    self.last_refill = now
+
+  def _refill(self, now: float) -> None:
+    elapsed = max(0.0, now - self.last_refill)
+    self.level = min(self.capacity, self.level + elapsed * self.rate_per_second)
+    self.last_refill = now
+
+  def seconds_until_available(self, amount: float, now: float) -> float:
+    """Returns how long to wait until the amount can be consumed.
+
+    Amounts larger than the capacity only need the bucket to be full, and
+    then leave it in debt, so that very large requests are still possible.
+
+    Args:
+      amount: The amount to consume.
+      now: The current time in seconds.
+    """
+    self._refill(now)
+    required = min(amount, self.capacity)
+    if self.level >= required:
+      return 0.0
+    return (required - self.level) / self.rate_per_second
+
+  def consume(self, amount: float) -> None:
+    self.level -= amount
+
+
+class RateLimiter:
+  """A thread-safe rate limiter for requests and tokens per minute.
+
+  The same rate limiter can be shared between multiple threads, vectorstores
+  or Copycat instances, to keep them all within the same quota.
+
+  Attributes:
+    requests_per_minute: The maximum number of requests per minute, or None for
+      no limit.
+    tokens_per_minute: The maximum number of tokens per minute, or None for no
+      limit.
+  """
+
+  def __init__(
+      self,
+      requests_per_minute: float | None = None,
+      tokens_per_minute: float | None = None,
+  ):
+    """Initialises the rate limiter.
+
+    Args:
+      requests_per_minute: The maximum number of requests per minute, or None
+        for no limit.
+      tokens_per_minute: The maximum number of tokens per minute, or None for
+        no limit.
+
+    Raises:
+      ValueError: If either of the limits is not positive.
+    """
+    for name, value in [
+        ("requests_per_minute", requests_per_minute),
+        ("tokens_per_minute", tokens_per_minute),
+    ]:
+      if value is not None and value <= 0:
+        LOGGER.error("%s must be positive, got %s.", name, value)
+        raise ValueError(f"{name} must be positive, got {value}.")
+
+    self.requests_per_minute = requests_per_minute
+    self.tokens_per_minute = tokens_per_minute
+    self._lock = threading.Lock()
+
+    now = time.monotonic()
+    self._request_bucket = (
+        _TokenBucket(requests_per_minute, now) if requests_per_minute else None
+    )
+    self._token_bucket = (
+        _TokenBucket(tokens_per_minute, now) if tokens_per_minute else None
+    )
+
+  def _try_acquire(self, tokens: int) -> float:
+    """Consumes the capacity if available, otherwise returns the wait time."""
+    buckets_and_amounts = [
+        (bucket, amount)
+        for bucket, amount in [
+            (self._request_bucket, 1),
+            (self._token_bucket, tokens),
+        ]
+        if bucket is not None
+    ]
+    with self._lock:
+      now = time.monotonic()
+      wait_seconds = max(
+          [
+              bucket.seconds_until_available(amount, now)
+              for bucket, amount in buckets_and_amounts
+          ],
+          default=0.0,
+      )
+      if wait_seconds <= 0.0:
+        for bucket, amount in buckets_and_amounts:
+          bucket.consume(amount)
+    return wait_seconds
+
+  def acquire(self, tokens: int = 0) -> None:
+    """Blocks until a request with the given number of tokens can be sent.
+
+    Args:
+      tokens: The (estimated) number of tokens in the request.
+    """
+    while (wait_seconds := self._try_acquire(tokens)) > 0.0:
+      LOGGER.debug("Rate limit reached, waiting %.2f seconds.", wait_seconds)
+      time.sleep(wait_seconds)
+
+  async def acquire_async(self, tokens: int = 0) -> None:
+    """Waits without blocking the event loop until a request can be sent.
+
+    Args:
+      tokens: The (estimated) number of tokens in the request.
+    """
+    while (wait_seconds := self._try_acquire(tokens)) > 0.0:
+      LOGGER.debug("Rate limit reached, waiting %.2f seconds.", wait_seconds)
+      await asyncio.sleep(wait_seconds)
+
+
+class SharedRateLimiter(RateLimiter):
+  """A rate limiter that can be shared between processes.
+
+  The state of the token buckets is kept in shared memory, so all the processes
+  that share the rate limiter stay within the same quota. It must be passed to
+  the other processes when they are started, e.g. through the initializer of a
+  ProcessPoolExecutor, because shared memory cannot be pickled afterwards.
+  """
+
+  def __init__(
+      self,
+      requests_per_minute: float | None = None,
+      tokens_per_minute: float | None = None,
+      *,
+      mp_context: multiprocessing_context.BaseContext | None = None,
+  ):
+    """Initialises the shared rate limiter.
+
+    Args:
+      requests_per_minute: The maximum number of requests per minute, or None
+        for no limit.
+      tokens_per_minute: The maximum number of tokens per minute, or None for
+        no limit.
+      mp_context: The multiprocessing context used to start the processes.
+        Defaults to the default context.
+
+    Raises:
+      ValueError: If either of the limits is not positive.
+    """
+    super().__init__(
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+    )
+    mp_context = mp_context or multiprocessing.get_context()
+    # The level and last refill time of the request and token buckets.
+    self._shared_state = mp_context.Array("d", 4)
+    self._save_state()
+
+  def _buckets(self) -> list[_TokenBucket | None]:
+    return [self._request_bucket, self._token_bucket]
+
+  def _load_state(self) -> None:
+    for i, bucket in enumerate(self._buckets()):
+      if bucket is not None:
+        bucket.level = self._shared_state[2 * i]
+        bucket.last_refill = self._shared_state[2 * i + 1]
+
+  def _save_state(self) -> None:
+    for i, bucket in enumerate(self._buckets()):
+      if bucket is not None:
+        self._shared_state[2 * i] = bucket.level
+        self._shared_state[2 * i + 1] = bucket.last_refill
+
+  def _try_acquire(self, tokens: int) -> float:
+    with self._shared_state.get_lock():
+      self._load_state()
+      wait_seconds = super()._try_acquire(tokens)
+      self._save_state()
+    return wait_seconds
+
+  def __getstate__(self) -> dict[str, Any]:
+    state = self.__dict__.copy()
+    del state["_lock"]
+    return state
+
+  def __setstate__(self, state: dict[str, Any]) -> None:
+    self.__dict__.update(state)
+    self._lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+  """Returns a rough estimate of the number of tokens in the text.
+
+  This uses the rule of thumb that one token is around four characters, which
+  is good enough for rate limiting without calling the token counting API.
+
+  Args:
+    text: The text to estimate the number of tokens for.
+  """
+  return max(1, len(text) // CHARACTERS_PER_TOKEN)
+
+
+def retry_on_transient_errors(
+    max_attempts: int,
+    max_wait_seconds: float = 60.0,
+) -> tenacity.Retrying:
+  """Returns a retrying context for transient errors with jittered backoff.
+
+  Usage:
+  ```
+  for attempt in retry_on_transient_errors(max_attempts=5):
+    with attempt:
+      response = model.get_embeddings(inputs)
+  ```
+
+  Args:
+    max_attempts: The maximum number of attempts, including the first one.
+    max_wait_seconds: The maximum time to wait between attempts.
+  """
+  return tenacity.Retrying(
+      retry=tenacity.retry_if_exception_type(TRANSIENT_ERRORS),
+      wait=tenacity.wait_random_exponential(multiplier=1, max=max_wait_seconds),
+      stop=tenacity.stop_after_attempt(max_attempts),
+      before_sleep=tenacity.before_sleep_log(LOGGER, logging.WARNING),
+      reraise=True,
+  )
+
+
+def async_retry_on_transient_errors(
+    max_attempts: int,
+    max_wait_seconds: float = 60.0,
+    transient_errors: tuple[type[Exception], ...] = TRANSIENT_ERRORS,
+) -> tenacity.AsyncRetrying:
+  """Returns an async retrying context for transient errors.
+
+  This is the asyncio version of retry_on_transient_errors, which waits
+  between attempts without blocking the event loop.
+
+  Usage:
+  ```
+  async for attempt in async_retry_on_transient_errors(max_attempts=5):
+    with attempt:
+      response = await model.generate_content_async(prompt)
+  ```
+
+  Args:
+    max_attempts: The maximum number of attempts, including the first one.
+    max_wait_seconds: The maximum time to wait between attempts.
+    transient_errors: The errors to retry.
+  """
+  return tenacity.AsyncRetrying(
+      retry=tenacity.retry_if_exception_type(transient_errors),
+      wait=tenacity.wait_random_exponential(multiplier=1, max=max_wait_seconds),
+      stop=tenacity.stop_after_attempt(max_attempts),
+      before_sleep=tenacity.before_sleep_log(LOGGER, logging.WARNING),
+      reraise=True,
+  )
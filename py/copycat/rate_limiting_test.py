@@ -0,0 +1,236 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import multiprocessing
+import pickle
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from google.api_core import exceptions as api_core_exceptions
+import mock
+
+from copycat import rate_limiting
+
+
+def acquire_in_other_process(rate_limiter: rate_limiting.RateLimiter) -> None:
+  rate_limiter.acquire()
+
+
+class FakeClock:
+  """A fake clock where sleeping advances the time instantly."""
+
+  def __init__(self):
+    self.now = 0.0
+    self.sleeps = []
+
+  def monotonic(self) -> float:
+    return self.now
+
+  def sleep(self, seconds: float) -> None:
+    self.sleeps.append(seconds)
+    self.now += seconds
+
+
+class RateLimiterTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.clock = FakeClock()
+    self.enter_context(
+        mock.patch.object(
+            rate_limiting.time, "monotonic", side_effect=self.clock.monotonic
+        )
+    )
+    self.enter_context(
+        mock.patch.object(
+            rate_limiting.time, "sleep", side_effect=self.clock.sleep
+        )
+    )
+
+  def test_requests_within_limit_do_not_wait(self):
+    rate_limiter = rate_limiting.RateLimiter(requests_per_minute=600)
+
+    for _ in range(10):
+      rate_limiter.acquire()
+
+    self.assertEmpty(self.clock.sleeps)
+
+  def test_requests_above_limit_are_spread_out(self):
+    rate_limiter = rate_limiting.RateLimiter(requests_per_minute=60)
+
+    for _ in range(4):
+      rate_limiter.acquire()
+
+    # One request per second, the first is sent immediately.
+    self.assertEqual(self.clock.now, 3.0)
+
+  def test_tokens_per_minute_is_respected(self):
+    rate_limiter = rate_limiting.RateLimiter(tokens_per_minute=600)
+
+    rate_limiter.acquire(tokens=10)
+    rate_limiter.acquire(tokens=10)
+
+    # 10 tokens per second, so the second request must wait a second.
+    self.assertEqual(self.clock.now, 1.0)
+
+  def test_no_limits_never_waits(self):
+    rate_limiter = rate_limiting.RateLimiter()
+
+    for _ in range(100):
+      rate_limiter.acquire(tokens=1000)
+
+    self.assertEmpty(self.clock.sleeps)
+
+  def test_acquire_async_spreads_out_requests_above_limit(self):
+    rate_limiter = rate_limiting.RateLimiter(requests_per_minute=60)
+
+    async def fake_sleep(seconds: float) -> None:
+      self.clock.sleep(seconds)
+
+    async def acquire_all():
+      for _ in range(4):
+        await rate_limiter.acquire_async()
+
+    with mock.patch.object(
+        rate_limiting.asyncio, "sleep", side_effect=fake_sleep
+    ):
+      asyncio.run(acquire_all())
+
+    # One request per second, the first is sent immediately.
+    self.assertEqual(self.clock.now, 3.0)
+
+  @parameterized.parameters("requests_per_minute", "tokens_per_minute")
+  def test_raises_value_error_for_non_positive_limit(self, limit_name):
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, f"{limit_name} must be positive, got 0."
+    ):
+      rate_limiting.RateLimiter(**{limit_name: 0})
+
+
+class SharedRateLimiterTest(parameterized.TestCase):
+
+  def test_shares_limit_with_other_processes(self):
+    mp_context = multiprocessing.get_context("spawn")
+    rate_limiter = rate_limiting.SharedRateLimiter(
+        requests_per_minute=6, mp_context=mp_context
+    )
+
+    process = mp_context.Process(
+        target=acquire_in_other_process, args=(rate_limiter,)
+    )
+    process.start()
+    process.join()
+
+    # The other process used the only request available in the next 10
+    # seconds.
+    self.assertEqual(process.exitcode, 0)
+    self.assertGreater(rate_limiter._try_acquire(0), 5.0)
+
+  def test_limits_requests_in_same_process(self):
+    rate_limiter = rate_limiting.SharedRateLimiter(requests_per_minute=6)
+
+    self.assertEqual(rate_limiter._try_acquire(0), 0.0)
+    self.assertGreater(rate_limiter._try_acquire(0), 5.0)
+
+  def test_raises_value_error_for_non_positive_limit(self):
+    with self.assertRaisesWithLiteralMatch(
+        ValueError, "requests_per_minute must be positive, got 0."
+    ):
+      rate_limiting.SharedRateLimiter(requests_per_minute=0)
+
+  def test_cannot_be_pickled_outside_of_process_start(self):
+    rate_limiter = rate_limiting.SharedRateLimiter(requests_per_minute=6)
+
+    with self.assertRaises(RuntimeError):
+      pickle.dumps(rate_limiter)
+
+
+class RetryTest(parameterized.TestCase):
+
+  def test_retries_transient_errors(self):
+    mock_function = mock.MagicMock(
+        side_effect=[api_core_exceptions.ResourceExhausted("quota"), "result"]
+    )
+
+    for attempt in rate_limiting.retry_on_transient_errors(
+        max_attempts=3, max_wait_seconds=0
+    ):
+      with attempt:
+        result = mock_function()
+
+    self.assertEqual(result, "result")
+    self.assertEqual(mock_function.call_count, 2)
+
+  def test_does_not_retry_other_errors(self):
+    mock_function = mock.MagicMock(side_effect=ValueError("bad request"))
+
+    with self.assertRaises(ValueError):
+      for attempt in rate_limiting.retry_on_transient_errors(
+          max_attempts=3, max_wait_seconds=0
+      ):
+        with attempt:
+          mock_function()
+
+    self.assertEqual(mock_function.call_count, 1)
+
+  def test_raises_last_error_after_max_attempts(self):
+    mock_function = mock.MagicMock(
+        side_effect=api_core_exceptions.ServiceUnavailable("unavailable")
+    )
+
+    with self.assertRaises(api_core_exceptions.ServiceUnavailable):
+      for attempt in rate_limiting.retry_on_transient_errors(
+          max_attempts=3, max_wait_seconds=0
+      ):
+        with attempt:
+          mock_function()
+
+    self.assertEqual(mock_function.call_count, 3)
+
+  def test_async_retry_retries_transient_errors(self):
+    mock_function = mock.AsyncMock(
+        side_effect=[api_core_exceptions.ResourceExhausted("quota"), "result"]
+    )
+
+    async def call_with_retry():
+      async for attempt in rate_limiting.async_retry_on_transient_errors(
+          max_attempts=3, max_wait_seconds=0
+      ):
+        with attempt:
+          return await mock_function()
+
+    result = asyncio.run(call_with_retry())
+
+    self.assertEqual(result, "result")
+    self.assertEqual(mock_function.call_count, 2)
+
+  def test_async_retry_retries_custom_transient_errors(self):
+    mock_function = mock.AsyncMock(side_effect=[TimeoutError(), "result"])
+
+    async def call_with_retry():
+      async for attempt in rate_limiting.async_retry_on_transient_errors(
+          max_attempts=3, max_wait_seconds=0, transient_errors=(TimeoutError,)
+      ):
+        with attempt:
+          return await mock_function()
+
+    result = asyncio.run(call_with_retry())
+
+    self.assertEqual(result, "result")
+    self.assertEqual(mock_function.call_count, 2)
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -0,0 +1,332 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Caches for chat model responses, so the same prompt is not sent twice."""
+
+import abc
+import collections
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from vertexai import generative_models
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+def make_cache_key(
+    *,
+    model_name: str,
+    system_instruction: str,
+    prompt: list[dict[str, Any]],
+    generation_config: dict[str, Any],
+    safety_settings: Any,
+    sample_index: int = 0,
+) -> str:
+  """Returns the content-addressed cache key for a single chat model request.
+
+  The key is a sha256 hash of a canonical json representation of everything
+  that is sent to the model, so a change to any of them (e.g. a different
+  in-context example or temperature) is cached separately.
+
+  Args:
+    model_name: The name of the chat model.
+    system_instruction: The system instruction.
+    prompt: The prompt contents, as dicts.
+    generation_config: The generation config, e.g. the temperature, top k, top p
+      and response schema.
+    safety_settings: A json serializable representation of the safety
+      settings.
+    sample_index: Which sample of identical requests this is, so that e.g.
+      several versions of the same ad are cached separately. The first sample
+      has the same key as before sample indices were added.
+  """
+  key_fields = {
+      "model_name": model_name,
+      "system_instruction": system_instruction,
+      "prompt": prompt,
+      "generation_config": generation_config,
+      "safety_settings": safety_settings,
+  }
+  if sample_index:
+    key_fields["sample_index"] = sample_index
+  key_material = json.dumps(key_fields, sort_keys=True, default=str)
+  return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(abc.ABC):
+  """Abstract class for caching chat model responses.
+
+  The raw responses are stored as json, and subclasses implement the storage.
+  This class keeps track of the hit and miss counts and the expiry of old
+  responses.
+
+  Attributes:
+    max_entries: The maximum number of responses to store. When the cache is
+      full the least recently used responses are evicted.
+    ttl_seconds: The time after which a stored response expires, or None if
+      the responses never expire.
+    hits: The number of keys that were found in the cache.
+    misses: The number of keys that were not found in the cache.
+  """
+
+  max_entries: int
+  ttl_seconds: float | None
+  hits: int
+  misses: int
+
+  def __init__(
+      self, max_entries: int = 10_000, ttl_seconds: float | None = None
+  ):
+    """Initialises the response cache.
+
+    Args:
+      max_entries: The maximum number of responses to store.
+      ttl_seconds: The time after which a stored response expires, or None if
+        the responses never expire.
+
+    Raises:
+      ValueError: If max_entries or ttl_seconds is not positive.
+    """
+    if max_entries <= 0:
+      LOGGER.error("max_entries must be positive, got %d.", max_entries)
+      raise ValueError(f"max_entries must be positive, got {max_entries}.")
+    if ttl_seconds is not None and ttl_seconds <= 0:
+      LOGGER.error("ttl_seconds must be positive, got %s.", ttl_seconds)
+      raise ValueError(f"ttl_seconds must be positive, got {ttl_seconds}.")
+    self.max_entries = max_entries
+    self.ttl_seconds = ttl_seconds
+    self.hits = 0
+    self.misses = 0
+
+  @abc.abstractmethod
+  def _get(self, key: str, min_created_at: float) -> str | None:
+    """Returns the cached response json, or None if it is not in the cache.
+
+    Retrieving a response marks it as recently used. Responses created before
+    min_created_at have expired, so they are removed and not returned.
+
+    Args:
+      key: The cache key to look up.
+      min_created_at: The earliest creation time of a response that has not
+        expired.
+    """
+    ...
+
+  @abc.abstractmethod
+  def _set(self, key: str, response_json: str, created_at: float) -> None:
+    """Stores the response json, evicting the least recently used if full.
+
+    Args:
+      key: The cache key of the response.
+      response_json: The response to store, as json.
+      created_at: The time the response was created.
+    """
+    ...
+
+  @abc.abstractmethod
+  def __len__(self) -> int:
+    """The number of responses in the cache."""
+    ...
+
+  @abc.abstractmethod
+  def clear(self) -> None:
+    """Removes all responses from the cache."""
+    ...
+
+  def get(self, key: str) -> generative_models.GenerationResponse | None:
+    """Returns the cached response for the key, or None if not found.
+
+    Args:
+      key: The cache key to look up.
+    """
+    now = time.time()
+    min_created_at = (
+        now - self.ttl_seconds if self.ttl_seconds is not None else -1.0
+    )
+    response_json = self._get(key, min_created_at)
+    if response_json is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return generative_models.GenerationResponse.from_dict(
+        json.loads(response_json)
+    )
+
+  def set(
+      self, key: str, response: generative_models.GenerationResponse
+  ) -> None:
+    """Stores the response in the cache.
+
+    Args:
+      key: The cache key of the response.
+      response: The response to store.
+    """
+    self._set(key, json.dumps(response.to_dict()), time.time())
+
+  @property
+  def hit_rate(self) -> float:
+    """The fraction of lookups that were found in the cache."""
+    total = self.hits + self.misses
+    return self.hits / total if total else 0.0
+
+  def stats(self) -> dict[str, int | float | None]:
+    """Returns the hit / miss counters and the current size of the cache."""
+    return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": self.hit_rate,
+        "size": len(self),
+        "max_entries": self.max_entries,
+        "ttl_seconds": self.ttl_seconds,
+    }
+
+
+class InMemoryResponseCache(ResponseCache):
+  """A response cache that lives in memory for the lifetime of the process."""
+
+  def __init__(
+      self, max_entries: int = 10_000, ttl_seconds: float | None = None
+  ):
+    super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    self._lock = threading.Lock()
+    self._responses: collections.OrderedDict[str, tuple[float, str]] = (
+        collections.OrderedDict()
+    )
+
+  def _get(self, key: str, min_created_at: float) -> str | None:
+    with self._lock:
+      if key not in self._responses:
+        return None
+      created_at, response_json = self._responses[key]
+      if created_at < min_created_at:
+        del self._responses[key]
+        return None
+      self._responses.move_to_end(key)
+      return response_json
+
+  def _set(self, key: str, response_json: str, created_at: float) -> None:
+    with self._lock:
+      self._responses[key] = (created_at, response_json)
+      self._responses.move_to_end(key)
+      while len(self._responses) > self.max_entries:
+        self._responses.popitem(last=False)
+
+  def __len__(self) -> int:
+    return len(self._responses)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._responses.clear()
+
+
+class SqliteResponseCache(ResponseCache):
+  """A response cache persisted to a SQLite database on disk.
+
+  The cache can be shared between runs and processes, e.g. to re-run a prompt
+  tuning notebook or a regression test without calling the chat model again.
+  Each row records when it was created, for the expiry, and when it was last
+  used, for the least recently used eviction.
+
+  Attributes:
+    path: The path to the SQLite database file.
+  """
+
+  def __init__(
+      self,
+      path: str,
+      max_entries: int = 100_000,
+      ttl_seconds: float | None = None,
+  ):
+    """Initialises the response cache, creating the database if required.
+
+    Args:
+      path: The path to the SQLite database file.
+      max_entries: The maximum number of responses to store.
+      ttl_seconds: The time after which a stored response expires, or None if
+        the responses never expire.
+    """
+    super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    self.path = path
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    with self._connection:
+      self._connection.execute(
+          "CREATE TABLE IF NOT EXISTS responses ("
+          " key TEXT PRIMARY KEY,"
+          " response TEXT NOT NULL,"
+          " created_at REAL NOT NULL,"
+          " last_used REAL NOT NULL)"
+      )
+      self._connection.execute(
+          "CREATE INDEX IF NOT EXISTS responses_last_used"
+          " ON responses (last_used)"
+      )
+
+  def _get(self, key: str, min_created_at: float) -> str | None:
+    with self._lock, self._connection:
+      row = self._connection.execute(
+          "SELECT response, created_at FROM responses WHERE key = ?",
+          (key,),
+      ).fetchone()
+      if row is None:
+        return None
+      response_json, created_at = row
+      if created_at < min_created_at:
+        self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+        return None
+      self._connection.execute(
+          "UPDATE responses SET last_used = ? WHERE key = ?",
+          (time.time(), key),
+      )
+    return response_json
+
+  def _set(self, key: str, response_json: str, created_at: float) -> None:
+    with self._lock, self._connection:
+      self._connection.execute(
+          "INSERT OR REPLACE INTO responses"
+          " (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+          (key, response_json, created_at, created_at),
+      )
+      (n_rows,) = self._connection.execute(
+          "SELECT COUNT(*) FROM responses"
+      ).fetchone()
+      n_to_evict = n_rows - self.max_entries
+      if n_to_evict > 0:
+        LOGGER.debug("Evicting %d responses from the cache.", n_to_evict)
+        self._connection.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses"
+            " ORDER BY last_used ASC LIMIT ?)",
+            (n_to_evict,),
+        )
+
+  def __len__(self) -> int:
+    with self._lock:
+      (n_rows,) = self._connection.execute(
+          "SELECT COUNT(*) FROM responses"
+      ).fetchone()
+    return n_rows
+
+  def clear(self) -> None:
+    with self._lock, self._connection:
+      self._connection.execute("DELETE FROM responses")
+
+  def close(self) -> None:
+    """Closes the connection to the database."""
+    self._connection.close()
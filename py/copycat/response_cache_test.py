@@ -0,0 +1,197 @@
+# Copyright 2024 Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from vertexai import generative_models
+
+from copycat import response_cache
+
+
+def make_response(text: str) -> generative_models.GenerationResponse:
+  return generative_models.GenerationResponse.from_dict({
+      "candidates": [{
+          "finish_reason": generative_models.FinishReason.STOP,
+          "content": {"role": "model", "parts": [{"text": text}]},
+      }]
+  })
+
+
+def get_text(response: generative_models.GenerationResponse) -> str:
+  return response.candidates[0].content.parts[0].text
+
+
+class MakeCacheKeyTest(parameterized.TestCase):
+
+  def _make_key(self, **overrides) -> str:
+    params = dict(
+        model_name="gemini-1.5-flash-002",
+        system_instruction="My system instruction",
+        prompt=[{"role": "user", "parts": [{"text": "My prompt"}]}],
+        generation_config={"temperature": 0.9, "top_k": 40, "top_p": 0.95},
+        safety_settings=None,
+    )
+    return response_cache.make_cache_key(**(params | overrides))
+
+  def test_same_inputs_give_same_key(self):
+    self.assertEqual(self._make_key(), self._make_key())
+
+  @parameterized.named_parameters(
+      dict(testcase_name="model_name", model_name="gemini-1.5-pro-002"),
+      dict(testcase_name="system_instruction", system_instruction="Other"),
+      dict(
+          testcase_name="prompt",
+          prompt=[{"role": "user", "parts": [{"text": "Other prompt"}]}],
+      ),
+      dict(
+          testcase_name="generation_config",
+          generation_config={"temperature": 0.5, "top_k": 40, "top_p": 0.95},
+      ),
+      dict(testcase_name="safety_settings", safety_settings=((1, 3),)),
+      dict(testcase_name="sample_index", sample_index=1),
+  )
+  def test_different_inputs_give_different_keys(self, **overrides):
+    self.assertNotEqual(self._make_key(), self._make_key(**overrides))
+
+  def test_first_sample_index_gives_same_key_as_no_sample_index(self):
+    self.assertEqual(self._make_key(), self._make_key(sample_index=0))
+
+
+class ResponseCacheTest(parameterized.TestCase):
+
+  def _make_cache(
+      self,
+      cache_type: str,
+      max_entries: int = 10,
+      ttl_seconds: float | None = None,
+  ) -> response_cache.ResponseCache:
+    if cache_type == "in_memory":
+      return response_cache.InMemoryResponseCache(
+          max_entries=max_entries, ttl_seconds=ttl_seconds
+      )
+    path = os.path.join(self.create_tempdir().full_path, "cache.db")
+    return response_cache.SqliteResponseCache(
+        path, max_entries=max_entries, ttl_seconds=ttl_seconds
+    )
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_get_returns_stored_response(self, cache_type):
+    cache = self._make_cache(cache_type)
+    cache.set("a", make_response("response a"))
+
+    self.assertEqual(get_text(cache.get("a")), "response a")
+    self.assertIsNone(cache.get("b"))
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_get_counts_hits_and_misses(self, cache_type):
+    cache = self._make_cache(cache_type)
+    cache.set("a", make_response("response a"))
+
+    cache.get("a")
+    cache.get("b")
+    cache.get("c")
+
+    self.assertEqual(cache.hits, 1)
+    self.assertEqual(cache.misses, 2)
+    self.assertAlmostEqual(cache.hit_rate, 1 / 3)
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_least_recently_used_responses_are_evicted(self, cache_type):
+    cache = self._make_cache(cache_type, max_entries=2)
+    cache.set("a", make_response("response a"))
+    cache.set("b", make_response("response b"))
+    cache.get("a")  # "a" is now more recently used than "b".
+    cache.set("c", make_response("response c"))
+
+    self.assertLen(cache, 2)
+    self.assertIsNotNone(cache.get("a"))
+    self.assertIsNone(cache.get("b"))
+    self.assertIsNotNone(cache.get("c"))
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_expired_responses_are_not_returned(self, cache_type):
+    cache = self._make_cache(cache_type, ttl_seconds=60.0)
+    cache.set("a", make_response("response a"))
+
+    with mock.patch.object(time, "time", return_value=time.time() + 61.0):
+      self.assertIsNone(cache.get("a"))
+
+    self.assertEmpty(cache)
+
+  @parameterized.parameters("in_memory", "sqlite")
+  def test_clear_removes_all_responses(self, cache_type):
+    cache = self._make_cache(cache_type)
+    cache.set("a", make_response("response a"))
+
+    cache.clear()
+
+    self.assertEmpty(cache)
+
+  def test_sqlite_cache_is_persisted_between_instances(self):
+    path = os.path.join(self.create_tempdir().full_path, "cache.db")
+    cache = response_cache.SqliteResponseCache(path)
+    cache.set("a", make_response("response a"))
+    cache.close()
+
+    reloaded_cache = response_cache.SqliteResponseCache(path)
+
+    self.assertEqual(get_text(reloaded_cache.get("a")), "response a")
+
+  def test_stats_returns_counters_and_size(self):
+    cache = response_cache.InMemoryResponseCache(
+        max_entries=10, ttl_seconds=3600.0
+    )
+    cache.set("a", make_response("response a"))
+    cache.get("a")
+    cache.get("b")
+
+    self.assertDictEqual(
+        cache.stats(),
+        {
+            "hits": 1,
+            "misses": 1,
+            "hit_rate": 0.5,
+            "size": 1,
+            "max_entries": 10,
+            "ttl_seconds": 3600.0,
+        },
+    )
+
+  @parameterized.parameters(
+      dict(
+          max_entries=0,
+          ttl_seconds=None,
+          expected_message="max_entries must be positive, got 0.",
+      ),
+      dict(
+          max_entries=10,
+          ttl_seconds=0.0,
+          expected_message="ttl_seconds must be positive, got 0.0.",
+      ),
+  )
+  def test_raises_value_error_for_non_positive_limits(
+      self, max_entries, ttl_seconds, expected_message
+  ):
+    with self.assertRaisesWithLiteralMatch(ValueError, expected_message):
+      response_cache.InMemoryResponseCache(
+          max_entries=max_entries, ttl_seconds=ttl_seconds
+      )
+
+
+if __name__ == "__main__":
+  absltest.main()
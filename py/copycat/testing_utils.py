@@ -252,11 +252,25 @@ def vectorstore_instances_are_equal(
       "embedding_model_name": ad_copy_vectorstore_1.embedding_model_name.value,
       "dimensionality": ad_copy_vectorstore_1.dimensionality,
       "embeddings_batch_size": ad_copy_vectorstore_1.embeddings_batch_size,
+      "embeddings_dtype": ad_copy_vectorstore_1.embeddings_dtype,
+      "nearest_neighbors_index_type": (
+          ad_copy_vectorstore_1.nearest_neighbors_index_type.value
+      ),
+      "nearest_neighbors_index_params": (
+          ad_copy_vectorstore_1.nearest_neighbors_index_params
+      ),
   }
   params_2 = {
       "embedding_model_name": ad_copy_vectorstore_2.embedding_model_name.value,
       "dimensionality": ad_copy_vectorstore_2.dimensionality,
       "embeddings_batch_size": ad_copy_vectorstore_2.embeddings_batch_size,
+      "embeddings_dtype": ad_copy_vectorstore_2.embeddings_dtype,
+      "nearest_neighbors_index_type": (
+          ad_copy_vectorstore_2.nearest_neighbors_index_type.value
+      ),
+      "nearest_neighbors_index_params": (
+          ad_copy_vectorstore_2.nearest_neighbors_index_params
+      ),
   }
 
   if not values_are_equal(params_1, params_2):
@@ -271,6 +285,11 @@ def vectorstore_instances_are_equal(
   except AssertionError:
     return False
 
+  if not np.array_equal(
+      ad_copy_vectorstore_1.embeddings, ad_copy_vectorstore_2.embeddings
+  ):
+    return False
+
   return True
 
 
@@ -1107,6 +1107,7 @@ def generate_ads(event: me.ClickEvent):
       allow_memorised_descriptions=params.new_ads_allow_memorised_descriptions,
       safety_settings=copycat.ALL_SAFETY_SETTINGS_ONLY_HIGH,
       style_guide=params.style_guide if params.new_ads_use_style_guide else "",
+      max_repair_attempts=params.new_ads_max_repair_attempts,
   )
   limit = params.new_ads_generation_limit
   if limit == 0:
@@ -227,6 +227,22 @@ def generate_new_ads_section(
             on_blur=event_handlers.update_copycat_parameter,
             key="new_ads_generation_limit",
         )
+      with me.tooltip(
+          message=(
+              "The maximum number of times to regenerate ads that fail the"
+              " evaluation or are incomplete. If 0 then the ads are not"
+              " regenerated."
+          )
+      ):
+        me.input(
+            label="Repair Attempts",
+            value=str(params.new_ads_max_repair_attempts),
+            type="number",
+            appearance="outline",
+            style=me.Style(width=100),
+            on_blur=event_handlers.update_copycat_parameter,
+            key="new_ads_max_repair_attempts",
+        )
     with components.row(gap=15, align_items="center", margin=me.Margin(top=15)):
       me.button(
           label="Generate",
@@ -179,7 +179,7 @@ def copycat_creation_settings_section(params: states.CopycatParamsState) -> None
     )
     if (
         params.exemplar_selection_method
-        == copycat.ExemplarSelectionMethod.AFFINITY_PROPAGATION.value
+        != copycat.ExemplarSelectionMethod.RANDOM.value
     ):
       me.input(
           label="Max Initial Ads",
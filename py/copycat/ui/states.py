@@ -106,4 +106,5 @@ class CopycatParamsState:
   new_ads_batch_size: int = 15
   new_ads_generation_limit: int = 30
   new_ads_fill_gaps: bool = True
+  new_ads_max_repair_attempts: int = 0
   new_ads_number_of_versions: int = 1